@@ -96,6 +96,7 @@ enum alert_types_t {
 	ALERT_BLOCK_UPLOADED =  94,
 	ALERT_ALERTS_DROPPED =  95,
 	ALERT_SOCKS5 =  96,
+	ALERT_PEER_CLASS_STATS =  97,
 };
 
 #endif // LIBTORRENT_ALERTS_H
@@ -78,6 +78,7 @@ enum settings_tags_t {
 	SET_SSRF_MITIGATION, // int (0 or 1)
 	SET_ALLOW_IDNA, // int (0 or 1)
 	SET_ENABLE_SET_FILE_VALID_DATA, // int (0 or 1)
+	SET_ADAPTIVE_ALERT_MASK, // int (0 or 1)
 	SET_TRACKER_COMPLETION_TIMEOUT, // int
 	SET_TRACKER_RECEIVE_TIMEOUT, // int
 	SET_STOP_TRACKER_TIMEOUT, // int
@@ -83,6 +83,7 @@ int settings_key(int const tag)
 		case SET_SSRF_MITIGATION: return sp::ssrf_mitigation;
 		case SET_ALLOW_IDNA: return sp::allow_idna;
 		case SET_ENABLE_SET_FILE_VALID_DATA: return sp::enable_set_file_valid_data;
+		case SET_ADAPTIVE_ALERT_MASK: return sp::adaptive_alert_mask;
 		case SET_TRACKER_COMPLETION_TIMEOUT: return sp::tracker_completion_timeout;
 		case SET_TRACKER_RECEIVE_TIMEOUT: return sp::tracker_receive_timeout;
 		case SET_STOP_TRACKER_TIMEOUT: return sp::stop_tracker_timeout;
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# micro benchmarks of the python binding's hot paths. Every benchmark runs
+# in-process against a local session using the "disabled" disk I/O back-end,
+# and without DHT, local service discovery or port mapping. Torrents are
+# built in memory.
+#
+# like pyperf, every benchmark is calibrated to run for roughly --min-time
+# seconds per sample, a number of warmup samples are discarded and the
+# remaining samples are reported as the mean and standard deviation of the
+# time per call. The results can be saved as JSON (--output) and compared
+# against a previous run (--compare), to track the cost of binding-level
+# changes.
+#
+# usage: bench_binding.py [options] [benchmark-name-pattern ...]
+
+import argparse
+import fnmatch
+import gc
+import json
+import math
+import socket
+import sys
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import libtorrent as lt
+
+settings = {
+    "alert_mask": lt.alert.category_t.all_categories,
+    "enable_dht": False,
+    "enable_lsd": False,
+    "enable_natpmp": False,
+    "enable_upnp": False,
+    "listen_interfaces": "127.0.0.1:0",
+    "alert_queue_size": 1000000,
+    "active_limit": -1,
+    "active_downloads": -1,
+    "active_seeds": -1,
+    "active_checking": -1,
+}
+
+
+class bench(object):
+    # a benchmark timing fun() with the state created by the setup function.
+    # keep holds on to objects that must stay alive as long as the benchmark
+
+    def __init__(self, fun: Callable[[], Any], keep: Any = None) -> None:
+        self.fun = fun
+        self.keep = keep
+
+    def run(self, loops: int) -> float:
+        fun = self.fun
+        start = time.perf_counter()
+        for i in range(loops):
+            fun()
+        return time.perf_counter() - start
+
+
+Setup = Callable[[argparse.Namespace], bench]
+
+# maps benchmark name -> function(args) returning a setup object with
+# a run(loops) method, returning the time it took (so setup can be excluded)
+benchmarks: Dict[str, Setup] = {}
+
+
+def benchmark(name: str) -> Callable[[Setup], Setup]:
+    def register(fun: Setup) -> Setup:
+        benchmarks[name] = fun
+        return fun
+
+    return register
+
+
+def make_torrent(
+    i: int,
+    num_files: int = 1,
+    piece_length: int = 256 * 1024,
+    file_size: int = 1024 * 1024,
+) -> Dict[str, Any]:
+    # a v1 torrent with (fake) zero piece hashes, unique per i
+    info: Dict[str, Any] = {"name": "bench-%d" % i, "piece length": piece_length}
+    if num_files == 1:
+        info["length"] = file_size
+    else:
+        info["files"] = [
+            {"length": file_size, "path": ["dir-%d" % (j // 100), "file-%d" % j]}
+            for j in range(num_files)
+        ]
+    num_pieces = (file_size * num_files + piece_length - 1) // piece_length
+    info["pieces"] = b"\0" * 20 * num_pieces
+    return {"info": info}
+
+
+def make_session(extra: Optional[Dict[str, Any]] = None) -> Any:
+    s = dict(settings)
+    s.update(extra or {})
+    return lt.session(s, disk_io="disabled")
+
+
+def add_torrents(ses: Any, num: int, flags: Any = lt.torrent_flags.paused) -> List[Any]:
+    handles = []
+    for i in range(num):
+        handles.append(
+            ses.add_torrent(
+                {
+                    "ti": lt.torrent_info(make_torrent(i)),
+                    "save_path": ".",
+                    "flags": flags,
+                }
+            )
+        )
+    return handles
+
+
+def drain_alerts(ses: Any) -> None:
+    while ses.pop_alerts():
+        pass
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("timed out setting up benchmark")
+        time.sleep(0.05)
+
+
+@benchmark("pop_alerts")
+def bench_pop_alerts(args: argparse.Namespace) -> bench:
+    # the time to pop (and convert) a batch of args.alerts alerts, all of
+    # which are queued before the clock starts. Posting them is not included
+    ses = make_session()
+    # the first post_session_stats() also posts a session_stats_header_alert
+    ses.post_session_stats()
+    ses.is_paused()
+    drain_alerts(ses)
+
+    class pop(bench):
+        def run(self, loops: int) -> float:
+            elapsed = 0.0
+            for i in range(loops):
+                for j in range(args.alerts):
+                    ses.post_session_stats()
+                # post_session_stats() is asynchronous. A synchronous call
+                # returns once the network thread has handled the calls made
+                # before it, i.e. once all the alerts are queued
+                ses.is_paused()
+                received = 0
+                while received < args.alerts:
+                    start = time.perf_counter()
+                    alerts = ses.pop_alerts()
+                    elapsed += time.perf_counter() - start
+                    if not alerts:
+                        raise RuntimeError(
+                            "only %d of %d alerts were queued "
+                            "(is alert_queue_size too small?)" % (received, args.alerts)
+                        )
+                    received += len(alerts)
+            return elapsed
+
+    return pop(lambda: None)
+
+
+def torrent_status_benchmarks(num: int) -> None:
+    @benchmark("get_torrent_status_%dk" % (num // 1000))
+    def bench_get_torrent_status(args: argparse.Namespace) -> bench:
+        ses = make_session()
+        add_torrents(ses, num)
+        return bench(lambda: ses.get_torrent_status(lambda st: True))
+
+    @benchmark("refresh_torrent_status_%dk" % (num // 1000))
+    def bench_refresh_torrent_status(args: argparse.Namespace) -> bench:
+        ses = make_session()
+        add_torrents(ses, num)
+        status = ses.get_torrent_status(lambda st: True)
+        return bench(lambda: ses.refresh_torrent_status(status))
+
+
+for n in [1000, 10000, 50000]:
+    torrent_status_benchmarks(n)
+
+
+@benchmark("get_peer_info")
+def bench_get_peer_info(args: argparse.Namespace) -> bench:
+    # a seed with args.peers downloading sessions connected to it, over
+    # loopback
+    seed = make_session(
+        {
+            "allow_multiple_connections_per_ip": True,
+            "connections_limit": args.peers * 2,
+        }
+    )
+    ti = lt.torrent_info(make_torrent(0, file_size=1024 * 1024 * 1024))
+    h = seed.add_torrent(
+        {"ti": ti, "save_path": ".", "flags": lt.torrent_flags.seed_mode}
+    )
+    port = seed.listen_port()
+
+    # keep the peers alive as long as the benchmark
+    peers = []
+    for i in range(args.peers):
+        ses = make_session({"download_rate_limit": 1})
+        ph = ses.add_torrent({"ti": ti, "save_path": "."})
+        ph.connect_peer(("127.0.0.1", port))
+        peers.append((ses, ph))
+
+    wait_for(lambda: bool(h.status().num_peers >= args.peers))
+    return bench(lambda: h.get_peer_info(), keep=peers)
+
+
+def large_entry(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        "announce": "http://tracker.example.com/announce",
+        "strings": [b"x" * 100] * args.entry_size,
+        "ints": list(range(args.entry_size)),
+        "dict": dict(
+            ("key-%08d" % i, {"a": i, "b": b"value"}) for i in range(args.entry_size)
+        ),
+    }
+
+
+@benchmark("bencode")
+def bench_bencode(args: argparse.Namespace) -> bench:
+    e = large_entry(args)
+    return bench(lambda: lt.bencode(e))
+
+
+@benchmark("bdecode")
+def bench_bdecode(args: argparse.Namespace) -> bench:
+    buf = lt.bencode(large_entry(args))
+    return bench(lambda: lt.bdecode(buf))
+
+
+@benchmark("torrent_info")
+def bench_torrent_info(args: argparse.Namespace) -> bench:
+    # constructing a torrent_info from a bencoded buffer with many files
+    buf = lt.bencode(make_torrent(0, num_files=args.files))
+    return bench(lambda: lt.torrent_info(buf))
+
+
+@benchmark("session_stats_values")
+def bench_session_stats_values(args: argparse.Namespace) -> bench:
+    # converting the counters of a session_stats_alert into a dict
+    ses = make_session()
+    drain_alerts(ses)
+    ses.post_session_stats()
+    alert: List[Any] = []
+
+    def find_alert() -> bool:
+        alert.extend(
+            a for a in ses.pop_alerts() if isinstance(a, lt.session_stats_alert)
+        )
+        return len(alert) > 0
+
+    wait_for(find_alert)
+    a = alert[0]
+    return bench(lambda: a.values)
+
+
+@benchmark("add_torrent")
+def bench_add_torrent(args: argparse.Namespace) -> bench:
+    # adding a torrent with dict params (the removal is included)
+    ses = make_session()
+    ti = lt.torrent_info(make_torrent(0))
+
+    def add() -> None:
+        h = ses.add_torrent(
+            {
+                "ti": ti,
+                "save_path": ".",
+                "flags": lt.torrent_flags.paused,
+                "trackers": ["http://tracker.example.com/announce"],
+                "file_priorities": [1],
+            }
+        )
+        ses.remove_torrent(h)
+
+    class add_remove(bench):
+        def run(self, loops: int) -> float:
+            ret = bench.run(self, loops)
+            drain_alerts(ses)
+            return ret
+
+    return add_remove(add)
+
+
+def calibrate(b: bench, min_time: float) -> int:
+    # find the number of loops that takes at least min_time
+    loops = 1
+    while True:
+        t = b.run(loops)
+        if t >= min_time or loops >= 1 << 20:
+            return loops
+        loops *= 2 if t == 0 else max(2, min(10, int(min_time / t * 1.2) + 1))
+
+
+def run_benchmark(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    b = benchmarks[name](args)
+    gc.collect()
+    loops = calibrate(b, args.min_time)
+    samples = []
+    for i in range(args.warmups + args.samples):
+        t = b.run(loops) / loops
+        if i >= args.warmups:
+            samples.append(t)
+    mean = sum(samples) / len(samples)
+    stdev = 0.0
+    if len(samples) > 1:
+        stdev = math.sqrt(sum((s - mean) ** 2 for s in samples) / (len(samples) - 1))
+    return {"mean": mean, "stdev": stdev, "loops": loops, "samples": samples}
+
+
+def format_time(t: float) -> str:
+    for unit, scale in [("s", 1.0), ("ms", 1e-3), ("us", 1e-6)]:
+        if t >= scale:
+            return "%.2f %s" % (t / scale, unit)
+    return "%.0f ns" % (t / 1e-9)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="benchmark the libtorrent python binding"
+    )
+    parser.add_argument(
+        "patterns",
+        nargs="*",
+        default=["*"],
+        help="only run benchmarks whose name matches these patterns",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="list the benchmarks and exit"
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=10,
+        help="the number of samples per benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--warmups",
+        type=int,
+        default=1,
+        help="the number of samples to discard (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.1,
+        help="the minimum duration of a sample, in seconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--alerts",
+        type=int,
+        default=10000,
+        help="the number of alerts to pop per call (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peers",
+        type=int,
+        default=16,
+        help="the number of peers for get_peer_info (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=10000,
+        help="the number of files in the torrent_info benchmark "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--entry-size",
+        type=int,
+        default=10000,
+        help="the number of items in the bencode benchmarks (default: %(default)s)",
+    )
+    parser.add_argument("-o", "--output", help="save the results as JSON to this file")
+    parser.add_argument(
+        "--compare", help="compare against results previously saved with --output"
+    )
+    args = parser.parse_args()
+
+    names = [n for n in benchmarks if any(fnmatch.fnmatch(n, p) for p in args.patterns)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    if not names:
+        print("no benchmark matches %s" % " ".join(args.patterns))
+        return 1
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["benchmarks"]
+
+    results = {}
+    for name in names:
+        print("%-28s" % name, end="")
+        sys.stdout.flush()
+        r = results[name] = run_benchmark(name, args)
+        line = "%12s +- %-10s" % (format_time(r["mean"]), format_time(r["stdev"]))
+        if name in baseline:
+            base = baseline[name]["mean"]
+            line += " %+7.1f%% (%s)" % (
+                (r["mean"] - base) / base * 100.0,
+                format_time(base),
+            )
+        print(line)
+
+    if args.output:
+        with open(args.output, "w+") as f:
+            json.dump(
+                {
+                    "version": lt.__version__,
+                    "python": sys.version.split()[0],
+                    "host": socket.gethostname(),
+                    "benchmarks": results,
+                },
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
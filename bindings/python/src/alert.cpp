@@ -137,6 +137,26 @@ dict session_stats_values(session_stats_alert const& alert)
     return d;
 }
 
+list peer_class_stats_list(peer_class_stats_alert const& alert)
+{
+    list result;
+    for (peer_class_stats const& s : alert.stats())
+    {
+        dict d;
+        d["peer_class"] = s.peer_class;
+        d["upload_payload"] = s.upload_payload;
+        d["upload_protocol"] = s.upload_protocol;
+        d["download_payload"] = s.download_payload;
+        d["download_protocol"] = s.download_protocol;
+        d["upload_queued"] = s.upload_queued;
+        d["download_queued"] = s.download_queued;
+        d["upload_throttled"] = s.upload_throttled;
+        d["download_throttled"] = s.download_throttled;
+        result.append(d);
+    }
+    return result;
+}
+
 list dht_live_nodes_nodes(dht_live_nodes_alert const& alert)
 {
     list result;
@@ -269,6 +289,7 @@ namespace boost
 	POLY(alerts_dropped_alert)
 	POLY(session_stats_alert)
 	POLY(socks5_alert)
+	POLY(peer_class_stats_alert)
 
 #if TORRENT_ABI_VERSION == 1
 	POLY(anonymous_mode_alert)
@@ -302,6 +323,14 @@ list get_dropped_alerts(alerts_dropped_alert const& alert)
     return ret;
 }
 
+list get_num_dropped(alerts_dropped_alert const& alert)
+{
+    list ret;
+    for (int const n : alert.num_dropped)
+        ret.append(n);
+    return ret;
+}
+
 void bind_alert()
 {
     using boost::noncopyable;
@@ -1092,6 +1121,7 @@ void bind_alert()
     class_<alerts_dropped_alert, bases<alert>, noncopyable>(
        "alerts_dropped_alert", no_init)
         .add_property("dropped_alerts", &get_dropped_alerts)
+        .add_property("num_dropped", &get_num_dropped)
         ;
 
     class_<socks5_alert, bases<alert>, noncopyable>(
@@ -1101,6 +1131,11 @@ void bind_alert()
         .add_property("ip", make_getter(&socks5_alert::ip, by_value()))
         ;
 
+    class_<peer_class_stats_alert, bases<alert>, noncopyable>(
+       "peer_class_stats_alert", no_init)
+        .add_property("stats", &peer_class_stats_list)
+        ;
+
     class_<dht_live_nodes_alert, bases<alert>, noncopyable>(
        "dht_live_nodes_alert", no_init)
         .add_property("node_id", &dht_live_nodes_alert::node_id)
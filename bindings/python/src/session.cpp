@@ -21,6 +21,9 @@
 #include <libtorrent/session_stats.hpp>
 #include <libtorrent/session_status.hpp>
 #include <libtorrent/peer_class_type_filter.hpp>
+#include <libtorrent/disabled_disk_io.hpp>
+#include <libtorrent/mmap_disk_io.hpp>
+#include <libtorrent/posix_disk_io.hpp>
 #include <libtorrent/torrent_status.hpp>
 
 #include <libtorrent/extensions/smart_ban.hpp>
@@ -185,7 +188,7 @@ namespace
 	}
 
 	std::shared_ptr<lt::session> make_session(boost::python::dict sett
-		, session_flags_t const flags)
+		, session_flags_t const flags, std::string const& disk_io)
 	{
 		session_params p;
 #if TORRENT_ABI_VERSION <= 2
@@ -194,6 +197,22 @@ namespace
 #endif
 		make_settings_pack(p.settings, sett);
 		p.flags = flags;
+
+		// the disabled back-end is primarily useful for benchmarking the
+		// rest of the stack without any disk I/O
+		if (disk_io == "disabled")
+			p.disk_io_constructor = lt::disabled_disk_io_constructor;
+		else if (disk_io == "posix")
+			p.disk_io_constructor = lt::posix_disk_io_constructor;
+#if TORRENT_HAVE_MMAP || TORRENT_HAVE_MAP_VIEW_OF_FILE
+		else if (disk_io == "mmap")
+			p.disk_io_constructor = lt::mmap_disk_io_constructor;
+#endif
+		else if (!disk_io.empty() && disk_io != "default")
+		{
+			PyErr_SetString(PyExc_ValueError, ("unknown disk_io back-end: " + disk_io).c_str());
+			throw_error_already_set();
+		}
 		return std::make_shared<lt::session>(std::move(p));
 	}
 
@@ -1017,7 +1036,7 @@ void bind_session()
 #else
                     lt::session_flags_t{}
 #endif
-                    ))
+                    , arg("disk_io")=std::string()))
               )
 #if TORRENT_ABI_VERSION == 1
         .def(
@@ -1031,6 +1050,7 @@ void bind_session()
         .def("post_torrent_updates", allow_threads(&lt::session::post_torrent_updates), arg("flags") = 0xffffffff)
         .def("post_dht_stats", allow_threads(&lt::session::post_dht_stats))
         .def("post_session_stats", allow_threads(&lt::session::post_session_stats))
+        .def("post_peer_class_stats", allow_threads(&lt::session::post_peer_class_stats))
         .def("is_listening", allow_threads(&lt::session::is_listening))
         .def("listen_port", allow_threads(&lt::session::listen_port))
 #ifndef TORRENT_DISABLE_DHT
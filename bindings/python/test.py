@@ -82,6 +82,11 @@ class test_session_stats(unittest.TestCase):
     def test_find_idx(self):
         self.assertEqual(lt.find_metric_idx("peer.error_peers"), 0)
 
+    def test_latency_histograms(self):
+        for kind in ['read', 'write', 'hash', 'queue']:
+            for n in range(4, 25):
+                self.assertTrue(lt.find_metric_idx('disk.disk_%s_latency%d' % (kind, n)) >= 0)
+
 
 class test_torrent_handle(unittest.TestCase):
 
@@ -628,6 +633,13 @@ class test_session(unittest.TestCase):
                        'banned_peers': [('8.7.6.5', 6881)],
                        'file_priorities': [1, 1, 1, 2, 0]})
 
+    def test_disk_io(self):
+        s = lt.session(settings, disk_io='disabled')
+        h = s.add_torrent({'ti': lt.torrent_info('base.torrent'), 'save_path': '.'})
+        self.assertTrue(h.is_valid())
+        s = lt.session(settings, disk_io='posix')
+        self.assertRaises(ValueError, lambda: lt.session(settings, disk_io='foobar'))
+
     def test_apply_settings(self):
 
         s = lt.session(settings)
@@ -660,6 +672,47 @@ class test_session(unittest.TestCase):
         self.assertTrue(isinstance(a.values, dict))
         self.assertTrue(len(a.values) > 0)
 
+    def test_alert_queue_counters(self):
+        s = lt.session({'alert_mask': 0, 'enable_dht': False, 'adaptive_alert_mask': True})
+        self.assertTrue(s.get_settings()['adaptive_alert_mask'])
+        s.post_session_stats()
+        a = None
+        for i in range(60):
+            s.wait_for_alert(1000)
+            alerts = [a for a in s.pop_alerts() if isinstance(a, lt.session_stats_alert)]
+            if alerts:
+                a = alerts[0]
+                break
+        self.assertTrue(isinstance(a, lt.session_stats_alert))
+        for name in ['alert.alerts_dropped', 'alert.alert_pops', 'alert.alert_pop_latency',
+                     'alert.alert_suppressions', 'alert.alert_queue_size',
+                     'alert.alert_queue_high_water', 'alert.alert_suppressed_categories']:
+            self.assertIn(name, a.values)
+        self.assertEqual(a.values['alert.alerts_dropped'], 0)
+        self.assertGreater(a.values['alert.alert_queue_high_water'], 0)
+
+    def test_post_peer_class_stats(self):
+        s = lt.session({'alert_mask': 0, 'enable_dht': False})
+        c = s.create_peer_class('test class')
+        s.post_peer_class_stats()
+        a = None
+        for i in range(60):
+            s.wait_for_alert(1000)
+            alerts = [a for a in s.pop_alerts() if isinstance(a, lt.peer_class_stats_alert)]
+            if alerts:
+                a = alerts[0]
+                break
+        self.assertTrue(isinstance(a, lt.peer_class_stats_alert))
+        self.assertTrue(isinstance(a.stats, list))
+        stats = {e['peer_class']: e for e in a.stats}
+        # the global, tcp and local classes, as well as the one we created
+        self.assertIn(s.global_peer_class_id, stats)
+        self.assertIn(c, stats)
+        for key in ['upload_payload', 'upload_protocol', 'download_payload',
+                    'download_protocol', 'upload_queued', 'download_queued',
+                    'upload_throttled', 'download_throttled']:
+            self.assertEqual(stats[c][key], 0)
+
     def test_post_dht_stats(self):
         s = lt.session({'alert_mask': 0, 'enable_dht': False})
         s.post_dht_stats()
@@ -53,6 +53,8 @@ see LICENSE file.
 #include "libtorrent/string_view.hpp"
 #include "libtorrent/disk_interface.hpp" // for open_file_state
 #include "libtorrent/disabled_disk_io.hpp" // for disabled_disk_io_constructor
+#include "libtorrent/mmap_disk_io.hpp"
+#include "libtorrent/posix_disk_io.hpp"
 
 #include "torrent_view.hpp"
 #include "session_view.hpp"
@@ -1157,6 +1159,7 @@ R"(
 DISK OPTIONS
   -a <mode>             sets the allocation mode. [sparse|allocate]
   -0                    disable disk I/O, read garbage and don't flush to disk
+  -B <back-end>         sets the disk I/O back-end. [mmap|posix|disabled]
 
 TORRENT is a path to a .torrent file
 MAGNETURL is a magnet link
@@ -1334,6 +1337,21 @@ int main(int argc, char* argv[])
 				}
 				break;
 			case 'T': max_connections_per_torrent = atoi(arg); break;
+			case 'B':
+				if (arg == "posix"_sv)
+					params.disk_io_constructor = lt::posix_disk_io_constructor;
+#if TORRENT_HAVE_MMAP || TORRENT_HAVE_MAP_VIEW_OF_FILE
+				else if (arg == "mmap"_sv)
+					params.disk_io_constructor = lt::mmap_disk_io_constructor;
+#endif
+				else if (arg == "disabled"_sv)
+					params.disk_io_constructor = lt::disabled_disk_io_constructor;
+				else
+				{
+					std::fprintf(stderr, "unknown disk I/O back-end: %s\n", arg);
+					return 1;
+				}
+				break;
 			case 'r': peer = arg; break;
 			case 'e':
 				{
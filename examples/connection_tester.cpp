@@ -67,9 +67,13 @@ bool local_bind = false;
 // the test torrents
 bool verify_downloads = false;
 
-// if this is true, one block in 1000 will be sent corrupt.
+// if this is true, one block in corruption_interval will be sent corrupt.
 // this only applies to dual and upload tests
 bool test_corruption = false;
+int corruption_interval = 1000;
+
+// number of corrupt blocks sent, across all connections
+std::atomic<int> num_corrupt_blocks(0);
 
 // number of seeds we've spawned. The test is terminated
 // when this reaches zero, for dual tests
@@ -151,7 +155,7 @@ struct peer_conn
 		, endpoint(ep)
 		, restarting(false)
 	{
-		corruption_counter = rand() % 1000;
+		corruption_counter = 1 + rand() % corruption_interval;
 		if (seed) ++num_seeds;
 		pieces.reserve(std::size_t(piece_count));
 		start_conn();
@@ -667,8 +671,9 @@ struct peer_conn
 			--corruption_counter;
 			if (corruption_counter == 0)
 			{
-				corruption_counter = 1000;
+				corruption_counter = corruption_interval;
 				std::memset(write_buffer, 0, 10);
+				++num_corrupt_blocks;
 			}
 		}
 		char* ptr = write_buf_proto;
@@ -708,6 +713,10 @@ struct peer_conn
 		"    -s <size>          the size of the torrent in megabytes\n"
 		"    -n <num-files>     the number of files in the test torrent\n"
 		"    -t <file>          the file to save the .torrent file to\n"
+		"    -S <piece-size>    the piece size in kiB (default 1024)\n"
+		"    -V <version>       the kind of torrent to create, v1, v2 or hybrid\n"
+		"                       (default v1). v2 and hybrid torrents can only be\n"
+		"                       used for checking tests\n"
 		"  gen-data             generate the data file(s) for the test torrent\n"
 		"    options for this command:\n"
 		"    -t <file>          the torrent file that was previously generated\n"
@@ -728,7 +737,13 @@ struct peer_conn
 		"    -p <dst-port>      the port the target listens on\n"
 		"    -t <torrent-file>  the torrent file previously generated by gen-torrent\n"
 		"    -C                 send corrupt pieces sometimes (applies to upload and dual)\n"
-		"    -r <reconnects>    churn - number of reconnects per second\n\n"
+		"    -K <blocks>        send one in every <blocks> blocks corrupt (implies -C,\n"
+		"                       default 1000)\n"
+		"    -r <reconnects>    churn - number of reconnects per second\n"
+		"    -m <percent>       the percentage of connections that are seeds\n"
+		"                       (applies to dual, default 50)\n"
+		"    -Z <seed>          seed the random number generators, to make runs\n"
+		"                       repeatable\n\n"
 		"examples:\n\n"
 		"connection_tester gen-torrent -s 1024 -n 4 -t test.torrent\n"
 		"connection_tester upload -c 200 -d 127.0.0.1 -p 6881 -t test.torrent\n"
@@ -737,7 +752,38 @@ struct peer_conn
 	exit(1);
 }
 
+// computes the merkle root of the leaves. The number of leaves must be a
+// power of two
+sha256_hash piece_root(std::vector<sha256_hash> leaves)
+{
+	while (leaves.size() > 1)
+	{
+		for (std::size_t i = 0; i < leaves.size() / 2; ++i)
+		{
+			hasher256 h;
+			h.update(leaves[i * 2]);
+			h.update(leaves[i * 2 + 1]);
+			leaves[i] = h.final();
+		}
+		leaves.resize(leaves.size() / 2);
+	}
+	return leaves.empty() ? sha256_hash() : leaves[0];
+}
+
+// add the v2 hash of the part of this block that's inside the file
+void hash_v2_block(std::vector<sha256_hash>& blocks, std::uint32_t const* block
+	, std::int64_t const left_in_file)
+{
+	if (left_in_file <= 0) return;
+	blocks.push_back(hasher256(reinterpret_cast<char const*>(block)
+		, int(std::min(left_in_file, std::int64_t(0x4000)))).final());
+}
+
+// if output2 is not nullptr, the v2 piece layer hashes are computed too.
+// In v2 (and hybrid) torrents every file is aligned to a piece boundary, so
+// each piece belongs to a single file
 void hasher_thread(lt::aux::vector<sha1_hash, piece_index_t>* output
+	, lt::aux::vector<sha256_hash, piece_index_t>* output2
 	, lt::file_storage const& fs
 	, piece_index_t const start_piece
 	, piece_index_t const end_piece
@@ -751,9 +797,14 @@ void hasher_thread(lt::aux::vector<sha1_hash, piece_index_t>* output
 		, std::min(static_cast<int>(end_piece - start_piece) * std::int64_t(piece_size)
 			, fs.total_size() - static_cast<int>(start_piece) * std::int64_t(piece_size)));
 
+	std::vector<sha256_hash> blocks;
 	for (piece_index_t i = start_piece; i < end_piece; ++i)
 	{
 		hasher ph;
+		blocks.clear();
+		std::int64_t const piece_start = static_cast<int>(i) * std::int64_t(piece_size);
+		file_index_t const file = fs.file_index_at_piece(i);
+		std::int64_t const file_end = fs.file_offset(file) + fs.file_size(file);
 		for (int j = 0; j < piece_size; j += 0x4000)
 		{
 			generate_block(piece, i, j);
@@ -771,6 +822,7 @@ void hasher_thread(lt::aux::vector<sha1_hash, piece_index_t>* output
 					// extends a bit past the end of the last file. This part
 					// should be truncated
 					ph.update(reinterpret_cast<char*>(piece), k);
+					if (output2) hash_v2_block(blocks, piece, file_end - piece_start - j);
 					goto out;
 				}
 				auto& f = files.front();
@@ -784,9 +836,24 @@ void hasher_thread(lt::aux::vector<sha1_hash, piece_index_t>* output
 				if (f.size == 0) files.erase(files.begin());
 			}
 			ph.update(reinterpret_cast<char*>(piece), 0x4000);
+			if (output2) hash_v2_block(blocks, piece, file_end - piece_start - j);
 		}
 out:
 		(*output)[i] = ph.final();
+		if (output2 && !blocks.empty() && !fs.pad_file_at(file))
+		{
+			// just like create_torrent, the block hashes of files smaller
+			// than a piece are padded to the next power of two, all other
+			// pieces are padded to the piece size
+			int num_leafs = piece_size / 0x4000;
+			if (fs.file_size(file) < piece_size)
+			{
+				num_leafs = 1;
+				while (num_leafs < int(blocks.size())) num_leafs *= 2;
+			}
+			blocks.resize(std::size_t(num_leafs));
+			(*output2)[i] = piece_root(blocks);
+		}
 		int const range = static_cast<int>(end_piece) - static_cast<int>(start_piece);
 		if (print && (static_cast<int>(i) & 1))
 		{
@@ -797,14 +864,12 @@ out:
 	if (print) std::fprintf(stderr, "\n");
 }
 
-// size is in megabytes
-void generate_torrent(std::vector<char>& buf, int num_pieces, int num_files
-	, char const* torrent_name)
+// size is in megabytes, piece_size in bytes
+void generate_torrent(std::vector<char>& buf, int const size, int num_files
+	, char const* torrent_name, int const piece_size, create_flags_t const flags)
 {
 	file_storage fs;
-	// 1 MiB piece size
-	const int piece_size = 1024 * 1024;
-	const std::int64_t total_size = std::int64_t(piece_size) * num_pieces;
+	const std::int64_t total_size = std::int64_t(size) * 1024 * 1024;
 
 	std::int64_t s = total_size;
 	int file_index = 0;
@@ -819,9 +884,10 @@ void generate_torrent(std::vector<char>& buf, int num_pieces, int num_files
 		file_size += 200;
 	}
 
-	lt::create_torrent t(fs, piece_size, lt::create_torrent::v1_only);
+	lt::create_torrent t(fs, piece_size, flags);
 
-	num_pieces = t.num_pieces();
+	int const num_pieces = t.num_pieces();
+	bool const v2 = !(flags & lt::create_torrent::v1_only);
 
 	int const num_threads = std::thread::hardware_concurrency()
 		? int(std::thread::hardware_concurrency()) : 4;
@@ -830,9 +896,11 @@ void generate_torrent(std::vector<char>& buf, int num_pieces, int num_files
 	std::vector<std::thread> threads;
 	threads.reserve(std::size_t(num_threads));
 	lt::aux::vector<lt::sha1_hash, piece_index_t> hashes{static_cast<std::size_t>(num_pieces)};
+	lt::aux::vector<lt::sha256_hash, piece_index_t> hashes2;
+	if (v2) hashes2.resize(static_cast<std::size_t>(num_pieces));
 	for (int i = 0; i < num_threads; ++i)
 	{
-		threads.emplace_back(&hasher_thread, &hashes, t.files()
+		threads.emplace_back(&hasher_thread, &hashes, v2 ? &hashes2 : nullptr, t.files()
 			, piece_index_t(i * num_pieces / num_threads)
 			, piece_index_t((i + 1) * num_pieces / num_threads)
 			, i == 0);
@@ -841,8 +909,17 @@ void generate_torrent(std::vector<char>& buf, int num_pieces, int num_files
 	for (auto& i : threads)
 		i.join();
 
-	for (auto i : t.files().piece_range())
-		t.set_hash(i, hashes[i]);
+	file_storage const& files = t.files();
+	for (auto i : files.piece_range())
+	{
+		if (!(flags & lt::create_torrent::v2_only))
+			t.set_hash(i, hashes[i]);
+		if (!v2) continue;
+		file_index_t const file = files.file_index_at_piece(i);
+		if (files.pad_file_at(file) || files.file_size(file) == 0) continue;
+		piece_index_t const first(int(files.file_offset(file) / piece_size));
+		t.set_hash2(file, i - first, hashes2[i]);
+	}
 
 	bencode(std::back_inserter(buf), t.generate());
 }
@@ -964,6 +1041,9 @@ int main(int argc, char* argv[])
 	int destination_port = 6881;
 	int churn = 0;
 	std::vector<std::string> trackers;
+	int piece_size = 1024 * 1024;
+	create_flags_t torrent_flags = lt::create_torrent::v1_only;
+	int seed_percent = 50;
 
 	argv += 2;
 	argc -= 2;
@@ -1008,6 +1088,22 @@ int main(int argc, char* argv[])
 			case 'p': destination_port = atoi(opt); break;
 			case 'd': destination_ip = opt; break;
 			case 'r': churn = atoi(opt); break;
+			case 'S': piece_size = atoi(opt) * 1024; break;
+			case 'K':
+				test_corruption = true;
+				corruption_interval = std::max(1, atoi(opt));
+				break;
+			case 'm': seed_percent = std::max(0, std::min(100, atoi(opt))); break;
+			case 'Z':
+				std::srand(unsigned(atoi(opt)));
+				rng.seed(std::mt19937::result_type(atoi(opt)));
+				break;
+			case 'V':
+				if (opt == "v1"_sv) torrent_flags = lt::create_torrent::v1_only;
+				else if (opt == "v2"_sv) torrent_flags = lt::create_torrent::v2_only;
+				else if (opt == "hybrid"_sv) torrent_flags = {};
+				else std::fprintf(stderr, "unknown torrent version: %s\n", opt);
+				break;
 			default: std::fprintf(stderr, "unknown option: %s\n", optname);
 		}
 	}
@@ -1019,7 +1115,7 @@ int main(int argc, char* argv[])
 		name = name.substr(0, name.find_last_of('.'));
 		std::printf("generating torrent: %s\n", name.c_str());
 		generate_torrent(tmp, size ? size : 1024, num_files ? num_files : 1
-			, name.c_str() );
+			, name.c_str(), piece_size, torrent_flags);
 
 		FILE* output = stdout;
 		if ("-"_sv != torrent_file)
@@ -1146,12 +1242,18 @@ int main(int argc, char* argv[])
 	conns.reserve(std::size_t(num_connections));
 	int const num_threads = 2;
 	io_context ios[num_threads];
+	int seeds = 0;
 	for (int i = 0; i < num_connections; ++i)
 	{
-		bool corrupt = test_corruption && (i & 1) == 0;
 		bool seed = false;
 		if (test_mode == upload_test) seed = true;
-		else if (test_mode == dual_test) seed = (i & 1);
+		else if (test_mode == dual_test)
+		{
+			// spread the seeds evenly over the connections
+			seed = (i + 1) * seed_percent / 100 != i * seed_percent / 100;
+		}
+		// only seeds send pieces. Every other one of them sends some corrupt
+		bool const corrupt = test_corruption && seed && (seeds++ % 2) == 0;
 		conns.push_back(new peer_conn(ios[i % num_threads], ti.num_pieces(), ti.piece_length() / 16 / 1024
 			, ep, ti.info_hash().data(), seed, churn, corrupt));
 		std::this_thread::sleep_for(std::chrono::milliseconds(1));
@@ -1189,5 +1291,15 @@ int main(int argc, char* argv[])
 		, total_received * 0x4000 * 100.0 / double(ti.total_size())
 		, up, down);
 
+	if (test_corruption)
+	{
+		std::printf("corrupt blocks sent: %d\n", int(num_corrupt_blocks));
+		if (num_corrupt_blocks == 0)
+		{
+			std::fprintf(stderr, "ERROR: corruption test did not send any corrupt blocks\n");
+			return 1;
+		}
+	}
+
 	return 0;
 }
@@ -1,18 +1,5 @@
 #!/bin/bash
-set -e
-
-function minimize
-{
-mkdir corpus/${1}
-./fuzzers/${1} -artifact_prefix=./${1}- -merge=1 corpus/${1} prev-corpus/${1}
-}
-
-mv corpus prev-corpus
-mkdir corpus
-
-for file in fuzzers/*; do
-	minimize $(basename $file) &
-done
-
-wait
 
+# minimizes the corpus of all fuzzers in parallel. The previous corpus is kept
+# in prev-corpus, see tools/corpus.py
+exec python3 "$(dirname "$0")/tools/corpus.py" minimize "$@"
@@ -1,13 +1,6 @@
 #!/bin/bash
 
-function run
-{
-# run for 48 hours
-nice ./fuzzers/${1} -max_total_time=172800 -timeout=10 -artifact_prefix=./${1}- corpus/${1}
-}
-
-for file in fuzzers/*; do
-	run $(basename $file) &
-done
-
-wait
+# runs all fuzzers in parallel, for 48 hours by default. The coverage and
+# execs/sec of every fuzzer are appended to corpus-history.jsonl, see
+# tools/corpus.py for options (e.g. --max-total-time)
+exec python3 "$(dirname "$0")/tools/corpus.py" run "$@"
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# the fuzz corpus pipeline. Run from the fuzzers directory, after building the
+# fuzzers (b2 clang stage) into fuzzers/:
+#
+#   generate   generates the seed inputs (generate_initial_corpus.py) in
+#              parallel, one process per fuzzer, into corpus/<fuzzer>
+#   dedupe     names every corpus file by the SHA-1 of its content, removing
+#              duplicates
+#   minimize   minimizes the corpus of every fuzzer with -merge=1, keeping only
+#              the inputs that add coverage. The previous corpus is kept in
+#              prev-corpus/
+#   run        runs the fuzzers, in parallel
+#   report     prints the corpus size, coverage and execs/sec of every fuzzer
+#              over time
+#
+# minimize and run append the corpus size, coverage (edges and features) and
+# throughput (execs/sec) of every fuzzer to a history file
+# (corpus-history.jsonl), one JSON object per line.
+#
+# usage: corpus.py generate|dedupe|minimize|run|report [options] [fuzzer...]
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import string
+import subprocess
+import sys
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import generate_initial_corpus
+
+# libFuzzer's status lines, e.g.:
+# #4096	pulse  cov: 1217 ft: 3307 corp: 201/27Kb lim: 4096 exec/s: 2048 rss: 42Mb
+status_line = re.compile(
+    r"^#(\d+)\s+(\w+)\s+cov: (\d+) ft: (\d+) (?:corp: (\d+)/(\d+)(b|Kb|Mb) )?"
+    r".*?exec/s: (\d+) rss: (\d+)Mb"
+)
+merge_line = re.compile(
+    r"MERGE-OUTER: (\d+) new files with (\d+) new features added; "
+    r"(\d+) new coverage edges"
+)
+
+units = {"b": 1, "Kb": 1024, "Mb": 1024 * 1024}
+
+# the stats of a status line, or a history entry
+Entry = Dict[str, Any]
+
+
+def parse_status(line: str) -> Optional[Entry]:
+    # returns a dict of the stats of a libFuzzer status line, or None
+    m = status_line.match(line)
+    if m is None:
+        return None
+    ret: Entry = {
+        "runs": int(m.group(1)),
+        "event": m.group(2),
+        "cov": int(m.group(3)),
+        "ft": int(m.group(4)),
+        "exec_per_sec": int(m.group(8)),
+        "rss_mb": int(m.group(9)),
+    }
+    if m.group(5) is not None:
+        ret["corp_files"] = int(m.group(5))
+        ret["corp_bytes"] = int(m.group(6)) * units[m.group(7)]
+    return ret
+
+
+def revision() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def corpus_size(directory: str) -> Tuple[int, int]:
+    files = 0
+    size = 0
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                files += 1
+                size += os.path.getsize(path)
+    return files, size
+
+
+def record(args: argparse.Namespace, entries: List[Entry]) -> None:
+    with open(args.history, "a") as f:
+        for e in entries:
+            f.write(json.dumps(e, sort_keys=True) + "\n")
+
+
+def fuzzer_names(args: argparse.Namespace) -> List[str]:
+    if args.fuzzers:
+        names: List[str] = args.fuzzers
+        return names
+    if not os.path.isdir(args.bin_dir):
+        print('no fuzzers in %s, build them with "b2 clang stage"' % args.bin_dir)
+        return []
+    return sorted(
+        f
+        for f in os.listdir(args.bin_dir)
+        if os.access(os.path.join(args.bin_dir, f), os.X_OK)
+    )
+
+
+def generate_one(job: Tuple[str, str]) -> Tuple[str, int, int]:
+    name, directory = job
+    inputs = generate_initial_corpus.generators[name]()
+    os.makedirs(directory, exist_ok=True)
+    new_files: int = generate_initial_corpus.write_inputs(directory, inputs)
+    return name, len(inputs), new_files
+
+
+def generate(args: argparse.Namespace) -> int:
+    for p in generate_initial_corpus.corpus_dirs:
+        os.makedirs(os.path.join(args.corpus, p), exist_ok=True)
+    names = args.fuzzers or sorted(generate_initial_corpus.generators)
+    jobs = [
+        (n, os.path.join(args.corpus, n))
+        for n in names
+        if n in generate_initial_corpus.generators
+    ]
+    with multiprocessing.Pool(args.jobs) as pool:
+        for name, generated, new_files in pool.imap_unordered(generate_one, jobs):
+            print("%-20s %6d inputs, %6d new" % (name, generated, new_files))
+    return 0
+
+
+def dedupe_dir(directory: str) -> Tuple[int, int]:
+    # returns (renamed, removed)
+    renamed = 0
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        if len(name) == 40 and all(c in string.hexdigits for c in name):
+            continue
+        with open(path, "rb") as f:
+            new_path = os.path.join(directory, hashlib.sha1(f.read()).hexdigest())
+        if os.path.exists(new_path):
+            os.remove(path)
+            removed += 1
+        else:
+            os.rename(path, new_path)
+            renamed += 1
+    return renamed, removed
+
+
+def dedupe(args: argparse.Namespace) -> int:
+    names = args.fuzzers or sorted(os.listdir(args.corpus))
+    for name in names:
+        directory = os.path.join(args.corpus, name)
+        if not os.path.isdir(directory):
+            continue
+        renamed, removed = dedupe_dir(directory)
+        print("%-20s %6d renamed, %6d duplicates removed" % (name, renamed, removed))
+    return 0
+
+
+def run_fuzzer(
+    args: argparse.Namespace, name: str, fuzzer_args: List[str], log: str
+) -> Tuple[int, List[Entry], Optional[Dict[str, int]]]:
+    # runs a fuzzer, logging its output. Returns the exit code and the
+    # status lines
+    cmd = [
+        os.path.join(args.bin_dir, name),
+        "-artifact_prefix=./%s-" % name,
+    ] + fuzzer_args
+    if args.nice:
+        cmd = ["nice"] + cmd
+    statuses: List[Entry] = []
+    merge: Optional[Dict[str, int]] = None
+    start = time.monotonic()
+    with open(log, "w+") as out:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+        )
+        assert proc.stdout is not None
+        for raw in proc.stdout:
+            line = raw.decode(errors="replace")
+            out.write(line)
+            s = parse_status(line)
+            if s is not None:
+                s["time"] = time.monotonic() - start
+                statuses.append(s)
+            m = merge_line.search(line)
+            if m is not None:
+                merge = {
+                    "new_files": int(m.group(1)),
+                    "new_ft": int(m.group(2)),
+                    "new_cov": int(m.group(3)),
+                }
+        proc.wait()
+    return proc.returncode, statuses, merge
+
+
+def history_entry(
+    name: str, event: str, statuses: List[Entry], directory: str
+) -> Entry:
+    files, size = corpus_size(directory)
+    e: Entry = {
+        "fuzzer": name,
+        "event": event,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        "revision": revision(),
+        "files": files,
+        "bytes": size,
+    }
+    if statuses:
+        last = statuses[-1]
+        e.update(
+            {
+                "cov": last["cov"],
+                "ft": last["ft"],
+                "exec_per_sec": last["exec_per_sec"],
+                "rss_mb": max(s["rss_mb"] for s in statuses),
+            }
+        )
+    return e
+
+
+def minimize_one(args: argparse.Namespace, name: str) -> Optional[Entry]:
+    directory = os.path.join(args.corpus, name)
+    prev = os.path.join(args.prev_corpus, name)
+    if os.path.exists(prev):
+        shutil.rmtree(prev)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    files_before, bytes_before = corpus_size(directory)
+    os.rename(directory, prev)
+    os.makedirs(directory)
+    ret, statuses, merge = run_fuzzer(
+        args,
+        name,
+        ["-merge=1", directory, prev],
+        os.path.join(args.log_dir, "%s-minimize.log" % name),
+    )
+    if ret != 0:
+        # put the previous corpus back
+        shutil.rmtree(directory)
+        os.rename(prev, directory)
+        print(
+            "%-20s merge failed (%d), see %s"
+            % (name, ret, os.path.join(args.log_dir, "%s-minimize.log" % name))
+        )
+        return None
+    e = history_entry(name, "minimize", statuses, directory)
+    e.update({"files_before": files_before, "bytes_before": bytes_before})
+    if merge is not None:
+        e.update(merge)
+    print(
+        "%-20s %6d -> %6d files, %9d -> %9d bytes, cov: %s"
+        % (name, files_before, e["files"], bytes_before, e["bytes"], e.get("cov", "-"))
+    )
+    return e
+
+
+def run_one(args: argparse.Namespace, name: str) -> Optional[Entry]:
+    directory = os.path.join(args.corpus, name)
+    os.makedirs(directory, exist_ok=True)
+    fuzzer_args = [
+        "-max_total_time=%d" % args.max_total_time,
+        "-timeout=%d" % args.timeout,
+    ]
+    fuzzer_args += ["-print_final_stats=1", directory]
+    ret, statuses, _ = run_fuzzer(
+        args, name, fuzzer_args, os.path.join(args.log_dir, "%s-run.log" % name)
+    )
+    e = history_entry(name, "run", statuses, directory)
+    e["exit_code"] = ret
+    # the coverage and corpus size over the run, at most one sample per
+    # minute
+    samples: List[Entry] = []
+    for s in statuses:
+        if not samples or s["time"] - samples[-1]["time"] >= 60 or s is statuses[-1]:
+            samples.append(
+                dict(
+                    (k, s[k])
+                    for k in ("time", "runs", "cov", "ft", "corp_files", "exec_per_sec")
+                    if k in s
+                )
+            )
+    e["samples"] = samples
+    print(
+        "%-20s exit: %d, cov: %s, files: %d, exec/s: %s"
+        % (name, ret, e.get("cov", "-"), e["files"], e.get("exec_per_sec", "-"))
+    )
+    return e
+
+
+def parallel(
+    args: argparse.Namespace,
+    fn: Callable[[argparse.Namespace, str], Optional[Entry]],
+) -> int:
+    names = fuzzer_names(args)
+    if not names:
+        return 1
+    os.makedirs(args.log_dir, exist_ok=True)
+    entries: List[Entry] = []
+    # the fuzzers are separate processes, threads are enough to drive them
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as pool:
+        for e in pool.map(lambda n: fn(args, n), names):
+            if e is not None:
+                entries.append(e)
+                record(args, [e])
+    return 0 if len(entries) == len(names) else 1
+
+
+def minimize(args: argparse.Namespace) -> int:
+    os.makedirs(args.prev_corpus, exist_ok=True)
+    return parallel(args, minimize_one)
+
+
+def run(args: argparse.Namespace) -> int:
+    return parallel(args, run_one)
+
+
+def report(args: argparse.Namespace) -> int:
+    if not os.path.exists(args.history):
+        print("no history in %s" % args.history)
+        return 1
+    history: Dict[str, List[Entry]] = {}
+    with open(args.history) as f:
+        for line in f:
+            e = json.loads(line)
+            if args.fuzzers and e["fuzzer"] not in args.fuzzers:
+                continue
+            history.setdefault(e["fuzzer"], []).append(e)
+    print(
+        "%-20s %-9s %-19s %-10s %8s %10s %7s %8s %9s"
+        % (
+            "fuzzer",
+            "event",
+            "date",
+            "revision",
+            "files",
+            "bytes",
+            "cov",
+            "ft",
+            "exec/s",
+        )
+    )
+    for name in sorted(history):
+        for e in history[name]:
+            print(
+                "%-20s %-9s %-19s %-10s %8d %10d %7s %8s %9s"
+                % (
+                    name,
+                    e["event"],
+                    e["date"][:19],
+                    e.get("revision") or "-",
+                    e["files"],
+                    e["bytes"],
+                    e.get("cov", "-"),
+                    e.get("ft", "-"),
+                    e.get("exec_per_sec", "-"),
+                )
+            )
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="generate, deduplicate, minimize and track the fuzz corpus"
+    )
+    parser.add_argument(
+        "command", choices=["generate", "dedupe", "minimize", "run", "report"]
+    )
+    parser.add_argument(
+        "fuzzers", nargs="*", help="the fuzzers to process (default: all)"
+    )
+    parser.add_argument(
+        "--corpus", default="corpus", help="the corpus directory (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--prev-corpus",
+        default="prev-corpus",
+        help="where minimize keeps the previous corpus (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--bin-dir",
+        default="fuzzers",
+        help="where the fuzzer binaries are (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default="logs",
+        help="where to write the fuzzer output (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--history",
+        default="corpus-history.jsonl",
+        help="the file to append corpus size, coverage and execs/sec to "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="the number of fuzzers or generators to run in parallel "
+        "(default: one per fuzzer for run, the number of CPUs otherwise)",
+    )
+    parser.add_argument(
+        "--max-total-time",
+        type=int,
+        default=172800,
+        help="seconds to run every fuzzer for (default: %(default)s, i.e. 48 hours)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=10,
+        help="the per-input timeout, in seconds (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-nice",
+        dest="nice",
+        action="store_false",
+        help="don't run the fuzzers with nice",
+    )
+    args = parser.parse_args()
+
+    if args.jobs is None and args.command == "run":
+        args.jobs = max(1, len(fuzzer_names(args)))
+    if args.jobs is None:
+        args.jobs = multiprocessing.cpu_count()
+
+    commands: Dict[str, Callable[[argparse.Namespace], int]] = {
+        "generate": generate,
+        "dedupe": dedupe,
+        "minimize": minimize,
+        "run": run,
+        "report": report,
+    }
+    return commands[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -34,6 +34,7 @@ see LICENSE file.
 #include "libtorrent/entry.hpp"
 #include "libtorrent/peer_request.hpp"
 #include "libtorrent/performance_counters.hpp"
+#include "libtorrent/peer_class.hpp"
 #include "libtorrent/operations.hpp" // for operation_t enum
 #include "libtorrent/close_reason.hpp"
 #include "libtorrent/piece_block.hpp"
@@ -74,7 +75,7 @@ namespace libtorrent {
 	constexpr int user_alert_id = 10000;
 
 	// this constant represents "max_alert_index" + 1
-	constexpr int num_alert_types = 97;
+	constexpr int num_alert_types = 98;
 
 	// internal
 	constexpr int abi_alert_count = 128;
@@ -2875,8 +2876,9 @@ TORRENT_VERSION_NAMESPACE_3
 	struct TORRENT_EXPORT alerts_dropped_alert final : alert
 	{
 		// internal
-		explicit TORRENT_UNEXPORT alerts_dropped_alert(aux::stack_allocator& alloc
-			, std::bitset<abi_alert_count> const&);
+		TORRENT_UNEXPORT alerts_dropped_alert(aux::stack_allocator& alloc
+			, std::bitset<abi_alert_count> const&
+			, std::array<int, abi_alert_count> const&);
 		TORRENT_DEFINE_ALERT_PRIO(alerts_dropped_alert, 95, alert_priority::meta)
 
 		static inline constexpr alert_category_t static_category = alert_category::error;
@@ -2887,6 +2889,10 @@ TORRENT_VERSION_NAMESPACE_3
 		// been dropped, and so on.
 		std::bitset<abi_alert_count> dropped_alerts;
 		static_assert(num_alert_types <= abi_alert_count, "need to increase bitset. This is an ABI break");
+
+		// the number of alerts of each type that were dropped since the last
+		// alerts_dropped_alert, indexed by alert type ID.
+		std::array<int, abi_alert_count> num_dropped;
 	};
 
 	// this alert is posted with SOCKS5 related errors, when a SOCKS5 proxy is
@@ -2911,6 +2917,58 @@ TORRENT_VERSION_NAMESPACE_3
 		aux::noexcept_movable<tcp::endpoint> ip;
 	};
 
+	// the bandwidth accounting of a single peer class, as reported by
+	// peer_class_stats_alert. The byte counters and throttled times are
+	// cumulative, since the peer class was created. The queued bytes are the
+	// current number of bytes waiting for quota in the rate limiter.
+	struct TORRENT_EXPORT peer_class_stats
+	{
+		// the peer class these counters belong to
+		peer_class_t peer_class;
+
+		// the number of payload and protocol bytes sent and received by peers
+		// in this class (including peers of torrents in this class)
+		std::int64_t upload_payload;
+		std::int64_t upload_protocol;
+		std::int64_t download_payload;
+		std::int64_t download_protocol;
+
+		// the number of bytes peers in this class are waiting for the rate
+		// limiter to assign them, for the upload and download channel
+		std::int64_t upload_queued;
+		std::int64_t download_queued;
+
+		// the number of milliseconds peers in this class have had to wait for
+		// this class' rate limit, i.e. the time there have been bytes queued.
+		std::int64_t upload_throttled;
+		std::int64_t download_throttled;
+	};
+
+	// posted in response to session::post_peer_class_stats(). It carries the
+	// bandwidth accounting of every peer class in the session, as a single
+	// array. To get the rates for an interval, call post_peer_class_stats()
+	// periodically and subtract the counters of the previous alert. This
+	// alert does not have a category, since it's only posted in response to
+	// an API call. It is not subject to the alert_mask filter.
+	struct TORRENT_EXPORT peer_class_stats_alert final : alert
+	{
+		// internal
+		TORRENT_UNEXPORT peer_class_stats_alert(aux::stack_allocator& alloc
+			, span<peer_class_stats const> stats);
+		TORRENT_DEFINE_ALERT_PRIO(peer_class_stats_alert, 97, alert_priority::critical)
+
+		static inline constexpr alert_category_t static_category = {};
+		std::string message() const override;
+
+		// the counters of every peer class, in peer class order
+		span<peer_class_stats const> stats() const;
+
+	private:
+		std::reference_wrapper<aux::stack_allocator const> m_alloc;
+		int const m_num_classes;
+		aux::allocation_slot m_stats_idx;
+	};
+
 TORRENT_VERSION_NAMESPACE_3_END
 
 	// internal
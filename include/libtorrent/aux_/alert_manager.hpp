@@ -18,6 +18,7 @@ see LICENSE file.
 #include "libtorrent/aux_/stack_allocator.hpp"
 #include "libtorrent/alert_types.hpp" // for abi_alert_count
 #include "libtorrent/aux_/array.hpp"
+#include "libtorrent/time.hpp"
 
 #include <functional>
 #include <utility> // for std::forward
@@ -58,7 +59,7 @@ namespace aux {
 			if (queue.size() / (1 + static_cast<int>(T::priority)) >= m_queue_size_limit)
 			{
 				// record that we dropped an alert of this type
-				m_dropped.set(T::alert_type);
+				record_dropped(T::alert_type);
 				return;
 			}
 
@@ -71,7 +72,7 @@ namespace aux {
 		{
 			// record that we dropped an alert of this type
 			std::unique_lock<std::recursive_mutex> lock(m_mutex);
-			m_dropped.set(T::alert_type);
+			record_dropped(T::alert_type);
 		}
 
 		bool pending() const;
@@ -80,7 +81,9 @@ namespace aux {
 		template <class T>
 		bool should_post() const
 		{
-			return bool(m_alert_mask.load(std::memory_order_relaxed) & T::static_category);
+			return bool(m_alert_mask.load(std::memory_order_relaxed)
+				& ~m_suppressed.load(std::memory_order_relaxed)
+				& T::static_category);
 		}
 
 		alert* wait_for_alert(time_duration max_wait);
@@ -100,6 +103,28 @@ namespace aux {
 
 		void set_notify_function(std::function<void()> const& fun);
 
+		// when enabled, the categories in noisy_categories are suppressed while
+		// the queue is close to full, and restored once the client keeps up
+		// again
+		void set_adaptive_mask(bool enable);
+
+		// the categories suppressed in adaptive mode. These are the ones that
+		// may post alerts at a high rate
+		static inline constexpr alert_category_t noisy_categories
+			= alert_category::session_log
+			| alert_category::torrent_log
+			| alert_category::peer_log
+			| alert_category::dht_log
+			| alert_category::port_mapping_log
+			| alert_category::picker_log
+			| alert_category::dht_operation
+			| alert_category::upload
+			| alert_category::block_progress;
+
+		// sets the alert queue counters (depth, high-water mark, drops, pop
+		// latency and suppressed categories) in the session stats
+		void update_stats_counters(counters& c) const;
+
 #ifndef TORRENT_DISABLE_EXTENSIONS
 		void add_extension(std::shared_ptr<plugin> ext);
 #endif
@@ -107,6 +132,7 @@ namespace aux {
 	private:
 
 		void maybe_notify(alert* a);
+		void record_dropped(int type);
 
 		// this mutex protects everything. Since it's held while executing user
 		// callbacks (the notify function and extension on_alert()) it must be
@@ -122,6 +148,29 @@ namespace aux {
 		// may have missed an update.
 		std::bitset<abi_alert_count> m_dropped;
 
+		// the number of alerts of each type dropped since the last
+		// alerts_dropped_alert was posted
+		std::array<int, abi_alert_count> m_num_dropped{};
+
+		// the total number of alerts dropped
+		std::int64_t m_total_dropped = 0;
+
+		// the largest number of alerts that has been in the queue
+		int m_high_water = 0;
+
+		// the time the first alert was posted into the (empty) queue, i.e.
+		// when the notify function was called. The time until the client
+		// pops the alerts is accumulated in m_pop_latency (microseconds)
+		time_point m_first_alert;
+		std::int64_t m_num_pops = 0;
+		std::int64_t m_pop_latency = 0;
+
+		// adaptive mode. m_suppressed are the categories currently masked out
+		// because the queue is (nearly) full
+		bool m_adaptive = false;
+		std::atomic<alert_category_t> m_suppressed{alert_category_t{}};
+		std::int64_t m_num_suppressions = 0;
+
 		// this function (if set) is called whenever the number of alerts in
 		// the alert queue goes from 0 to 1. The client is expected to wake up
 		// its main message loop for it to poll for alerts (using get_alerts()).
@@ -65,6 +65,10 @@ struct TORRENT_EXTRA_EXPORT bandwidth_channel
 	// this is the number of bytes to distribute this round
 	int distribute_quota;
 
+	// the number of milliseconds this channel has had requests waiting for
+	// quota in the bandwidth_manager. Cumulative
+	std::int64_t throttled_time;
+
 private:
 
 	// this is the amount of bandwidth we have
@@ -37,6 +37,9 @@ struct TORRENT_EXTRA_EXPORT bandwidth_manager
 	int queue_size() const;
 	std::int64_t queued_bytes() const;
 
+	// the number of queued bytes waiting for quota from the specified channel
+	std::int64_t queued_bytes(bandwidth_channel const* chan) const;
+
 	// non prioritized means that, if there's a line for bandwidth,
 	// others will cut in front of the non-prioritized peers.
 	// this is used by web seeds
@@ -21,6 +21,7 @@ see LICENSE file.
 #include "libtorrent/units.hpp"
 #include "libtorrent/session_types.hpp"
 #include "libtorrent/flags.hpp"
+#include "libtorrent/time.hpp"
 
 #include <variant>
 #include <string>
@@ -183,6 +184,10 @@ namespace libtorrent::aux {
 
 		move_flags_t move_flags = move_flags_t::always_replace_files;
 
+		// the time the job was added to the disk thread, to measure how long
+		// it waits in the queue (disk_queue_latency)
+		time_point queued_time;
+
 #if TORRENT_USE_ASSERTS
 		bool in_use = false;
 
@@ -757,6 +757,11 @@ namespace libtorrent::aux {
 
 		void account_received_bytes(int bytes_transferred);
 
+		// adds transferred bytes to the counters of the peer classes this
+		// peer (and its torrent) belongs to
+		void account_peer_class_bytes(int channel, int bytes_payload
+			, int bytes_protocol);
+
 		void do_update_interest();
 		void fill_send_buffer();
 		void on_disk_read_complete(disk_buffer_holder buffer
@@ -592,6 +592,7 @@ namespace aux {
 			void post_torrent_updates(status_flags_t flags);
 			void post_session_stats();
 			void post_dht_stats();
+			void post_peer_class_stats();
 
 			std::vector<torrent_handle> get_torrents() const;
 
@@ -830,6 +831,7 @@ namespace aux {
 			void update_upload_rate();
 			void update_connections_limit();
 			void update_alert_mask();
+			void update_adaptive_alert_mask();
 			void update_validate_https();
 
 			void trigger_auto_manage() override;
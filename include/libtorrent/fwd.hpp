@@ -119,6 +119,8 @@ struct dht_sample_infohashes_alert;
 struct block_uploaded_alert;
 struct alerts_dropped_alert;
 struct socks5_alert;
+struct peer_class_stats;
+struct peer_class_stats_alert;
 TORRENT_VERSION_NAMESPACE_3_END
 
 // include/libtorrent/announce_entry.hpp
@@ -78,6 +78,10 @@ namespace libtorrent {
 		{
 			priority[0] = 1;
 			priority[1] = 1;
+			payload_bytes[0] = 0;
+			payload_bytes[1] = 0;
+			protocol_bytes[0] = 0;
+			protocol_bytes[1] = 0;
 		}
 
 		void clear()
@@ -104,6 +108,12 @@ namespace libtorrent {
 		// for download
 		int priority[2];
 
+		// the number of bytes transferred by peers in this class, one counter
+		// for upload and one for download. Reported by
+		// session::post_peer_class_stats()
+		std::int64_t payload_bytes[2];
+		std::int64_t protocol_bytes[2];
+
 		// the name of this peer class
 		std::string label;
 
@@ -122,6 +132,10 @@ namespace libtorrent {
 		peer_class* at(peer_class_t c);
 		peer_class const* at(peer_class_t c) const;
 
+		// one past the highest peer class ID. Classes that have been deleted
+		// are nullptr when looked up with at()
+		peer_class_t end_index() const { return m_peer_classes.end_index(); }
+
 	private:
 
 		// state for peer classes (a peer can belong to multiple classes)
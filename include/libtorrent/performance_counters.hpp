@@ -301,6 +301,107 @@ namespace libtorrent {
 			socket_recv_size19,
 			socket_recv_size20,
 
+			// log2 histograms of the latency of disk jobs. Every job is
+			// counted in one bucket. Bucket n counts jobs that took at least
+			// 1 << n microseconds (and less than 1 << (n + 1)). The first
+			// bucket also counts faster jobs, the last one slower jobs.
+
+			// 16, 32, 64, 128, 256, 512 microseconds, 1, 2, 4, 8, 16, 32,
+			// 65, 131, 262, 524 milliseconds, 1, 2, 4, 8, 16 seconds
+			disk_read_latency4,
+			disk_read_latency5,
+			disk_read_latency6,
+			disk_read_latency7,
+			disk_read_latency8,
+			disk_read_latency9,
+			disk_read_latency10,
+			disk_read_latency11,
+			disk_read_latency12,
+			disk_read_latency13,
+			disk_read_latency14,
+			disk_read_latency15,
+			disk_read_latency16,
+			disk_read_latency17,
+			disk_read_latency18,
+			disk_read_latency19,
+			disk_read_latency20,
+			disk_read_latency21,
+			disk_read_latency22,
+			disk_read_latency23,
+			disk_read_latency24,
+
+			disk_write_latency4,
+			disk_write_latency5,
+			disk_write_latency6,
+			disk_write_latency7,
+			disk_write_latency8,
+			disk_write_latency9,
+			disk_write_latency10,
+			disk_write_latency11,
+			disk_write_latency12,
+			disk_write_latency13,
+			disk_write_latency14,
+			disk_write_latency15,
+			disk_write_latency16,
+			disk_write_latency17,
+			disk_write_latency18,
+			disk_write_latency19,
+			disk_write_latency20,
+			disk_write_latency21,
+			disk_write_latency22,
+			disk_write_latency23,
+			disk_write_latency24,
+
+			disk_hash_latency4,
+			disk_hash_latency5,
+			disk_hash_latency6,
+			disk_hash_latency7,
+			disk_hash_latency8,
+			disk_hash_latency9,
+			disk_hash_latency10,
+			disk_hash_latency11,
+			disk_hash_latency12,
+			disk_hash_latency13,
+			disk_hash_latency14,
+			disk_hash_latency15,
+			disk_hash_latency16,
+			disk_hash_latency17,
+			disk_hash_latency18,
+			disk_hash_latency19,
+			disk_hash_latency20,
+			disk_hash_latency21,
+			disk_hash_latency22,
+			disk_hash_latency23,
+			disk_hash_latency24,
+
+			disk_queue_latency4,
+			disk_queue_latency5,
+			disk_queue_latency6,
+			disk_queue_latency7,
+			disk_queue_latency8,
+			disk_queue_latency9,
+			disk_queue_latency10,
+			disk_queue_latency11,
+			disk_queue_latency12,
+			disk_queue_latency13,
+			disk_queue_latency14,
+			disk_queue_latency15,
+			disk_queue_latency16,
+			disk_queue_latency17,
+			disk_queue_latency18,
+			disk_queue_latency19,
+			disk_queue_latency20,
+			disk_queue_latency21,
+			disk_queue_latency22,
+			disk_queue_latency23,
+			disk_queue_latency24,
+
+			// alert queue counters, see alert_manager::update_stats_counters()
+			alerts_dropped,
+			alert_pops,
+			alert_pop_latency,
+			alert_suppressions,
+
 			num_stats_counters
 		};
 
@@ -436,9 +537,16 @@ namespace libtorrent {
 
 			num_queued_tracker_announces,
 
+			alert_queue_size,
+			alert_queue_high_water,
+			alert_suppressed_categories,
+
 			num_counters,
 			num_gauges_counters = num_counters - num_stats_counters
 		};
+
+		// the number of buckets of each latency histogram
+		static constexpr int num_latency_buckets = disk_read_latency24 - disk_read_latency4 + 1;
 #ifdef ATOMIC_LLONG_LOCK_FREE
 #define TORRENT_COUNTER_NOEXCEPT noexcept
 #else
@@ -457,6 +565,10 @@ namespace libtorrent {
 		void set_value(int c, std::int64_t value) TORRENT_COUNTER_NOEXCEPT;
 		void blend_stats_counter(int c, std::int64_t value, int ratio) TORRENT_COUNTER_NOEXCEPT;
 
+		// increments the bucket of a latency histogram (e.g.
+		// disk_read_latency4) the number of microseconds falls in
+		void inc_latency_histogram(int first_bucket, std::int64_t microseconds) TORRENT_COUNTER_NOEXCEPT;
+
 	private:
 
 		// TODO: some space could be saved here by making gauges 32 bits
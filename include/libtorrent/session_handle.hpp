@@ -211,6 +211,13 @@ namespace aux { struct torrent; }
 		// This will cause a dht_stats_alert to be posted.
 		void post_dht_stats();
 
+		// This will post a peer_class_stats_alert, with the bytes transferred,
+		// bytes queued in the rate limiter and time spent throttled, of every
+		// peer class. Calling this periodically and comparing the counters
+		// gives the per peer class rates, without having to sum the stats of
+		// individual torrents.
+		void post_peer_class_stats();
+
 		// internal
 		io_context& get_context();
 
@@ -974,6 +974,16 @@ namespace aux {
 			// previously deleted information from the disk.
 			enable_set_file_valid_data,
 
+			// when enabled, the session stops posting alerts of the high
+			// volume categories (logs, block progress, uploads and DHT
+			// operations) once the alert queue is 3/4 full, rather than
+			// dropping alerts when the queue is full. The categories are
+			// turned back on once the client pops the alert queue before it
+			// is 1/4 full. The ``alert.alert_suppressions`` and
+			// ``alert.alert_suppressed_categories`` session stats counters
+			// tell when this happens.
+			adaptive_alert_mask,
+
 			max_bool_setting_internal
 		};
 
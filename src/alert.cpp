@@ -2186,7 +2186,7 @@ namespace {
 		return arr;
 	}
 }
-#else
+#endif
 namespace {
 	template <typename T, typename U>
 	T* align_pointer(U* ptr)
@@ -2195,7 +2195,6 @@ namespace {
 			& ~(alignof(T) - 1));
 	}
 }
-#endif
 
 #if TORRENT_ABI_VERSION == 1
 	session_stats_alert::session_stats_alert(aux::stack_allocator&, struct counters const& cnt)
@@ -2872,8 +2871,10 @@ namespace {
 	}
 
 	alerts_dropped_alert::alerts_dropped_alert(aux::stack_allocator&
-		, std::bitset<abi_alert_count> const& dropped)
+		, std::bitset<abi_alert_count> const& dropped
+		, std::array<int, abi_alert_count> const& counts)
 		: dropped_alerts(dropped)
+		, num_dropped(counts)
 	{}
 
 	char const* alert_name(int const alert_type)
@@ -2925,7 +2926,8 @@ namespace {
 		"dht_pkt", "dht_get_peers_reply", "dht_direct_response",
 		"picker_log", "session_error", "dht_live_nodes",
 		"session_stats_header", "dht_sample_infohashes",
-		"block_uploaded", "alerts_dropped", "socks5"
+		"block_uploaded", "alerts_dropped", "socks5",
+		"peer_class_stats"
 		}};
 
 		TORRENT_ASSERT(alert_type >= 0);
@@ -2971,4 +2973,45 @@ namespace {
 #endif
 	}
 
+	peer_class_stats_alert::peer_class_stats_alert(aux::stack_allocator& alloc
+		, span<peer_class_stats const> st)
+		: m_alloc(alloc)
+		, m_num_classes(int(st.size()))
+		, m_stats_idx(alloc.allocate(int(sizeof(peer_class_stats)) * m_num_classes
+			+ int(alignof(peer_class_stats)) - 1))
+	{
+		peer_class_stats* ptr = align_pointer<peer_class_stats>(alloc.ptr(m_stats_idx));
+		std::copy(st.begin(), st.end(), ptr);
+	}
+
+	span<peer_class_stats const> peer_class_stats_alert::stats() const
+	{
+		return { align_pointer<peer_class_stats const>(m_alloc.get().ptr(m_stats_idx))
+			, m_num_classes };
+	}
+
+	std::string peer_class_stats_alert::message() const
+	{
+#ifdef TORRENT_DISABLE_ALERT_MSG
+		return {};
+#else
+		char msg[300];
+		std::snprintf(msg, sizeof(msg), "peer class stats (%d classes)", m_num_classes);
+		std::string ret = msg;
+		for (auto const& s : stats())
+		{
+			std::snprintf(msg, sizeof(msg), " [%u] up: %" PRId64 "/%" PRId64
+				" down: %" PRId64 "/%" PRId64 " queued: %" PRId64 "/%" PRId64
+				" throttled: %" PRId64 "/%" PRId64 " ms"
+				, static_cast<std::uint32_t>(s.peer_class)
+				, s.upload_payload, s.upload_protocol
+				, s.download_payload, s.download_protocol
+				, s.upload_queued, s.download_queued
+				, s.upload_throttled, s.download_throttled);
+			ret += msg;
+		}
+		return ret;
+#endif
+	}
+
 } // namespace libtorrent
@@ -13,6 +13,7 @@ see LICENSE file.
 #include "libtorrent/config.hpp"
 #include "libtorrent/aux_/alert_manager.hpp"
 #include "libtorrent/alert_types.hpp"
+#include "libtorrent/performance_counters.hpp"
 
 #ifndef TORRENT_DISABLE_EXTENSIONS
 #include "libtorrent/extensions.hpp"
@@ -46,8 +47,22 @@ namespace aux {
 
 	void alert_manager::maybe_notify(alert* a)
 	{
-		if (m_alerts[m_generation].size() == 1)
+		int const size = m_alerts[m_generation].size();
+		m_high_water = std::max(m_high_water, size);
+
+		// in adaptive mode, stop posting the noisy categories when the
+		// queue is 3/4 full, rather than dropping alerts once it's full
+		if (m_adaptive && size * 4 >= m_queue_size_limit * 3
+			&& m_suppressed.load(std::memory_order_relaxed) == alert_category_t{})
 		{
+			m_suppressed = noisy_categories;
+			++m_num_suppressions;
+		}
+
+		if (size == 1)
+		{
+			m_first_alert = clock_type::now();
+
 			// we just posted to an empty queue. If anyone is waiting for
 			// alerts, we need to notify them. Also (potentially) call the
 			// user supplied m_notify callback to let the client wake up its
@@ -67,6 +82,33 @@ namespace aux {
 #endif
 	}
 
+	void alert_manager::record_dropped(int const type)
+	{
+		m_dropped.set(std::size_t(type));
+		++m_num_dropped[std::size_t(type)];
+		++m_total_dropped;
+	}
+
+	void alert_manager::set_adaptive_mask(bool const enable)
+	{
+		std::lock_guard<std::recursive_mutex> lock(m_mutex);
+		m_adaptive = enable;
+		if (!enable) m_suppressed = alert_category_t{};
+	}
+
+	void alert_manager::update_stats_counters(counters& c) const
+	{
+		std::lock_guard<std::recursive_mutex> lock(m_mutex);
+		c.set_value(counters::alerts_dropped, m_total_dropped);
+		c.set_value(counters::alert_pops, m_num_pops);
+		c.set_value(counters::alert_pop_latency, m_pop_latency);
+		c.set_value(counters::alert_suppressions, m_num_suppressions);
+		c.set_value(counters::alert_queue_size, m_alerts[m_generation].size());
+		c.set_value(counters::alert_queue_high_water, m_high_water);
+		c.set_value(counters::alert_suppressed_categories
+			, static_cast<std::uint32_t>(m_suppressed.load(std::memory_order_relaxed)));
+	}
+
 	void alert_manager::set_notify_function(std::function<void()> const& fun)
 	{
 		std::unique_lock<std::recursive_mutex> lock(m_mutex);
@@ -95,12 +137,24 @@ namespace aux {
 		}
 
 		if (m_dropped.any()) {
-			emplace_alert<alerts_dropped_alert>(m_dropped);
+			emplace_alert<alerts_dropped_alert>(m_dropped, m_num_dropped);
 			m_dropped.reset();
+			m_num_dropped.fill(0);
 		}
 
 		m_alerts[m_generation].get_pointers(alerts);
 
+		++m_num_pops;
+		m_pop_latency += total_microseconds(clock_type::now() - m_first_alert);
+
+		// the client has caught up with the noisy categories suppressed. Once
+		// it pops the alerts before the queue is 1/4 full, turn them back on
+		if (m_suppressed.load(std::memory_order_relaxed) != alert_category_t{}
+			&& int(alerts.size()) * 4 < m_queue_size_limit)
+		{
+			m_suppressed = alert_category_t{};
+		}
+
 		// swap buffers
 		m_generation = (m_generation + 1) & 1;
 		// clear the one we will start writing to now
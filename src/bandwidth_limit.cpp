@@ -19,6 +19,7 @@ namespace aux {
 	bandwidth_channel::bandwidth_channel()
 		: tmp(0)
 		, distribute_quota(0)
+		, throttled_time(0)
 		, m_quota_left(0)
 		, m_limit(0)
 	{}
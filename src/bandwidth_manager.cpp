@@ -62,6 +62,21 @@ namespace aux {
 		return m_queued_bytes;
 	}
 
+	std::int64_t bandwidth_manager::queued_bytes(bandwidth_channel const* chan) const
+	{
+		std::int64_t ret = 0;
+		for (auto const& r : m_queue)
+		{
+			for (int j = 0; j < bw_request::max_bandwidth_channels && r.channel[j]; ++j)
+			{
+				if (r.channel[j] != chan) continue;
+				ret += r.request_size - r.assigned;
+				break;
+			}
+		}
+		return ret;
+	}
+
 	// non prioritized means that, if there's a line for bandwidth,
 	// others will cut in front of the non-prioritized peers.
 	// this is used by web seeds
@@ -162,7 +177,11 @@ namespace aux {
 			for (int j = 0; j < bw_request::max_bandwidth_channels && r.channel[j]; ++j)
 			{
 				bandwidth_channel* bwc = r.channel[j];
-				if (bwc->tmp == 0) channels.push_back(bwc);
+				if (bwc->tmp == 0)
+				{
+					channels.push_back(bwc);
+					bwc->throttled_time += dt_milliseconds;
+				}
 				TORRENT_ASSERT(INT_MAX - bwc->tmp > r.priority);
 				bwc->tmp += r.priority;
 			}
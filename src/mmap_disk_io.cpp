@@ -594,6 +594,7 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 			m_stats_counters.inc_stats_counter(counters::num_blocks_read);
 			m_stats_counters.inc_stats_counter(counters::num_read_ops);
 			m_stats_counters.inc_stats_counter(counters::disk_read_time, read_time);
+			m_stats_counters.inc_latency_histogram(counters::disk_read_latency4, read_time);
 			m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 		}
 		return status_t::no_error;
@@ -629,6 +630,7 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 			m_stats_counters.inc_stats_counter(counters::num_blocks_read);
 			m_stats_counters.inc_stats_counter(counters::num_read_ops);
 			m_stats_counters.inc_stats_counter(counters::disk_read_time, read_time);
+			m_stats_counters.inc_latency_histogram(counters::disk_read_latency4, read_time);
 			m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 		}
 		return status_t::no_error;
@@ -657,6 +659,7 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 			m_stats_counters.inc_stats_counter(counters::num_blocks_written);
 			m_stats_counters.inc_stats_counter(counters::num_write_ops);
 			m_stats_counters.inc_stats_counter(counters::disk_write_time, write_time);
+			m_stats_counters.inc_latency_histogram(counters::disk_write_latency4, write_time);
 			m_stats_counters.inc_stats_counter(counters::disk_job_time, write_time);
 		}
 
@@ -1081,6 +1084,7 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 				m_stats_counters.inc_stats_counter(counters::num_blocks_read, blocks_to_read);
 				m_stats_counters.inc_stats_counter(counters::num_read_ops);
 				m_stats_counters.inc_stats_counter(counters::disk_hash_time, read_time);
+				m_stats_counters.inc_latency_histogram(counters::disk_hash_latency4, read_time);
 				m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 			}
 
@@ -1132,6 +1136,7 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 			m_stats_counters.inc_stats_counter(counters::num_blocks_read);
 			m_stats_counters.inc_stats_counter(counters::num_read_ops);
 			m_stats_counters.inc_stats_counter(counters::disk_hash_time, read_time);
+			m_stats_counters.inc_latency_histogram(counters::disk_hash_latency4, read_time);
 			m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 		}
 
@@ -1284,6 +1289,8 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 		// before the disk threads are shut down
 		TORRENT_ASSERT(!m_abort);
 
+		j->queued_time = clock_type::now();
+
 		DLOG("add_fence:job: %s (outstanding: %d)\n"
 			, job_name(j->action)
 			, j->storage->num_outstanding_jobs());
@@ -1344,6 +1351,9 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 			, job_name(j->action)
 			, j->storage ? j->storage->num_outstanding_jobs() : 0);
 
+		// the time spent blocked by a fence counts as queued too
+		j->queued_time = clock_type::now();
+
 		// is the fence up for this storage?
 		// jobs that are instantaneous are not affected by the fence, is_blocked()
 		// will take ownership of the job and queue it up, in case the fence is up
@@ -1495,6 +1505,12 @@ TORRENT_EXPORT std::unique_ptr<disk_interface> mmap_disk_io_constructor(
 
 			TORRENT_ASSERT((j->flags & aux::disk_io_job::in_progress) || !j->storage);
 
+			if (j->queued_time != time_point{})
+			{
+				m_stats_counters.inc_latency_histogram(counters::disk_queue_latency4
+					, total_microseconds(clock_type::now() - j->queued_time));
+			}
+
 			if (&pool == &m_generic_threads && thread_id == pool.first_thread_id())
 			{
 				time_point const now = aux::time_now();
@@ -1097,10 +1097,37 @@ namespace {
 			? protocol_version::V2 : protocol_version::V1);
 	}
 
+	void peer_connection::account_peer_class_bytes(int const channel
+		, int const bytes_payload, int const bytes_protocol)
+	{
+		auto& classes = m_ses.peer_classes();
+		for (int i = 0; i < num_classes(); ++i)
+		{
+			peer_class* pc = classes.at(class_at(i));
+			if (pc == nullptr) continue;
+			pc->payload_bytes[channel] += bytes_payload;
+			pc->protocol_bytes[channel] += bytes_protocol;
+		}
+
+		auto const t = m_torrent.lock();
+		if (!t) return;
+		for (int i = 0; i < t->num_classes(); ++i)
+		{
+			// don't count a class twice if both the peer and the torrent
+			// belong to it
+			if (has_class(t->class_at(i))) continue;
+			peer_class* pc = classes.at(t->class_at(i));
+			if (pc == nullptr) continue;
+			pc->payload_bytes[channel] += bytes_payload;
+			pc->protocol_bytes[channel] += bytes_protocol;
+		}
+	}
+
 	void peer_connection::received_bytes(int const bytes_payload, int const bytes_protocol)
 	{
 		TORRENT_ASSERT(is_single_thread());
 		m_statistics.received_bytes(bytes_payload, bytes_protocol);
+		account_peer_class_bytes(download_channel, bytes_payload, bytes_protocol);
 		if (m_ignore_stats) return;
 		auto t = m_torrent.lock();
 		if (!t) return;
@@ -1111,6 +1138,7 @@ namespace {
 	{
 		TORRENT_ASSERT(is_single_thread());
 		m_statistics.sent_bytes(bytes_payload, bytes_protocol);
+		account_peer_class_bytes(upload_channel, bytes_payload, bytes_protocol);
 #ifndef TORRENT_DISABLE_EXTENSIONS
 		if (bytes_payload)
 		{
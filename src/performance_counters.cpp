@@ -10,7 +10,9 @@ see LICENSE file.
 
 #include "libtorrent/performance_counters.hpp"
 #include "libtorrent/assert.hpp"
+#include "libtorrent/aux_/ffs.hpp"
 #include <cstring> // for memset
+#include <algorithm>
 
 namespace libtorrent {
 
@@ -116,6 +118,18 @@ namespace libtorrent {
 #endif
 	}
 
+	void counters::inc_latency_histogram(int const first_bucket, std::int64_t const microseconds) TORRENT_COUNTER_NOEXCEPT
+	{
+		TORRENT_ASSERT(first_bucket >= 0);
+		TORRENT_ASSERT(first_bucket + num_latency_buckets <= num_stats_counters);
+
+		// bucket n counts [1 << n, 1 << (n + 1)) microseconds, starting at
+		// n = 4. log2p1() returns the index of the most significant bit
+		std::uint32_t const v = std::uint32_t(std::min(std::max(microseconds, std::int64_t(0)) >> 4
+			, std::int64_t(0xffffffff)));
+		inc_stats_counter(first_bucket + std::min(aux::log2p1(v), num_latency_buckets - 1));
+	}
+
 	void counters::set_value(int const c, std::int64_t const value) TORRENT_COUNTER_NOEXCEPT
 	{
 		TORRENT_ASSERT(c >= 0);
@@ -112,6 +112,7 @@ namespace {
 				m_stats_counters.inc_stats_counter(counters::num_blocks_read);
 				m_stats_counters.inc_stats_counter(counters::num_read_ops);
 				m_stats_counters.inc_stats_counter(counters::disk_read_time, read_time);
+				m_stats_counters.inc_latency_histogram(counters::disk_read_latency4, read_time);
 				m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 			}
 
@@ -140,6 +141,7 @@ namespace {
 				m_stats_counters.inc_stats_counter(counters::num_blocks_written);
 				m_stats_counters.inc_stats_counter(counters::num_write_ops);
 				m_stats_counters.inc_stats_counter(counters::disk_write_time, write_time);
+				m_stats_counters.inc_latency_histogram(counters::disk_write_latency4, write_time);
 				m_stats_counters.inc_stats_counter(counters::disk_job_time, write_time);
 			}
 
@@ -205,6 +207,7 @@ namespace {
 				m_stats_counters.inc_stats_counter(counters::num_blocks_read, blocks_to_read);
 				m_stats_counters.inc_stats_counter(counters::num_read_ops);
 				m_stats_counters.inc_stats_counter(counters::disk_hash_time, read_time);
+				m_stats_counters.inc_latency_histogram(counters::disk_hash_latency4, read_time);
 				m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 			}
 
@@ -248,6 +251,7 @@ namespace {
 				m_stats_counters.inc_stats_counter(counters::num_blocks_read);
 				m_stats_counters.inc_stats_counter(counters::num_read_ops);
 				m_stats_counters.inc_stats_counter(counters::disk_hash_time, read_time);
+				m_stats_counters.inc_latency_histogram(counters::disk_hash_latency4, read_time);
 				m_stats_counters.inc_stats_counter(counters::disk_job_time, read_time);
 			}
 
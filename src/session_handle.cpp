@@ -176,6 +176,11 @@ namespace libtorrent {
 		async_call(&session_impl::post_dht_stats);
 	}
 
+	void session_handle::post_peer_class_stats()
+	{
+		async_call(&session_impl::post_peer_class_stats);
+	}
+
 	io_context& session_handle::get_context()
 	{
 		std::shared_ptr<session_impl> s = m_impl.lock();
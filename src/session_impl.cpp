@@ -4695,6 +4695,7 @@ namespace {
 			m_alerts.emplace_alert<session_stats_header_alert>();
 		}
 		m_disk_thread->update_stats_counters(m_stats_counters);
+		m_alerts.update_stats_counters(m_stats_counters);
 
 #ifndef TORRENT_DISABLE_DHT
 		if (m_dht)
@@ -4740,6 +4741,31 @@ namespace {
 #endif
 	}
 
+	void session_impl::post_peer_class_stats()
+	{
+		std::vector<peer_class_stats> stats;
+		for (peer_class_t c{0}; c < m_classes.end_index(); ++c)
+		{
+			peer_class const* pc = m_classes.at(c);
+			if (pc == nullptr) continue;
+
+			bandwidth_channel const& up = pc->channel[peer_connection::upload_channel];
+			bandwidth_channel const& down = pc->channel[peer_connection::download_channel];
+			peer_class_stats s;
+			s.peer_class = c;
+			s.upload_payload = pc->payload_bytes[peer_connection::upload_channel];
+			s.upload_protocol = pc->protocol_bytes[peer_connection::upload_channel];
+			s.download_payload = pc->payload_bytes[peer_connection::download_channel];
+			s.download_protocol = pc->protocol_bytes[peer_connection::download_channel];
+			s.upload_queued = m_upload_rate.queued_bytes(&up);
+			s.download_queued = m_download_rate.queued_bytes(&down);
+			s.upload_throttled = up.throttled_time;
+			s.download_throttled = down.throttled_time;
+			stats.push_back(s);
+		}
+		m_alerts.emplace_alert<peer_class_stats_alert>(stats);
+	}
+
 	std::vector<torrent_handle> session_impl::get_torrents() const
 	{
 		std::vector<torrent_handle> ret;
@@ -6586,6 +6612,11 @@ namespace {
 		}
 	}
 
+	void session_impl::update_adaptive_alert_mask()
+	{
+		m_alerts.set_adaptive_mask(m_settings.get_bool(settings_pack::adaptive_alert_mask));
+	}
+
 	void session_impl::update_alert_mask()
 	{
 		m_alerts.set_alert_mask(alert_category_t(
@@ -535,11 +535,133 @@ namespace {
 		METRIC(sock_bufs, socket_recv_size19)
 		METRIC(sock_bufs, socket_recv_size20)
 
+		// log2 histograms of the time disk jobs took, for reads, writes and
+		// hash jobs, measured in the disk threads. ``disk_queue_latency``
+		// is the time jobs spent queued, waiting for a disk thread to pick
+		// them up. Bucket n counts jobs that took at least 1 << n
+		// microseconds (and less than 1 << (n + 1)). i.e. 16, 32, 64, 128,
+		// 256, 512 microseconds, 1, 2, 4, 8, 16, 32, 65, 131, 262, 524
+		// milliseconds, 1, 2, 4, 8 and 16 seconds. The first bucket also
+		// counts faster jobs and the last one slower jobs
+		METRIC(disk, disk_read_latency4)
+		METRIC(disk, disk_read_latency5)
+		METRIC(disk, disk_read_latency6)
+		METRIC(disk, disk_read_latency7)
+		METRIC(disk, disk_read_latency8)
+		METRIC(disk, disk_read_latency9)
+		METRIC(disk, disk_read_latency10)
+		METRIC(disk, disk_read_latency11)
+		METRIC(disk, disk_read_latency12)
+		METRIC(disk, disk_read_latency13)
+		METRIC(disk, disk_read_latency14)
+		METRIC(disk, disk_read_latency15)
+		METRIC(disk, disk_read_latency16)
+		METRIC(disk, disk_read_latency17)
+		METRIC(disk, disk_read_latency18)
+		METRIC(disk, disk_read_latency19)
+		METRIC(disk, disk_read_latency20)
+		METRIC(disk, disk_read_latency21)
+		METRIC(disk, disk_read_latency22)
+		METRIC(disk, disk_read_latency23)
+		METRIC(disk, disk_read_latency24)
+		METRIC(disk, disk_write_latency4)
+		METRIC(disk, disk_write_latency5)
+		METRIC(disk, disk_write_latency6)
+		METRIC(disk, disk_write_latency7)
+		METRIC(disk, disk_write_latency8)
+		METRIC(disk, disk_write_latency9)
+		METRIC(disk, disk_write_latency10)
+		METRIC(disk, disk_write_latency11)
+		METRIC(disk, disk_write_latency12)
+		METRIC(disk, disk_write_latency13)
+		METRIC(disk, disk_write_latency14)
+		METRIC(disk, disk_write_latency15)
+		METRIC(disk, disk_write_latency16)
+		METRIC(disk, disk_write_latency17)
+		METRIC(disk, disk_write_latency18)
+		METRIC(disk, disk_write_latency19)
+		METRIC(disk, disk_write_latency20)
+		METRIC(disk, disk_write_latency21)
+		METRIC(disk, disk_write_latency22)
+		METRIC(disk, disk_write_latency23)
+		METRIC(disk, disk_write_latency24)
+		METRIC(disk, disk_hash_latency4)
+		METRIC(disk, disk_hash_latency5)
+		METRIC(disk, disk_hash_latency6)
+		METRIC(disk, disk_hash_latency7)
+		METRIC(disk, disk_hash_latency8)
+		METRIC(disk, disk_hash_latency9)
+		METRIC(disk, disk_hash_latency10)
+		METRIC(disk, disk_hash_latency11)
+		METRIC(disk, disk_hash_latency12)
+		METRIC(disk, disk_hash_latency13)
+		METRIC(disk, disk_hash_latency14)
+		METRIC(disk, disk_hash_latency15)
+		METRIC(disk, disk_hash_latency16)
+		METRIC(disk, disk_hash_latency17)
+		METRIC(disk, disk_hash_latency18)
+		METRIC(disk, disk_hash_latency19)
+		METRIC(disk, disk_hash_latency20)
+		METRIC(disk, disk_hash_latency21)
+		METRIC(disk, disk_hash_latency22)
+		METRIC(disk, disk_hash_latency23)
+		METRIC(disk, disk_hash_latency24)
+		METRIC(disk, disk_queue_latency4)
+		METRIC(disk, disk_queue_latency5)
+		METRIC(disk, disk_queue_latency6)
+		METRIC(disk, disk_queue_latency7)
+		METRIC(disk, disk_queue_latency8)
+		METRIC(disk, disk_queue_latency9)
+		METRIC(disk, disk_queue_latency10)
+		METRIC(disk, disk_queue_latency11)
+		METRIC(disk, disk_queue_latency12)
+		METRIC(disk, disk_queue_latency13)
+		METRIC(disk, disk_queue_latency14)
+		METRIC(disk, disk_queue_latency15)
+		METRIC(disk, disk_queue_latency16)
+		METRIC(disk, disk_queue_latency17)
+		METRIC(disk, disk_queue_latency18)
+		METRIC(disk, disk_queue_latency19)
+		METRIC(disk, disk_queue_latency20)
+		METRIC(disk, disk_queue_latency21)
+		METRIC(disk, disk_queue_latency22)
+		METRIC(disk, disk_queue_latency23)
+		METRIC(disk, disk_queue_latency24)
+
+		// the total number of alerts dropped because the alert queue was full
+		// (see ``alert_queue_size``). The alerts_dropped_alert tells which
+		// types were dropped
+		METRIC(alert, alerts_dropped)
+
+		// the number of times the client popped a non-empty alert queue, and
+		// the total number of microseconds from the first alert being posted
+		// to the empty queue (which is when the notify function passed to
+		// set_alert_notify() is called) until the client popped it.
+		// ``alert_pop_latency / alert_pops`` is the average time it takes the
+		// client to react to alerts
+		METRIC(alert, alert_pops)
+		METRIC(alert, alert_pop_latency)
+
+		// the number of times the noisy alert categories were suppressed
+		// because the queue was filling up. This only happens when
+		// ``adaptive_alert_mask`` is enabled
+		METRIC(alert, alert_suppressions)
+
 		// if the outstanding tracker announce limit is reached, tracker
 		// announces are queued, to be issued when an announce slot opens up.
 		// this measure the number of tracker announces currently in the
 		// queue
 		METRIC(tracker, num_queued_tracker_announces)
+
+		// the number of alerts currently in the alert queue, and the largest
+		// number of alerts that has been queued since the session started
+		METRIC(alert, alert_queue_size)
+		METRIC(alert, alert_queue_high_water)
+
+		// the alert categories currently suppressed by ``adaptive_alert_mask``
+		// (a bitmask of alert_category_t), or 0 if all categories in the
+		// alert mask are posted
+		METRIC(alert, alert_suppressed_categories)
 		// ... more
 	}});
 #undef METRIC
@@ -199,6 +199,7 @@ namespace libtorrent {
 		SET(ssrf_mitigation, true, nullptr),
 		SET(allow_idna, false, nullptr),
 		SET(enable_set_file_valid_data, false, nullptr),
+		SET(adaptive_alert_mask, false, &session_impl::update_adaptive_alert_mask),
 	}});
 
 	CONSTEXPR_SETTINGS
@@ -6,15 +6,24 @@
 
 See http://github.com/AllSeeingEyeTolledEweSew/http_proxy for more information
 about this project.
+
+Besides the thread-per-client proxy built on http.server, --asyncio selects a
+proxy running on a single event loop. It keeps idle upstream connections in a
+pool for reuse, relays bodies (including chunked ones) in large reads, can
+inject bandwidth limits and latency, and reports its counters as JSON at
+/stats.
 """
 
 import argparse
+import asyncio
 import base64
 import http.client
 import http.server
+import json
 import select
 import socket
 import socketserver
+import time
 import traceback
 import urllib.parse
 
@@ -508,6 +517,504 @@ class Handler(http.server.BaseHTTPRequestHandler):
         self.do_proxy()
 
 
+# Hop-by-hop headers, which are never forwarded
+_HOP_BY_HOP = frozenset(("connection", "keep-alive", "proxy-authorization",
+                         "proxy-authenticate", "proxy-connection"))
+
+
+def _connection_tokens(headers):
+    """Returns the lower-cased tokens of all Connection headers."""
+    tokens = set()
+    for name, value in headers:
+        if name.lower() == "connection":
+            tokens.update(t.strip().lower() for t in value.split(","))
+    tokens.discard("")
+    return tokens
+
+
+def _get_header(headers, name, default=None):
+    """Returns the value of the first header with the given name."""
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return default
+
+
+async def _read_head(reader):
+    """Reads a request or response head from a StreamReader.
+
+    Returns:
+        A tuple of (start line, list of (name, value) header tuples), or None
+            if the stream was closed before any data was read.
+
+    Raises:
+        _HTTPError: if the head is malformed or too long.
+    """
+    try:
+        data = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial:
+            return None
+        raise _HTTPError(400, explain="Incomplete message head")
+    except asyncio.LimitOverrunError:
+        raise _HTTPError(431)
+    lines = data[:-4].decode("iso-8859-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise _HTTPError(400, explain="Malformed header: %r" % line)
+        headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+class RateLimiter:
+    """A token bucket shared by all relayed data.
+
+    Attributes:
+        rate: The sustained rate in bytes per second, or 0 for no limit.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+
+    async def consume(self, amount):
+        """Waits until amount bytes may be sent."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.rate,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class ProxyStats:
+    """Counters for the asyncio proxy, served at /stats."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.clients = 0
+        self.active_clients = 0
+        self.active_tunnels = 0
+        self.tunnels = 0
+        self.requests = 0
+        self.errors = 0
+        self.upstream_connects = 0
+        self.pool_hits = 0
+        # bytes from clients to upstreams, and back
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def to_dict(self, pool):
+        """Returns the counters as a dict, suitable for JSON encoding."""
+        uptime = time.monotonic() - self.start
+        ret = dict(vars(self))
+        del ret["start"]
+        ret["uptime"] = uptime
+        ret["idle_upstream_connections"] = pool.num_idle()
+        ret["up_rate"] = self.bytes_up / uptime if uptime > 0 else 0
+        ret["down_rate"] = self.bytes_down / uptime if uptime > 0 else 0
+        return ret
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to upstream servers.
+
+    Attributes:
+        max_idle: The most idle connections kept per upstream.
+        idle_timeout: Idle connections older than this many seconds are
+            closed rather than reused.
+    """
+
+    def __init__(self, max_idle, idle_timeout):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+
+    def num_idle(self):
+        """Returns the number of idle connections in the pool."""
+        return sum(len(conns) for conns in self._idle.values())
+
+    def get(self, key):
+        """Returns an idle (reader, writer) tuple for key, or None."""
+        conns = self._idle.get(key)
+        now = time.monotonic()
+        while conns:
+            reader, writer, since = conns.pop()
+            # a server may close the connection while it's idle
+            if (now - since < self.idle_timeout and not reader.at_eof()
+                    and not writer.is_closing()):
+                return reader, writer
+            writer.close()
+        return None
+
+    def put(self, key, reader, writer):
+        """Returns a connection to the pool, once its response was read."""
+        conns = self._idle.setdefault(key, [])
+        if len(conns) >= self.max_idle:
+            writer.close()
+            return
+        conns.append((reader, writer, time.monotonic()))
+
+    def close(self):
+        """Closes all idle connections."""
+        for conns in self._idle.values():
+            for _, writer, _ in conns:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncProxy:
+    """An HTTP proxy running on an asyncio event loop.
+
+    Attributes:
+        timeout: Timeout value in seconds. Applies to upstream connections,
+            idle CONNECT-method streams, and reading data from both client
+            and upstream.
+        basic_auth: If set, proxy will require basic authorization with this
+            credential.
+        latency: Seconds to delay every upstream connection and request.
+        limiter: A RateLimiter for all relayed data.
+        pool: The ConnectionPool of idle upstream connections.
+        stats: The ProxyStats counters.
+    """
+
+    BUFLEN = 65536
+
+    def __init__(self, timeout=30, basic_auth=None, latency=0, rate=0,
+                 max_idle=8, idle_timeout=30):
+        self.timeout = timeout
+        self.basic_auth = basic_auth
+        self.latency = latency
+        self.limiter = RateLimiter(rate)
+        self.pool = ConnectionPool(max_idle, idle_timeout)
+        self.stats = ProxyStats()
+
+    async def _read(self, reader, amount):
+        try:
+            return await asyncio.wait_for(reader.read(amount), self.timeout)
+        except asyncio.TimeoutError:
+            return b""
+
+    async def _write(self, writer, data, direction):
+        await self.limiter.consume(len(data))
+        setattr(self.stats, direction, getattr(self.stats, direction) + len(data))
+        writer.write(data)
+        await writer.drain()
+
+    async def _relay_exactly(self, reader, writer, length, direction):
+        while length > 0:
+            buf = await self._read(reader, min(length, self.BUFLEN))
+            if not buf:
+                raise ConnectionError("Connection closed mid-body")
+            await self._write(writer, buf, direction)
+            length -= len(buf)
+
+    async def _relay_chunked(self, reader, writer, direction):
+        """Relays a chunked body as-is, up to and including the trailers.
+
+        Only the chunk size lines and trailers are read line by line, the
+        chunk data is relayed in BUFLEN reads.
+        """
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                raise ConnectionError("Connection closed mid-body")
+            try:
+                size = int(size_line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise ChunkError("Invalid chunk size: %r" % size_line)
+            if size < 0:
+                raise ChunkError("Invalid chunk size: %d" % size)
+            await self._write(writer, size_line, direction)
+            if size == 0:
+                break
+            # Chunk size + crlf
+            await self._relay_exactly(reader, writer, size + 2, direction)
+        # Allow trailers, if any
+        while True:
+            line = await reader.readline()
+            await self._write(writer, line, direction)
+            if line in (b"\r\n", b"", b"\n"):
+                return
+
+    async def _relay_to_eof(self, reader, writer, direction):
+        while True:
+            buf = await self._read(reader, self.BUFLEN)
+            if not buf:
+                return
+            await self._write(writer, buf, direction)
+
+    async def _relay_body(self, reader, writer, headers, direction):
+        """Relays a message body delimited according to its headers.
+
+        https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html#sec4.4
+
+        Returns:
+            False if the body was delimited by closing the connection, True
+                otherwise.
+        """
+        if _get_header(headers, "Transfer-Encoding", "identity") != "identity":
+            await self._relay_chunked(reader, writer, direction)
+            return True
+        length = _get_header(headers, "Content-Length")
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                raise _HTTPError(411)
+            await self._relay_exactly(reader, writer, length, direction)
+            return True
+        await self._relay_to_eof(reader, writer, direction)
+        return False
+
+    @staticmethod
+    def _send_head(writer, status, reason, headers):
+        lines = ["HTTP/1.1 %d %s" % (status, reason)]
+        lines.extend("%s: %s" % header for header in headers)
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1"))
+
+    def _send_error(self, writer, err):
+        self.stats.errors += 1
+        reason = err.message or http.HTTPStatus(err.code).phrase
+        body = (err.explain or reason).encode()
+        headers = [("Content-Type", "text/plain"),
+                   ("Content-Length", str(len(body))), ("Connection", "close")]
+        if err.code == 407:
+            headers.append(("Proxy-Authenticate", "Basic"))
+        self._send_head(writer, err.code, reason, headers)
+        writer.write(body)
+
+    def _authorize(self, headers):
+        if not self.basic_auth:
+            return True
+        split = _get_header(headers, "Proxy-Authorization", "").split(None, 1)
+        if len(split) != 2 or split[0].lower() != "basic":
+            return False
+        return split[1] == self.basic_auth
+
+    async def _open_upstream(self, host, port):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        try:
+            conn = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                          self.timeout)
+        except asyncio.TimeoutError:
+            raise _HTTPError(504, explain=traceback.format_exc())
+        except OSError:
+            raise _HTTPError(502, explain=traceback.format_exc())
+        self.stats.upstream_connects += 1
+        return conn
+
+    async def handle_client(self, reader, writer):
+        """Serves requests from a client connection until it's closed."""
+        self.stats.clients += 1
+        self.stats.active_clients += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(_read_head(reader),
+                                                  self.timeout)
+                    if head is None:
+                        break
+                    keep_alive = await self._handle_request(
+                        reader, writer, *head)
+                except _HTTPError as err:
+                    self._send_error(writer, err)
+                    keep_alive = False
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ChunkError):
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.stats.active_clients -= 1
+            writer.close()
+
+    async def _handle_request(self, reader, writer, request_line, headers):
+        """Handles a single request.
+
+        Returns:
+            Whether the client connection may be used for another request.
+        """
+        split = request_line.split()
+        if len(split) != 3:
+            raise _HTTPError(400, explain="Bad request line")
+        command, path, version = split
+        self.stats.requests += 1
+
+        if command == "GET" and path == "/stats":
+            body = json.dumps(self.stats.to_dict(self.pool)).encode()
+            self._send_head(writer, 200, "OK",
+                            [("Content-Type", "application/json"),
+                             ("Content-Length", str(len(body)))])
+            writer.write(body)
+            return True
+
+        if not self._authorize(headers):
+            raise _HTTPError(407, message="Proxy authorization required")
+
+        if command == "CONNECT":
+            await self._tunnel(reader, writer, path)
+            return False
+
+        client_tokens = _connection_tokens(headers)
+        if version == "HTTP/1.0":
+            keep_alive = "keep-alive" in client_tokens
+        else:
+            keep_alive = "close" not in client_tokens
+        return await self._proxy(reader, writer, command, path, headers,
+                                 client_tokens) and keep_alive
+
+    async def _tunnel(self, reader, writer, target):
+        host, sep, port = target.rpartition(":")
+        if not sep or not host:
+            raise _HTTPError(400, explain="Target must be host:port")
+        up_reader, up_writer = await self._open_upstream(host.strip("[]"), port)
+        self._send_head(writer, 200, "Connection established",
+                        [("Connection", "close")])
+        self.stats.tunnels += 1
+        self.stats.active_tunnels += 1
+
+        async def pipe(src, dst, direction):
+            try:
+                await self._relay_to_eof(src, dst, direction)
+                if dst.can_write_eof():
+                    dst.write_eof()
+            except OSError:
+                dst.close()
+
+        try:
+            await asyncio.gather(pipe(reader, up_writer, "bytes_up"),
+                                 pipe(up_reader, writer, "bytes_down"))
+        finally:
+            self.stats.active_tunnels -= 1
+            up_writer.close()
+
+    async def _proxy(self, reader, writer, command, path, headers,
+                     client_tokens):
+        """Forwards a normal HTTP request over a pooled upstream connection.
+
+        Returns:
+            False if the response was delimited by closing the connection.
+        """
+        url = urllib.parse.urlsplit(path)
+        if url.scheme != "http":
+            raise _HTTPError(400, message="Target scheme is not http")
+        if (_get_header(headers, "Transfer-Encoding", "identity") == "identity"
+                and _get_header(headers, "Content-Length") is None
+                and command in ("PATCH", "POST", "PUT")):
+            raise _HTTPError(411)
+        try:
+            key = (url.hostname, url.port or 80)
+        except ValueError as exc:
+            raise _HTTPError(400, message=str(exc))
+
+        filter_headers = _HOP_BY_HOP | client_tokens
+        out = ["%s %s HTTP/1.1" % (command, urllib.parse.urlunsplit(
+            ("", "", url.path or "/", url.query, "")))]
+        out.extend("%s: %s" % (name, value) for name, value in headers
+                   if name.lower() not in filter_headers)
+        if _get_header(headers, "Host") is None:
+            out.append("Host: %s" % url.netloc)
+        request_head = ("\r\n".join(out) + "\r\n\r\n").encode("iso-8859-1")
+
+        has_body = (_get_header(headers, "Transfer-Encoding") is not None
+                    or _get_header(headers, "Content-Length") is not None)
+        conn = self.pool.get(key)
+        pooled = conn is not None
+        if pooled:
+            self.stats.pool_hits += 1
+            if self.latency > 0:
+                await asyncio.sleep(self.latency)
+        else:
+            conn = await self._open_upstream(*key)
+        up_reader, up_writer = conn
+        reusable = False
+        try:
+            try:
+                head = await self._send_request(up_reader, up_writer,
+                                                request_head, reader, headers,
+                                                has_body)
+                # the upstream may have closed a pooled connection just as we
+                # picked it. Requests without a body can simply be retried
+                if head is None and pooled and not has_body:
+                    up_writer.close()
+                    up_reader, up_writer = await self._open_upstream(*key)
+                    head = await self._send_request(up_reader, up_writer,
+                                                    request_head, reader,
+                                                    headers, has_body)
+            except asyncio.TimeoutError:
+                raise _HTTPError(504, explain=traceback.format_exc())
+            except ChunkError as exc:
+                raise _HTTPError(400, message=str(exc),
+                                 explain=traceback.format_exc())
+            except (OSError, _HTTPError):
+                raise _HTTPError(502, explain=traceback.format_exc())
+            if head is None:
+                raise _HTTPError(502, explain="Upstream closed the connection")
+            status_line, response_headers = head
+            split = status_line.split(None, 2)
+            try:
+                status = int(split[1])
+            except (IndexError, ValueError):
+                raise _HTTPError(502, explain="Bad status line")
+
+            upstream_tokens = _connection_tokens(response_headers)
+            filter_headers = _HOP_BY_HOP | upstream_tokens
+            self._send_head(
+                writer, status, split[2] if len(split) > 2 else "",
+                [(name, value) for name, value in response_headers
+                 if name.lower() not in filter_headers] +
+                [("Connection", "keep-alive" if "close" not in client_tokens
+                  else "close")])
+
+            if command == "HEAD" or status in (204, 304) or status < 200:
+                delimited = True
+            else:
+                delimited = await self._relay_body(up_reader, writer,
+                                                   response_headers,
+                                                   "bytes_down")
+            reusable = (delimited and "close" not in upstream_tokens
+                        and split[0] != "HTTP/1.0")
+            return delimited
+        finally:
+            if reusable:
+                self.pool.put(key, up_reader, up_writer)
+            else:
+                up_writer.close()
+
+    async def _send_request(self, up_reader, up_writer, request_head, reader,
+                            headers, has_body):
+        """Sends a request upstream and reads the head of its response.
+
+        Returns:
+            The response head, as returned by _read_head().
+        """
+        up_writer.write(request_head)
+        # Requests are never delimited by closing the connection
+        if has_body:
+            await self._relay_body(reader, up_writer, headers, "bytes_up")
+        return await asyncio.wait_for(_read_head(up_reader), self.timeout)
+
+    async def serve(self, host, port):
+        """Serves clients until cancelled."""
+        server = await asyncio.start_server(self.handle_client, host, port,
+                                            reuse_address=True, backlog=1024)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.close()
+
+
 class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
 
     daemon_threads = True
@@ -521,6 +1028,21 @@ class Main:
         self.parser.add_argument("--basic-auth")
         self.parser.add_argument("--timeout", type=int, default=30)
         self.parser.add_argument("--bind-host", default="localhost")
+        self.parser.add_argument(
+            "--asyncio", action="store_true",
+            help="run the event loop proxy, with upstream connection pooling "
+            "and a /stats endpoint")
+        self.parser.add_argument(
+            "--rate", type=int, default=0,
+            help="limit relayed data to this many bytes per second "
+            "(--asyncio only)")
+        self.parser.add_argument(
+            "--latency", type=float, default=0,
+            help="milliseconds to delay every upstream request "
+            "(--asyncio only)")
+        self.parser.add_argument(
+            "--pool-size", type=int, default=8,
+            help="idle connections kept per upstream (--asyncio only)")
 
         self.args = None
         self.server = None
@@ -538,6 +1060,19 @@ class Main:
         else:
             Handler.basic_auth = None
 
+        if self.args.asyncio:
+            proxy = AsyncProxy(timeout=self.args.timeout,
+                               basic_auth=Handler.basic_auth,
+                               latency=self.args.latency / 1000.,
+                               rate=self.args.rate,
+                               max_idle=self.args.pool_size,
+                               idle_timeout=self.args.timeout)
+            try:
+                asyncio.run(proxy.serve(*self.address))
+            except KeyboardInterrupt:
+                pass
+            return
+
         self.server = _ThreadingHTTPServer(self.address, Handler)
         self.server.serve_forever()
 
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+"""HTTP tracker stand-in for tests and tracker load testing
+
+Answers /announce and /scrape requests (BEP 3, BEP 23 compact peer lists,
+BEP 7 IPv6 peers and BEP 48 scrape) from an in-memory swarm table, on
+keep-alive connections. Every swarm can be padded with synthetic peers, to
+simulate large swarms without running them. Latency and failures can be
+injected, and request counts and rates are printed periodically and served as
+JSON at /stats.
+
+Python's per request overhead limits a single process to around ten thousand
+announces per second. For higher loads, --workers runs several processes
+sharing the port.
+
+usage: http_tracker.py [--port <port>] [--peers-per-swarm <n>] [options]
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+from types import FrameType
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import unquote_to_bytes
+
+# the arguments of a request, by name
+Query = Dict[str, List[bytes]]
+# the HTTP status and body of a response
+Response = Tuple[bytes, bytes]
+
+
+def debug(s: str) -> None:
+    print("http_tracker.py: ", s)
+    sys.stdout.flush()
+
+
+def bencode(v: Any) -> bytes:
+    if isinstance(v, int):
+        return b"i%de" % v
+    if isinstance(v, str):
+        v = v.encode()
+    if isinstance(v, bytes):
+        return b"%d:%s" % (len(v), v)
+    if isinstance(v, list):
+        return b"l" + b"".join(bencode(e) for e in v) + b"e"
+    if isinstance(v, dict):
+        return b"d" + b"".join(bencode(k) + bencode(v[k]) for k in sorted(v)) + b"e"
+    raise TypeError("can't bencode %r" % type(v))
+
+
+class swarm(object):
+    # the peers are keyed by their compact endpoint (6 bytes for IPv4, 18 for
+    # IPv6), mapping to the time of their last announce. That's all that's
+    # needed to produce compact peer lists
+    __slots__ = ("seeds", "leechers", "downloaded")
+
+    def __init__(self) -> None:
+        self.seeds: Dict[bytes, float] = {}
+        self.leechers: Dict[bytes, float] = {}
+        self.downloaded = 0
+
+
+class swarm_table(object):
+    # the swarms of every info-hash that has been announced. This is shared
+    # with the UDP tracker (udp_tracker.py)
+
+    def __init__(self, synthetic_peers: int = 0, peer_timeout: float = 0) -> None:
+        self.swarms: Dict[bytes, swarm] = {}
+        self.synthetic_peers = synthetic_peers
+        self.peer_timeout = peer_timeout
+
+    def announce(
+        self, info_hash: bytes, endpoint: bytes, event: str, left: int, now: float
+    ) -> swarm:
+        s = self.swarms.get(info_hash)
+        if s is None:
+            s = swarm()
+            self.swarms[info_hash] = s
+        if event == "stopped":
+            s.seeds.pop(endpoint, None)
+            s.leechers.pop(endpoint, None)
+            return s
+        if event == "completed":
+            s.downloaded += 1
+        if left == 0:
+            s.leechers.pop(endpoint, None)
+            s.seeds[endpoint] = now
+        else:
+            s.seeds.pop(endpoint, None)
+            s.leechers[endpoint] = now
+        return s
+
+    def expire(self, now: float) -> None:
+        if self.peer_timeout <= 0:
+            return
+        deadline = now - self.peer_timeout
+        for s in self.swarms.values():
+            for peers in (s.seeds, s.leechers):
+                for ep in [ep for ep, t in peers.items() if t < deadline]:
+                    del peers[ep]
+
+    # returns (complete, incomplete, downloaded), counting the synthetic peers
+    # as seeds
+    def counts(self, info_hash: bytes) -> Tuple[int, int, int]:
+        s = self.swarms.get(info_hash)
+        if s is None:
+            return self.synthetic_peers, 0, 0
+        return len(s.seeds) + self.synthetic_peers, len(s.leechers), s.downloaded
+
+    # returns the compact IPv4 and IPv6 peer lists for a peer announcing to
+    # the swarm (excluding itself), at most num_want peers in total
+    def peers(
+        self, info_hash: bytes, endpoint: bytes, num_want: int
+    ) -> Tuple[bytes, bytes]:
+        s = self.swarms.get(info_hash)
+        v4: List[bytes] = []
+        v6: List[bytes] = []
+        if s is not None:
+            for peers in (s.leechers, s.seeds):
+                for ep in peers:
+                    if len(v4) + len(v6) >= num_want:
+                        break
+                    if ep == endpoint:
+                        continue
+                    (v4 if len(ep) == 6 else v6).append(ep)
+        n = min(num_want - len(v4) - len(v6), self.synthetic_peers)
+        if n > 0:
+            v4.append(synthetic_peers(info_hash, n))
+        return b"".join(v4), b"".join(v6)
+
+
+def synthetic_peers(info_hash: bytes, n: int) -> bytes:
+    # n made up (but stable per info-hash) IPv4 peers, in the 10.0.0.0/8
+    # range
+    seed = int.from_bytes(info_hash[:4], "big")
+    return b"".join(
+        struct.pack(">IH", 0x0A000000 | ((seed + i) & 0xFFFFFF), 6881 + (i % 1000))
+        for i in range(n)
+    )
+
+
+def compact_endpoint(ip: str, port: int) -> bytes:
+    return ipaddress.ip_address(ip).packed + struct.pack(">H", port)
+
+
+def parse_query(query: bytes) -> Query:
+    # the values are kept as bytes, since info_hash and peer_id are binary.
+    # info_hash may be repeated (scrape)
+    ret: Query = {}
+    for arg in query.split(b"&"):
+        key, _, value = arg.partition(b"=")
+        ret.setdefault(key.decode(), []).append(unquote_to_bytes(value))
+    return ret
+
+
+class stats(object):
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.announces = 0
+        self.scrapes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.connections = 0
+        self.latency = 0.0
+        self.requests = 0
+        self.last_report = (self.start, 0)
+
+    def to_dict(self, table: swarm_table) -> Dict[str, float]:
+        elapsed = time.monotonic() - self.start
+        return {
+            "uptime": elapsed,
+            "announces": self.announces,
+            "scrapes": self.scrapes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "connections": self.connections,
+            "requests_per_second": self.requests / elapsed if elapsed > 0 else 0,
+            "mean_latency": self.latency / self.requests if self.requests else 0,
+            "swarms": len(table.swarms),
+        }
+
+
+class tracker(object):
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.table = swarm_table(args.peers_per_swarm, args.peer_timeout)
+        self.stats = stats()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.stats.connections += 1
+        peer_ip = writer.get_extra_info("peername")[0]
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                start = time.monotonic()
+                lines = head.split(b"\r\n")
+                try:
+                    method, target, version = lines[0].split(b" ", 2)
+                except ValueError:
+                    break
+                keepalive = version == b"HTTP/1.1"
+                for line in lines[1:]:
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"connection":
+                        keepalive = value.strip().lower() == b"keep-alive"
+
+                if self.args.latency > 0:
+                    await asyncio.sleep(
+                        random.uniform(
+                            self.args.latency, self.args.latency + self.args.jitter
+                        )
+                        / 1000.0
+                    )
+
+                r = random.random()
+                if r < self.args.drop_rate:
+                    self.stats.dropped += 1
+                    break
+
+                path, _, query = target.partition(b"?")
+                if r < self.args.drop_rate + self.args.failure_rate:
+                    self.stats.failures += 1
+                    status, body = b"200 OK", bencode(
+                        {"failure reason": "injected failure"}
+                    )
+                elif path.endswith(b"/announce"):
+                    status, body = self.announce(parse_query(query), peer_ip)
+                elif path.endswith(b"/scrape"):
+                    status, body = self.scrape(parse_query(query))
+                elif path == b"/stats":
+                    status, body = (
+                        b"200 OK",
+                        json.dumps(self.stats.to_dict(self.table), indent=1).encode(),
+                    )
+                else:
+                    status, body = b"404 Not Found", b""
+
+                writer.write(
+                    b"HTTP/1.1 %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n%s"
+                    % (
+                        status,
+                        len(body),
+                        b"keep-alive" if keepalive else b"close",
+                        body,
+                    )
+                )
+                await writer.drain()
+                self.stats.requests += 1
+                self.stats.latency += time.monotonic() - start
+                if not keepalive:
+                    break
+        finally:
+            writer.close()
+
+    def announce(self, q: Query, peer_ip: str) -> Response:
+        self.stats.announces += 1
+        try:
+            info_hash = q["info_hash"][0]
+            port = int(q["port"][0])
+            left = int(q.get("left", [b"1"])[0])
+            event = q.get("event", [b""])[0].decode()
+            num_want = min(int(q.get("numwant", [b"50"])[0]), self.args.max_peers)
+            ip = q["ip"][0].decode() if "ip" in q else peer_ip
+            endpoint = compact_endpoint(ip, port)
+        except (KeyError, ValueError):
+            return b"400 Bad Request", bencode({"failure reason": "invalid announce"})
+
+        self.table.announce(info_hash, endpoint, event, left, time.monotonic())
+        complete, incomplete, _ = self.table.counts(info_hash)
+        ret: Dict[str, Any] = {
+            "interval": self.args.interval,
+            "min interval": self.args.min_interval,
+            "complete": complete,
+            "incomplete": incomplete,
+        }
+        if event != "stopped":
+            v4, v6 = self.table.peers(info_hash, endpoint, num_want)
+            if q.get("compact", [b"1"])[0] == b"0":
+                ret["peers"] = [
+                    {
+                        "ip": socket.inet_ntoa(v4[i : i + 4]),
+                        "port": struct.unpack(">H", v4[i + 4 : i + 6])[0],
+                    }
+                    for i in range(0, len(v4), 6)
+                ]
+            else:
+                ret["peers"] = v4
+            if v6:
+                ret["peers6"] = v6
+        return b"200 OK", bencode(ret)
+
+    def scrape(self, q: Query) -> Response:
+        self.stats.scrapes += 1
+        files = {}
+        for info_hash in q.get("info_hash", []):
+            complete, incomplete, downloaded = self.table.counts(info_hash)
+            files[info_hash] = {
+                "complete": complete,
+                "incomplete": incomplete,
+                "downloaded": downloaded,
+            }
+        return b"200 OK", bencode({"files": files})
+
+    async def report(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.stats_interval)
+            now = time.monotonic()
+            self.table.expire(now)
+            last, requests = self.stats.last_report
+            debug(
+                "%.0f requests/s (%d announces, %d scrapes, %d failures, %d dropped, "
+                "%d swarms)"
+                % (
+                    (self.stats.requests - requests) / (now - last),
+                    self.stats.announces,
+                    self.stats.scrapes,
+                    self.stats.failures,
+                    self.stats.dropped,
+                    len(self.table.swarms),
+                )
+            )
+            self.stats.last_report = (now, self.stats.requests)
+
+
+async def run(args: argparse.Namespace, worker: int) -> None:
+    t = tracker(args)
+    server = await asyncio.start_server(
+        t.handle_connection,
+        args.bind,
+        args.port,
+        reuse_address=True,
+        reuse_port=args.workers > 1,
+        backlog=4096,
+    )
+    debug("listening on port %d..." % args.port)
+    if args.stats_interval > 0:
+        asyncio.ensure_future(t.report())
+
+    stop = asyncio.get_running_loop().create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set_result, None)
+    await stop
+    server.close()
+
+    debug("stats: %s" % json.dumps(t.stats.to_dict(t.table)))
+    if args.stats_file:
+        name = (
+            args.stats_file
+            if args.workers == 1
+            else "%s.%d" % (args.stats_file, worker)
+        )
+        with open(name, "w+") as f:
+            json.dump(t.stats.to_dict(t.table), f, indent=1)
+
+
+def run_worker(args: argparse.Namespace, worker: int) -> None:
+    if args.seed is not None:
+        random.seed(args.seed + worker)
+
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
+
+    asyncio.run(run(args, worker))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="HTTP tracker stand-in")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="the port to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--bind",
+        default="127.0.0.1",
+        help="the address to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=1800,
+        help="the announce interval (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=int,
+        default=60,
+        help="the min announce interval (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peers-per-swarm",
+        type=int,
+        default=0,
+        help="synthetic peers (seeds) added to every swarm (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-peers",
+        type=int,
+        default=200,
+        help="the most peers returned per announce (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peer-timeout",
+        type=float,
+        default=0,
+        help="forget peers that haven't announced in this many seconds "
+        "(default: never)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="milliseconds to delay every response",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="up to this many additional milliseconds of delay",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="the fraction of requests answered with a failure reason",
+    )
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="the fraction of requests whose connection is closed without a "
+        "response",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="print request rates every this many seconds (default: never)",
+    )
+    parser.add_argument(
+        "--stats-file", help="write the request counters as JSON to this file on exit"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed the random number generator (for failure injection)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="the number of processes sharing the port (SO_REUSEPORT). Each worker "
+        "has its own swarm table and stats (written to <stats-file>.<n>), so this is "
+        "only meant for load testing (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_worker(args, 0)
+        return 0
+
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(args, i))
+        for i in range(args.workers)
+    ]
+    for w in workers:
+        w.start()
+
+    # forward SIGTERM to the workers, they write their stats on the way out
+    def stop(sig: int, frame: Optional[FrameType]) -> None:
+        for w in workers:
+            w.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for w in workers:
+        w.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
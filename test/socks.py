@@ -1,19 +1,31 @@
 #!/usr/bin/env python3
 
-"""Minimal non-feature complete socks proxy"""
-
+"""Minimal non-feature complete socks proxy
+
+Every connection is handled by a coroutine on a single asyncio event loop, so
+thousands of proxied connections don't need thousands of threads. The bytes
+forwarded in each direction are counted per connection, and the totals and
+throughput can be printed periodically (--stats-interval) and written as JSON
+on exit (--stats-file), along with the counters of the active connections and
+the most recently closed ones (--stats-history).
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import signal
 import socket
 from struct import pack, unpack
-import threading
 import sys
+import time
 import traceback
 
-from socketserver import StreamRequestHandler, ThreadingTCPServer
-
 
 def debug(s):
-    print('socks.py: ', s)
-    sys.stdout.flush()
+    if verbose:
+        print('socks.py: ', s)
+        sys.stdout.flush()
 
 
 def error(s):
@@ -21,15 +33,6 @@ def error(s):
     sys.stdout.flush()
 
 
-class MyTCPServer(ThreadingTCPServer):
-    allow_reuse_address = True
-
-    def handle_timeout(self):
-        raise Exception('socks.py: timeout')
-
-
-CLOSE = object()
-
 VERSION = b'\x05'
 NOAUTH = b'\x00'
 USERPASS = b'\x02'
@@ -43,275 +46,320 @@ SUCCESS = b'\x00'
 password = None
 username = None
 allow_v4 = False
-
-
-def send(dest, msg):
-    if msg == CLOSE:
-        try:
-            dest.shutdown(socket.SHUT_WR)
-        except Exception:
-            pass
-        dest.close()
-        return 0
-    else:
-        return dest.sendall(msg)
-
-
-def recv(source, n):
-    data = source.recv(n)
-    if data == b'':
-        return CLOSE
-    else:
-        return data
-
-
-def forward(source, dest, name):
-    while True:
-        data = recv(source, 4000)
-        if data == CLOSE:
-            send(dest, CLOSE)
-            debug('%s hung up' % name)
-            return
-#        debug('Forwarding (%d) %r' % (len(data), data))
-        send(dest, data)
-
-
-def spawn_forwarder(source, dest, name):
-    t = threading.Thread(target=forward, args=(source, dest, name))
-    t.daemon = True
-    t.start()
-
-
-class SocksHandler(StreamRequestHandler):
+verbose = True
+
+# the number of bytes forwarded per read
+BUFFER_SIZE = 0x10000
+
+
+class connection_stats(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.destination = None
+        self.start = time.monotonic()
+        self.end = None
+        # bytes from the client to the destination, and back
+        self.up = 0
+        self.down = 0
+
+    def to_dict(self):
+        duration = (self.end or time.monotonic()) - self.start
+        return {
+            'client': '%s:%d' % self.client[:2],
+            'destination': self.destination,
+            'duration': duration,
+            'bytes_up': self.up,
+            'bytes_down': self.down,
+            'up_rate': self.up / duration if duration > 0 else 0,
+            'down_rate': self.down / duration if duration > 0 else 0,
+        }
+
+
+class proxy_stats(object):
+
+    def __init__(self, history=1000):
+        self.start = time.monotonic()
+        self.num_connections = 0
+        # bytes forwarded by all connections, including the closed ones
+        self.up = 0
+        self.down = 0
+        self.active = set()
+        # the most recently closed connections
+        self.closed = collections.deque(maxlen=history)
+        self.last_accept = self.start
+        self.last_report = (self.start, 0, 0)
+
+    def opened(self, conn):
+        self.num_connections += 1
+        self.active.add(conn)
+        self.last_accept = conn.start
+
+    def close(self, conn):
+        conn.end = time.monotonic()
+        self.active.discard(conn)
+        self.closed.append(conn)
+
+    def totals(self):
+        return self.up, self.down
+
+    def to_dict(self):
+        up, down = self.totals()
+        elapsed = time.monotonic() - self.start
+        return {
+            'uptime': elapsed,
+            'num_connections': self.num_connections,
+            'active_connections': len(self.active),
+            'bytes_up': up,
+            'bytes_down': down,
+            'up_rate': up / elapsed if elapsed > 0 else 0,
+            'down_rate': down / elapsed if elapsed > 0 else 0,
+            'connections': [c.to_dict() for c in sorted(
+                list(self.closed) + list(self.active), key=lambda c: c.start)],
+        }
+
+
+stats = proxy_stats()
+
+# the tasks handling connections, cancelled on exit
+handlers = set()
+
+
+class socks_error(Exception):
+    pass
+
+
+async def forward(reader, writer, conn, direction, name):
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if data == b'':
+                break
+            setattr(conn, direction, getattr(conn, direction) + len(data))
+            setattr(stats, direction, getattr(stats, direction) + len(data))
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    debug('%s hung up' % name)
+    try:
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        writer.close()
+
+
+class socks_handler(object):
     """Highly feature incomplete SOCKS 5 implementation"""
 
-    def close_request(self):
-        self.server.close_request(self.request)
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.conn = connection_stats(writer.get_extra_info('peername'))
 
-    def read(self, n):
-        data = b''
-        while len(data) < n:
-            extra = self.rfile.read(n)
-            if extra == b'':
-                raise Exception('Connection closed')
-            data += extra
-        return data
+    async def read(self, n):
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError:
+            raise socks_error('Connection closed')
 
-    def handle(self):
+    async def handle(self):
+        stats.opened(self.conn)
         try:
-            self.inner_handle()
+            await self.inner_handle()
+        except socks_error as e:
+            error('%s' % e)
+        except asyncio.CancelledError:
+            # the proxy is shutting down
+            pass
         except Exception:
             error("Unhandled exception")
             traceback.print_exc(file=sys.stdout)
             sys.stdout.flush()
+        finally:
+            self.writer.close()
+            stats.close(self.conn)
 
-    def inner_handle(self):
-        # IMRPOVEMENT: Report who requests are from in logging
-        # IMPROVEMENT: Timeout on client
-        debug('Connection - authenticating')
-        version = self.read(1)
+    async def inner_handle(self):
+        debug('Connection from %s:%d - authenticating' % self.conn.client[:2])
+        version = await self.read(1)
 
         if allow_v4 and version == b'\x04':
-            cmd = self.read(1)
+            cmd = await self.read(1)
             if cmd != CONNECT and cmd != UDP_ASSOCIATE:
-                error('Only supports connect and udp-associate method not (%r) closing' % cmd)
-                self.close_request()
-                return
-
-            raw_dest_port = self.read(2)
-            dest_port, = unpack('>H', raw_dest_port)
-
-            raw_dest_address = self.read(4)
-            dest_address = '.'.join(map(str, unpack('>4B', raw_dest_address)))
+                raise socks_error('Only supports connect and udp-associate method not (%r) closing' % cmd)
 
-            user_id = b''
-            c = self.read(1)
-            while c != b'\0':
-                user_id += c
-                c = self.read(1)
+            dest_port, = unpack('>H', await self.read(2))
+            dest_address = '.'.join(map(str, unpack('>4B', await self.read(4))))
 
-            outbound_sock = socket.socket(socket.AF_INET)
-            out_address = socket.getaddrinfo(dest_address, dest_port)[0][4]
-            debug("Creating forwarder connection to %s:%d" % (out_address[0], out_address[1]))
-            outbound_sock.connect(out_address)
+            # the user ID is not checked
+            while await self.read(1) != b'\0':
+                pass
 
-            self.send_reply_v4(outbound_sock.getsockname())
-
-            spawn_forwarder(outbound_sock, self.request, 'destination')
-            forward(self.request, outbound_sock, 'client')
-            return
-
-        if version != b'\x05':
-            error('Wrong version number (%r) closing...' % version)
-            self.close_request()
+            out_reader, out_writer = await self.connect(dest_address, dest_port)
+            self.writer.write(b'\0\x5a\0\0\0\0\0\0')
+            await self.forward(out_reader, out_writer)
             return
 
-        nmethods = ord(self.read(1))
-        method_list = self.read(nmethods)
+        if version != VERSION:
+            raise socks_error('Wrong version number (%r) closing...' % version)
 
-        global password
-        global username
+        nmethods = ord(await self.read(1))
+        method_list = await self.read(nmethods)
 
         if password is None and NOAUTH in method_list:
-            self.send_no_auth_method()
+            self.writer.write(b'\x05\x00')
             debug('Authenticated (no-auth)')
         elif USERPASS in method_list:
-            self.send_user_pass_auth_method()
-            auth_version = self.read(1)
+            self.writer.write(b'\x05\x02')
+            auth_version = await self.read(1)
             if auth_version != b'\x01':
-                error('Wrong sub-negotiation version number (%r) closing...' % version)
-                self.close_request()
-                return
-            usr_len = ord(self.read(1))
-            usr_name = self.read(usr_len)
-            pwd_len = ord(self.read(1))
-            pwd = self.read(pwd_len)
+                raise socks_error('Wrong sub-negotiation version number (%r) closing...' % auth_version)
+            usr_name = await self.read(ord(await self.read(1)))
+            pwd = await self.read(ord(await self.read(1)))
 
             if usr_name != username.encode() or pwd != password.encode():
-                error('Invalid username or password')
-                self.close_request()
-                return
+                raise socks_error('Invalid username or password')
             debug('Authenticated (user/password)')
-            self.send_authenticated()
+            self.writer.write(b'\x01\x00')
         else:
-            error('Server only supports NOAUTH and user/pass')
-            self.send_no_method()
-            return
-
-        # If we were authenticating it would go here
-        version = self.read(1)
-        cmd = self.read(1)
-        zero = self.read(1)
-        address_type = self.read(1)
-        if version != b'\x05':
-            error('Wrong version number (%r) closing...' % version)
-            self.close_request()
+            self.writer.write(b'\x05\xff')
+            raise socks_error('Server only supports NOAUTH and user/pass')
+
+        version = await self.read(1)
+        cmd = await self.read(1)
+        zero = await self.read(1)
+        address_type = await self.read(1)
+        if version != VERSION:
+            raise socks_error('Wrong version number (%r) closing...' % version)
         elif cmd != CONNECT and cmd != UDP_ASSOCIATE:
-            error('Only supports connect and udp-associate method not (%r) closing' % cmd)
-            self.close_request()
+            raise socks_error('Only supports connect and udp-associate method not (%r) closing' % cmd)
         elif zero != b'\x00':
-            error('Mangled request. Reserved field (%r) is not null' % zero)
-            self.close_request()
+            raise socks_error('Mangled request. Reserved field (%r) is not null' % zero)
 
         if address_type == IPV4:
-            raw_dest_address = self.read(4)
-            dest_address = '.'.join(map(str, unpack('>4B', raw_dest_address)))
+            dest_address = socket.inet_ntop(socket.AF_INET, await self.read(4))
         elif address_type == IPV6:
-            raw_dest_address = self.read(16)
-            dest_address = ":".join([hex(x)[2:] for x in unpack('>8H', raw_dest_address)])
+            dest_address = socket.inet_ntop(socket.AF_INET6, await self.read(16))
         elif address_type == DOMAIN_NAME:
-            dns_length = ord(self.read(1))
-            dns_name = self.read(dns_length)
-            dest_address = dns_name
+            dest_address = (await self.read(ord(await self.read(1)))).decode()
         else:
-            error('Unknown addressing (%r)' % address_type)
-            self.close_request()
+            raise socks_error('Unknown addressing (%r)' % address_type)
 
-        raw_dest_port = self.read(2)
-        dest_port, = unpack('>H', raw_dest_port)
-
-        if address_type == IPV6:
-            outbound_sock = socket.socket(socket.AF_INET6)
-        else:
-            outbound_sock = socket.socket(socket.AF_INET)
-        try:
-            out_address = socket.getaddrinfo(dest_address, dest_port)[0][4]
-        except Exception as e:
-            error('%s' % e)
-            traceback.print_exc(file=sys.stdout)
-            return
+        dest_port, = unpack('>H', await self.read(2))
 
         if cmd == UDP_ASSOCIATE:
             debug("no UDP support yet, closing")
             return
 
-        debug("Creating forwarder connection to %s:%d" % (out_address[0], out_address[1]))
-
-        try:
-            outbound_sock.connect(out_address)
-        except Exception as e:
-            error('%s' % e)
-            traceback.print_exc(file=sys.stdout)
-            return
-
-        if address_type == IPV6:
-            self.send_reply6(outbound_sock.getsockname())
+        out_reader, out_writer = await self.connect(dest_address, dest_port)
+        bind_addr = out_writer.get_extra_info('sockname')
+        debug('Setting up forwarding port %r' % (bind_addr[:2],))
+        if len(bind_addr) == 4:
+            self.writer.write(pack('>cccc16sH', VERSION, SUCCESS, b'\x00', IPV6,
+                                   socket.inet_pton(socket.AF_INET6, bind_addr[0]), bind_addr[1]))
         else:
-            self.send_reply(outbound_sock.getsockname())
+            self.writer.write(pack('>cccc4sH', VERSION, SUCCESS, b'\x00', IPV4,
+                                   socket.inet_pton(socket.AF_INET, bind_addr[0]), bind_addr[1]))
+        await self.forward(out_reader, out_writer)
 
-        spawn_forwarder(outbound_sock, self.request, 'destination')
+    async def connect(self, dest_address, dest_port):
+        debug("Creating forwarder connection to %s:%d" % (dest_address, dest_port))
+        self.conn.destination = '%s:%d' % (dest_address, dest_port)
         try:
-            forward(self.request, outbound_sock, 'client')
-        except Exception as e:
-            error('%s' % e)
-            traceback.print_exc(file=sys.stdout)
-
-    def send_reply_v4(self, xxx_todo_changeme):
-        (bind_addr, bind_port) = xxx_todo_changeme
-        self.wfile.write(b'\0\x5a\0\0\0\0\0\0')
-        self.wfile.flush()
+            return await asyncio.open_connection(dest_address, dest_port)
+        except OSError as e:
+            raise socks_error('%s' % e)
 
-    def send_reply(self, xxx_todo_changeme1):
-        (bind_addr, bind_port) = xxx_todo_changeme1
-        bind_tuple = tuple(map(int, bind_addr.split('.')))
-        full_address = bind_tuple + (bind_port,)
-        debug('Setting up forwarding port %r' % (full_address,))
-        msg = pack('>cccc4BH', VERSION, SUCCESS, b'\x00', IPV4, *full_address)
-        self.wfile.write(msg)
-
-    def send_reply6(self, xxx_todo_changeme2):
-        (bind_addr, bind_port, unused1, unused2) = xxx_todo_changeme2
-        bind_tuple = tuple([int(x, 16) for x in bind_addr.split(':')])
-        full_address = bind_tuple + (bind_port,)
-        debug('Setting up forwarding port %r' % (full_address,))
-        msg = pack('>cccc8HH', VERSION, SUCCESS, b'\x00', IPV6, *full_address)
-        self.wfile.write(msg)
+    async def forward(self, out_reader, out_writer):
+        try:
+            await asyncio.gather(
+                forward(self.reader, out_writer, self.conn, 'up', 'client'),
+                forward(out_reader, self.writer, self.conn, 'down', 'destination'))
+        finally:
+            out_writer.close()
 
-    def send_no_method(self):
-        self.wfile.write(b'\x05\xff')
-        self.close_request()
 
-    def send_no_auth_method(self):
-        self.wfile.write(b'\x05\x00')
-        self.wfile.flush()
+async def on_connection(reader, writer):
+    task = asyncio.current_task()
+    handlers.add(task)
+    try:
+        await socks_handler(reader, writer).handle()
+    finally:
+        handlers.discard(task)
 
-    def send_user_pass_auth_method(self):
-        self.wfile.write(b'\x05\x02')
-        self.wfile.flush()
 
-    def send_authenticated(self):
-        self.wfile.write(b'\x01\x00')
-        self.wfile.flush()
+async def report(interval):
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        up, down = stats.totals()
+        last, last_up, last_down = stats.last_report
+        print('socks.py: %d active connections (%d total) up: %.1f kB/s down: %.1f kB/s' % (
+            len(stats.active), stats.num_connections, (up - last_up) / (now - last) / 1000,
+            (down - last_down) / (now - last) / 1000))
+        sys.stdout.flush()
+        stats.last_report = (now, up, down)
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(on_connection, 'localhost', args.port,
+                                        reuse_address=True, backlog=1024)
+    debug('Listening on port %d...' % args.port)
+    if args.stats_interval > 0:
+        asyncio.ensure_future(report(args.stats_interval))
+
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set_result, None)
+
+    # like the tests expect, give up if there are no new connections for a
+    # while
+    while not stop.done():
+        await asyncio.wait([stop], timeout=1)
+        if args.timeout > 0 and time.monotonic() - stats.last_accept > args.timeout:
+            error('timeout')
+            break
+    server.close()
+
+    # let the handlers close their connections, rather than having
+    # asyncio.run() cancel them mid-forward
+    for task in list(handlers):
+        task.cancel()
+    await asyncio.gather(*handlers, return_exceptions=True)
+
+    if args.stats_file:
+        with open(args.stats_file, 'w+') as f:
+            json.dump(stats.to_dict(), f, indent=1)
 
 
 if __name__ == '__main__':
 
     debug('starting socks.py %s' % " ".join(sys.argv))
     debug('python version: %s' % sys.version_info.__str__())
-    listen_port = 8002
-    i = 1
-    while i < len(sys.argv):
-        if sys.argv[i] == '--username':
-            username = sys.argv[i + 1]
-            i += 1
-        elif sys.argv[i] == '--password':
-            password = sys.argv[i + 1]
-            i += 1
-        elif sys.argv[i] == '--port':
-            listen_port = int(sys.argv[i + 1])
-            i += 1
-        elif sys.argv[i] == '--allow-v4':
-            allow_v4 = True
-        else:
-            if sys.argv[i] != '--help':
-                debug('unknown option "%s"' % sys.argv[i])
-            print('usage: socks.py [--username <user> --password <password>] [--port <listen-port>]')
-            sys.stdout.flush()
-            sys.exit(1)
-        i += 1
 
-    debug('Listening on port %d...' % listen_port)
-    server = MyTCPServer(('localhost', listen_port), SocksHandler)
-    server.timeout = 190
-    while True:
-        server.handle_request()
+    parser = argparse.ArgumentParser(usage='socks.py [--username <user> --password <password>] '
+                                     '[--port <listen-port>] [--allow-v4] [options]')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--allow-v4', action='store_true', help='accept SOCKS4 connections')
+    parser.add_argument('--timeout', type=float, default=190,
+                        help='exit if there are no new connections for this many seconds (0 = never)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='print the throughput every this many seconds (default: never)')
+    parser.add_argument('--stats-file', help='write per connection byte counters as JSON to this file on exit')
+    parser.add_argument('--stats-history', type=int, default=1000,
+                        help='the number of closed connections to keep the counters of '
+                        'for --stats-file (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='only log errors')
+    args = parser.parse_args()
+
+    username = args.username
+    password = args.password
+    allow_v4 = args.allow_v4
+    verbose = not args.quiet
+    stats = proxy_stats(args.stats_history)
+
+    asyncio.run(run(args))
@@ -18,6 +18,7 @@ see LICENSE file.
 #include "setup_transfer.hpp"
 
 #include <functional>
+#include <numeric> // for accumulate
 #include <thread>
 
 using namespace lt;
@@ -288,6 +289,66 @@ TORRENT_TEST(dropped_alerts)
 	auto const d = alert_cast<alerts_dropped_alert>(alerts.back())->dropped_alerts;
 	TEST_EQUAL(d.count(), 1);
 	TEST_CHECK(d.test(torrent_finished_alert::alert_type));
+	auto const& n = alert_cast<alerts_dropped_alert>(alerts.back())->num_dropped;
+	TEST_EQUAL(n[torrent_finished_alert::alert_type], 1);
+	TEST_EQUAL(std::accumulate(n.begin(), n.end(), 0), 1);
+}
+
+TORRENT_TEST(adaptive_mask)
+{
+	aux::alert_manager mgr(8, alert_category::all);
+	mgr.set_adaptive_mask(true);
+
+	for (int i = 0; i < 5; ++i)
+		mgr.emplace_alert<torrent_finished_alert>(torrent_handle());
+	TEST_CHECK(mgr.should_post<block_finished_alert>());
+
+	// the queue is 3/4 full, the noisy categories are turned off
+	mgr.emplace_alert<torrent_finished_alert>(torrent_handle());
+	TEST_CHECK(!mgr.should_post<block_finished_alert>());
+	TEST_CHECK(!mgr.should_post<peer_log_alert>());
+	TEST_CHECK(mgr.should_post<torrent_finished_alert>());
+	// the user's mask is unchanged
+	TEST_CHECK(mgr.alert_mask() == alert_category::all);
+
+	// popping a large batch keeps them suppressed
+	std::vector<alert*> alerts;
+	mgr.get_all(alerts);
+	TEST_CHECK(!mgr.should_post<block_finished_alert>());
+
+	// once the client keeps up, they are restored
+	mgr.emplace_alert<torrent_finished_alert>(torrent_handle());
+	mgr.get_all(alerts);
+	TEST_CHECK(mgr.should_post<block_finished_alert>());
+
+	counters cnt;
+	mgr.update_stats_counters(cnt);
+	TEST_EQUAL(cnt[counters::alert_suppressions], 1);
+	TEST_EQUAL(cnt[counters::alert_suppressed_categories], 0);
+}
+
+TORRENT_TEST(queue_counters)
+{
+	aux::alert_manager mgr(1, alert_category::all);
+
+	for (int i = 0; i < 3; ++i)
+		mgr.emplace_alert<torrent_finished_alert>(torrent_handle());
+
+	counters cnt;
+	mgr.update_stats_counters(cnt);
+	TEST_EQUAL(cnt[counters::alert_queue_size], 2);
+	TEST_EQUAL(cnt[counters::alert_queue_high_water], 2);
+	TEST_EQUAL(cnt[counters::alerts_dropped], 1);
+	TEST_EQUAL(cnt[counters::alert_pops], 0);
+
+	std::vector<alert*> alerts;
+	mgr.get_all(alerts);
+	mgr.update_stats_counters(cnt);
+	TEST_EQUAL(cnt[counters::alert_queue_size], 0);
+	// the alerts_dropped_alert was added to the queue too
+	TEST_EQUAL(cnt[counters::alert_queue_high_water], 3);
+	TEST_EQUAL(cnt[counters::alert_pops], 1);
+	TEST_CHECK(cnt[counters::alert_pop_latency] >= 0);
 }
 
 TORRENT_TEST(alerts_dropped_alert)
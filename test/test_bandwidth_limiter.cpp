@@ -494,3 +494,29 @@ TORRENT_TEST(no_starvation)
 {
 	test_no_starvation(40000);
 }
+
+TORRENT_TEST(throttled_time)
+{
+	aux::bandwidth_manager manager(0);
+	aux::bandwidth_channel limited;
+	aux::bandwidth_channel other;
+	limited.throttle(1000);
+
+	connections_t v;
+	spawn_connections(v, manager, limited, 1, "p");
+	aux::bandwidth_channel* channels[] = { &limited };
+	TEST_EQUAL(manager.request_bandwidth(v[0], 100000, 1, channels, 1), 0);
+	TEST_EQUAL(manager.queued_bytes(&limited), 100000);
+	TEST_EQUAL(manager.queued_bytes(&other), 0);
+
+	for (int i = 0; i < 10; ++i)
+		manager.update_quotas(milliseconds(100));
+
+	// the request has been waiting for quota for a second, and has been
+	// assigned some of it
+	TEST_EQUAL(limited.throttled_time, 1000);
+	TEST_EQUAL(other.throttled_time, 0);
+	TEST_CHECK(manager.queued_bytes(&limited) < 100000);
+	TEST_EQUAL(manager.queued_bytes(&limited), manager.queued_bytes());
+	manager.close();
+}
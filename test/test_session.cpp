@@ -208,6 +208,34 @@ TORRENT_TEST(session_stats)
 		, lt::counters::utp_packet_resend);
 	TEST_EQUAL(lt::find_metric_idx("utp.utp_fast_retransmit")
 		, lt::counters::utp_fast_retransmit);
+
+	TEST_EQUAL(lt::find_metric_idx("disk.disk_read_latency4")
+		, lt::counters::disk_read_latency4);
+	TEST_EQUAL(lt::find_metric_idx("disk.disk_queue_latency24")
+		, lt::counters::disk_queue_latency24);
+
+	TEST_EQUAL(lt::find_metric_idx("alert.alerts_dropped")
+		, lt::counters::alerts_dropped);
+	TEST_EQUAL(lt::find_metric_idx("alert.alert_queue_high_water")
+		, lt::counters::alert_queue_high_water);
+}
+
+TORRENT_TEST(latency_histogram)
+{
+	lt::counters c;
+	c.inc_latency_histogram(lt::counters::disk_read_latency4, 0);
+	c.inc_latency_histogram(lt::counters::disk_read_latency4, 31);
+	c.inc_latency_histogram(lt::counters::disk_read_latency4, 32);
+	c.inc_latency_histogram(lt::counters::disk_read_latency4, 1000);
+	c.inc_latency_histogram(lt::counters::disk_read_latency4, std::int64_t(1) << 40);
+
+	TEST_EQUAL(c[lt::counters::disk_read_latency4], 2);
+	TEST_EQUAL(c[lt::counters::disk_read_latency5], 1);
+	// 512 <= 1000 < 1024
+	TEST_EQUAL(c[lt::counters::disk_read_latency9], 1);
+	// the last bucket counts everything slower
+	TEST_EQUAL(c[lt::counters::disk_read_latency24], 1);
+	TEST_EQUAL(c[lt::counters::disk_write_latency4], 0);
 }
 
 TORRENT_TEST(paused_session)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+"""UDP tracker stand-in (BEP 15) for tests and tracker load testing
+
+Implements connect, announce and scrape, validating connection IDs (which are
+valid for two minutes), with the swarms kept in the same in-memory table as
+http_tracker.py. Incoming packets can be dropped and replies delayed, and every
+swarm can be padded with synthetic peers to control the reply size. Request
+rates, the time clients take from a connect response to using the connection
+ID and the time spent handling requests are printed periodically and written
+as JSON on exit.
+
+usage: udp_tracker.py [--port <port>] [--loss <fraction>] [options]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import signal
+import struct
+import sys
+import time
+from typing import cast
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from http_tracker import compact_endpoint
+from http_tracker import swarm_table
+
+PROTOCOL_ID = 0x41727101980
+
+# the IP and port of the sender of a packet
+Address = Tuple[str, int]
+
+CONNECT = 0
+ANNOUNCE = 1
+SCRAPE = 2
+ERROR = 3
+
+events = {0: "", 1: "completed", 2: "started", 3: "stopped"}
+action_names = {CONNECT: "connect", ANNOUNCE: "announce", SCRAPE: "scrape"}
+
+# connection IDs are valid for this many seconds (at least, see
+# connection_id())
+CONNECTION_ID_TIMEOUT = 120
+
+
+def debug(s: str) -> None:
+    print("udp_tracker.py: ", s)
+    sys.stdout.flush()
+
+
+class stats(object):
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.requests = {CONNECT: 0, ANNOUNCE: 0, SCRAPE: 0}
+        self.lost = 0
+        self.errors = 0
+        self.invalid_connection_ids = 0
+        # time spent handling requests, in seconds
+        self.service_time = 0.0
+        # the time between sending a connection ID and it being used, summed
+        # over the requests that used them
+        self.turnaround = 0.0
+        self.turnaround_count = 0
+        self.last_report = (self.start, 0)
+
+    def total(self) -> int:
+        return sum(self.requests.values())
+
+    def to_dict(self, table: swarm_table) -> Dict[str, float]:
+        elapsed = time.monotonic() - self.start
+        ret: Dict[str, float] = {
+            "uptime": elapsed,
+            "requests_per_second": self.total() / elapsed if elapsed > 0 else 0,
+            "lost": self.lost,
+            "errors": self.errors,
+            "invalid_connection_ids": self.invalid_connection_ids,
+            "mean_service_time": self.service_time / self.total()
+            if self.total()
+            else 0,
+            "mean_turnaround": self.turnaround / self.turnaround_count
+            if self.turnaround_count
+            else 0,
+            "swarms": len(table.swarms),
+        }
+        for action, name in action_names.items():
+            ret[name + "s"] = self.requests[action]
+        return ret
+
+
+class tracker_protocol(asyncio.DatagramProtocol):
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.table = swarm_table(args.peers_per_swarm, args.peer_timeout)
+        self.stats = stats()
+        self.secret = os.urandom(16)
+        # connection ID -> the time it was handed out, for the turnaround
+        # stats
+        self.issued: Dict[bytes, float] = {}
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+
+    # the connection ID is a keyed hash of the client's endpoint and the
+    # current time period. The current and the previous period are accepted,
+    # so IDs are valid for between one and two periods
+    def connection_id(self, addr: Address, period: int) -> bytes:
+        h = hashlib.blake2b(
+            b"%s:%d:%d" % (addr[0].encode(), addr[1], period),
+            key=self.secret,
+            digest_size=8,
+        )
+        return h.digest()
+
+    def valid_connection_id(self, conn_id: bytes, addr: Address) -> bool:
+        period = int(time.monotonic()) // CONNECTION_ID_TIMEOUT
+        return conn_id in (
+            self.connection_id(addr, period),
+            self.connection_id(addr, period - 1),
+        )
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        if random.random() < self.args.loss:
+            self.stats.lost += 1
+            return
+
+        start = time.monotonic()
+        reply = self.handle(data, addr, start)
+        self.stats.service_time += time.monotonic() - start
+        if reply is None:
+            return
+        assert self.transport is not None
+        if self.args.latency > 0:
+            delay = (
+                random.uniform(self.args.latency, self.args.latency + self.args.jitter)
+                / 1000.0
+            )
+            asyncio.get_running_loop().call_later(
+                delay, self.transport.sendto, reply, addr
+            )
+        else:
+            self.transport.sendto(reply, addr)
+
+    def error(self, transaction_id: int, msg: bytes) -> bytes:
+        self.stats.errors += 1
+        return struct.pack(">II", ERROR, transaction_id) + msg
+
+    def handle(self, data: bytes, addr: Address, now: float) -> Optional[bytes]:
+        if len(data) < 16:
+            return None
+        conn_id, action, transaction_id = struct.unpack_from(">8sII", data)
+        if action not in self.stats.requests:
+            return self.error(transaction_id, b"invalid action")
+        self.stats.requests[action] += 1
+
+        if action == CONNECT:
+            if struct.unpack(">Q", conn_id)[0] != PROTOCOL_ID:
+                return self.error(transaction_id, b"invalid protocol id")
+            conn_id = self.connection_id(addr, int(now) // CONNECTION_ID_TIMEOUT)
+            self.issued[conn_id] = now
+            return struct.pack(">II8s", CONNECT, transaction_id, conn_id)
+
+        if not self.valid_connection_id(conn_id, addr):
+            self.stats.invalid_connection_ids += 1
+            return self.error(transaction_id, b"invalid connection id")
+        issued = self.issued.pop(conn_id, None)
+        if issued is not None:
+            self.stats.turnaround += now - issued
+            self.stats.turnaround_count += 1
+
+        if action == ANNOUNCE:
+            return self.announce(data, addr, transaction_id, now)
+        return self.scrape(data, transaction_id)
+
+    def announce(
+        self, data: bytes, addr: Address, transaction_id: int, now: float
+    ) -> bytes:
+        if len(data) < 98:
+            return self.error(transaction_id, b"invalid announce")
+        info_hash, _, _, left, _, event, ip, _, num_want, port = struct.unpack_from(
+            ">20s20sqqqI4sIiH", data, 16
+        )
+        v6 = ":" in addr[0]
+        # the ip field is only meaningful for IPv4
+        host = addr[0] if v6 or ip == b"\0\0\0\0" else ".".join(str(b) for b in ip)
+        endpoint = compact_endpoint(host, port)
+        if num_want < 0:
+            num_want = 50
+        num_want = min(num_want, self.args.max_peers)
+
+        self.table.announce(info_hash, endpoint, events.get(event, ""), left, now)
+        complete, incomplete, _ = self.table.counts(info_hash)
+        peers = b""
+        if events.get(event) != "stopped":
+            peers_v4, peers_v6 = self.table.peers(info_hash, endpoint, num_want)
+            # the reply only carries peers of the address family the request
+            # came in over
+            peers = peers_v6 if v6 else peers_v4
+        return (
+            struct.pack(
+                ">IIIII",
+                ANNOUNCE,
+                transaction_id,
+                self.args.interval,
+                incomplete,
+                complete,
+            )
+            + peers
+        )
+
+    def scrape(self, data: bytes, transaction_id: int) -> bytes:
+        ret = [struct.pack(">II", SCRAPE, transaction_id)]
+        # at most 74 info-hashes fit in a packet
+        for i in range(16, min(len(data), 16 + 74 * 20) - 19, 20):
+            complete, incomplete, downloaded = self.table.counts(data[i : i + 20])
+            ret.append(struct.pack(">III", complete, downloaded, incomplete))
+        return b"".join(ret)
+
+    async def housekeeping(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.stats_interval or 60)
+            now = time.monotonic()
+            self.table.expire(now)
+            # forget connection IDs that were never used
+            deadline = now - 2 * CONNECTION_ID_TIMEOUT
+            for conn_id in [c for c, t in self.issued.items() if t < deadline]:
+                del self.issued[conn_id]
+            if self.args.stats_interval <= 0:
+                continue
+            last, requests = self.stats.last_report
+            s = self.stats.to_dict(self.table)
+            debug(
+                "%.0f requests/s (%d connects, %d announces, %d scrapes, %d lost, "
+                "%d errors, service time: %.1f us, turnaround: %.1f ms, %d swarms)"
+                % (
+                    (self.stats.total() - requests) / (now - last),
+                    s["connects"],
+                    s["announces"],
+                    s["scrapes"],
+                    s["lost"],
+                    s["errors"],
+                    s["mean_service_time"] * 1000000,
+                    s["mean_turnaround"] * 1000,
+                    s["swarms"],
+                )
+            )
+            self.stats.last_report = (now, self.stats.total())
+
+
+async def run(args: argparse.Namespace) -> None:
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: tracker_protocol(args), local_addr=(args.bind, args.port)
+    )
+    debug("listening on port %d..." % args.port)
+    asyncio.ensure_future(protocol.housekeeping())
+
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set_result, None)
+    await stop
+    transport.close()
+
+    s = protocol.stats.to_dict(protocol.table)
+    debug("stats: %s" % json.dumps(s))
+    if args.stats_file:
+        with open(args.stats_file, "w+") as f:
+            json.dump(s, f, indent=1)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="UDP tracker stand-in")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8081,
+        help="the port to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--bind",
+        default="127.0.0.1",
+        help="the address to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=1800,
+        help="the announce interval (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peers-per-swarm",
+        type=int,
+        default=0,
+        help="synthetic peers (seeds) added to every swarm (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-peers",
+        type=int,
+        default=200,
+        help="the most peers returned per announce (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peer-timeout",
+        type=float,
+        default=0,
+        help="forget peers that haven't announced in this many seconds "
+        "(default: never)",
+    )
+    parser.add_argument(
+        "--loss",
+        type=float,
+        default=0.0,
+        help="the fraction of incoming packets to drop",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="milliseconds to delay every reply"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="up to this many additional milliseconds of delay",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="print request rates every this many seconds (default: never)",
+    )
+    parser.add_argument(
+        "--stats-file", help="write the request counters as JSON to this file on exit"
+    )
+    parser.add_argument(
+        "--seed", type=int, help="seed the random number generator (for packet loss)"
+    )
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
+
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,36 @@
 #!/usr/bin/env python3
 
+# usage: web_server.py port chunked ssl keepalive min_interval [options]
+#
+# by default requests are served one at a time, logging every request and
+# chunk, which is what the unit tests use. For load testing web seeds
+# (web_peer_connection), --concurrent serves connections on a pool of
+# --threads threads, using sendfile() for plain (not chunked or SSL)
+# responses. Connections beyond the size of the pool wait for a thread.
+# --latency, --rate and --connection-rate add delay and bandwidth limits, and
+# --quiet turns off the logging.
+
+import argparse
 import sys
 import os
 import ssl
 import gzip
 import base64
 import socket
+import threading
+import time
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
 chunked_encoding = False
 keepalive = True
+verbose = True
+use_sendfile = False
+latency = 0.
+global_limit = None
+connection_rate = 0
 
 try:
     fin = open('test_file', 'rb')
@@ -32,8 +51,109 @@ class http_server_with_timeout(HTTPServer):
         raise Exception('timeout')
 
 
+class concurrent_http_server(http_server_with_timeout):
+    # serves connections on a bounded pool of threads (rather than a thread
+    # per connection, like ThreadingMixIn)
+    request_queue_size = 1024
+
+    def __init__(self, server_address, handler, threads):
+        http_server_with_timeout.__init__(self, server_address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        http_server_with_timeout.server_close(self)
+        self.pool.shutdown(wait=False)
+
+
+class rate_limiter(object):
+    # a token bucket, shared by all threads sending through it. It allows
+    # bursts of up to 1/10 of a second's worth of bytes
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.burst = max(rate // 10, 1)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # returns the number of bytes (at most n) that may be sent now, blocking
+    # until at least one may
+    def take(self, n):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    n = int(min(n, self.tokens))
+                    self.tokens -= n
+                    return n
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def log(*args):
+    if not verbose:
+        return
+    print(*args)
+    sys.stdout.flush()
+
+
 class http_handler(BaseHTTPRequestHandler):
 
+    def log_message(self, fmt, *args):
+        if verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    # the largest number of bytes that may be sent right now, given the rate
+    # limits
+    def quota(self, limiter, n):
+        if global_limit:
+            n = global_limit.take(n)
+        if limiter:
+            n = limiter.take(n)
+        return n
+
+    def send_file(s, f, offset, length):
+        limiter = rate_limiter(connection_rate) if connection_rate else None
+        if use_sendfile and not chunked_encoding and not use_ssl:
+            # zero-copy from the file to the socket
+            s.wfile.flush()
+            while length > 0:
+                to_send = s.quota(limiter, min(length, 0x100000))
+                sent = os.sendfile(s.connection.fileno(), f.fileno(), offset, to_send)
+                if sent == 0:
+                    raise Exception('connection closed')
+                offset += sent
+                length -= sent
+            return
+
+        f.seek(offset)
+        while length > 0:
+            to_send = s.quota(limiter, min(length, 0x900 if verbose else 0x10000))
+            if chunked_encoding:
+                s.wfile.write(b'%x\r\n' % to_send)
+            data = f.read(to_send)
+            log('read %d bytes' % to_send)
+            s.wfile.write(data)
+            if chunked_encoding:
+                s.wfile.write(b'\r\n')
+            length -= to_send
+            log('sent %d bytes (%d bytes left)' % (len(data), length))
+        if chunked_encoding:
+            s.wfile.write(b'0\r\n\r\n')
+
     def do_GET(self):
         try:
             self.inner_do_GET()
@@ -44,9 +164,11 @@ class http_handler(BaseHTTPRequestHandler):
 
     def inner_do_GET(s):
 
-        print('INCOMING-REQUEST [from: {}]: {}'.format(s.request.getsockname(), s.requestline))
-        print(s.headers)
-        sys.stdout.flush()
+        log('INCOMING-REQUEST [from: {}]: {}'.format(s.request.getsockname(), s.requestline))
+        log(s.headers)
+
+        if latency > 0:
+            time.sleep(latency)
 
         global chunked_encoding
         global keepalive
@@ -57,7 +179,6 @@ class http_handler(BaseHTTPRequestHandler):
             s.path = s.path[s.path.find('/'):]
 
         file_path = os.path.normpath(s.path)
-        sys.stdout.flush()
 
         if s.path == '/password_protected':
             passed = False
@@ -140,23 +261,8 @@ class http_handler(BaseHTTPRequestHandler):
 
                 s.end_headers()
 
-                f.seek(start_range)
-                length = end_range - start_range
-                while length > 0:
-                    to_send = min(length, 0x900)
-                    if chunked_encoding:
-                        s.wfile.write(b'%x\r\n' % to_send)
-                    data = f.read(to_send)
-                    print('read %d bytes' % to_send)
-                    sys.stdout.flush()
-                    s.wfile.write(data)
-                    if chunked_encoding:
-                        s.wfile.write(b'\r\n')
-                    length -= to_send
-                    print('sent %d bytes (%d bytes left)' % (len(data), length))
-                    sys.stdout.flush()
-                if chunked_encoding:
-                    s.wfile.write(b'0\r\n\r\n')
+                with f:
+                    s.send_file(f, start_range, end_range - start_range)
             except Exception as e:
                 print('FILE ERROR: ', filename, e)
                 traceback.print_exc(file=sys.stdout)
@@ -168,23 +274,63 @@ class http_handler(BaseHTTPRequestHandler):
                 except Exception:
                     pass
 
-        print("...DONE")
-        sys.stdout.flush()
+        log("...DONE")
         s.wfile.flush()
 
 
 if __name__ == '__main__':
-    port = int(sys.argv[1])
-    chunked_encoding = sys.argv[2] != '0'
-    use_ssl = sys.argv[3] != '0'
-    keepalive = sys.argv[4] != '0'
-    min_interval = sys.argv[5]
+    parser = argparse.ArgumentParser(description='web server for tests and web seed load testing')
+    parser.add_argument('port', type=int)
+    parser.add_argument('chunked', help='1 to use chunked encoding, 0 otherwise')
+    parser.add_argument('ssl', help='1 to use SSL, 0 otherwise')
+    parser.add_argument('keepalive', help='1 to keep connections alive, 0 otherwise')
+    parser.add_argument('min_interval', help='the min interval returned to /announce requests')
+    parser.add_argument('--concurrent', action='store_true',
+                        help='serve connections on a pool of threads, using sendfile() where possible')
+    parser.add_argument('--threads', type=int, default=64,
+                        help='the number of threads serving connections with --concurrent '
+                        '(default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='milliseconds to wait before responding to each request')
+    parser.add_argument('--rate', type=int, default=0,
+                        help='limit the total upload rate to this many bytes per second')
+    parser.add_argument('--connection-rate', type=int, default=0,
+                        help='limit the upload rate of each response to this many bytes per second')
+    parser.add_argument('--root', help='the directory to serve files from (default: the current directory)')
+    parser.add_argument('--bind', default='127.0.0.1', help='the address to listen on (default: %(default)s)')
+    parser.add_argument('--quiet', action='store_true', help='don\'t log requests')
+    args = parser.parse_args()
+
+    chunked_encoding = args.chunked != '0'
+    use_ssl = args.ssl != '0'
+    keepalive = args.keepalive != '0'
+    min_interval = args.min_interval
+    verbose = not args.quiet
+    use_sendfile = args.concurrent and hasattr(os, 'sendfile')
+    latency = args.latency / 1000.
+    global_limit = rate_limiter(args.rate) if args.rate else None
+    connection_rate = args.connection_rate
+    certfile = os.path.abspath(os.path.join('..', 'ssl', 'server.pem'))
+    if args.root:
+        os.chdir(args.root)
     print('python version: %s' % sys.version_info.__str__())
 
     http_handler.protocol_version = 'HTTP/1.1'
-    httpd = http_server_with_timeout(('127.0.0.1', port), http_handler)
+    if args.concurrent:
+        httpd = concurrent_http_server((args.bind, args.port), http_handler, args.threads)
+    else:
+        httpd = http_server_with_timeout((args.bind, args.port), http_handler)
     if use_ssl:
-        httpd.socket = ssl.wrap_socket(httpd.socket, certfile='../ssl/server.pem', server_side=True)
+        httpd.socket = ssl.wrap_socket(httpd.socket, certfile=certfile, server_side=True)
 
-    while True:
-        httpd.handle_request()
+    if args.concurrent:
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            # the pool's threads may be blocked on idle keep-alive
+            # connections, don't wait for them
+            httpd.server_close()
+            os._exit(0)
+    else:
+        while True:
+            httpd.handle_request()
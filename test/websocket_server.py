@@ -1,9 +1,28 @@
 #!/usr/bin/env python3
 
+"""WebSocket (WebTorrent) tracker stand-in for tests and signaling load tests
+
+Keeps a table of the sessions announcing each swarm and, like a real
+WebTorrent tracker, relays the WebRTC offers in announces to other peers in the
+swarm, and the answers back to the peer that made the offer. Connections are
+handled on a single event loop, so thousands of concurrent sessions are fine.
+
+The offer fan-out (how many peers each announce's offers reached) and the
+signaling round-trip (the time from relaying an offer to relaying its answer)
+are printed periodically (--stats-interval) and written as JSON on exit
+(--stats-file).
+
+usage: websocket_server.py port ssl min_interval [options]
+"""
+
+import argparse
 import sys
 import ssl
 import json
 import asyncio
+import random
+import signal
+import time
 import logging
 from datetime import datetime
 
@@ -16,42 +35,299 @@ logger = logging.getLogger('websockets')
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
+# how long an offer waits for its answer before it's counted as unanswered
+OFFER_TIMEOUT = 50
 
-async def handle(websocket, path):
-    try:
+# the most round-trip samples kept for the percentiles
+MAX_SAMPLES = 100000
+
+
+def debug(s):
+    print('websocket_server.py: ', s)
+    sys.stdout.flush()
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class stats(object):
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.connections = 0
+        self.active_connections = 0
+        self.messages = 0
+        self.announces = 0
+        self.scrapes = 0
+        self.errors = 0
+        # offers received, and the number of peers they were relayed to
+        self.offers = 0
+        self.offers_relayed = 0
+        self.answers = 0
+        self.answers_relayed = 0
+        # answers to offers we never relayed, or from peers that left
+        self.answers_dropped = 0
+        self.offers_unanswered = 0
+        # the number of peers each announce's offers were relayed to
+        self.fan_out = []
+        # seconds from relaying an offer to relaying its answer
+        self.round_trip = []
+        self.last_report = (self.start, 0)
+
+    def sample(self, samples, value):
+        if len(samples) < MAX_SAMPLES:
+            samples.append(value)
+        else:
+            samples[random.randrange(MAX_SAMPLES)] = value
+
+    def to_dict(self, swarms):
+        elapsed = time.monotonic() - self.start
+        ret = {k: v for k, v in vars(self).items()
+               if k not in ('start', 'fan_out', 'round_trip', 'last_report')}
+        rtt = sorted(self.round_trip)
+        fan_out = sorted(self.fan_out)
+        ret.update({
+            'uptime': elapsed,
+            'messages_per_second': self.messages / elapsed if elapsed > 0 else 0,
+            'swarms': len(swarms),
+            'peers': sum(len(s) for s in swarms.values()),
+            'mean_fan_out': sum(fan_out) / len(fan_out) if fan_out else 0,
+            'max_fan_out': fan_out[-1] if fan_out else 0,
+            'mean_round_trip': sum(rtt) / len(rtt) if rtt else 0,
+            'p50_round_trip': percentile(rtt, 0.5),
+            'p99_round_trip': percentile(rtt, 0.99),
+        })
+        return ret
+
+
+class session(object):
+    __slots__ = ('websocket', 'peer_ids')
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        # info-hash -> the peer ID this session announced with
+        self.peer_ids = {}
+
+
+class tracker(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.stats = stats()
+        # info-hash -> {peer ID -> (session, seed)}
+        self.swarms = {}
+        # (info-hash, offer ID) -> (offering peer ID, the time it was relayed)
+        self.pending = {}
+
+    async def send(self, websocket, msg):
+        try:
+            await websocket.send(json.dumps(msg))
+        except websockets.ConnectionClosed:
+            pass
+
+    def leave(self, s, info_hash):
+        peer_id = s.peer_ids.pop(info_hash, None)
+        swarm = self.swarms.get(info_hash)
+        if swarm is None or peer_id is None:
+            return
+        entry = swarm.get(peer_id)
+        if entry is not None and entry[0] is s:
+            del swarm[peer_id]
+        if not swarm:
+            del self.swarms[info_hash]
+
+    async def handle(self, websocket, path=None):
+        s = session(websocket)
+        self.stats.connections += 1
+        self.stats.active_connections += 1
+        try:
+            async for message in websocket:
+                self.stats.messages += 1
+                if self.args.verbose:
+                    print('{} - [{}] WS "{}..."'.format(
+                        websocket.remote_address[0],
+                        datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+                        message[:33]),
+                        file=sys.stderr)
+                try:
+                    request = json.loads(message)
+                    if request.get('action') == 'scrape':
+                        await self.scrape(s, request)
+                    else:
+                        await self.announce(s, request)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    self.stats.errors += 1
+                    await self.send(websocket, {'failure reason': 'invalid request: %s' % e})
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(e)
+        finally:
+            self.stats.active_connections -= 1
+            for info_hash in list(s.peer_ids):
+                self.leave(s, info_hash)
+
+    async def announce(self, s, request):
+        info_hash = request['info_hash']
+        peer_id = request['peer_id']
+        self.stats.announces += 1
+
+        if 'answer' in request:
+            await self.relay_answer(info_hash, peer_id, request)
+            # answers aren't announces in their own right
+            if 'event' not in request and 'offers' not in request:
+                return
+
+        event = request.get('event', '')
+        if event == 'stopped':
+            self.leave(s, info_hash)
+        else:
+            old = s.peer_ids.get(info_hash)
+            if old is not None and old != peer_id:
+                self.leave(s, info_hash)
+            s.peer_ids[info_hash] = peer_id
+            seed = event == 'completed' or request.get('left', 1) == 0
+            self.swarms.setdefault(info_hash, {})[peer_id] = (s, seed)
+
+        swarm = self.swarms.get(info_hash, {})
+        complete = sum(1 for _, seed in swarm.values() if seed)
+        await self.send(s.websocket, {
+            'action': 'announce',
+            'info_hash': info_hash,
+            'interval': self.args.interval,
+            'min_interval': self.args.min_interval,
+            'complete': complete,
+            'incomplete': len(swarm) - complete,
+        })
+
+        offers = request.get('offers') or []
+        if event == 'stopped' or not offers:
+            return
+        self.stats.offers += len(offers)
+        num_want = min(len(offers), request.get('numwant', len(offers)), self.args.max_offers)
+        targets = [p for p in swarm.items() if p[0] != peer_id]
+        targets = random.sample(targets, min(num_want, len(targets)))
+        now = time.monotonic()
+        sends = []
+        # every peer gets a different offer
+        for (target_id, (target, _)), offer in zip(targets, offers):
+            self.pending[(info_hash, offer['offer_id'])] = (peer_id, now)
+            sends.append(self.send(target.websocket, {
+                'action': 'announce',
+                'info_hash': info_hash,
+                'peer_id': peer_id,
+                'offer_id': offer['offer_id'],
+                'offer': offer['offer'],
+            }))
+        self.stats.offers_relayed += len(sends)
+        self.stats.sample(self.stats.fan_out, len(sends))
+        await asyncio.gather(*sends)
+
+    async def relay_answer(self, info_hash, peer_id, request):
+        self.stats.answers += 1
+        offer_id = request['offer_id']
+        pending = self.pending.pop((info_hash, offer_id), None)
+        target = self.swarms.get(info_hash, {}).get(request['to_peer_id'])
+        if target is None:
+            self.stats.answers_dropped += 1
+            return
+        if pending is not None:
+            self.stats.sample(self.stats.round_trip, time.monotonic() - pending[1])
+        self.stats.answers_relayed += 1
+        await self.send(target[0].websocket, {
+            'action': 'announce',
+            'info_hash': info_hash,
+            'peer_id': peer_id,
+            'offer_id': offer_id,
+            'answer': request['answer'],
+        })
+
+    async def scrape(self, s, request):
+        self.stats.scrapes += 1
+        info_hashes = request.get('info_hash', list(self.swarms))
+        if isinstance(info_hashes, str):
+            info_hashes = [info_hashes]
+        files = {}
+        for info_hash in info_hashes:
+            swarm = self.swarms.get(info_hash, {})
+            complete = sum(1 for _, seed in swarm.values() if seed)
+            files[info_hash] = {'complete': complete, 'incomplete': len(swarm) - complete,
+                                'downloaded': 0}
+        await self.send(s.websocket, {'action': 'scrape', 'files': files})
+
+    async def housekeeping(self):
         while True:
-            message = await websocket.recv()
+            await asyncio.sleep(self.args.stats_interval or 10)
+            now = time.monotonic()
+            deadline = now - OFFER_TIMEOUT
+            expired = [k for k, v in self.pending.items() if v[1] < deadline]
+            for k in expired:
+                del self.pending[k]
+            self.stats.offers_unanswered += len(expired)
+            if self.args.stats_interval <= 0:
+                continue
+            last, messages = self.stats.last_report
+            st = self.stats.to_dict(self.swarms)
+            debug('%.0f messages/s (%d connections, %d swarms, %d peers, %d offers relayed, '
+                  'fan-out: %.1f, %d answers relayed, round-trip p50: %.1f ms p99: %.1f ms)' % (
+                      (self.stats.messages - messages) / (now - last), st['active_connections'],
+                      st['swarms'], st['peers'], st['offers_relayed'], st['mean_fan_out'],
+                      st['answers_relayed'], st['p50_round_trip'] * 1000, st['p99_round_trip'] * 1000))
+            self.stats.last_report = (now, self.stats.messages)
 
-            print('{} - [{}] WS "{}..."'.format(
-                websocket.remote_address[0],
-                datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-                message[:33]),
-                file=sys.stderr)
 
-            request = json.loads(message)
-            response = {}
-            response["info_hash"] = request["info_hash"]
-            response["interval"] = 120
-            response["min_interval"] = 60
+async def run(args, ssl_context):
+    t = tracker(args)
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set_result, None)
 
-            await websocket.send(json.dumps(response))
+    # per-message compression costs a lot of CPU and memory per connection,
+    # and the messages are small
+    async with websockets.serve(t.handle, args.bind, args.port, ssl=ssl_context,
+                                compression=None, max_size=2 ** 20):
+        debug('listening on port %d...' % args.port)
+        housekeeping = asyncio.ensure_future(t.housekeeping())
+        await stop
+        housekeeping.cancel()
 
-    except Exception as e:
-        print(e)
+    st = t.stats.to_dict(t.swarms)
+    debug('stats: %s' % json.dumps(st))
+    if args.stats_file:
+        with open(args.stats_file, 'w+') as f:
+            json.dump(st, f, indent=1)
 
 
 if __name__ == '__main__':
-    port = int(sys.argv[1])
-    use_ssl = sys.argv[2] != '0'
-    min_interval = sys.argv[3]
+    parser = argparse.ArgumentParser(description='WebSocket tracker stand-in')
+    parser.add_argument('port', type=int)
+    parser.add_argument('ssl', help='1 to use TLS, 0 otherwise')
+    parser.add_argument('min_interval', type=int)
+    parser.add_argument('--bind', default='127.0.0.1', help='the address to listen on (default: %(default)s)')
+    parser.add_argument('--interval', type=int, default=120, help='the announce interval (default: %(default)s)')
+    parser.add_argument('--max-offers', type=int, default=10,
+                        help='the most peers an announce\'s offers are relayed to (default: %(default)s)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='print signaling stats every this many seconds (default: never)')
+    parser.add_argument('--stats-file', help='write the signaling stats as JSON to this file on exit')
+    parser.add_argument('--verbose', action='store_true', help='log every message to stderr')
+    args = parser.parse_args()
     print('python version: %s' % sys.version_info.__str__())
 
-    if use_ssl:
+    if args.ssl != '0':
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ssl_context.load_cert_chain('../ssl/server.pem')
     else:
         ssl_context = None
 
-    start_server = websockets.serve(handle, '127.0.0.1', port, ssl=ssl_context)
-    asyncio.get_event_loop().run_until_complete(start_server)
-    asyncio.get_event_loop().run_forever()
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
+    asyncio.run(run(args, ssl_context))
@@ -0,0 +1,2125 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# this is the libtorrent benchmark harness. Benchmarks are described by
+# declarative scenario files (JSON, see tools/benchmarks/). A scenario names
+# a driver, the parameters passed to it, an optional parameter sweep and how
+# many warmup and measured runs to make for every point in the sweep.
+#
+#   {
+#       "name": "checking",
+#       "driver": "checking",
+#       "warmup": 1,
+#       "repeat": 5,
+#       "params": {"size": 10000, "files": 15, "settings": {}},
+#       "sweep": {"settings.hashing_threads": [4, 8, 16, 32, 64]}
+#   }
+#
+# sweep keys may refer into nested parameters with dots. Every combination of
+# the sweep values is run. The results of every configuration are stored as
+# JSON in the results directory, keyed by git revision and a hash of the
+# parameters, along with the mean, standard deviation and 95% confidence
+# interval of every metric.
+#
+# the compare command compares the results of two revisions and fails if any
+# metric regressed by more than the threshold.
+#
+# scenarios with a "plot" section also get their metrics plotted against one
+# of the swept parameters (curves.json, .tsv and gnuplot files in curves/ next
+# to the results).
+#
+# with --profile perf (or py-spy, for the python client) the client is
+# sampled during every measured run. The profiles of a configuration are
+# folded together into <key>.folded next to its results, along with an
+# interactive flamegraph (<key>.svg) and a top-functions table
+# (<key>.top.txt). Compare the tables of two revisions with
+# "flamegraph.py diff".
+#
+# with --memory (or "memory": true in the scenario) the client's RSS is
+# sampled during every run and joined with the session counters into a
+# timeline (memory.tsv in the run directory). --profile heap additionally
+# runs the client with tcmalloc's heap profiler and attributes the heap in
+# use at its peak to subsystems (disk buffers, peer connections, the piece
+# picker, the alert queue, DHT storage, ...). The mem_* metrics are stored
+# with the results, a per-subsystem report and timeline plot go in
+# <key>.memory.txt and <key>.memory.png. Compare two revisions with
+# "compare --metric 'mem_*'".
+#
+# usage: benchmark.py run [options] scenario.json [...]
+#        benchmark.py compare [options] base-revision new-revision
+
+import argparse
+import copy
+import ctypes.util
+import datetime
+import fnmatch
+import hashlib
+import itertools
+import json
+import math
+import os
+import platform
+import pty
+import re
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Match
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+import flamegraph
+
+tools_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(tools_dir)
+
+# the (nested) parameters of a configuration, the metrics a driver returns
+# for one run and the summary of every metric over all runs
+Params = Dict[str, Any]
+Metrics = Dict[str, float]
+Summary = Dict[str, Dict[str, Any]]
+Driver = Callable[["context", Params, str], Metrics]
+Profiler = List[Union["memory_sampler", "subprocess.Popen[bytes]"]]
+
+# maps driver name -> function(ctx, params, run_dir) returning a dict of
+# metric name -> value
+drivers: Dict[str, Driver] = {}
+
+# for every metric, whether higher or lower values are better. Only metrics
+# listed here are considered by the compare command
+metric_direction = {
+    "wall_time": "lower",
+    "client_cpu_time": "lower",
+    "throughput": "higher",
+    "upload_rate": "higher",
+    "download_rate": "higher",
+    "checking_time": "lower",
+    "checking_rate": "higher",
+    "cpu_per_mb": "lower",
+    "peak_rss": "lower",
+    "waste_ratio": "lower",
+    "add_time": "lower",
+    "ready_time": "lower",
+    "rss_per_torrent": "lower",
+    "idle_cpu": "lower",
+    "updates_first_latency": "lower",
+    "updates_latency": "lower",
+    "shutdown_time": "lower",
+    "insert_rate": "higher",
+    "rss_per_item": "lower",
+    "cpu_per_query": "lower",
+    "lookup_latency": "lower",
+    "lookup_p99_latency": "lower",
+    "init_time": "lower",
+    "execs_per_sec": "higher",
+    "us_per_exec": "lower",
+}
+
+# metrics describing the input of a run rather than its performance. The
+# compare command flags configurations where they differ, their performance
+# metrics aren't comparable
+input_metrics = ["corpus_files"]
+
+# heap allocations are attributed to the first of these subsystems matching
+# a frame of their call stack, searching from the innermost frame. The rest
+# is reported as "other"
+memory_buckets = [
+    (
+        "disk_buffers",
+        r"libtorrent::(aux::)?(disk_buffer_pool|disk_buffer_holder|mmap_disk_io|"
+        r"posix_disk_io|disk_job_pool|store_buffer|disk_io_thread_pool)",
+    ),
+    (
+        "alert_queue",
+        r"libtorrent::(aux::)?(alert_manager|heterogeneous_queue|stack_allocator)"
+        r"|_alert::",
+    ),
+    ("piece_picker", r"libtorrent::(aux::)?piece_picker::"),
+    (
+        "peer_connections",
+        r"libtorrent::(aux::)?(bt_peer_connection|peer_connection|web_peer_connection|"
+        r"chained_buffer|receive_buffer|crypto_receive_buffer|peer_list|torrent_peer|"
+        r"utp_socket_impl|utp_stream|socket_type)",
+    ),
+    ("dht_storage", r"libtorrent::dht::(dht_default_storage|\w*storage)"),
+    ("dht", r"libtorrent::dht::"),
+    (
+        "torrents",
+        r"libtorrent::(aux::)?(torrent::|torrent_info::|file_storage::|torrent_list)",
+    ),
+]
+
+# session counters sampled on the memory timeline, and the unit they're
+# multiplied by (disk blocks are 16 kiB)
+memory_counters = [
+    ("disk.disk_blocks_in_use", 16 * 1024),
+    ("disk.queued_write_bytes", 1),
+    ("peer.num_peers_connected", 1),
+    ("peer.num_peers_half_open", 1),
+    ("ses.num_checking_torrents", 1),
+    ("ses.num_downloading_torrents", 1),
+    ("ses.num_seeding_torrents", 1),
+    ("dht.dht_torrents", 1),
+    ("dht.dht_peers", 1),
+    ("dht.dht_immutable_data", 1),
+    ("dht.dht_mutable_data", 1),
+    ("dht.dht_allocated_observers", 1),
+]
+
+# two-sided 95% critical values of Student's t-distribution, indexed by
+# degrees of freedom - 1. Beyond the table we use the normal distribution
+t_table = [
+    12.706,
+    4.303,
+    3.182,
+    2.776,
+    2.571,
+    2.447,
+    2.365,
+    2.306,
+    2.262,
+    2.228,
+    2.201,
+    2.179,
+    2.160,
+    2.145,
+    2.131,
+    2.120,
+    2.110,
+    2.101,
+    2.093,
+    2.086,
+    2.080,
+    2.074,
+    2.069,
+    2.064,
+    2.060,
+    2.056,
+    2.052,
+    2.048,
+    2.045,
+    2.042,
+]
+
+
+def driver(name: str) -> Callable[[Driver], Driver]:
+    def register(fun: Driver) -> Driver:
+        drivers[name] = fun
+        return fun
+
+    return register
+
+
+class benchmark_error(Exception):
+    pass
+
+
+class context(object):
+    # the environment benchmarks are run in
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.bin_dir = os.path.abspath(args.bin_dir)
+        self.work_dir = os.path.abspath(args.work_dir)
+        self.verbose = args.verbose
+        self.profile = args.profile
+        self.call_graph = args.call_graph
+        self.sample_rate = args.sample_rate
+        self.session_stats = args.session_stats
+        # sample the client's memory use (also enabled by heap profiling
+        # and by scenarios with "memory": true)
+        self.memory_flag = args.memory or args.profile == "heap"
+        self.memory = self.memory_flag
+        self.memory_interval = args.memory_interval
+
+    def binary(self, name: str) -> str:
+        path = os.path.join(self.bin_dir, name)
+        if not os.path.exists(path):
+            raise benchmark_error(
+                'could not find "%s" (build and stage it, or use --build)' % path
+            )
+        return path
+
+    def path(self, *name: str) -> str:
+        return os.path.join(self.work_dir, *name)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    n = len(values)
+    mean = sum(values) / float(n)
+    if n < 2:
+        return {"n": n, "mean": mean, "stdev": 0.0, "ci95": [mean, mean]}
+    stdev = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    t = t_table[n - 2] if n - 2 < len(t_table) else 1.96
+    delta = t * stdev / math.sqrt(n)
+    return {"n": n, "mean": mean, "stdev": stdev, "ci95": [mean - delta, mean + delta]}
+
+
+def git_revision() -> str:
+    try:
+        rev = (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=root_dir,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+        dirty = (
+            subprocess.call(
+                ["git", "diff", "--quiet", "HEAD"],
+                cwd=root_dir,
+                stderr=subprocess.DEVNULL,
+            )
+            != 0
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("-dirty" if dirty else "")
+
+
+def config_key(params: Params) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def set_param(params: Params, key: str, value: Any) -> None:
+    path = key.split(".")
+    for k in path[:-1]:
+        params = params.setdefault(k, {})
+    params[path[-1]] = value
+
+
+def expand_sweep(scenario: Dict[str, Any]) -> List[Params]:
+    # returns the list of parameter sets to run, one per combination of the
+    # sweep values
+    base = scenario.get("params", {})
+    sweep = scenario.get("sweep", {})
+    keys = sorted(sweep.keys())
+    ret = []
+    for values in itertools.product(*[sweep[k] for k in keys]):
+        params = copy.deepcopy(base)
+        for k, v in zip(keys, values):
+            set_param(params, k, v)
+        ret.append(params)
+    return ret
+
+
+def flatten(params: Params, prefix: str = "") -> Dict[str, Any]:
+    # returns nested parameters as a dict of dotted key -> value
+    ret: Dict[str, Any] = {}
+    for k, v in params.items():
+        if isinstance(v, dict):
+            ret.update(flatten(v, prefix + k + "."))
+        else:
+            ret[prefix + k] = v
+    return ret
+
+
+def describe(params: Params, sweep: Dict[str, Any]) -> str:
+    # a short description of the parameters being swept over
+    ret = []
+    for k in sorted(sweep):
+        v: Any = params
+        for p in k.split("."):
+            v = v.get(p) if isinstance(v, dict) else None
+        ret.append("%s=%s" % (k.split(".")[-1], v))
+    return " ".join(ret)
+
+
+def free_port() -> int:
+    # ask the OS for a port nobody is listening on
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port: int = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_for_port(
+    port: int, proc: "subprocess.Popen[bytes]", timeout: float = 30.0
+) -> None:
+    # wait until proc accepts connections on port
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if poll_rusage(proc) is not None:
+            raise benchmark_error(
+                "process exited (%d) before listening on port %d"
+                % (proc.returncode, port)
+            )
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise benchmark_error("timed out waiting for port %d" % port)
+
+
+def wait_rusage(
+    proc: "subprocess.Popen[bytes]", timeout: Optional[float] = None
+) -> resource.struct_rusage:
+    # waits for proc to exit and returns its resource usage. Popen.wait()
+    # doesn't provide the rusage of the child, so we reap it ourselves
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        pid, status, rusage = os.wait4(
+            proc.pid, os.WNOHANG if deadline is not None else 0
+        )
+        if pid != 0:
+            proc.returncode = (
+                os.waitstatus_to_exitcode(status)
+                if hasattr(os, "waitstatus_to_exitcode")
+                else (status >> 8)
+            )
+            return rusage
+        if deadline is not None and time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired(proc.args, timeout or 0.0)
+        time.sleep(0.05)
+
+
+def poll_rusage(proc: "subprocess.Popen[bytes]") -> Optional[resource.struct_rusage]:
+    # like Popen.poll(), but returns the resource usage of proc once it has
+    # exited (and None while it's running). Popen.poll() (which
+    # Popen.send_signal() also calls) reaps the process and discards its
+    # resource usage, so don't call it on processes we measure
+    try:
+        return wait_rusage(proc, 0)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+def stop(
+    proc: "subprocess.Popen[bytes]", rusage_timeout: float = 30.0
+) -> resource.struct_rusage:
+    # ask client_test to quit (it terminates its main loop on SIGINT), and
+    # kill it if it doesn't. proc must not have been reaped yet
+    os.kill(proc.pid, signal.SIGINT)
+    try:
+        return wait_rusage(proc, rusage_timeout)
+    except subprocess.TimeoutExpired:
+        os.kill(proc.pid, signal.SIGKILL)
+        return wait_rusage(proc)
+
+
+def better(metric: str) -> Optional[str]:
+    # memory metrics (mem_*) are always better lower
+    if metric.startswith("mem_"):
+        return "lower"
+    return metric_direction.get(metric)
+
+
+class memory_sampler(threading.Thread):
+    # samples the RSS of a process from /proc every interval seconds, until
+    # it exits. Times are milliseconds since the process started, which is
+    # (approximately) the time base of client_test's log
+
+    def __init__(self, pid: int, interval: float, run_dir: str) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.run_dir = run_dir
+        self.samples: List[Tuple[int, int]] = []
+        self.done = threading.Event()
+        try:
+            with open("/proc/%d/stat" % pid) as f:
+                ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+            self.start_time = time.monotonic() - (
+                uptime - ticks / os.sysconf("SC_CLK_TCK")
+            )
+        except (OSError, IndexError, ValueError):
+            self.start_time = time.monotonic()
+
+    def run(self) -> None:
+        while not self.done.is_set():
+            rss = None
+            try:
+                with open("/proc/%d/status" % self.pid) as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss = int(line.split()[1])
+            except OSError:
+                pass
+            # zombies don't have an RSS
+            if rss is None:
+                break
+            self.samples.append((int((time.monotonic() - self.start_time) * 1000), rss))
+            self.done.wait(self.interval)
+
+    def stop(self) -> None:
+        self.done.set()
+        self.join()
+
+
+def client_env(ctx: context, run_dir: str) -> Optional[Dict[str, str]]:
+    # the environment to run the client in. Heap profiling preloads
+    # tcmalloc, which writes a heap profile every few seconds
+    if ctx.profile != "heap":
+        return None
+    tcmalloc = ctypes.util.find_library("tcmalloc")
+    if tcmalloc is None:
+        raise benchmark_error(
+            "heap profiling requires tcmalloc (libgoogle-perftools-dev)"
+        )
+    env = dict(os.environ)
+    env.update(
+        {
+            "LD_PRELOAD": tcmalloc,
+            "HEAPPROFILE": os.path.join(run_dir, "heap"),
+            "HEAP_PROFILE_TIME_INTERVAL": str(max(1, int(ctx.memory_interval * 10))),
+        }
+    )
+    return env
+
+
+def start_profiler(
+    ctx: context, proc: "subprocess.Popen[bytes]", run_dir: str
+) -> Profiler:
+    # attaches a sampling profiler to proc, and the memory sampler. Both stop
+    # by themselves when proc exits
+    profiler: Profiler = []
+    if ctx.memory:
+        sampler = memory_sampler(proc.pid, ctx.memory_interval, run_dir)
+        sampler.start()
+        profiler.append(sampler)
+    if ctx.profile == "perf":
+        cmd = [
+            "perf",
+            "record",
+            "--call-graph",
+            ctx.call_graph,
+            "-F",
+            str(ctx.sample_rate),
+            "-p",
+            str(proc.pid),
+            "-o",
+            os.path.join(run_dir, "perf.data"),
+        ]
+    elif ctx.profile == "py-spy":
+        cmd = [
+            "py-spy",
+            "record",
+            "--native",
+            "--nonblocking",
+            "--format",
+            "raw",
+            "-r",
+            str(ctx.sample_rate),
+            "--pid",
+            str(proc.pid),
+            "-o",
+            os.path.join(run_dir, "py-spy.txt"),
+        ]
+    else:
+        return profiler
+    if ctx.verbose:
+        print("  $ %s" % " ".join(cmd))
+    try:
+        profiler.append(
+            subprocess.Popen(
+                cmd,
+                stdout=open(os.path.join(run_dir, "profiler.out"), "w+"),
+                stderr=subprocess.STDOUT,
+            )
+        )
+    except OSError as e:
+        stop_profiler(profiler)
+        raise benchmark_error("failed to start %s: %s" % (ctx.profile, e))
+    return profiler
+
+
+def stop_profiler(profiler: Optional[Profiler]) -> None:
+    for p in profiler or []:
+        if isinstance(p, memory_sampler):
+            p.stop()
+            with open(os.path.join(p.run_dir, "rss.tsv"), "w+") as f:
+                for t, rss in p.samples:
+                    f.write("%d\t%d\n" % (t, rss))
+            continue
+        try:
+            p.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            p.send_signal(signal.SIGINT)
+            p.wait()
+
+
+def run_command(ctx: context, cmd: List[str], **kwargs: Any) -> int:
+    if ctx.verbose:
+        print("  $ %s" % " ".join(cmd))
+    return subprocess.check_call(cmd, **kwargs)
+
+
+def settings_args(settings: Dict[str, Any]) -> List[str]:
+    ret = []
+    for k, v in sorted(settings.items()):
+        if isinstance(v, bool):
+            v = int(v)
+        ret.append("--%s=%s" % (k, v))
+    return ret
+
+
+def torrent_name(params: Params) -> str:
+    # piece_size is in kiB, version is v1, v2 or hybrid
+    name = "bench_%dMB_%d" % (params.get("size", 1000), params.get("files", 1))
+    if params.get("piece_size", 1024) != 1024:
+        name += "_%dk" % params["piece_size"]
+    if params.get("version", "v1") != "v1":
+        name += "_%s" % params["version"]
+    return name
+
+
+def prepare_torrent(ctx: context, params: Params, with_data: bool = False) -> str:
+    # generates (and caches) the test torrent described by params, and
+    # optionally its data (in ctx.path('data')). Returns the path to the
+    # .torrent file
+    name = torrent_name(params)
+    torrent = ctx.path("%s.torrent" % name)
+    if not os.path.exists(torrent):
+        run_command(
+            ctx,
+            [
+                ctx.binary("connection_tester"),
+                "gen-torrent",
+                "-s",
+                str(params.get("size", 1000)),
+                "-n",
+                str(params.get("files", 1)),
+                "-S",
+                str(params.get("piece_size", 1024)),
+                "-V",
+                params.get("version", "v1"),
+                "-t",
+                torrent,
+            ],
+            cwd=ctx.work_dir,
+            stdout=subprocess.DEVNULL,
+        )
+    if with_data:
+        marker = ctx.path("data", "%s.complete" % name)
+        if not os.path.exists(marker):
+            os.makedirs(ctx.path("data"), exist_ok=True)
+            run_command(
+                ctx,
+                [
+                    ctx.binary("connection_tester"),
+                    "gen-data",
+                    "-t",
+                    torrent,
+                    "-P",
+                    ctx.path("data"),
+                ],
+                cwd=ctx.work_dir,
+                stdout=subprocess.DEVNULL,
+            )
+            open(marker, "w").close()
+    return torrent
+
+
+def clean_session_state(directory: str) -> None:
+    for p in [".ses_state", ".resume"]:
+        p = os.path.join(directory, p)
+        if os.path.isdir(p):
+            shutil.rmtree(p)
+        elif os.path.exists(p):
+            os.remove(p)
+
+
+def evict_cache(path: str) -> None:
+    # drop the data from the page cache, to make the next run read it from
+    # disk. Dropping all caches requires root, otherwise every file is
+    # evicted with posix_fadvise()
+    try:
+        subprocess.check_call(["sync"])
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    files = (
+        [path]
+        if os.path.isfile(path)
+        else [os.path.join(d, f) for d, dirs, names in os.walk(path) for f in names]
+    )
+    for name in files:
+        fd = os.open(name, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def rusage_cpu(rusage: Optional[resource.struct_rusage]) -> float:
+    if rusage is None:
+        return 0.0
+    return rusage.ru_utime + rusage.ru_stime
+
+
+def read_session_stats_timeline(events: str) -> List[Tuple[int, Dict[str, int]]]:
+    # returns the session stats counters client_test logged (with -O), as a
+    # list of (milliseconds, dict of metric name -> value)
+    keys: Optional[List[str]] = None
+    timeline: List[Tuple[int, Dict[str, int]]] = []
+    if not os.path.exists(events):
+        return timeline
+    with open(events, errors="replace") as f:
+        for line in f:
+            if "session stats header: " in line:
+                keys = line.split("session stats header: ")[1].strip().split(", ")
+            elif keys is not None and "session stats (" in line:
+                values = line.split("values): ")[1].strip().split(", ")
+                timeline.append(
+                    (
+                        int(line.split(" ")[0][1:-1]),
+                        dict(zip(keys, [int(v) for v in values])),
+                    )
+                )
+    return timeline
+
+
+def read_session_stats(events: str) -> Dict[str, int]:
+    # returns the last session stats counters, or an empty dict
+    timeline = read_session_stats_timeline(events)
+    return timeline[-1][1] if timeline else {}
+
+
+def transport_args(transport: str) -> List[str]:
+    if transport == "utp":
+        return ["--enable_outgoing_tcp=0", "--enable_incoming_tcp=0"]
+    return ["--enable_outgoing_utp=0", "--enable_incoming_utp=0"]
+
+
+def is_seed(i: int, ratio: float) -> bool:
+    # spreads the seeds evenly over the peers
+    return int((i + 1) * ratio) != int(i * ratio)
+
+
+@driver("transfer")
+def run_transfer(ctx: context, params: Params, run_dir: str) -> Metrics:
+    # runs client_test against a synthetic swarm over loopback. "test" is
+    # what client_test does: upload, download or dual. The swarm is made of
+    # "peers" connections, either from connection_tester (the default) or
+    # from that many client_test instances ("peer_impl": "client_test").
+    #
+    # connection_tester speaks TCP only, but supports churn (reconnects per
+    # "churn" blocks), sending one in every "corrupt" blocks corrupt and a
+    # deterministic "rng_seed". client_test peers support "transport": "utp".
+    # In dual tests, "seed_ratio" is the fraction of the peers that are
+    # seeds.
+    #
+    # with "client": "python", the client of the python binding is measured
+    # instead (which ignores settings and client_args)
+    test = params.get("test", "download")
+    peers = params.get("peers", 50)
+    duration = params.get("duration", 60)
+    transport = params.get("transport", "tcp")
+    peer_impl = params.get("peer_impl", "connection_tester")
+    seed_ratio: float = params.get("seed_ratio", 0.5)
+    if test == "download":
+        seed_ratio = 1.0
+    elif test == "upload":
+        seed_ratio = 0.0
+    python_client = params.get("client", "client_test") == "python"
+
+    if peer_impl == "connection_tester" and transport != "tcp":
+        raise benchmark_error(
+            'connection_tester only supports TCP, use "peer_impl": "client_test"'
+        )
+    if peer_impl == "client_test" and (params.get("churn") or params.get("corrupt")):
+        raise benchmark_error(
+            'churn and corruption require "peer_impl": "connection_tester"'
+        )
+
+    helper_seeds = peer_impl == "client_test" and any(
+        is_seed(i, seed_ratio) for i in range(peers)
+    )
+    torrent = prepare_torrent(ctx, params, with_data=(test == "upload" or helper_seeds))
+    save_path = ctx.path("data")
+    if test != "upload":
+        save_path = os.path.join(run_dir, "download")
+    # client_test keeps resume data in the save path
+    clean_session_state(save_path)
+
+    port = free_port()
+    events = os.path.join(run_dir, "events.log")
+    client_cmd = [
+        ctx.binary("client_test"),
+        "-k",
+        "-O",
+        "--listen_interfaces=127.0.0.1:%d" % port,
+        "--enable_dht=0",
+        "--enable_lsd=0",
+        "--enable_upnp=0",
+        "--enable_natpmp=0",
+        "--allow_multiple_connections_per_ip=1",
+        "--connections_limit=%d" % (peers * 2),
+        "-T",
+        str(peers * 2),
+        "-f",
+        events,
+        "-s",
+        save_path,
+    ]
+    if test == "upload":
+        client_cmd.append("-G")
+    if test == "download":
+        client_cmd.append("-1")
+    if peer_impl == "client_test":
+        client_cmd += transport_args(transport)
+    client_cmd += settings_args(params.get("settings", {}))
+    client_cmd += params.get("client_args", [])
+    client_cmd.append(torrent)
+    client_stdin = subprocess.DEVNULL
+    if python_client:
+        client_cmd = [
+            sys.executable,
+            os.path.join(root_dir, "bindings", "python", "client.py"),
+            "-p",
+            str(port),
+            "-i",
+            "127.0.0.1",
+            "-s",
+            save_path,
+            torrent,
+        ]
+        # the python client needs a terminal
+        pty_master, client_stdin = pty.openpty()
+
+    swarm_cmds = []
+    if peer_impl == "connection_tester":
+        tester_mode = {"download": "upload", "upload": "download", "dual": "dual"}[test]
+        cmd = [
+            ctx.binary("connection_tester"),
+            tester_mode,
+            "-c",
+            str(peers),
+            "-d",
+            "127.0.0.1",
+            "-p",
+            str(port),
+            "-t",
+            torrent,
+            "-Z",
+            str(params.get("rng_seed", 1)),
+        ]
+        if test == "dual":
+            cmd += ["-m", str(int(seed_ratio * 100))]
+        if params.get("churn"):
+            cmd += ["-r", str(params["churn"])]
+        if params.get("corrupt"):
+            cmd += ["-K", str(params["corrupt"])]
+        swarm_cmds.append(cmd + params.get("tester_args", []))
+    else:
+        for i in range(peers):
+            peer_dir = os.path.join(run_dir, "peer%d" % i)
+            os.makedirs(peer_dir)
+            seed = is_seed(i, seed_ratio)
+            cmd = [
+                ctx.binary("client_test"),
+                "--listen_interfaces=127.0.0.1:%d" % free_port(),
+                "--enable_dht=0",
+                "--enable_lsd=0",
+                "--enable_upnp=0",
+                "--enable_natpmp=0",
+                "-r",
+                "127.0.0.1:%d" % port,
+                "-s",
+                ctx.path("data") if seed else peer_dir,
+            ]
+            if seed:
+                cmd.append("-G")
+            swarm_cmds.append(
+                cmd
+                + transport_args(transport)
+                + params.get("peer_args", [])
+                + [torrent]
+            )
+
+    client_out = open(os.path.join(run_dir, "client.out"), "w+")
+    swarm_out = open(os.path.join(run_dir, "tester.out"), "w+")
+    with open(os.path.join(run_dir, "cmdline.txt"), "w+") as f:
+        for cmd in [client_cmd] + swarm_cmds:
+            print(" ".join(cmd), file=f)
+
+    if ctx.verbose:
+        print("  $ %s" % " ".join(client_cmd))
+    client = subprocess.Popen(
+        client_cmd,
+        stdout=client_out,
+        stderr=subprocess.STDOUT,
+        stdin=client_stdin,
+        cwd=run_dir,
+        env=client_env(ctx, run_dir),
+    )
+    swarm = []
+    profiler = None
+    rusage = None
+    try:
+        wait_for_port(port, client)
+        profiler = start_profiler(ctx, client, run_dir)
+        start = time.monotonic()
+        for cmd in swarm_cmds:
+            if ctx.verbose:
+                print("  $ %s" % " ".join(cmd))
+            swarm.append(
+                subprocess.Popen(
+                    cmd,
+                    stdout=swarm_out,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    cwd=run_dir,
+                )
+            )
+        # connection_tester exits when it's done, client_test peers don't.
+        # In download tests, the client exits once it has the whole torrent
+        deadline = start + duration
+        while time.monotonic() < deadline:
+            rusage = poll_rusage(client)
+            if rusage is not None:
+                break
+            if peer_impl == "connection_tester" and swarm[0].poll() is not None:
+                break
+            time.sleep(0.1)
+        end = time.monotonic()
+        for p in swarm:
+            if p.poll() is None:
+                p.send_signal(signal.SIGINT)
+    finally:
+        if rusage is None:
+            rusage = stop(client)
+        stop_profiler(profiler)
+        for p in swarm:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+        client_out.close()
+        swarm_out.close()
+        if client_stdin != subprocess.DEVNULL:
+            os.close(client_stdin)
+            os.close(pty_master)
+
+    if peer_impl == "connection_tester" and swarm[0].returncode not in (
+        0,
+        -signal.SIGINT,
+    ):
+        raise benchmark_error(
+            "connection_tester failed (%d), see %s"
+            % (swarm[0].returncode, os.path.join(run_dir, "tester.out"))
+        )
+
+    wall = end - start
+    cpu = rusage_cpu(rusage)
+    metrics = {"wall_time": wall, "client_cpu_time": cpu}
+    if rusage is not None:
+        # ru_maxrss is in kiB
+        metrics["peak_rss"] = rusage.ru_maxrss / 1024.0
+
+    if peer_impl == "connection_tester" and params.get("corrupt"):
+        # connection_tester fails if it didn't send any corrupt blocks, but
+        # only prints the count when it exits by itself
+        with open(os.path.join(run_dir, "tester.out")) as f:
+            m = re.search(r"corrupt blocks sent: (\d+)", f.read())
+        if m is not None:
+            metrics["corrupt_blocks"] = int(m.group(1))
+
+    counters = {} if python_client else read_session_stats(events)
+    if counters:
+        sent = counters.get("net.sent_payload_bytes", 0) / 1000000.0
+        received = counters.get("net.recv_payload_bytes", 0) / 1000000.0
+        waste = counters.get("net.recv_failed_bytes", 0) + counters.get(
+            "net.recv_redundant_bytes", 0
+        )
+        metrics["upload_rate"] = sent / wall
+        metrics["download_rate"] = received / wall
+        metrics["throughput"] = (sent + received) / wall
+        metrics["cpu_per_mb"] = cpu / max(sent + received, 0.001)
+        metrics["waste_ratio"] = waste / max(
+            counters.get("net.recv_payload_bytes", 0), 1.0
+        )
+        metrics["waste_bytes"] = waste
+        metrics["hash_failures"] = counters.get("ses.num_piece_failed", 0)
+        metrics["banned_peers"] = counters.get("peer.banned_for_hash_failure", 0)
+        metrics["disconnects"] = counters.get("peer.disconnected_peers", 0)
+        metrics["outgoing_unchokes"] = counters.get("ses.num_outgoing_unchoke", 0)
+        return metrics
+
+    # without session stats, fall back to the rates connection_tester
+    # reports. "rate sent: 12.3 MB/s received: 45.6 MB/s" is from the
+    # tester's perspective
+    with open(os.path.join(run_dir, "tester.out")) as f:
+        m = re.search(r"rate sent: ([\d.]+) MB/s received: ([\d.]+) MB/s", f.read())
+    if m is None:
+        raise benchmark_error(
+            "no transfer rate reported, see %s" % os.path.join(run_dir, "tester.out")
+        )
+    metrics["download_rate"] = float(m.group(1))
+    metrics["upload_rate"] = float(m.group(2))
+    metrics["throughput"] = metrics["download_rate"] + metrics["upload_rate"]
+    metrics["cpu_per_mb"] = cpu / max(metrics["throughput"] * wall, 0.001)
+    return metrics
+
+
+@driver("checking")
+def run_checking(ctx: context, params: Params, run_dir: str) -> Metrics:
+    # runs client_test on a torrent whose data is complete, without resume
+    # data, and measures the time it takes to check the files. "disk_io" is
+    # the disk I/O back-end (mmap or posix) and with "cache": "cold" the
+    # data is evicted from the page cache before every run
+    torrent = prepare_torrent(ctx, params, with_data=True)
+    clean_session_state(ctx.path("data"))
+    name = torrent_name(params)
+    events = os.path.join(run_dir, "events.log")
+    if params.get("cache", "warm") == "cold":
+        evict_cache(ctx.path("data", name))
+
+    client_cmd = [
+        ctx.binary("client_test"),
+        "-1",
+        "--enable_dht=0",
+        "--enable_lsd=0",
+        "--enable_upnp=0",
+        "--enable_natpmp=0",
+        "--listen_interfaces=127.0.0.1:%d" % free_port(),
+        "-s",
+        ctx.path("data"),
+        "-f",
+        events,
+        "--alert_mask=all",
+    ]
+    if "disk_io" in params:
+        client_cmd += ["-B", params["disk_io"]]
+    if ctx.memory:
+        client_cmd.append("-O")
+    client_cmd += settings_args(params.get("settings", {}))
+    client_cmd += params.get("client_args", [])
+    client_cmd.append(torrent)
+
+    with open(os.path.join(run_dir, "cmdline.txt"), "w+") as f:
+        print(" ".join(client_cmd), file=f)
+    if ctx.verbose:
+        print("  $ %s" % " ".join(client_cmd))
+    with open(os.path.join(run_dir, "client.out"), "w+") as out:
+        start = time.monotonic()
+        client = subprocess.Popen(
+            client_cmd,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=run_dir,
+            env=client_env(ctx, run_dir),
+        )
+        profiler = start_profiler(ctx, client, run_dir)
+        try:
+            rusage = wait_rusage(client, params.get("timeout", 3600))
+        except subprocess.TimeoutExpired:
+            rusage = stop(client)
+            raise benchmark_error("timed out checking, see %s" % events)
+        finally:
+            stop_profiler(profiler)
+        end = time.monotonic()
+
+    # checking starts when the torrent enters the checking state and ends
+    # with the torrent_checked_alert
+    start_time = None
+    end_time = None
+    for line in open(events, errors="replace"):
+        if start_time is None and "%s: state changed to: checking" % name in line:
+            start_time = int(line.split(" ")[0][1:-1])
+        elif start_time is not None and ("] %s checked" % name) in line:
+            end_time = int(line.split(" ")[0][1:-1])
+            break
+    if start_time is None or end_time is None:
+        raise benchmark_error("could not find the checking time in %s" % events)
+
+    checking_time = (end_time - start_time) / 1000.0
+    return {
+        "wall_time": end - start,
+        "client_cpu_time": rusage_cpu(rusage),
+        "checking_time": checking_time,
+        "checking_rate": params.get("size", 1000) / max(checking_time, 0.001),
+    }
+
+
+@driver("scale")
+def run_scale(ctx: context, params: Params, run_dir: str) -> Metrics:
+    # runs session_scale.py, adding "torrents" synthetic torrents to a
+    # session of the python binding and measuring startup time, RSS per
+    # torrent, idle CPU, post_torrent_updates() latency and announce load
+    cmd = [
+        sys.executable,
+        os.path.join(tools_dir, "session_scale.py"),
+        "--torrents",
+        str(params.get("torrents", 1000)),
+        "--idle",
+        str(params.get("idle", 30)),
+        "--settle",
+        str(params.get("settle", 5)),
+        "--updates",
+        str(params.get("updates", 10)),
+        "--announce-interval",
+        str(params.get("announce_interval", 1800)),
+        "--disk-io",
+        params.get("disk_io", "disabled"),
+        "--settings",
+        json.dumps(params.get("settings", {})),
+        "--output",
+        os.path.join(run_dir, "scale.json"),
+    ]
+    if params.get("dht"):
+        cmd.append("--dht")
+    if params.get("paused"):
+        cmd.append("--paused")
+
+    with open(os.path.join(run_dir, "cmdline.txt"), "w+") as f:
+        print(" ".join(cmd), file=f)
+    if ctx.verbose:
+        print("  $ %s" % " ".join(cmd))
+    with open(os.path.join(run_dir, "client.out"), "w+") as out:
+        start = time.monotonic()
+        client = subprocess.Popen(
+            cmd,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=run_dir,
+            env=client_env(ctx, run_dir),
+        )
+        profiler = start_profiler(ctx, client, run_dir)
+        try:
+            rusage = wait_rusage(client, params.get("timeout", 3600))
+        except subprocess.TimeoutExpired:
+            rusage = stop(client)
+            raise benchmark_error(
+                "timed out, see %s" % os.path.join(run_dir, "client.out")
+            )
+        finally:
+            stop_profiler(profiler)
+        end = time.monotonic()
+
+    if client.returncode != 0 or not os.path.exists(
+        os.path.join(run_dir, "scale.json")
+    ):
+        raise benchmark_error(
+            "session_scale.py failed (%d), see %s"
+            % (client.returncode, os.path.join(run_dir, "client.out"))
+        )
+    with open(os.path.join(run_dir, "scale.json")) as f:
+        metrics: Metrics = json.load(f)
+    del metrics["torrents"]
+    metrics.update({"wall_time": end - start, "client_cpu_time": rusage_cpu(rusage)})
+    if rusage is not None:
+        metrics["peak_rss"] = rusage.ru_maxrss / 1024.0
+    return metrics
+
+
+@driver("dht_storage")
+def run_dht_storage(ctx: context, params: Params, run_dir: str) -> Metrics:
+    # runs dht_storage.py, storing "items" peers or BEP 44 items ("kind") in
+    # the DHT of a session of the python binding and measuring the memory
+    # and CPU per item, lookup latency and which entries are evicted
+    cmd = [
+        sys.executable,
+        os.path.join(tools_dir, "dht_storage.py"),
+        "--kind",
+        params.get("kind", "immutable"),
+        "--items",
+        str(params.get("items", 10000)),
+        "--peers-per-torrent",
+        str(params.get("peers_per_torrent", 10)),
+        "--item-size",
+        str(params.get("item_size", 64)),
+        "--nodes",
+        str(params.get("nodes", 1000)),
+        "--qps",
+        str(params.get("qps", 2000)),
+        "--lookups",
+        str(params.get("lookups", 1000)),
+        "--settings",
+        json.dumps(params.get("settings", {})),
+        "--output",
+        os.path.join(run_dir, "dht_storage.json"),
+    ]
+
+    with open(os.path.join(run_dir, "cmdline.txt"), "w+") as f:
+        print(" ".join(cmd), file=f)
+    if ctx.verbose:
+        print("  $ %s" % " ".join(cmd))
+    with open(os.path.join(run_dir, "client.out"), "w+") as out:
+        start = time.monotonic()
+        client = subprocess.Popen(
+            cmd,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=run_dir,
+            env=client_env(ctx, run_dir),
+        )
+        profiler = start_profiler(ctx, client, run_dir)
+        try:
+            rusage = wait_rusage(client, params.get("timeout", 3600))
+        except subprocess.TimeoutExpired:
+            rusage = stop(client)
+            raise benchmark_error(
+                "timed out, see %s" % os.path.join(run_dir, "client.out")
+            )
+        finally:
+            stop_profiler(profiler)
+        end = time.monotonic()
+
+    if client.returncode != 0 or not os.path.exists(
+        os.path.join(run_dir, "dht_storage.json")
+    ):
+        raise benchmark_error(
+            "dht_storage.py failed (%d), see %s"
+            % (client.returncode, os.path.join(run_dir, "client.out"))
+        )
+    with open(os.path.join(run_dir, "dht_storage.json")) as f:
+        metrics: Metrics = json.load(f)
+    del metrics["kind"]
+    del metrics["items"]
+    metrics.update({"wall_time": end - start})
+    if rusage is not None:
+        metrics["peak_rss"] = rusage.ru_maxrss / 1024.0
+    return metrics
+
+
+# libFuzzer's -print_final_stats=1 output, e.g.:
+# stat::number_of_executed_units: 100000
+fuzzer_stat = re.compile(r"^stat::(\w+):\s+(\d+)")
+# libFuzzer's status lines, e.g.:
+# #4096	pulse  cov: 1217 ft: 3307 corp: 201/27Kb lim: 4096 exec/s: 2048 rss: 42Mb
+fuzzer_status = re.compile(r"^#(\d+)\s+(\w+)\s+cov: (\d+) ft: (\d+)")
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    # the user and system CPU time of a running process, from /proc
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class fuzzer_log(threading.Thread):
+    # copies the output of a fuzzer to a file, noting the time, the number
+    # of runs and the fuzzer's CPU time when it's done loading the corpus
+    # (the "INITED" status line)
+
+    def __init__(self, proc: "subprocess.Popen[bytes]", path: str) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.proc = proc
+        self.path = path
+        self.stats: Dict[str, int] = {}
+        self.status: Optional[Match[str]] = None
+        self.inited: Optional[Tuple[float, int, Optional[float]]] = None
+
+    def run(self) -> None:
+        assert self.proc.stdout is not None
+        with open(self.path, "w+") as out:
+            for raw in self.proc.stdout:
+                line = raw.decode(errors="replace")
+                out.write(line)
+                m = fuzzer_stat.match(line)
+                if m is not None:
+                    self.stats[m.group(1)] = int(m.group(2))
+                m = fuzzer_status.match(line)
+                if m is None:
+                    continue
+                self.status = m
+                if m.group(2) == "INITED" and self.inited is None:
+                    self.inited = (
+                        time.monotonic(),
+                        int(m.group(1)),
+                        process_cpu_time(self.proc.pid),
+                    )
+
+
+@driver("fuzzer")
+def run_fuzzer(ctx: context, params: Params, run_dir: str) -> Metrics:
+    # runs the libFuzzer "target" (built with "b2 clang stage" in fuzzers/)
+    # over its corpus for a fixed number of inputs ("runs", counting the
+    # corpus itself) and a fixed seed, measuring the cost per input. New
+    # inputs go in the run directory, the corpus is left as it is.
+    # Replaying the corpus is measured separately (init_time), the rates are
+    # of the inputs run after that. Both depend on the corpus, compare flags
+    # results from different corpus sizes (corpus_files)
+    target = params["target"]
+    bin_dir = params.get("bin_dir", os.path.join(root_dir, "fuzzers", "fuzzers"))
+    corpus = os.path.join(
+        params.get("corpus", os.path.join(root_dir, "fuzzers", "corpus")), target
+    )
+    fuzzer = os.path.join(bin_dir, target)
+    if not os.path.exists(fuzzer):
+        raise benchmark_error(
+            'could not find "%s" (build the fuzzers with "b2 clang stage" in fuzzers/)'
+            % fuzzer
+        )
+    if not os.path.isdir(corpus):
+        raise benchmark_error('no corpus in "%s" (see fuzzers/README.rst)' % corpus)
+    corpus_files = len(
+        [f for f in os.listdir(corpus) if os.path.isfile(os.path.join(corpus, f))]
+    )
+    new_inputs = os.path.join(run_dir, "new-inputs")
+    os.makedirs(new_inputs)
+    cmd = [
+        fuzzer,
+        "-runs=%d" % params.get("runs", 100000),
+        "-seed=%d" % params.get("seed", 1),
+        "-timeout=%d" % params.get("input_timeout", 10),
+        "-print_final_stats=1",
+        "-artifact_prefix=%s/" % run_dir,
+        new_inputs,
+        corpus,
+    ]
+
+    with open(os.path.join(run_dir, "cmdline.txt"), "w+") as f:
+        print(" ".join(cmd), file=f)
+    if ctx.verbose:
+        print("  $ %s" % " ".join(cmd))
+    start = time.monotonic()
+    client = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+        cwd=run_dir,
+        env=client_env(ctx, run_dir),
+    )
+    log = fuzzer_log(client, os.path.join(run_dir, "client.out"))
+    log.start()
+    profiler = start_profiler(ctx, client, run_dir)
+    try:
+        rusage = wait_rusage(client, params.get("timeout", 3600))
+    except subprocess.TimeoutExpired:
+        rusage = stop(client)
+        raise benchmark_error("timed out, see %s" % os.path.join(run_dir, "client.out"))
+    finally:
+        stop_profiler(profiler)
+        log.join()
+    end = time.monotonic()
+
+    if (
+        client.returncode != 0
+        or "number_of_executed_units" not in log.stats
+        or log.inited is None
+    ):
+        raise benchmark_error(
+            "%s failed (%d), see %s"
+            % (target, client.returncode, os.path.join(run_dir, "client.out"))
+        )
+
+    inited, init_runs, init_cpu = log.inited
+    units = log.stats["number_of_executed_units"] - init_runs
+    if units <= 0:
+        raise benchmark_error(
+            '"runs" (%d) doesn\'t exceed the %d inputs of the corpus replay'
+            % (params.get("runs", 100000), init_runs)
+        )
+    metrics = {
+        "wall_time": end - start,
+        "init_time": inited - start,
+        "client_cpu_time": rusage_cpu(rusage),
+        "corpus_files": corpus_files,
+        "executed_units": units,
+        "execs_per_sec": units / max(end - inited, 0.001),
+        "new_inputs": len(os.listdir(new_inputs)),
+    }
+    if rusage is not None:
+        metrics["peak_rss"] = rusage.ru_maxrss / 1024.0
+        if init_cpu is not None:
+            metrics["us_per_exec"] = (rusage_cpu(rusage) - init_cpu) * 1000000.0 / units
+    if log.status is not None:
+        metrics.update(
+            {"cov": int(log.status.group(3)), "ft": int(log.status.group(4))}
+        )
+    return metrics
+
+
+def write_curves(
+    ctx: context,
+    scenario: Dict[str, Any],
+    points: List[Tuple[Params, Summary]],
+    out_dir: str,
+    revision: str,
+) -> None:
+    # plots the metrics against one parameter, with one line per
+    # combination of the other swept parameters. "plot" in the scenario is
+    # {"x": parameter, "metrics": [...], "logscale": true}
+    plot = scenario["plot"]
+    x = plot["x"]
+    sweep = dict((k, v) for k, v in scenario.get("sweep", {}).items() if k != x)
+    series: Dict[str, List[Tuple[Any, Summary]]] = {}
+    for params, summary in points:
+        xv = flatten(params).get(x)
+        if xv is None:
+            continue
+        series.setdefault(describe(params, sweep) or "default", []).append(
+            (xv, summary)
+        )
+    for s in series.values():
+        s.sort(key=lambda p: p[0])
+    measured = set(m for params, summary in points for m in summary)
+    metrics = [m for m in plot.get("metrics") or sorted(measured) if m in measured]
+
+    # the curves are kept apart from the results of the configurations
+    curves_dir = os.path.join(out_dir, "curves")
+    os.makedirs(curves_dir, exist_ok=True)
+    base = os.path.join(curves_dir, "curves")
+    with open(base + ".json", "w+") as f:
+        json.dump(
+            {
+                "scenario": scenario["name"],
+                "revision": revision,
+                "x": x,
+                "series": dict(
+                    (
+                        name,
+                        [
+                            dict(
+                                [(x, xv)]
+                                + [
+                                    (m, summary[m]["mean"])
+                                    for m in metrics
+                                    if m in summary
+                                ]
+                            )
+                            for xv, summary in s
+                        ],
+                    )
+                    for name, s in series.items()
+                ),
+            },
+            f,
+            indent=1,
+            sort_keys=True,
+        )
+        f.write("\n")
+
+    names = sorted(series)
+    for i, name in enumerate(names):
+        with open("%s.%d.tsv" % (base, i), "w+") as f:
+            print("# %s" % name, file=f)
+            for xv, summary in series[name]:
+                print(
+                    "\t".join(
+                        ["%s" % xv]
+                        + [
+                            "%f\t%f" % (summary[m]["mean"], summary[m]["ci95"][0])
+                            if m in summary
+                            else "-\t-"
+                            for m in metrics
+                        ]
+                    ),
+                    file=f,
+                )
+    for j, m in enumerate(metrics):
+        with open("%s_%s.gnuplot" % (base, m), "w+") as f:
+            print("set term png size 800,600", file=f)
+            print('set output "curves_%s.png"' % m, file=f)
+            print('set title "%s %s (%s)"' % (scenario["name"], m, revision), file=f)
+            print('set xlabel "%s"' % x, file=f)
+            print('set ylabel "%s"' % m, file=f)
+            print("set key left top box", file=f)
+            print('set datafile missing "-"', file=f)
+            if plot.get("logscale", True):
+                print("set logscale x", file=f)
+            # the error bars are the 95% confidence interval
+            print(
+                "plot "
+                + ", ".join(
+                    '"curves.%d.tsv" using 1:%d:($%d-$%d) with yerrorlines title "%s"'
+                    % (i, 2 + j * 2, 2 + j * 2, 3 + j * 2, name)
+                    for i, name in enumerate(names)
+                ),
+                file=f,
+            )
+        try:
+            subprocess.call(["gnuplot", "curves_%s.gnuplot" % m], cwd=curves_dir)
+        except OSError:
+            pass
+    print("\n[%s] curves: %s.json" % (scenario["name"], base))
+
+
+def post_process(ctx: context, run_dir: str) -> None:
+    events = os.path.join(run_dir, "events.log")
+    if ctx.session_stats and os.path.exists(events):
+        subprocess.call(
+            [sys.executable, os.path.join(tools_dir, "parse_session_stats.py"), events],
+            cwd=run_dir,
+            stdout=subprocess.DEVNULL,
+        )
+
+    for profile in ["perf.data", "py-spy.txt"]:
+        if os.path.exists(os.path.join(run_dir, profile)):
+            f = flamegraph.folder()
+            flamegraph.fold(os.path.join(run_dir, profile), f)
+            flamegraph.write_folded(f.stacks, os.path.join(run_dir, "profile.folded"))
+
+    if ctx.profile == "heap":
+        # attribute the heap at its peak. pprof folds the in-use bytes by
+        # call stack
+        heap = peak_heap_profile(run_dir)
+        pprof = shutil.which("google-pprof") or shutil.which("pprof")
+        if heap is None or pprof is None:
+            print("  no heap profile (is google-pprof installed?)")
+        else:
+            p = subprocess.Popen(
+                [
+                    pprof,
+                    "--collapsed",
+                    "--inuse_space",
+                    ctx.binary("client_test"),
+                    heap,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd=run_dir,
+                universal_newlines=True,
+                errors="replace",
+            )
+            assert p.stdout is not None
+            f = flamegraph.folder()
+            flamegraph.fold_folded(p.stdout, f)
+            p.wait()
+            flamegraph.write_folded(f.stacks, os.path.join(run_dir, "profile.folded"))
+
+    if ctx.profile == "gprof":
+        # client_test built with variant=profile writes gmon.out in its cwd
+        if not os.path.exists(os.path.join(run_dir, "gmon.out")):
+            print('  no gmon.out (was client_test built with "b2 profile"?)')
+            return
+        with open(os.path.join(run_dir, "gprof.out"), "w+") as out:
+            subprocess.call(
+                ["gprof", ctx.binary("client_test"), "gmon.out"],
+                stdout=out,
+                cwd=run_dir,
+            )
+        try:
+            dot = subprocess.Popen(
+                ["gprof2dot", "--strip", os.path.join(run_dir, "gprof.out")],
+                stdout=subprocess.PIPE,
+            )
+            subprocess.call(
+                ["dot", "-Tpng", "-o", os.path.join(run_dir, "cpu_profile.png")],
+                stdin=dot.stdout,
+            )
+            dot.wait()
+        except OSError:
+            print(
+                "please install gprof2dot and dot:\nsudo pip install gprof2dot\n"
+                "sudo apt install graphviz"
+            )
+
+
+def peak_heap_profile(run_dir: str) -> Optional[str]:
+    # returns the heap profile (written by tcmalloc) with the most memory in
+    # use. Its first line is:
+    #   heap profile:   <in-use objects>:  <in-use bytes> [ ...
+    peak: Optional[Tuple[int, str]] = None
+    for name in os.listdir(run_dir):
+        if not name.startswith("heap.") or not name.endswith(".heap"):
+            continue
+        with open(os.path.join(run_dir, name), errors="replace") as f:
+            m = re.match(r"heap profile:\s*\d+:\s*(\d+)", f.readline())
+        if m is not None and (peak is None or int(m.group(1)) > peak[0]):
+            peak = (int(m.group(1)), name)
+    return None if peak is None else peak[1]
+
+
+def attribute_memory(stacks: Dict[str, int]) -> Dict[str, int]:
+    # returns a dict of memory bucket -> bytes
+    patterns = [(name, re.compile(r)) for name, r in memory_buckets]
+    ret = dict((name, 0) for name, r in memory_buckets)
+    ret["other"] = 0
+    for stack, size in stacks.items():
+        bucket = "other"
+        for frame in reversed(stack.split(";")):
+            match = [name for name, r in patterns if r.search(frame)]
+            if match:
+                bucket = match[0]
+                break
+        ret[bucket] += size
+    return ret
+
+
+def memory_metrics(ctx: context, run_dir: str) -> Metrics:
+    # joins the RSS samples with the session counters logged at the same
+    # time into memory.tsv, and returns the memory metrics of the run (in
+    # MB, or kB per peer/torrent)
+    rss = []
+    if os.path.exists(os.path.join(run_dir, "rss.tsv")):
+        with open(os.path.join(run_dir, "rss.tsv")) as f:
+            rss = [
+                tuple(int(v) for v in line.split("\t")) for line in f if line.strip()
+            ]
+    stats = read_session_stats_timeline(os.path.join(run_dir, "events.log"))
+
+    metrics = {}
+    if rss:
+        metrics["mem_rss_peak"] = max(r for t, r in rss) / 1024.0
+        metrics["mem_rss_mean"] = sum(r for t, r in rss) / len(rss) / 1024.0
+
+    with open(os.path.join(run_dir, "memory.tsv"), "w+") as f:
+        print(
+            "#" + "\t".join(["time", "rss"] + [name for name, unit in memory_counters]),
+            file=f,
+        )
+        i = 0
+        for t, r in rss:
+            while i + 1 < len(stats) and stats[i + 1][0] <= t:
+                i += 1
+            counters = stats[i][1] if stats and stats[i][0] <= t else {}
+            print(
+                "\t".join(
+                    ["%d" % t, "%d" % r]
+                    + [
+                        "%d" % (counters.get(name, 0) * unit)
+                        for name, unit in memory_counters
+                    ]
+                ),
+                file=f,
+            )
+
+    if stats:
+
+        def peak(*names: str) -> int:
+            return max(sum(c.get(n, 0) for n in names) for t, c in stats)
+
+        metrics["mem_disk_buffers_peak"] = peak("disk.disk_blocks_in_use") * 16 / 1024.0
+        peers = peak("peer.num_peers_connected", "peer.num_peers_half_open")
+        torrents = peak(
+            "ses.num_checking_torrents",
+            "ses.num_downloading_torrents",
+            "ses.num_seeding_torrents",
+            "ses.num_stopped_torrents",
+        )
+        if rss and peers > 0:
+            metrics["mem_rss_per_peer"] = metrics["mem_rss_peak"] * 1024.0 / peers
+        if rss and torrents > 0:
+            metrics["mem_rss_per_torrent"] = metrics["mem_rss_peak"] * 1024.0 / torrents
+
+    if ctx.profile == "heap" and os.path.exists(
+        os.path.join(run_dir, "profile.folded")
+    ):
+        buckets = attribute_memory(
+            flamegraph.read_folded(os.path.join(run_dir, "profile.folded"))
+        )
+        for name, size in buckets.items():
+            metrics["mem_heap_%s" % name] = size / 1024.0 / 1024.0
+        metrics["mem_heap_total"] = sum(buckets.values()) / 1024.0 / 1024.0
+    return metrics
+
+
+def write_memory_report(base: str, title: str, summary: Summary, run_dir: str) -> None:
+    # the in-use heap per subsystem, and a plot of the memory timeline of
+    # the last run
+    buckets = sorted(
+        (
+            (s["mean"], m[len("mem_heap_") :])
+            for m, s in summary.items()
+            if m.startswith("mem_heap_") and m != "mem_heap_total"
+        ),
+        reverse=True,
+    )
+    with open(base + ".memory.txt", "w+") as f:
+        print("# %s" % title, file=f)
+        for m in [
+            "mem_rss_peak",
+            "mem_rss_mean",
+            "mem_disk_buffers_peak",
+            "mem_rss_per_peer",
+            "mem_rss_per_torrent",
+        ]:
+            if m in summary:
+                print(
+                    "%-24s %12.3f +- %.3f"
+                    % (
+                        m,
+                        summary[m]["mean"],
+                        summary[m]["mean"] - summary[m]["ci95"][0],
+                    ),
+                    file=f,
+                )
+        if buckets:
+            total = max(summary["mem_heap_total"]["mean"], 0.000001)
+            print("\n%-24s %12s %8s" % ("heap in use", "MB", "share"), file=f)
+            for size, name in buckets:
+                print(
+                    "%-24s %12.3f %7.1f%%" % (name, size, size * 100.0 / total), file=f
+                )
+
+    timeline = os.path.join(run_dir, "memory.tsv")
+    if not os.path.exists(timeline):
+        return
+    shutil.copy(timeline, base + ".memory.tsv")
+    with open(base + ".memory.gnuplot", "w+") as f:
+        print("set term png size 1200,600", file=f)
+        print('set output "%s.memory.png"' % os.path.basename(base), file=f)
+        print('set title "%s"' % title, file=f)
+        print('set xlabel "time (s)"', file=f)
+        print('set ylabel "MB"', file=f)
+        print('set y2label "count"', file=f)
+        print("set y2tics", file=f)
+        print("set key box", file=f)
+        print(
+            'plot "%s.memory.tsv" using ($1/1000):($2/1024) title "RSS" '
+            "with steps lw 2, "
+            '"" using ($1/1000):($3/1048576) title "disk buffers" with steps, '
+            '"" using ($1/1000):5 title "connected peers" with steps axes x1y2'
+            % os.path.basename(base),
+            file=f,
+        )
+    try:
+        subprocess.call(
+            ["gnuplot", os.path.basename(base) + ".memory.gnuplot"],
+            cwd=os.path.dirname(base),
+        )
+    except OSError:
+        pass
+
+
+def run_scenario(
+    ctx: context, scenario: Dict[str, Any], results_dir: str, revision: str
+) -> int:
+    name = scenario["name"]
+    run_driver = drivers[scenario.get("driver", name)]
+    warmup = scenario.get("warmup", 0)
+    repeat = scenario.get("repeat", 3)
+    sweep = scenario.get("sweep", {})
+    out_dir = os.path.join(results_dir, revision, name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    failed = 0
+    ranking = []
+    points = []
+    for params in expand_sweep(scenario):
+        key = config_key(params)
+        print("[%s] %s (%s)" % (name, describe(params, sweep) or "default", key))
+        runs = []
+        profile: Dict[str, int] = {}
+        for i in range(warmup + repeat):
+            run_dir = ctx.path("runs", name, key, "%d" % i)
+            if os.path.exists(run_dir):
+                shutil.rmtree(run_dir)
+            os.makedirs(run_dir)
+            label = "warmup" if i < warmup else "run %d/%d" % (i - warmup + 1, repeat)
+            try:
+                metrics = run_driver(ctx, params, run_dir)
+            except (benchmark_error, subprocess.CalledProcessError) as e:
+                print("  %s: FAILED: %s" % (label, e))
+                failed += 1
+                break
+            if i >= warmup:
+                post_process(ctx, run_dir)
+                if ctx.memory:
+                    metrics.update(memory_metrics(ctx, run_dir))
+            print(
+                "  %s: %s"
+                % (label, " ".join("%s=%.3f" % m for m in sorted(metrics.items())))
+            )
+            if i >= warmup:
+                runs.append(metrics)
+                if os.path.exists(os.path.join(run_dir, "profile.folded")):
+                    flamegraph.merge(
+                        flamegraph.read_folded(os.path.join(run_dir, "profile.folded")),
+                        profile,
+                    )
+
+        if not runs:
+            continue
+
+        summary = {}
+        for m in sorted(runs[0]):
+            summary[m] = summarize([r[m] for r in runs if m in r])
+        result = {
+            "scenario": name,
+            "driver": scenario.get("driver", name),
+            "revision": revision,
+            "key": key,
+            "params": params,
+            "date": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "host": platform.node(),
+            "warmup": warmup,
+            "runs": runs,
+            "summary": summary,
+            "better": dict((m, better(m)) for m in summary if better(m) is not None),
+        }
+        if profile:
+            base = os.path.join(out_dir, key)
+            flamegraph.write_folded(profile, base + ".folded")
+            flamegraph.write_svg(
+                profile,
+                base + ".svg",
+                title="%s %s (%s)" % (name, describe(params, sweep), revision),
+            )
+            with open(base + ".top.txt", "w+") as f:
+                flamegraph.write_top(profile, f)
+            result["profile"] = {
+                "samples": sum(profile.values()),
+                "flamegraph": key + ".svg",
+                "top": key + ".top.txt",
+            }
+            print("  profile: %s.svg" % base)
+        if ctx.memory:
+            write_memory_report(
+                os.path.join(out_dir, key),
+                "%s %s (%s)" % (name, describe(params, sweep) or "default", revision),
+                summary,
+                run_dir,
+            )
+            result["memory"] = {
+                "report": key + ".memory.txt",
+                "timeline": key + ".memory.tsv",
+            }
+            print("  memory: %s.memory.txt" % os.path.join(out_dir, key))
+        with open(os.path.join(out_dir, "%s.json" % key), "w+") as f:
+            json.dump(result, f, indent=1, sort_keys=True)
+            f.write("\n")
+        for m, s in sorted(summary.items()):
+            print(
+                "  %-20s %12.3f +- %.3f (95%% CI, n=%d)"
+                % (m, s["mean"], s["mean"] - s["ci95"][0], s["n"])
+            )
+        ranking.append((describe(params, sweep) or "default", summary))
+        points.append((params, summary))
+
+    # for matrix benchmarks, the scenario may name a metric to rank all
+    # configurations by
+    rank = scenario.get("rank")
+    if rank and len(ranking) > 1:
+        ranking = [r for r in ranking if rank in r[1]]
+        ranking.sort(
+            key=lambda r: r[1][rank]["mean"],
+            reverse=metric_direction.get(rank) == "higher",
+        )
+        print("\n[%s] configurations ranked by %s" % (name, rank))
+        for desc, summary in ranking:
+            print(
+                "  %12.3f +- %-8.3f %s"
+                % (
+                    summary[rank]["mean"],
+                    summary[rank]["mean"] - summary[rank]["ci95"][0],
+                    desc,
+                )
+            )
+
+    # scaling benchmarks may plot their metrics against a swept parameter
+    if scenario.get("plot") and points:
+        write_curves(ctx, scenario, points, out_dir, revision)
+    return failed
+
+
+def build(ctx: context, toolset: str, variant: str) -> None:
+    cmd = ["b2", variant, "stage_client_test", "stage_connection_tester"]
+    if toolset:
+        cmd.insert(1, toolset)
+    print("building: %s" % " ".join(cmd))
+    if subprocess.call(cmd, cwd=os.path.join(root_dir, "examples")) != 0:
+        raise benchmark_error("build failed")
+
+
+def load_results(results_dir: str, revision: str) -> Dict[Tuple[str, str], Any]:
+    # returns a dict of (scenario, key) -> result, for the given revision
+    # (either a directory or the name of a revision in results_dir)
+    path = revision if os.path.isdir(revision) else os.path.join(results_dir, revision)
+    if not os.path.isdir(path):
+        raise benchmark_error('no results for "%s"' % revision)
+    ret = {}
+    for directory, dirs, files in os.walk(path):
+        for f in files:
+            if not f.endswith(".json"):
+                continue
+            with open(os.path.join(directory, f)) as fp:
+                r = json.load(fp)
+            # other output next to the results (e.g. plotted curves) isn't
+            # keyed on a configuration
+            if not isinstance(r, dict) or "scenario" not in r or "key" not in r:
+                continue
+            ret[(r["scenario"], r["key"])] = r
+    return ret
+
+
+def compare(args: argparse.Namespace) -> int:
+    base = load_results(args.results_dir, args.base)
+    new = load_results(args.results_dir, args.new)
+    threshold = args.threshold / 100.0
+
+    # only show the parameters that differ between the configurations of a
+    # scenario
+    values: Dict[Tuple[str, str], Set[str]] = {}
+    for k in new:
+        for p, v in flatten(new[k]["params"]).items():
+            values.setdefault((k[0], p), set()).add(json.dumps(v))
+
+    regressions = 0
+    different_inputs = 0
+    print(
+        "%-12s %-30s %-16s %22s %22s %8s"
+        % ("scenario", "config", "metric", args.base, args.new, "change")
+    )
+    for k in sorted(set(base) & set(new)):
+        b = base[k]
+        n = new[k]
+        sweep_desc = (
+            " ".join(
+                "%s=%s" % (p.split(".")[-1], v)
+                for p, v in sorted(flatten(n["params"]).items())
+                if len(values[(k[0], p)]) > 1
+            )
+            or "default"
+        )
+        for m in input_metrics:
+            if m not in b["summary"] or m not in n["summary"]:
+                continue
+            bm = b["summary"][m]["mean"]
+            nm = n["summary"][m]["mean"]
+            if bm != nm:
+                different_inputs += 1
+                print(
+                    "%-12s %-30s %-16s %22.0f %22.0f %8s DIFFERENT INPUT"
+                    % (k[0], sweep_desc[:30], m, bm, nm, "")
+                )
+        for m in sorted(n["summary"]):
+            direction = n.get("better", {}).get(m)
+            if direction is None or m not in b["summary"]:
+                continue
+            if args.metric and not any(fnmatch.fnmatch(m, p) for p in args.metric):
+                continue
+            bm = b["summary"][m]["mean"]
+            nm = n["summary"][m]["mean"]
+            change = (nm - bm) / bm if bm != 0 else 0.0
+            worse = -change if direction == "higher" else change
+            status = ""
+            if worse > threshold:
+                status = "REGRESSION"
+                regressions += 1
+            elif -worse > threshold:
+                status = "improved"
+            print(
+                "%-12s %-30s %-16s %12.3f +- %-7.3f %12.3f +- %-7.3f %+7.1f%% %s"
+                % (
+                    k[0],
+                    sweep_desc[:30],
+                    m,
+                    bm,
+                    bm - b["summary"][m]["ci95"][0],
+                    nm,
+                    nm - n["summary"][m]["ci95"][0],
+                    change * 100.0,
+                    status,
+                )
+            )
+
+    if different_inputs:
+        print(
+            "%d configurations ran on different inputs, their metrics are not "
+            "comparable" % different_inputs
+        )
+    missing = set(base) - set(new)
+    if missing:
+        print(
+            "%d configurations in %s have no results in %s"
+            % (len(missing), args.base, args.new)
+        )
+    if regressions:
+        print(
+            "%d metrics regressed by more than %.1f%%" % (regressions, args.threshold)
+        )
+        return 1
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="libtorrent benchmark harness")
+    sub = parser.add_subparsers(dest="command")
+
+    r = sub.add_parser("run", help="run benchmark scenarios")
+    r.add_argument("scenarios", nargs="+", help="scenario files")
+    r.add_argument(
+        "--bin-dir",
+        default=os.path.join(root_dir, "examples"),
+        help="where client_test and connection_tester are (default: %(default)s)",
+    )
+    r.add_argument(
+        "--work-dir",
+        default="bench_work",
+        help="where to keep test torrents, data and run logs (default: %(default)s)",
+    )
+    r.add_argument(
+        "--results-dir",
+        default="bench_results",
+        help="where to store the results (default: %(default)s)",
+    )
+    r.add_argument(
+        "--revision",
+        default=None,
+        help="the revision to file the results under (default: the git revision)",
+    )
+    r.add_argument(
+        "--build",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="TOOLSET",
+        help="build and stage the binaries with b2 first",
+    )
+    r.add_argument(
+        "--variant",
+        default="release",
+        help="the b2 variant to build (default: %(default)s)",
+    )
+    r.add_argument(
+        "--profile",
+        choices=["gprof", "perf", "py-spy", "heap"],
+        default=None,
+        help="profile every measured run. gprof requires a profile build, "
+        "perf and py-spy sample the running client and produce flamegraphs, "
+        "heap attributes the heap in use at its peak to subsystems "
+        "(requires tcmalloc and pprof)",
+    )
+    r.add_argument(
+        "--call-graph",
+        default="fp",
+        choices=["fp", "dwarf", "lbr"],
+        help="how perf records call stacks. Use dwarf for builds without frame "
+        "pointers (default: %(default)s)",
+    )
+    r.add_argument(
+        "--sample-rate",
+        type=int,
+        default=999,
+        help="the sampling frequency of perf and py-spy, in Hz (default: %(default)s)",
+    )
+    r.add_argument(
+        "--memory",
+        action="store_true",
+        help="sample the memory use of the client and report it per subsystem",
+    )
+    r.add_argument(
+        "--memory-interval",
+        type=float,
+        default=0.5,
+        help="how often to sample the memory use, in seconds (default: %(default)s)",
+    )
+    r.add_argument(
+        "--session-stats",
+        action="store_true",
+        help="render the session stats of every measured run with "
+        "parse_session_stats.py",
+    )
+    r.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="set a (dotted) parameter, overriding the sweep over it "
+        "(may be given more than once)",
+    )
+    r.add_argument(
+        "--repeat", type=int, default=None, help="override the number of measured runs"
+    )
+    r.add_argument(
+        "--warmup", type=int, default=None, help="override the number of warmup runs"
+    )
+    r.add_argument(
+        "-v", "--verbose", action="store_true", help="print the commands being run"
+    )
+
+    c = sub.add_parser("compare", help="compare the results of two revisions")
+    c.add_argument("base", help="the baseline revision (or results directory)")
+    c.add_argument(
+        "new",
+        help="the revision (or results directory) to compare against the baseline",
+    )
+    c.add_argument(
+        "--results-dir",
+        default="bench_results",
+        help="where the results are stored (default: %(default)s)",
+    )
+    c.add_argument(
+        "--threshold",
+        type=float,
+        default=5.0,
+        help="fail if a metric regressed by more than this many percent "
+        "(default: %(default)s)",
+    )
+    c.add_argument(
+        "--metric",
+        action="append",
+        help='only compare metrics matching this pattern, e.g. "mem_*" '
+        "(may be given more than once)",
+    )
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "compare":
+            return compare(args)
+        if args.command != "run":
+            parser.print_help()
+            return 1
+
+        # tests with many peers need many file descriptors
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(
+                resource.RLIMIT_NOFILE,
+                (hard if hard != resource.RLIM_INFINITY else 8192, hard),
+            )
+        except (ValueError, OSError):
+            pass
+
+        ctx = context(args)
+        os.makedirs(ctx.work_dir, exist_ok=True)
+        if args.build is not None:
+            # gprof needs the binaries to be instrumented
+            build(
+                ctx, args.build, "profile" if args.profile == "gprof" else args.variant
+            )
+        revision = args.revision or git_revision()
+
+        failed = 0
+        for path in args.scenarios:
+            with open(path) as f:
+                scenario = json.load(f)
+            if args.repeat is not None:
+                scenario["repeat"] = args.repeat
+            if args.warmup is not None:
+                scenario["warmup"] = args.warmup
+            for assignment in args.set:
+                key, value = assignment.split("=", 1)
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+                scenario.get("sweep", {}).pop(key, None)
+                set_param(scenario.setdefault("params", {}), key, value)
+            ctx.memory = ctx.memory_flag or scenario.get("memory", False)
+            if scenario.get("driver", scenario["name"]) not in drivers:
+                raise benchmark_error(
+                    'unknown driver "%s" in %s' % (scenario.get("driver"), path)
+                )
+            failed += run_scenario(
+                ctx, scenario, os.path.abspath(args.results_dir), revision
+            )
+        return 1 if failed else 0
+    except benchmark_error as e:
+        print("ERROR: %s" % e)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
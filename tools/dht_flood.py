@@ -1,78 +1,534 @@
 #!/usr/bin/env python3
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
 
+"""DHT swarm simulator and load generator
+
+Runs thousands of virtual DHT nodes on loopback, each with its own socket and
+its own address in 127.0.0.0/8 (so a session's per-IP DoS blocker and routing
+table IP restrictions see them as distinct nodes), and uniformly random node
+IDs. The virtual nodes answer ping, find_node, get_peers, announce_peer, get,
+put and sample_infohashes, like a real swarm would, and flood a DHT node (a
+libtorrent session) with a configurable mix of queries at a configured rate.
+
+The report covers, per query type, the replies, errors and unanswered queries
+(dropped by the session's DHT rate limit or DoS blocker, or lost) and the
+reply latency, as well as the growth of the session's routing table: the
+virtual nodes it returns in its replies and the ones it queries itself.
+
+Mutable BEP 44 puts need ed25519 signatures, which require the
+``cryptography`` package. Without it, puts are immutable only.
+
+usage: dht_flood.py <port> [--qps <n>] [--nodes <n>] [options]
+
+--listen-only only runs the virtual nodes, for example as a swarm to bootstrap
+a session from (see --nodes-file).
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import random
+import resource
 import socket
+import struct
 import sys
-from types import StringType, IntType, LongType, DictType, ListType, TupleType
-import random
+import time
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from cryptography.hazmat.primitives import serialization
+except ImportError:
+    Ed25519PrivateKey = None
 
-port = int(sys.argv[1])
+# the most latency samples kept per query type
+MAX_SAMPLES = 100000
 
-# from BitTorrent 4.3.0
+# tokens are valid for this many seconds (at least)
+TOKEN_PERIOD = 300
 
+query_types = ['ping', 'find_node', 'get_peers', 'announce_peer', 'get', 'put', 'sample_infohashes']
 
-def encode_bencached(x, r):
-    r.append(x.bencoded)
 
+def bencode(x):
+    if isinstance(x, int):
+        return b'i%de' % x
+    if isinstance(x, str):
+        x = x.encode()
+    if isinstance(x, bytes):
+        return b'%d:%s' % (len(x), x)
+    if isinstance(x, (list, tuple)):
+        return b'l' + b''.join(bencode(e) for e in x) + b'e'
+    if isinstance(x, dict):
+        return b'd' + b''.join(bencode(k) + bencode(x[k]) for k in sorted(x)) + b'e'
+    raise TypeError('can\'t bencode %r' % type(x))
 
-def encode_int(x, r):
-    r.extend(('i', str(x), 'e'))
 
+def bdecode(buf):
+    def decode(i):
+        c = buf[i:i + 1]
+        if c == b'i':
+            end = buf.index(b'e', i)
+            return int(buf[i + 1:end]), end + 1
+        if c == b'l':
+            ret = []
+            i += 1
+            while buf[i:i + 1] != b'e':
+                v, i = decode(i)
+                ret.append(v)
+            return ret, i + 1
+        if c == b'd':
+            ret = {}
+            i += 1
+            while buf[i:i + 1] != b'e':
+                k, i = decode(i)
+                ret[k], i = decode(i)
+            return ret, i + 1
+        colon = buf.index(b':', i)
+        length = int(buf[i:colon])
+        if length < 0 or colon + 1 + length > len(buf):
+            raise ValueError('invalid string length')
+        return buf[colon + 1:colon + 1 + length], colon + 1 + length
 
-def encode_string(x, r):
-    r.extend((str(len(x)), ':', x))
+    try:
+        ret, i = decode(0)
+    except (IndexError, KeyError, TypeError) as e:
+        raise ValueError('invalid bencoding: %s' % e)
+    if i != len(buf):
+        raise ValueError('trailing data')
+    return ret
 
 
-def encode_list(x, r):
-    r.append('l')
-    for i in x:
-        encode_func[type(i)](i, r)
-    r.append('e')
+def node_address(i):
+    # every node gets its own /24, to not trip dht_restrict_routing_ips
+    return '127.%d.%d.1' % (1 + i // 250 % 250, 1 + i % 250)
 
 
-def encode_dict(x, r):
-    r.append('d')
-    ilist = sorted(x.items())
-    for k, v in ilist:
-        r.extend((str(len(k)), ':', k))
-        encode_func[type(v)](v, r)
-    r.append('e')
+def compact_endpoint(addr):
+    return socket.inet_aton(addr[0]) + struct.pack('>H', addr[1])
 
 
-encode_func = {}
-encode_func[IntType] = encode_int
-encode_func[LongType] = encode_int
-encode_func[StringType] = encode_string
-encode_func[ListType] = encode_list
-encode_func[TupleType] = encode_list
-encode_func[DictType] = encode_dict
+def reservoir_add(samples, value):
+    if len(samples) < MAX_SAMPLES:
+        samples.append(value)
+    else:
+        samples[random.randrange(MAX_SAMPLES)] = value
 
 
-def bencode(x):
-    r = []
-    encode_func[type(x)](x, r)
-    return ''.join(r)
+def percentile(samples, p):
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
 
 
-def send_dht_message(msg):
-    s.sendto(bencode(msg), 0, ('127.0.0.1', port))
+class query_stats(object):
 
+    def __init__(self):
+        self.sent = 0
+        self.replies = 0
+        self.errors = 0
+        # no reply within the timeout. Either the session's rate limiter (or
+        # DoS blocker) dropped it, or the packet was lost
+        self.unanswered = 0
+        self.latency = []
+
+    def to_dict(self):
+        latency = sorted(self.latency)
+        return {
+            'sent': self.sent,
+            'replies': self.replies,
+            'errors': self.errors,
+            'unanswered': self.unanswered,
+            'drop_rate': self.unanswered / self.sent if self.sent else 0,
+            'mean_latency': sum(latency) / len(latency) if latency else 0,
+            'p50_latency': percentile(latency, 0.5),
+            'p99_latency': percentile(latency, 0.99),
+        }
+
+
+class virtual_node(asyncio.DatagramProtocol):
+
+    def __init__(self, sim, node_id):
+        self.sim = sim
+        self.id = node_id
+        self.transport = None
+        self.addr = None
+        self.next_tid = random.randrange(0x10000)
+        # transaction ID -> future
+        self.pending = {}
+        # info-hash -> set of compact endpoints
+        self.peers = {}
+        # target -> BEP 44 item dict
+        self.items = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('sockname')
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = bdecode(data)
+            y = msg.get(b'y')
+            if y == b'q':
+                q = msg.get(b'q', b'').decode(errors='replace')
+                self.sim.session_queries[q] = self.sim.session_queries.get(q, 0) + 1
+                self.sim.queried_by_session.add(self.id)
+                self.reply(msg, addr)
+            elif y in (b'r', b'e'):
+                f = self.pending.pop(msg.get(b't'), None)
+                if f is not None and not f.done():
+                    f.set_result(msg)
+        except (ValueError, AttributeError, TypeError):
+            self.sim.invalid_messages += 1
+
+    def error_received(self, exc):
+        pass
+
+    async def query(self, addr, q, args, timeout):
+        tid = struct.pack('>H', self.next_tid)
+        self.next_tid = (self.next_tid + 1) & 0xffff
+        args[b'id'] = self.id
+        f = asyncio.get_running_loop().create_future()
+        self.pending[tid] = f
+        self.transport.sendto(bencode({b't': tid, b'y': b'q', b'q': q, b'a': args}), addr)
+        try:
+            return await asyncio.wait_for(f, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(tid, None)
+
+    def reply(self, msg, addr):
+        q = msg.get(b'q')
+        a = msg.get(b'a', {})
+        r = {b'id': self.id}
+        try:
+            if q == b'ping':
+                pass
+            elif q == b'find_node':
+                r[b'nodes'] = self.sim.compact_nodes(a[b'target'])
+            elif q == b'get_peers':
+                r[b'token'] = self.sim.token(addr)
+                peers = self.peers.get(a[b'info_hash'])
+                if peers:
+                    r[b'values'] = random.sample(sorted(peers), min(len(peers), 50))
+                else:
+                    r[b'nodes'] = self.sim.compact_nodes(a[b'info_hash'])
+            elif q == b'announce_peer':
+                if not self.sim.valid_token(a[b'token'], addr):
+                    return self.error(msg, addr, 203, b'invalid token')
+                port = addr[1] if a.get(b'implied_port') else a[b'port']
+                self.peers.setdefault(a[b'info_hash'], set()).add(compact_endpoint((addr[0], port)))
+            elif q == b'get':
+                r[b'token'] = self.sim.token(addr)
+                r[b'nodes'] = self.sim.compact_nodes(a[b'target'])
+                item = self.items.get(a[b'target'])
+                if item is not None and a.get(b'seq', -1) < item.get(b'seq', 0):
+                    r.update(item)
+            elif q == b'put':
+                if not self.sim.valid_token(a[b'token'], addr):
+                    return self.error(msg, addr, 203, b'invalid token')
+                # signatures aren't verified, the virtual nodes trust the
+                # session
+                if b'k' in a:
+                    target = hashlib.sha1(a[b'k'] + a.get(b'salt', b'')).digest()
+                    self.items[target] = {k: a[k] for k in (b'v', b'k', b'sig', b'seq') if k in a}
+                else:
+                    self.items[hashlib.sha1(bencode(a[b'v'])).digest()] = {b'v': a[b'v']}
+            elif q == b'sample_infohashes':
+                samples = list(self.peers)[:20]
+                r[b'interval'] = 21600
+                r[b'num'] = len(self.peers)
+                r[b'samples'] = b''.join(samples)
+                r[b'nodes'] = self.sim.compact_nodes(a[b'target'])
+            else:
+                return self.error(msg, addr, 204, b'method unknown')
+        except (KeyError, TypeError):
+            return self.error(msg, addr, 203, b'protocol error')
+        r[b'ip'] = compact_endpoint(addr)
+        self.transport.sendto(bencode({b't': msg.get(b't', b''), b'y': b'r', b'r': r}), addr)
+
+    def error(self, msg, addr, code, text):
+        self.transport.sendto(bencode({b't': msg.get(b't', b''), b'y': b'e', b'e': [code, text]}), addr)
+
+
+class simulator(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.nodes = []
+        # the node IDs as integers, sorted, and the nodes in the same order
+        self.sorted_ids = []
+        self.sorted_nodes = []
+        self.by_id = {}
+        self.secret = os.urandom(16)
+        self.stats = {q: query_stats() for q in query_types}
+        self.session_queries = {q: 0 for q in query_types}
+        self.invalid_messages = 0
+        # the virtual nodes the session has returned in replies, i.e. that
+        # are in its routing table
+        self.known_by_session = set()
+        # the virtual nodes the session has sent queries to
+        self.queried_by_session = set()
+        self.growth = []
+        self.start = time.monotonic()
+        self.info_hashes = [os.urandom(20) for _ in range(args.info_hashes)]
+        self.items = []
+        self.signing_key = None
+        if args.mutable > 0 and Ed25519PrivateKey is not None:
+            self.signing_key = Ed25519PrivateKey.generate()
+            self.public_key = self.signing_key.public_key().public_bytes(
+                serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        self.seq = 0
+
+    async def start_nodes(self, count):
+        loop = asyncio.get_running_loop()
+        for i in range(count):
+            node_id = os.urandom(20)
+            _, node = await loop.create_datagram_endpoint(
+                lambda: virtual_node(self, node_id), local_addr=(node_address(i), 0))
+            self.nodes.append(node)
+            self.by_id[node_id] = node
+        order = sorted(self.nodes, key=lambda n: n.id)
+        self.sorted_nodes = order
+        self.sorted_ids = [n.id for n in order]
+
+    def closest(self, target, count=8):
+        # nodes sharing a long prefix with the target are adjacent to it in
+        # sorted order, so the XOR-closest nodes are among its neighbours
+        i = bisect.bisect_left(self.sorted_ids, target)
+        candidates = self.sorted_nodes[max(0, i - count * 2):i + count * 2]
+        t = int.from_bytes(target, 'big')
+        candidates.sort(key=lambda n: int.from_bytes(n.id, 'big') ^ t)
+        return candidates[:count]
+
+    def compact_nodes(self, target):
+        return b''.join(n.id + compact_endpoint(n.addr) for n in self.closest(target))
+
+    def token(self, addr, period=None):
+        if period is None:
+            period = int(time.monotonic()) // TOKEN_PERIOD
+        return hashlib.sha1(self.secret + addr[0].encode() + b'%d' % period).digest()[:4]
+
+    def valid_token(self, token, addr):
+        period = int(time.monotonic()) // TOKEN_PERIOD
+        return token in (self.token(addr, period), self.token(addr, period - 1))
+
+    def observe(self, reply):
+        r = reply.get(b'r', {})
+        nodes = r.get(b'nodes', b'')
+        for i in range(0, len(nodes) - 25, 26):
+            if nodes[i:i + 20] in self.by_id:
+                self.known_by_session.add(nodes[i:i + 20])
+
+    async def timed_query(self, node, kind, args):
+        st = self.stats[kind]
+        st.sent += 1
+        start = time.monotonic()
+        reply = await node.query(self.target, kind.encode(), args, self.args.timeout)
+        if reply is None:
+            st.unanswered += 1
+            return None
+        reservoir_add(st.latency, time.monotonic() - start)
+        if reply.get(b'y') == b'e':
+            st.errors += 1
+            return None
+        st.replies += 1
+        self.observe(reply)
+        return reply.get(b'r', {})
+
+    def mutable_item(self, salt=None):
+        self.seq += 1
+        if salt is None:
+            salt = b'%d' % random.randrange(self.args.items)
+        v = os.urandom(self.args.item_size)
+        signed = b'4:salt%d:%s3:seqi%de1:v%s' % (len(salt), salt, self.seq, bencode(v))
+        sig = self.signing_key.sign(signed)
+        target = hashlib.sha1(self.public_key + salt).digest()
+        return target, {b'v': v, b'k': self.public_key, b'salt': salt, b'seq': self.seq, b'sig': sig}
+
+    async def run_query(self, kind):
+        node = random.choice(self.nodes)
+        if kind == 'ping':
+            await self.timed_query(node, kind, {})
+        elif kind in ('find_node', 'sample_infohashes'):
+            await self.timed_query(node, kind, {b'target': os.urandom(20)})
+        elif kind == 'get_peers':
+            await self.timed_query(node, kind, {b'info_hash': random.choice(self.info_hashes)})
+        elif kind == 'announce_peer':
+            info_hash = random.choice(self.info_hashes)
+            r = await self.timed_query(node, 'get_peers', {b'info_hash': info_hash})
+            if r and b'token' in r:
+                await self.timed_query(node, kind, {b'info_hash': info_hash, b'port': node.addr[1],
+                                                    b'token': r[b'token']})
+        elif kind == 'get':
+            target = random.choice(self.items) if self.items else os.urandom(20)
+            await self.timed_query(node, kind, {b'target': target})
+        elif kind == 'put':
+            if self.signing_key is not None and random.random() < self.args.mutable:
+                target, args = self.mutable_item()
+            else:
+                args = {b'v': os.urandom(self.args.item_size)}
+                target = hashlib.sha1(bencode(args[b'v'])).digest()
+            r = await self.timed_query(node, 'get', {b'target': target})
+            if r and b'token' in r:
+                args[b'token'] = r[b'token']
+                if await self.timed_query(node, kind, args) is not None:
+                    if len(self.items) < self.args.items:
+                        self.items.append(target)
+                    else:
+                        self.items[random.randrange(len(self.items))] = target
+
+    async def flood(self, target, mix, qps, duration):
+        self.target = target
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        tasks = set()
+        start = time.monotonic()
+        issued = 0
+        while duration <= 0 or time.monotonic() - start < duration:
+            # issue queries to catch up with the target rate
+            due = int((time.monotonic() - start) * qps) - issued
+            for kind in random.choices(kinds, weights, k=max(0, due)):
+                t = asyncio.ensure_future(self.run_query(kind))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+            issued += max(0, due)
+            await asyncio.sleep(0.01)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def sample_growth(self):
+        self.growth.append({
+            'time': time.monotonic() - self.start,
+            'known_by_session': len(self.known_by_session),
+            'queried_by_session': len(self.queried_by_session),
+        })
+
+    async def report(self, interval):
+        last = {q: 0 for q in query_types}
+        while True:
+            await asyncio.sleep(interval)
+            self.sample_growth()
+            sent = {q: self.stats[q].sent for q in query_types}
+            print('%.0f queries/s, %d unanswered, routing table: %d nodes returned, %d nodes queried' % (
+                sum(sent[q] - last[q] for q in query_types) / interval,
+                sum(s.unanswered for s in self.stats.values()),
+                len(self.known_by_session), len(self.queried_by_session)))
+            sys.stdout.flush()
+            last = sent
+
+    def to_dict(self):
+        return {
+            'nodes': len(self.nodes),
+            'elapsed': time.monotonic() - self.start,
+            'queries': {q: s.to_dict() for q, s in self.stats.items() if s.sent},
+            'session_queries': {q: n for q, n in self.session_queries.items() if n},
+            'invalid_messages': self.invalid_messages,
+            'routing_table_growth': self.growth,
+        }
+
+
+def parse_mix(s):
+    mix = {}
+    for entry in s.split(','):
+        name, _, weight = entry.partition('=')
+        if name not in query_types:
+            raise argparse.ArgumentTypeError('unknown query type "%s"' % name)
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(d):
+    print('\n%-18s %8s %8s %7s %10s %9s %9s %9s' % (
+        'query', 'sent', 'replies', 'errors', 'unanswered', 'mean ms', 'p50 ms', 'p99 ms'))
+    for q, s in d['queries'].items():
+        print('%-18s %8d %8d %7d %10d %9.2f %9.2f %9.2f' % (
+            q, s['sent'], s['replies'], s['errors'], s['unanswered'], s['mean_latency'] * 1000,
+            s['p50_latency'] * 1000, s['p99_latency'] * 1000))
+    if d['routing_table_growth']:
+        g = d['routing_table_growth'][-1]
+        print('\nrouting table: %d virtual nodes returned by the session, %d queried by it' % (
+            g['known_by_session'], g['queried_by_session']))
+    print('queries from the session: %s' % d['session_queries'])
+
+
+async def run(args):
+    sim = simulator(args)
+    await sim.start_nodes(args.nodes)
+    print('started %d virtual nodes' % len(sim.nodes))
+    if args.nodes_file:
+        with open(args.nodes_file, 'w+') as f:
+            f.write(','.join('%s:%d' % n.addr for n in sim.nodes) + '\n')
+
+    if args.listen_only:
+        reporter = asyncio.ensure_future(sim.report(args.stats_interval or 10))
+        try:
+            await asyncio.sleep(args.duration if args.duration > 0 else 1e9)
+        finally:
+            reporter.cancel()
+    else:
+        reporter = asyncio.ensure_future(sim.report(args.stats_interval or 1))
+        await sim.flood((args.host, args.port), args.mix, args.qps, args.duration)
+        reporter.cancel()
+    sim.sample_growth()
+
+    d = sim.to_dict()
+    print_report(d)
+    if args.out:
+        with open(args.out, 'w+') as f:
+            json.dump(d, f, indent=1)
+    return d
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, needed), hard))
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description='DHT swarm simulator and load generator')
+    parser.add_argument('port', type=int, help='the DHT port of the session to flood')
+    parser.add_argument('--host', default='127.0.0.1', help='the address of the session (default: %(default)s)')
+    parser.add_argument('--nodes', type=int, default=1000, help='the number of virtual nodes (default: %(default)s)')
+    parser.add_argument('--qps', type=float, default=1000, help='queries per second (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to run for, 0 to run until interrupted (default: %(default)s)')
+    parser.add_argument('--mix', type=parse_mix,
+                        default=parse_mix('get_peers=4,find_node=2,announce_peer=1,get=1,put=1,sample_infohashes=1'),
+                        help='the relative weights of the query types, e.g. '
+                        'get_peers=4,announce_peer=1 (default: all, favoring get_peers)')
+    parser.add_argument('--timeout', type=float, default=5, help='seconds to wait for a reply (default: %(default)s)')
+    parser.add_argument('--info-hashes', type=int, default=1000,
+                        help='the number of distinct info-hashes to look up and announce (default: %(default)s)')
+    parser.add_argument('--items', type=int, default=1000,
+                        help='the number of distinct BEP 44 items to put and get (default: %(default)s)')
+    parser.add_argument('--item-size', type=int, default=64, help='the size of BEP 44 values (default: %(default)s)')
+    parser.add_argument('--mutable', type=float, default=0.5,
+                        help='the fraction of puts that are mutable items (default: %(default)s)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='print progress every this many seconds (default: 1)')
+    parser.add_argument('--listen-only', action='store_true', help='only run the virtual nodes, don\'t flood')
+    parser.add_argument('--nodes-file', help='write the virtual nodes\' endpoints, comma separated, to this file')
+    parser.add_argument('--out', help='write the report as JSON to this file')
+    return parser
 
-def random_key():
-    ret = ''
-    for i in range(0, 20):
-        ret += chr(random.randint(0, 255))
-    return ret
 
+def main():
+    args = argument_parser().parse_args()
+    if args.mutable > 0 and Ed25519PrivateKey is None:
+        print('the cryptography package is not available, only immutable items will be put')
+    raise_fd_limit(args.nodes + 64)
 
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-node_id = '1' * 20
-query = 'get_peers'
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
 
-print('test random info-hashes')
-for i in range(1, 30000):
-    send_dht_message({'a': {'id': node_id, 'info_hash': random_key()}, 'q': query, 'y': 'q', 't': '%d' % i})
 
-print('test random peer-ids')
-for i in range(1, 30000):
-    send_dht_message({'a': {'id': random_key(), 'info_hash': random_key()}, 'q': query, 'y': 'q', 't': '%d' % i})
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# this script measures the capacity of a session's DHT storage. It stores
+# --items peers (announce_peer), immutable or mutable items (BEP 44 put) in
+# the DHT node of a session of the python binding, over its UDP socket on
+# loopback, from the virtual nodes of dht_flood.py, and measures:
+#
+#   insert_rate           stores per second acknowledged by the session
+#   insert_unanswered     the fraction of stores the session didn't reply to
+#   stored                the peers or items held by the session afterwards
+#                         (dht.dht_peers, dht_immutable_data or
+#                         dht_mutable_data)
+#   rss_per_item          kB of RSS per stored peer or item
+#   cpu_per_query         microseconds of session CPU time per DHT message
+#   lookup_latency        median seconds for a get_peers or get of a stored
+#                         key
+#   lookup_p99_latency    99th percentile of the same
+#   retained              the fraction of a random sample of the stored keys
+#                         that are still found
+#   retained_oldest       the same, for the first 10% of keys stored
+#   retained_newest       the same, for the last 10% of keys stored
+#
+# once the dht_max_torrents, dht_max_dht_items or dht_max_peers limits (set
+# with --settings) are exceeded, the retained fractions show which entries
+# the storage evicts.
+#
+# the virtual nodes run in a separate process, so they don't count towards
+# the session's CPU time. Mutable items need the cryptography package (see
+# dht_flood.py). The results are printed (or written to --output) as JSON.
+# This is what the "dht_storage" driver of benchmark.py runs, see
+# tools/benchmarks/dht_storage.json
+#
+# usage: dht_storage.py [options] --kind immutable --items 10000
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+import dht_flood
+import libtorrent as lt
+
+# the counter holding the number of stored entries, for every kind
+stored_counter = {
+    "peers": "dht.dht_peers",
+    "immutable": "dht.dht_immutable_data",
+    "mutable": "dht.dht_mutable_data",
+}
+
+T = TypeVar("T")
+
+
+def rss() -> int:
+    # in kiB
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_time() -> float:
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+
+def free_port() -> int:
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    port: int = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class store_driver(object):
+    # stores and looks up entries of one kind through a dht_flood simulator
+
+    def __init__(
+        self, sim: dht_flood.simulator, kind: str, peers_per_torrent: int
+    ) -> None:
+        self.sim = sim
+        self.kind = kind
+        self.peers_per_torrent = peers_per_torrent
+        # the lookup key of every entry stored, in order
+        self.keys: List[bytes] = []
+
+    def node(self, i: int) -> dht_flood.virtual_node:
+        # consecutive peers of a torrent are announced by different nodes,
+        # so they're stored as distinct peers
+        node: dht_flood.virtual_node = self.sim.nodes[i % len(self.sim.nodes)]
+        return node
+
+    async def store(self, i: int) -> bool:
+        node = self.node(i)
+        if self.kind == "peers":
+            info_hash = hashlib.sha1(
+                b"torrent-%d" % (i // self.peers_per_torrent)
+            ).digest()
+            r = await self.sim.timed_query(node, "get_peers", {b"info_hash": info_hash})
+            if not r or b"token" not in r:
+                return False
+            key = info_hash
+            args: Dict[bytes, Any] = {
+                b"info_hash": info_hash,
+                b"port": node.addr[1],
+                b"token": r[b"token"],
+            }
+            query = "announce_peer"
+        else:
+            if self.kind == "mutable":
+                key, args = self.sim.mutable_item(salt=b"%d" % i)
+            else:
+                args = {b"v": b"%d:" % i + os.urandom(self.sim.args.item_size)}
+                key = hashlib.sha1(dht_flood.bencode(args[b"v"])).digest()
+            r = await self.sim.timed_query(node, "get", {b"target": key})
+            if not r or b"token" not in r:
+                return False
+            args[b"token"] = r[b"token"]
+            query = "put"
+        if i % self.peers_per_torrent == 0 or self.kind != "peers":
+            self.keys.append(key)
+        return await self.sim.timed_query(node, query, args) is not None
+
+    async def found(self, key: bytes) -> Tuple[bool, Optional[float]]:
+        node = random.choice(self.sim.nodes)
+        start = time.monotonic()
+        if self.kind == "peers":
+            r = await self.sim.timed_query(node, "get_peers", {b"info_hash": key})
+            hit = bool(r and r.get(b"values"))
+        else:
+            r = await self.sim.timed_query(node, "get", {b"target": key})
+            hit = bool(r and b"v" in r)
+        return hit, time.monotonic() - start if r is not None else None
+
+
+async def paced(make: Callable[[int], Awaitable[T]], count: int, qps: float) -> List[T]:
+    # runs make(i) for i in range(count), starting qps of them per second.
+    # Returns their results, in order
+    tasks: List["asyncio.Future[T]"] = []
+    start = time.monotonic()
+    while len(tasks) < count:
+        due = min(count, int((time.monotonic() - start) * qps) + 1)
+        while len(tasks) < due:
+            tasks.append(asyncio.ensure_future(make(len(tasks))))
+        await asyncio.sleep(0.01)
+    return list(await asyncio.gather(*tasks))
+
+
+async def serve_swarm(
+    conn: multiprocessing.connection.Connection, args: argparse.Namespace, port: int
+) -> None:
+    flood_args = dht_flood.argument_parser().parse_args(
+        [
+            str(port),
+            "--nodes",
+            str(args.nodes),
+            "--timeout",
+            str(args.query_timeout),
+            "--item-size",
+            str(args.item_size),
+            "--mutable",
+            "1" if args.kind == "mutable" else "0",
+        ]
+    )
+    sim = dht_flood.simulator(flood_args)
+    sim.target = ("127.0.0.1", port)
+    await sim.start_nodes(args.nodes)
+    driver = store_driver(sim, args.kind, args.peers_per_torrent)
+    loop = asyncio.get_running_loop()
+    conn.send("ready")
+    while True:
+        cmd = await loop.run_in_executor(None, conn.recv)
+        if cmd == "store":
+            start = time.monotonic()
+            ok = await paced(driver.store, args.items, args.qps)
+            conn.send(
+                {"time": time.monotonic() - start, "stored": sum(ok), "sent": len(ok)}
+            )
+        elif cmd == "lookup":
+            keys = driver.keys
+            tenth = max(1, len(keys) // 10)
+            samples = {
+                "retained": random.sample(keys, min(len(keys), args.lookups)),
+                "retained_oldest": random.sample(
+                    keys[:tenth], min(tenth, args.lookups)
+                ),
+                "retained_newest": random.sample(
+                    keys[-tenth:], min(tenth, args.lookups)
+                ),
+            }
+            ret: Dict[str, float] = {}
+            latencies: List[float] = []
+            for name, sample in samples.items():
+                results = await paced(
+                    lambda i: driver.found(sample[i]), len(sample), args.qps
+                )
+                ret[name] = sum(1 for hit, _ in results if hit) / float(
+                    max(1, len(results))
+                )
+                latencies += [lat for _, lat in results if lat is not None]
+            latencies.sort()
+            ret["lookup_latency"] = dht_flood.percentile(latencies, 0.5)
+            ret["lookup_p99_latency"] = dht_flood.percentile(latencies, 0.99)
+            conn.send(ret)
+        else:
+            return
+
+
+def run_swarm(
+    conn: multiprocessing.connection.Connection, args: argparse.Namespace, port: int
+) -> None:
+    dht_flood.raise_fd_limit(args.nodes + 64)
+    asyncio.run(serve_swarm(conn, args, port))
+
+
+def session_stats(ses: Any, timeout: float) -> Dict[str, int]:
+    ses.post_session_stats()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ses.wait_for_alert(500)
+        for a in ses.pop_alerts():
+            if isinstance(a, lt.session_stats_alert):
+                values: Dict[str, int] = a.values
+                return values
+    raise RuntimeError("timed out waiting for session_stats_alert")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="measure the capacity of the DHT storage"
+    )
+    parser.add_argument(
+        "--kind",
+        choices=sorted(stored_counter),
+        default="immutable",
+        help="what to store (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--items",
+        type=int,
+        default=10000,
+        help="the number of peers or items to store (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--peers-per-torrent",
+        type=int,
+        default=10,
+        help="with --kind peers, the number of peers announced per info-hash "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--item-size",
+        type=int,
+        default=64,
+        help="the size of BEP 44 values (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--nodes",
+        type=int,
+        default=1000,
+        help="the number of virtual nodes storing (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--qps",
+        type=float,
+        default=2000,
+        help="stores and lookups per second (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--lookups",
+        type=int,
+        default=1000,
+        help="the number of keys to look up per sample (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--query-timeout", type=float, default=5, help="seconds to wait for a reply"
+    )
+    parser.add_argument(
+        "--settings",
+        default="{}",
+        help="additional settings, as a JSON object (e.g. dht_max_dht_items)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="fail after this many seconds per step",
+    )
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.kind == "mutable" and dht_flood.Ed25519PrivateKey is None:
+        print("--kind mutable requires the cryptography package")
+        return 1
+
+    port = free_port()
+    settings: Dict[str, Any] = {
+        "alert_mask": lt.alert.category_t.status_notification
+        | lt.alert.category_t.error_notification,
+        "enable_dht": True,
+        "enable_lsd": False,
+        "enable_natpmp": False,
+        "enable_upnp": False,
+        "listen_interfaces": "127.0.0.1:%d" % port,
+        "dht_bootstrap_nodes": "",
+        "dht_restrict_routing_ips": False,
+        "dht_restrict_search_ips": False,
+        # this measures the storage, not the rate limits
+        "dht_upload_rate_limit": 100 * 1024 * 1024,
+        "dht_block_ratelimit": 10000,
+    }
+    settings.update(json.loads(args.settings))
+    ses = lt.session(settings, disk_io="disabled")
+    ses.pop_alerts()
+
+    conn, child_conn = multiprocessing.Pipe()
+    swarm = multiprocessing.Process(
+        target=run_swarm, daemon=True, args=(child_conn, args, port)
+    )
+    swarm.start()
+    if not conn.poll(60) or conn.recv() != "ready":
+        raise RuntimeError("the virtual nodes failed to start")
+
+    results: Dict[str, Any] = {"kind": args.kind, "items": args.items}
+    before = session_stats(ses, args.timeout)
+    rss_before = rss()
+    cpu_before = cpu_time()
+    conn.send("store")
+    if not conn.poll(args.timeout):
+        raise RuntimeError("timed out storing")
+    r = conn.recv()
+    cpu = cpu_time() - cpu_before
+    after = session_stats(ses, args.timeout)
+
+    messages = after.get("dht.dht_messages_in", 0) - before.get(
+        "dht.dht_messages_in", 0
+    )
+    stored = after.get(stored_counter[args.kind], 0)
+    results["insert_time"] = r["time"]
+    results["insert_rate"] = r["stored"] / max(r["time"], 0.001)
+    results["insert_unanswered"] = 1.0 - r["stored"] / float(max(1, r["sent"]))
+    results["stored"] = stored
+    results["dht_torrents"] = after.get("dht.dht_torrents", 0)
+    results["rss"] = rss()
+    results["rss_per_item"] = (results["rss"] - rss_before) / float(max(1, stored))
+    results["cpu_per_query"] = cpu * 1000000.0 / max(1, messages)
+    results["messages_in_dropped"] = after.get(
+        "dht.dht_messages_in_dropped", 0
+    ) - before.get("dht.dht_messages_in_dropped", 0)
+
+    conn.send("lookup")
+    if not conn.poll(args.timeout):
+        raise RuntimeError("timed out looking up")
+    results.update(conn.recv())
+    conn.send("quit")
+    swarm.join(10)
+    del ses
+
+    out = json.dumps(results, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w+") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
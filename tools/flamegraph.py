@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# this script turns CPU profiles into folded stacks, interactive flamegraphs
+# and top-functions tables. Profiles are either recorded with
+# "perf record -g" (pass the perf.data file or the output of "perf script")
+# or with "py-spy record --format raw" (which already is folded).
+#
+# folded stacks are one line per unique stack, root first, separated by ';'
+# followed by the number of samples:
+#
+#   client_test;main;libtorrent::session_impl::on_tick;... 12
+#
+# C++ function names are simplified by default: the argument lists are
+# removed and template arguments are collapsed to <>, so profiles of
+# different builds are comparable. Call stacks are cut at common leaf
+# functions (allocation, locking, logging), which are folded into the frame
+# calling them.
+#
+# the top-functions table lists the self and total (inclusive) share of
+# samples of every function, and of the libtorrent components we look at the
+# most (the piece picker, the bittorrent peer connection and the disk
+# threads). Tables are sorted and formatted to be diffable, use the diff
+# command to compare two of them.
+#
+# usage: flamegraph.py fold <perf.data|perf-script.txt|py-spy.txt> [-o out.folded]
+#        flamegraph.py svg <in.folded> [-o out.svg] [--title title]
+#        flamegraph.py top <in.folded> [-n 50]
+#        flamegraph.py diff <base.folded|base.top> <new.folded|new.top>
+
+import argparse
+import html
+import os
+import re
+import subprocess
+import sys
+from typing import Dict
+from typing import IO
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+import zlib
+
+# folded stack -> number of samples
+Stacks = Dict[str, int]
+
+# call stacks are cut below frames matching these
+default_folds = [
+    r"^(malloc|free|calloc|realloc|operator new|operator delete)",
+    r"^(__)?pthread_(mutex|cond|spin|rwlock)_",
+    r"^(__)?(v?s?n?printf|puts|fflush|fwrite)",
+    r"^std::(__)?mutex::",
+    r"^std::condition_variable::",
+    r"^libtorrent::aux::session_impl::session_log",
+    r"SHA1_Update|SHA256_Update|sha1_block|sha256_block",
+    r"^(__)?(sendmsg|recvmsg|sendto|recvfrom|epoll_wait|poll|read|write|pread64"
+    r"|pwrite64|futex)",
+    r"^BN_mod_exp",
+]
+
+# components reported separately in the top-functions table. The share of
+# a component is the fraction of samples with any frame matching it
+components = [
+    ("piece_picker", r"libtorrent::(aux::)?piece_picker::"),
+    ("bt_peer_connection", r"libtorrent::(aux::)?bt_peer_connection::"),
+    ("peer_connection", r"libtorrent::(aux::)?peer_connection::"),
+    (
+        "disk threads",
+        r"libtorrent::(aux::)?(mmap_disk_io|posix_disk_io|disk_io_thread_pool"
+        r"|disk_job_pool|disk_buffer_pool|mmap_storage|posix_storage|file_view_pool"
+        r"|disk_job)",
+    ),
+    ("hashing", r"libtorrent::hasher|SHA1|SHA256|sha1_|sha256_"),
+    ("session_impl", r"libtorrent::aux::session_impl::"),
+    ("utp", r"libtorrent::(aux::)?utp_"),
+    ("dht", r"libtorrent::dht::"),
+]
+
+perf_header_re = re.compile(r"^(\S.*?)\s+(\d+)(?:/(\d+))?\s")
+perf_frame_re = re.compile(r"^\s+[0-9a-f]+\s+(.*?)(?:\+0x[0-9a-f]+)?\s+\(([^()]*)\)$")
+python_frame_re = re.compile(r"\.py(:\d+)?\)$")
+# cv and ref qualifiers of member functions and the suffix GCC gives cloned
+# functions, e.g. "f(int) const [clone .isra.0]"
+qualifiers_re = re.compile(r"\)(\s*(const|volatile|noexcept|&&|&|\[clone [^\]]*\]))+$")
+
+
+def strip_arguments(name: str) -> str:
+    # removes the argument list of a demangled C++ function, taking care of
+    # "operator()" and nested parentheses. Qualifiers following the argument
+    # list are removed as well, so all variants of a function are one frame
+    if name.startswith("["):
+        return name
+    name = qualifiers_re.sub(")", name)
+    if not name.endswith(")"):
+        return name
+    depth = 0
+    for i in range(len(name) - 1, -1, -1):
+        c = name[i]
+        if c == ")":
+            depth += 1
+        elif c == "(":
+            depth -= 1
+            if depth == 0:
+                # this is the name of the call operator, not its arguments
+                if name.endswith("operator()", 0, i + 2):
+                    return name
+                return name[:i]
+    return name
+
+
+def collapse_templates(name: str) -> str:
+    out: List[str] = []
+    depth = 0
+    for i, c in enumerate(name):
+        if (
+            c == "<"
+            and not name.endswith("operator<", 0, i + 1)
+            and not name.endswith("operator<<", 0, i + 1)
+        ):
+            if depth == 0:
+                out.append("<")
+            depth += 1
+        elif c == ">" and depth > 0 and not name.endswith("operator->", 0, i + 1):
+            depth -= 1
+            if depth == 0:
+                out.append(">")
+        elif depth == 0:
+            out.append(c)
+    return "".join(out)
+
+
+class folder(object):
+    # accumulates folded stacks, applying name simplification and folding
+
+    def __init__(
+        self, raw_names: bool = False, folds: Optional[List[str]] = None
+    ) -> None:
+        self.raw_names = raw_names
+        self.folds = [
+            re.compile(f) for f in (default_folds if folds is None else folds)
+        ]
+        self.stacks: Stacks = {}
+        self.names: Dict[str, str] = {}
+
+    def name(self, name: str) -> str:
+        ret = self.names.get(name)
+        if ret is None:
+            ret = name
+            # python frames (from py-spy) are "function (file.py:line)"
+            if not self.raw_names and python_frame_re.search(name) is None:
+                ret = collapse_templates(strip_arguments(name)).replace(";", ":")
+            self.names[name] = ret
+        return ret
+
+    def add(self, frames: List[str], count: int = 1) -> None:
+        # frames are root first
+        stack = []
+        for f in frames:
+            f = self.name(f)
+            stack.append(f)
+            if any(r.search(f) for r in self.folds):
+                break
+        if not stack:
+            return
+        key = ";".join(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + count
+
+
+def fold_perf_script(lines: Iterable[str], f: folder) -> None:
+    # parses the output of "perf script". Every sample is a header line
+    # followed by one line per frame (leaf first), terminated by an empty
+    # line. The thread name is used as the root frame
+    comm: Optional[str] = None
+    frames: List[str] = []
+    for line in lines:
+        if not line.strip():
+            if comm is not None:
+                f.add([comm] + frames[::-1])
+            comm = None
+            frames = []
+            continue
+        if comm is None:
+            m = perf_header_re.match(line)
+            if m is not None:
+                comm = m.group(1).strip()
+            continue
+        m = perf_frame_re.match(line)
+        if m is None:
+            continue
+        sym = m.group(1)
+        if sym == "[unknown]":
+            sym = "[%s]" % os.path.basename(m.group(2))
+        elif "kernel" in m.group(2) or m.group(2).startswith("["):
+            sym += "_[k]"
+        frames.append(sym)
+    if comm is not None:
+        f.add([comm] + frames[::-1])
+
+
+def fold_folded(lines: Iterable[str], f: folder) -> None:
+    # already folded stacks, e.g. py-spy's raw output
+    for line in lines:
+        line = line.rstrip("\n")
+        stack, _, count = line.rpartition(" ")
+        if not stack or not count.isdigit():
+            continue
+        f.add(stack.split(";"), int(count))
+
+
+def fold(path: str, f: folder) -> None:
+    # returns the folded stacks from a perf.data file, perf script output or
+    # a folded stacks file
+    with open(path, "rb") as fp:
+        magic = fp.read(8)
+    if magic.startswith(b"PERFILE"):
+        p = subprocess.Popen(
+            ["perf", "script", "-i", path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            errors="replace",
+        )
+        assert p.stdout is not None
+        fold_perf_script(p.stdout, f)
+        p.wait()
+        return
+    with open(path, errors="replace") as lines:
+        first = ""
+        for first in lines:
+            if first.strip():
+                break
+        lines.seek(0)
+        if re.search(r" \d+$", first.rstrip("\n")) and "\t" not in first:
+            fold_folded(lines, f)
+        else:
+            fold_perf_script(lines, f)
+
+
+def read_folded(path: str) -> Stacks:
+    ret: Stacks = {}
+    with open(path, errors="replace") as lines:
+        for line in lines:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                ret[stack] = ret.get(stack, 0) + int(count)
+    return ret
+
+
+def write_folded(stacks: Stacks, path: str) -> None:
+    with open(path, "w+") as out:
+        for stack, count in sorted(stacks.items()):
+            print("%s %d" % (stack, count), file=out)
+
+
+def merge(stacks: Stacks, into: Stacks) -> Stacks:
+    for k, v in stacks.items():
+        into[k] = into.get(k, 0) + v
+    return into
+
+
+def top_functions(stacks: Stacks) -> Tuple[int, Dict[str, List[int]], Stacks]:
+    # returns the total number of samples, a dict of function -> [self,
+    # total] and a dict of component -> samples
+    total = 0
+    functions: Dict[str, List[int]] = {}
+    component_res = [(name, re.compile(expr)) for name, expr in components]
+    component_samples = dict((name, 0) for name, expr in components)
+    for stack, count in stacks.items():
+        total += count
+        frames = stack.split(";")
+        # the root is the thread name, not a function
+        for fun in set(frames[1:]):
+            functions.setdefault(fun, [0, 0])[1] += count
+        if len(frames) > 1:
+            functions[frames[-1]][0] += count
+        for name, r in component_res:
+            if any(r.search(fr) for fr in frames[1:]):
+                component_samples[name] += count
+    return total, functions, component_samples
+
+
+def write_top(stacks: Stacks, out: IO[str], limit: int = 50) -> None:
+    total, functions, component_samples = top_functions(stacks)
+    if total == 0:
+        print("no samples", file=out)
+        return
+    print("# samples: %d" % total, file=out)
+    print("# component              total%", file=out)
+    for name, expr in components:
+        print("%-24s %7.2f" % (name, component_samples[name] * 100.0 / total), file=out)
+    print("# self%  total%  function", file=out)
+    ranked = sorted(functions.items(), key=lambda f: (-f[1][0], -f[1][1], f[0]))
+    for fun, (self_samples, total_samples) in ranked[:limit]:
+        print(
+            "%7.2f %7.2f  %s"
+            % (self_samples * 100.0 / total, total_samples * 100.0 / total, fun),
+            file=out,
+        )
+
+
+def read_top(
+    path: str,
+) -> Tuple[Dict[str, float], Dict[str, Tuple[float, float]]]:
+    # reads a table written by write_top(), or computes it from folded stacks
+    if not path.endswith(".top") and not path.endswith(".txt"):
+        total, functions, component_samples = top_functions(read_folded(path))
+        if total == 0:
+            return {}, {}
+        return (
+            dict((k, v * 100.0 / total) for k, v in component_samples.items()),
+            dict(
+                (k, (v[0] * 100.0 / total, v[1] * 100.0 / total))
+                for k, v in functions.items()
+            ),
+        )
+    comps: Dict[str, float] = {}
+    funs: Dict[str, Tuple[float, float]] = {}
+    section = None
+    for line in open(path):
+        line = line.rstrip("\n")
+        if line.startswith("# component"):
+            section = "component"
+            continue
+        if line.startswith("# self%"):
+            section = "functions"
+            continue
+        if line.startswith("#") or not line.strip():
+            continue
+        if section == "component":
+            name, _, share = line.rpartition(" ")
+            comps[name.strip()] = float(share)
+        elif section == "functions":
+            s, t, fun = line.split(None, 2)
+            funs[fun] = (float(s), float(t))
+    return comps, funs
+
+
+def diff(
+    base_path: str, new_path: str, limit: int = 30, out: IO[str] = sys.stdout
+) -> None:
+    base_comps, base_funs = read_top(base_path)
+    new_comps, new_funs = read_top(new_path)
+    print("%-24s %8s %8s %8s" % ("component", "base%", "new%", "delta"), file=out)
+    for name, expr in components:
+        b = base_comps.get(name, 0.0)
+        n = new_comps.get(name, 0.0)
+        print("%-24s %8.2f %8.2f %+8.2f" % (name, b, n, n - b), file=out)
+    print("\n%8s %8s %8s  %s" % ("base", "new", "delta", "function (self%)"), file=out)
+    changes = []
+    for fun in set(base_funs) | set(new_funs):
+        b = base_funs.get(fun, (0.0, 0.0))[0]
+        n = new_funs.get(fun, (0.0, 0.0))[0]
+        changes.append((-abs(n - b), fun, b, n))
+    changes.sort()
+    for c, fun, b, n in changes[:limit]:
+        print("%8.2f %8.2f %+8.2f  %s" % (b, n, n - b, fun), file=out)
+
+
+def frame_color(name: str) -> str:
+    # kernel frames are orange, python frames green, libtorrent frames red,
+    # others yellow. The exact shade depends on the name, to tell adjacent
+    # frames apart
+    v = zlib.crc32(name.encode()) & 0xFFFF
+    if name.endswith("_[k]"):
+        return "rgb(%d,%d,%d)" % (220 + v % 30, 120 + v % 60, 20)
+    if ".py:" in name or ".py)" in name:
+        return "rgb(%d,%d,%d)" % (60 + v % 60, 190 + v % 50, 60 + v % 40)
+    if "libtorrent::" in name:
+        return "rgb(%d,%d,%d)" % (220 + v % 35, 60 + v % 80, 50 + v % 40)
+    return "rgb(%d,%d,%d)" % (220 + v % 35, 170 + v % 60, 40 + v % 50)
+
+
+svg_script = """
+var frames = document.getElementsByClassName("f");
+var details = document.getElementById("details");
+var searchtext = document.getElementById("search");
+function label(g) {
+    var w = parseFloat(g.getAttribute("data-sw"));
+    var n = g.getAttribute("data-n");
+    var chars = Math.floor((w - 6) / 7);
+    var t = g.getElementsByTagName("text")[0];
+    if (chars < 3) t.textContent = "";
+    else if (n.length > chars) t.textContent = n.substring(0, chars - 2) + "..";
+    else t.textContent = n;
+}
+function place(g, x, w) {
+    var r = g.getElementsByTagName("rect")[0];
+    var t = g.getElementsByTagName("text")[0];
+    r.setAttribute("x", PAD + x * WIDTH);
+    r.setAttribute("width", Math.max(0, w * WIDTH - 0.5));
+    t.setAttribute("x", PAD + x * WIDTH + 3);
+    g.setAttribute("data-sw", w * WIDTH);
+    g.style.display = w * WIDTH < 0.1 ? "none" : "";
+    label(g);
+}
+function zoom(target) {
+    var x0 = 0, w0 = 1, d0 = 0;
+    if (target) {
+        x0 = parseFloat(target.getAttribute("data-x"));
+        w0 = parseFloat(target.getAttribute("data-w"));
+        d0 = parseInt(target.getAttribute("data-d"));
+    }
+    for (var i = 0; i < frames.length; ++i) {
+        var g = frames[i];
+        var x = parseFloat(g.getAttribute("data-x"));
+        var w = parseFloat(g.getAttribute("data-w"));
+        var d = parseInt(g.getAttribute("data-d"));
+        if (d < d0 && x <= x0 + 1e-9 && x + w >= x0 + w0 - 1e-9) {
+            g.style.opacity = "0.5";
+            place(g, 0, 1);
+        } else if (d >= d0 && x >= x0 - 1e-9 && x + w <= x0 + w0 + 1e-9) {
+            g.style.opacity = "";
+            place(g, (x - x0) / w0, w / w0);
+        } else {
+            g.style.display = "none";
+        }
+    }
+}
+function search() {
+    var term = prompt("search (regular expression)", "");
+    if (term === null) return;
+    var re = new RegExp(term);
+    var matched = [];
+    for (var i = 0; i < frames.length; ++i) {
+        var g = frames[i];
+        var r = g.getElementsByTagName("rect")[0];
+        if (term !== "" && re.test(g.getAttribute("data-n"))) {
+            r.setAttribute("fill", "rgb(230,0,230)");
+            matched.push([parseFloat(g.getAttribute("data-x")),
+                parseFloat(g.getAttribute("data-w"))]);
+        } else {
+            r.setAttribute("fill", g.getAttribute("data-c"));
+        }
+    }
+    // don't count nested matches twice
+    matched.sort(function(a, b) { return a[0] - b[0]; });
+    var share = 0, end = -1;
+    for (var i = 0; i < matched.length; ++i) {
+        if (matched[i][0] >= end - 1e-9) {
+            share += matched[i][1];
+            end = matched[i][0] + matched[i][1];
+        }
+    }
+    searchtext.textContent = term === "" ? "search"
+        : "matched " + (share * 100).toFixed(2) + "%";
+}
+document.addEventListener("click", function(e) {
+    var g = e.target.parentNode;
+    if (g && g.classList && g.classList.contains("f")) zoom(g);
+});
+document.addEventListener("mouseover", function(e) {
+    var g = e.target.parentNode;
+    if (g && g.classList && g.classList.contains("f"))
+        details.textContent = g.getElementsByTagName("title")[0].textContent;
+});
+document.getElementById("reset").addEventListener("click", function(e) {
+    e.stopPropagation();
+    zoom(null);
+});
+searchtext.addEventListener("click", function(e) { e.stopPropagation(); search(); });
+for (var i = 0; i < frames.length; ++i) label(frames[i]);
+"""
+
+
+class call_tree(object):
+    # the number of samples of a frame and its callees, by name
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.children: Dict[str, "call_tree"] = {}
+
+
+def write_svg(
+    stacks: Stacks,
+    path: str,
+    title: str = "",
+    width: int = 1200,
+    frame_height: int = 16,
+    min_width: float = 0.1,
+) -> None:
+    # builds the call tree and lays it out with the root at the bottom. The
+    # width of every frame is proportional to its number of samples
+    root = call_tree()
+    for stack, count in stacks.items():
+        node = root
+        node.count += count
+        for fr in stack.split(";"):
+            node = node.children.setdefault(fr, call_tree())
+            node.count += count
+    total = root.count
+
+    pad = 10
+    inner = width - 2 * pad
+    frames: List[Tuple[str, float, float, int, int]] = []
+    max_depth = [0]
+
+    def layout(node: call_tree, x: float, depth: int) -> None:
+        for name in sorted(node.children):
+            child = node.children[name]
+            w = child.count / float(total)
+            if w * inner >= min_width:
+                frames.append((name, x, w, depth, child.count))
+                max_depth[0] = max(max_depth[0], depth)
+                layout(child, x, depth + 1)
+            x += w
+
+    if total > 0:
+        layout(root, 0.0, 0)
+
+    height = (max_depth[0] + 1) * frame_height + 80
+    out = open(path, "w+")
+    print('<?xml version="1.0" standalone="no"?>', file=out)
+    print(
+        '<svg version="1.1" width="%d" height="%d" viewBox="0 0 %d %d" '
+        'xmlns="http://www.w3.org/2000/svg">' % (width, height, width, height),
+        file=out,
+    )
+    print(
+        "<style>text { font-family: monospace; font-size: 12px; fill: black; } "
+        ".f { cursor: pointer; } .f:hover rect { stroke: black; stroke-width: 0.5; } "
+        "#reset, #search { cursor: pointer; }</style>",
+        file=out,
+    )
+    print(
+        '<rect x="0" y="0" width="%d" height="%d" fill="rgb(248,248,248)"/>'
+        % (width, height),
+        file=out,
+    )
+    print(
+        '<text x="%d" y="24" text-anchor="middle" style="font-size: 16px">%s</text>'
+        % (width // 2, html.escape(title or "flamegraph")),
+        file=out,
+    )
+    print('<text id="reset" x="%d" y="24">reset zoom</text>' % pad, file=out)
+    print(
+        '<text id="search" x="%d" y="24" text-anchor="end">search</text>'
+        % (width - pad),
+        file=out,
+    )
+    print('<text id="details" x="%d" y="%d"> </text>' % (pad, height - 10), file=out)
+    for name, x, w, depth, count in frames:
+        y = height - 40 - (depth + 1) * frame_height
+        color = frame_color(name)
+        print(
+            '<g class="f" data-n="%s" data-x="%.8f" data-w="%.8f" data-d="%d" '
+            'data-c="%s" data-sw="%.2f">'
+            "<title>%s (%d samples, %.2f%%)</title>"
+            '<rect x="%.2f" y="%d" width="%.2f" height="%d" fill="%s" rx="2"/>'
+            '<text x="%.2f" y="%d"></text></g>'
+            % (
+                html.escape(name, quote=True),
+                x,
+                w,
+                depth,
+                color,
+                w * inner,
+                html.escape(name),
+                count,
+                w * 100.0,
+                pad + x * inner,
+                y,
+                max(0.0, w * inner - 0.5),
+                frame_height - 1,
+                color,
+                pad + x * inner + 3,
+                y + frame_height - 4,
+            ),
+            file=out,
+        )
+    print('<script type="text/ecmascript"><![CDATA[', file=out)
+    print("var PAD = %d, WIDTH = %d;" % (pad, inner), file=out)
+    print(svg_script, file=out)
+    print("]]></script>", file=out)
+    print("</svg>", file=out)
+    out.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="fold CPU profiles and render flamegraphs"
+    )
+    sub = parser.add_subparsers(dest="command")
+
+    f = sub.add_parser("fold", help="convert a perf or py-spy profile to folded stacks")
+    f.add_argument(
+        "profiles", nargs="+", help="perf.data, perf script output or folded stacks"
+    )
+    f.add_argument("-o", "--output", help="the folded stacks file (default: stdout)")
+    f.add_argument(
+        "--raw-names", action="store_true", help="do not simplify C++ function names"
+    )
+    f.add_argument(
+        "--fold",
+        action="append",
+        default=[],
+        metavar="REGEX",
+        help="also cut call stacks below frames matching REGEX",
+    )
+    f.add_argument(
+        "--no-default-folds",
+        action="store_true",
+        help="do not cut stacks at common leaf functions",
+    )
+
+    s = sub.add_parser("svg", help="render folded stacks as an interactive flamegraph")
+    s.add_argument("folded", help="the folded stacks file")
+    s.add_argument("-o", "--output", help="the SVG file (default: <folded>.svg)")
+    s.add_argument("--title", default="", help="the title of the graph")
+    s.add_argument(
+        "--width",
+        type=int,
+        default=1200,
+        help="the width in pixels (default: %(default)s)",
+    )
+
+    t = sub.add_parser("top", help="print the top-functions table of folded stacks")
+    t.add_argument("folded", help="the folded stacks file")
+    t.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=50,
+        help="the number of functions (default: %(default)s)",
+    )
+
+    d = sub.add_parser(
+        "diff", help="compare two profiles (folded stacks or top tables)"
+    )
+    d.add_argument("base")
+    d.add_argument("new")
+    d.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=30,
+        help="the number of functions to show (default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "fold":
+        folds = ([] if args.no_default_folds else default_folds) + args.fold
+        fo = folder(raw_names=args.raw_names, folds=folds)
+        for p in args.profiles:
+            fold(p, fo)
+        if args.output:
+            write_folded(fo.stacks, args.output)
+        else:
+            for stack, count in sorted(fo.stacks.items()):
+                print("%s %d" % (stack, count))
+    elif args.command == "svg":
+        write_svg(
+            read_folded(args.folded),
+            args.output or os.path.splitext(args.folded)[0] + ".svg",
+            title=args.title,
+            width=args.width,
+        )
+    elif args.command == "top":
+        write_top(read_folded(args.folded), sys.stdout, args.limit)
+    elif args.command == "diff":
+        diff(args.base, args.new, args.limit)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
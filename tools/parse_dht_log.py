@@ -1,276 +1,409 @@
 #!/usr/bin/env python3
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
 
-from __future__ import print_function
-
-import sys
+# this script parses DHT logs (the dht_log and dht_pkt alerts, as written by
+# client_test -f) and generates CDFs and histograms of DHT lookups, node
+# up-times and announce distances.
+#
+# The logs are parsed in a single streaming pass per file, with memory
+# bounded by the number of outstanding lookups. Multiple log shards are
+# parsed in parallel by a process pool. Every shard writes its searches, node
+# up-times and announce distances into compact columnar files (one binary
+# int32 array per column) in the columns directory. The graphs are then
+# computed from those files, which means they can be re-generated without
+# re-parsing the logs (--reuse).
+#
+# usage: parse_dht_log.py [options] log-file [log-file ...]
+
+import argparse
+import array
+import glob
+import json
+import multiprocessing
 import os
-import pprint
-
-pp = pprint.PrettyPrinter(indent=4)
+import re
+import sys
+import zlib
+from collections import OrderedDict
 
 up_time_quanta = 500
 
-f = open(sys.argv[1])
+# the number of distance-to-target boundaries we track the crossing time of
+num_distances = 15
 
-announce_histogram = {}
+# the max number of lookups to keep track of at any given time. If a lookup
+# never completes, it's eventually evicted to make room for new ones
+max_outstanding_searches = 100000
 
-# TODO: make this histogram into a CDF
+# the number of bits in the filter used to count every IP only once when
+# building the client version histograms. It's approximate, but bounded
+unique_ip_bits = 1 << 24
 
-node_uptime_histogram = {}
+# the number of values to buffer per column before writing them to disk
+column_buffer_size = 64 * 1024
 
-counter = 0
+search_events = ['NEW', 'INVOKE', 'ADD', 'RESPONSE', 'PEERS', '1ST_TIMEOUT',
+                 'TIMEOUT', 'ABORTED', 'COMPLETED']
 
-# maps search_id to a list of events. Each event is a dict containing:
-#  t: timestamp
-#  d: distance (from target)
-#  o: outstanding searches
-#  e: event (NEW, COMPLETED, ADD, INVOKE, TIMEOUT)
-#  i: node-id
-#  a: IP address and port
-#  s: source node-id (only for ADD events)
-outstanding_searches = {}
+# a log line is either prefixed by the number of milliseconds since the start
+# of the log "[1234]" or by a wall-clock time "12:34:56.789"
+timestamp_re = re.compile(r'^\[?(?:(\d+):(\d+):(\d+)\.(\d+)|(\d+))\]?\s')
 
-# list of completed searches
-searches = []
+# matches the first interesting token of a line. Which group matched tells us
+# what kind of line it is, so every line is only scanned once
+dispatch_re = re.compile(
+    r'\[(\d+)\] (%s)\b'
+    r'|(<==) \[?(\S+?):\d+\]? '
+    r'|(announce-distance): (\d+)'
+    r'|(NODE FAILED) '
+    r'|starting DHT tracker with node (id): (\w+)' % '|'.join(search_events))
 
+# "name: value" pairs of the traversal log lines
+field_re = re.compile(r'([\w-]+): (\S+)')
 
-def convert_timestamp(t):
-    parts = t.split('.')
-    hms = parts[0].split(':')
-    return (int(hms[0]) * 3600 + int(hms[1]) * 60 + int(hms[2])) * 1000 + int(parts[1])
+# the client version in the (printed) message of incoming packets
+version_re = re.compile(r"'v': '([^']*)'")
 
+search_columns = ['first', 'last', 'done'] + \
+    ['distance_%d' % i for i in range(num_distances)]
 
-last_incoming = ''
 
-our_node_id = ''
+def timestamp_ms(m):
+    if m.group(5) is not None:
+        return int(m.group(5))
+    return (int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3))) * 1000 + int(m.group(4))
 
-unique_ips = set()
-client_version_histogram = {}
-client_histogram = {}
-
-for line in f:
-    counter += 1
-    # if counter % 1000 == 0:
-    #     print '\r%d' % counter,
-    try:
-        ls = line.split(' ')
-        if 'starting DHT tracker with node id:' in line:
-            our_node_id = ls[ls.index('id:') + 1].strip()
 
+def parse_version(version):
+    if len(version) == 4:
+        return '%s-%d' % (version[0:2], (ord(version[2]) << 8) + ord(version[3]))
+    elif len(version) == 8:
         try:
-            if len(ls) > 4 and ls[2] == '<==' and ls[1] == '[dht_tracker]':
-                ip = ls[3].split(':')[0]
-                if ip not in unique_ips:
-                    unique_ips.add(ip)
-                    json_blob = line.split(ls[3])[1]
-                    version = json_blob.split("'v': '")[1].split("'")[0]
-                    if len(version) == 4:
-                        v = '%s-%d' % (version[0:2], (ord(version[2]) << 8) + ord(version[3]))
-                    elif len(version) == 8:
-                        v = '%c%c-%d' % (chr(int(version[0:2], 16)), chr(int(version[2:4], 16)), int(version[4:8], 16))
-                    else:
-                        v = 'unknown'
+            return '%c%c-%d' % (chr(int(version[0:2], 16)), chr(int(version[2:4], 16)),
+                                int(version[4:8], 16))
+        except ValueError:
+            pass
+    return 'unknown'
 
-                    if v not in client_version_histogram:
-                        client_version_histogram[v] = 1
-                    else:
-                        client_version_histogram[v] += 1
 
-                    if not v[0:2] in client_histogram:
-                        client_histogram[v[0:2]] = 1
-                    else:
-                        client_histogram[v[0:2]] += 1
-        except Exception:
+class column_writer(object):
+    # buffers int32 values and appends them to a file in the columns directory
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = array.array('i')
+        with open(path, 'wb'):
             pass
 
-        if 'announce-distance:' in line:
-            idx = ls.index('announce-distance:')
+    def append(self, v):
+        self.buffer.append(v)
+        if len(self.buffer) >= column_buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with open(self.path, 'ab') as f:
+            self.buffer.tofile(f)
+        self.buffer = array.array('i')
+
+
+def read_column(columns_dir, shard, name):
+    ret = array.array('i')
+    path = os.path.join(columns_dir, '%s.%s.i32' % (shard, name))
+    with open(path, 'rb') as f:
+        ret.frombytes(f.read())
+    return ret
+
+
+class search(object):
+    __slots__ = ['start', 'target', 'first', 'last', 'distance', 'reached',
+                 'last_response', 'events', 'node_distance']
+
+    def __init__(self, start, target, keep_events):
+        self.start = start
+        self.target = target
+        self.first = -1
+        self.last = -1
+        # the time (relative to start) the lookup first got a response from
+        # a node sharing at least this many bits prefix with the target
+        self.distance = [-1] * num_distances
+        self.reached = -1
+        self.last_response = ''
+        self.events = [] if keep_events else None
+        # node id -> distance, as logged when the node was invoked. RESPONSE
+        # lines don't log the distance
+        self.node_distance = {}
+
+    def response(self, t, distance):
+        distance = min(distance, num_distances - 1)
+        while self.reached < distance:
+            self.reached += 1
+            self.distance[self.reached] = t
+
+
+def parse_shard(job):
+    # parses one log file and writes its columns. Returns the name of the
+    # shard. This runs in a worker process
+    index, path, columns_dir, lookups = job
+    shard = '%04d-%s' % (index, os.path.basename(path))
+
+    searches = {}
+    for c in search_columns:
+        searches[c] = column_writer(os.path.join(columns_dir, '%s.search_%s.i32' % (shard, c)))
+    search_types = []
+    type_column = column_writer(os.path.join(columns_dir, '%s.search_type.i32' % shard))
+    uptime = column_writer(os.path.join(columns_dir, '%s.node_uptime.i32' % shard))
+    announce = column_writer(os.path.join(columns_dir, '%s.announce_distance.i32' % shard))
+
+    lookups_out = None
+    if lookups:
+        lookups_out = open(os.path.join(columns_dir, '%s.lookups.txt' % shard), 'w+')
+
+    outstanding = OrderedDict()
+    unique_ips = bytearray(unique_ip_bits // 8)
+    client_versions = {}
+    our_node_id = ''
+    lines = 0
+    orphaned = 0
+    unknown_distance = 0
+
+    f = open(path, 'r', errors='replace')
+    for line in f:
+        lines += 1
+        m = dispatch_re.search(line)
+        if m is None:
+            continue
 
-            d = int(ls[idx + 1].strip())
-            if d not in announce_histogram:
-                announce_histogram[d] = 0
-            announce_histogram[d] += 1
-        if 'NODE FAILED' in line:
-            idx = ls.index('fails:')
-            if int(ls[idx + 1].strip()) != 1:
+        if m.group(1) is not None:
+            ts = timestamp_re.match(line)
+            if ts is None:
                 continue
-            idx = ls.index('up-time:')
-            d = int(ls[idx + 1].strip())
-            # quantize
-            d = d - (d % up_time_quanta)
-            if d not in node_uptime_histogram:
-                node_uptime_histogram[d] = 0
-            node_uptime_histogram[d] += 1
-
-        search_id = ls[2]
-        ts = ls[0]
-        event = ls[3]
-
-        if event == 'RESPONSE':
-            outstanding = int(ls[ls.index('invoke-count:') + 1])
-            distance = int(ls[ls.index('distance:') + 1])
-            nid = ls[ls.index('id:') + 1]
-            addr = ls[ls.index('addr:') + 1]
-            last_response = addr
-            outstanding_searches[search_id].append({'t': ts, 'd': distance,
-                                                    'o': outstanding + 1, 'a': addr, 'e': event, 'i': nid})
-        elif event == 'NEW':
-            nid = ls[ls.index('target:') + 1]
-            outstanding_searches[search_id] = [{'t': ts, 'd': 0, 'o': 0,
-                                                'e': event, 'abstime': ts, 'i': nid}]
-            last_response = ''
-        elif event == 'INVOKE' or event == 'ADD' or event == '1ST_TIMEOUT' or \
-                event == 'TIMEOUT' or event == 'PEERS':
-            if search_id not in outstanding_searches:
-                print('orphaned event: %s' % line)
+            ts = timestamp_ms(ts)
+            search_id = m.group(1)
+            event = m.group(2)
+            fields = dict(field_re.findall(line, m.end()))
+
+            if event == 'NEW':
+                if len(outstanding) >= max_outstanding_searches:
+                    outstanding.popitem(last=False)
+                outstanding[search_id] = search(ts, fields.get('target', ''), lookups)
+                continue
+
+            s = outstanding.get(search_id)
+            if s is None:
+                orphaned += 1
+                continue
+            t = ts - s.start
+
+            nid = fields.get('id', '')
+            if 'distance' in fields:
+                try:
+                    distance = 160 - int(fields['distance'])
+                except ValueError:
+                    distance = None
+                if distance is not None and nid != '':
+                    s.node_distance[nid] = distance
+            else:
+                distance = s.node_distance.get(nid)
+            if distance is None and event != 'ABORTED':
+                unknown_distance += 1
+                continue
+
+            if event == 'COMPLETED':
+                del outstanding[search_id]
+                for i, c in enumerate(search_columns):
+                    if i == 0:
+                        searches[c].append(s.first)
+                    elif i == 1:
+                        searches[c].append(s.last)
+                    elif i == 2:
+                        searches[c].append(t)
+                    else:
+                        searches[c].append(s.distance[i - 3])
+                lookup_type = fields.get('type', 'unknown')
+                if lookup_type not in search_types:
+                    search_types.append(lookup_type)
+                type_column.append(search_types.index(lookup_type))
+
+                if lookups_out is not None:
+                    print('=== %d %s ===' % (s.start, lookup_type), file=lookups_out)
+                    print('<>  0 %s %s' % (our_node_id, s.target), file=lookups_out)
+                    for e in s.events:
+                        print(e, file=lookups_out)
+                    print('*** %d %d\n' % (t, distance), file=lookups_out)
+                continue
+
+            if event == 'ABORTED':
+                if s.events is not None:
+                    s.events.append('abort')
+                continue
+
+            if event in ('RESPONSE', 'PEERS'):
+                s.response(t, distance)
+                s.last_response = fields.get('addr', '')
+                if event == 'PEERS':
+                    if s.first < 0:
+                        s.first = t
+                    s.last = t
+
+            if s.events is None:
+                continue
+
+            addr = fields.get('addr', '')
+            if event == 'INVOKE':
+                s.events.append(' -> %d %d %s %s' % (t, distance, nid, addr))
+            elif event == '1ST_TIMEOUT':
+                s.events.append(' x  %d %d %s %s' % (t, distance, nid, addr))
+            elif event == 'TIMEOUT':
+                s.events.append(' X  %d %d %s %s' % (t, distance, nid, addr))
+            elif event == 'ADD':
+                if s.last_response != '':
+                    s.events.append(' +  %d %d %s %s %s' % (t, distance, nid, addr, s.last_response))
             else:
-                outstanding = int(ls[ls.index('invoke-count:') + 1])
-                distance = int(ls[ls.index('distance:') + 1])
-                nid = ls[ls.index('id:') + 1]
-                addr = ls[ls.index('addr:') + 1]
-                source = ''
-                if event == 'ADD':
-                    if last_response == '':
-                        continue
-                    source = last_response
-
-                outstanding_searches[search_id].append(
-                    {'t': ts, 'd': distance, 'o': outstanding + 1, 'a': addr, 'e': event, 'i': nid, 's': source})
-        elif event == 'ABORTED':
-            outstanding_searches[search_id].append({'t': ts, 'e': event})
-        elif event == 'COMPLETED':
-            distance = int(ls[ls.index('distance:') + 1])
-            lookup_type = ls[ls.index('type:') + 1].strip()
-            outstanding_searches[search_id].append({'t': ts, 'd': distance,
-                                                    'o': 0, 'e': event, 'i': ''})
-
-            outstanding_searches[search_id][0]['type'] = lookup_type
-
-            s = outstanding_searches[search_id]
+                s.events.append(' <- %d %d %s %s' % (t, distance, nid, addr))
 
+        elif m.group(3) is not None:
+            ip = m.group(4)
+            h = zlib.crc32(ip.encode()) % unique_ip_bits
+            if unique_ips[h >> 3] & (1 << (h & 7)):
+                continue
+            v = version_re.search(line, m.end())
+            if v is None:
+                continue
+            unique_ips[h >> 3] |= 1 << (h & 7)
+            v = parse_version(v.group(1))
+            client_versions[v] = client_versions.get(v, 0) + 1
+
+        elif m.group(5) is not None:
+            announce.append(int(m.group(6)))
+
+        elif m.group(7) is not None:
+            fields = dict(field_re.findall(line, m.end()))
             try:
-                start_time = convert_timestamp(s[0]['t'])
-                for i in range(len(s)):
-                    s[i]['t'] = convert_timestamp(s[i]['t']) - start_time
-            except Exception:
-                pass
-            searches.append(s)
-            del outstanding_searches[search_id]
-
-    except Exception as e:
-        print(e)
-        print(line.split(' '))
-
-lookup_times_min = []
-lookup_times_max = []
-
-# these are the timestamps for lookups crossing distance
-# to target boundaries
-lookup_distance = []
-for i in range(0, 15):
-    lookup_distance.append([])
-
-for s in searches:
-    for i in s:
-        if 'last_dist' not in i:
-            i['last_dist'] = -1
-        cur_dist = 160 - i['d']
-        last_dist = i['last_dist']
-        if cur_dist > last_dist:
-            for j in range(last_dist + 1, cur_dist + 1):
-                if j >= len(lookup_distance):
-                    break
-                lookup_distance[j].append(i['t'])
-            i['last_dist'] = cur_dist
-        if i['e'] != 'PEERS':
-            continue
-        lookup_times_min.append(i['t'])
-        break
-    for i in reversed(s):
-        if i['e'] != 'PEERS':
-            continue
-        lookup_times_max.append(i['t'])
-        break
-
-
-lookup_times_min.sort()
-lookup_times_max.sort()
-out = open('dht_lookup_times_cdf.txt', 'w+')
-counter = 0
-for i in range(len(lookup_times_min)):
-    counter += 1
-    print('%d\t%d\t%f' % (lookup_times_min[i], lookup_times_max[i], counter / float(len(lookup_times_min))), file=out)
-out.close()
-
-for i in lookup_distance:
-    i.sort()
-
-dist = 0
-for i in lookup_distance:
-    out = open('dht_lookup_distance_%d.txt' % dist, 'w+')
-    dist += 1
-    counter = 0
-    for j in i:
-        counter += 1
-        print('%d\t%f' % (j, counter / float(len(i))), file=out)
+                if int(fields['fails']) != 1:
+                    continue
+                d = int(fields['up-time'])
+            except (KeyError, ValueError):
+                continue
+            # quantize
+            uptime.append(d - (d % up_time_quanta))
+
+        else:
+            our_node_id = m.group(9)
+
+    f.close()
+
+    for c in searches.values():
+        c.flush()
+    type_column.flush()
+    uptime.flush()
+    announce.flush()
+    if lookups_out is not None:
+        lookups_out.close()
+
+    with open(os.path.join(columns_dir, '%s.json' % shard), 'w+') as out:
+        json.dump({'log': path, 'lines': lines, 'orphaned': orphaned,
+                   'unknown_distance': unknown_distance,
+                   'node_id': our_node_id, 'search_types': search_types,
+                   'client_versions': client_versions}, out)
+    return shard
+
+
+def write_cdf(filename, values):
+    values = sorted(values)
+    out = open(filename, 'w+')
+    n = float(len(values))
+    for i, v in enumerate(values):
+        print('%d\t%f' % (v, (i + 1) / n), file=out)
+    out.close()
+
+
+def generate_report(columns_dir, shards, lookups):
+    lookup_times_min = array.array('i')
+    lookup_times_max = array.array('i')
+    lookup_distance = [array.array('i') for i in range(num_distances)]
+    announce_histogram = {}
+    node_uptime_histogram = {}
+    client_version_histogram = {}
+
+    if lookups:
+        lookups_out = open('dht_lookups.txt', 'w+')
+
+    for shard in shards:
+        with open(os.path.join(columns_dir, '%s.json' % shard)) as f:
+            info = json.load(f)
+        for v, count in info['client_versions'].items():
+            client_version_histogram[v] = client_version_histogram.get(v, 0) + count
+
+        first = read_column(columns_dir, shard, 'search_first')
+        last = read_column(columns_dir, shard, 'search_last')
+        # only lookups that received at least one data response count
+        lookup_times_min.extend(t for t in first if t >= 0)
+        lookup_times_max.extend(t for t in last if t >= 0)
+
+        for i in range(num_distances):
+            d = read_column(columns_dir, shard, 'search_distance_%d' % i)
+            lookup_distance[i].extend(t for t in d if t >= 0)
+
+        for d in read_column(columns_dir, shard, 'announce_distance'):
+            announce_histogram[d] = announce_histogram.get(d, 0) + 1
+
+        for d in read_column(columns_dir, shard, 'node_uptime'):
+            node_uptime_histogram[d] = node_uptime_histogram.get(d, 0) + 1
+
+        if lookups:
+            path = os.path.join(columns_dir, '%s.lookups.txt' % shard)
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        lookups_out.write(line)
+
+    if lookups:
+        lookups_out.close()
+
+    lookup_times_min = sorted(lookup_times_min)
+    lookup_times_max = sorted(lookup_times_max)
+    out = open('dht_lookup_times_cdf.txt', 'w+')
+    for i in range(len(lookup_times_min)):
+        print('%d\t%d\t%f' % (lookup_times_min[i], lookup_times_max[i],
+                              (i + 1) / float(len(lookup_times_min))), file=out)
+    out.close()
+
+    for dist, times in enumerate(lookup_distance):
+        write_cdf('dht_lookup_distance_%d.txt' % dist, times)
+
+    out = open('dht_announce_distribution.dat', 'w+')
+    print('announce distribution items: %d' % len(announce_histogram))
+    for k, v in sorted(announce_histogram.items()):
+        print('%d %d' % (k, v), file=out)
+        print('%d %d' % (k, v))
+    out.close()
+
+    out = open('dht_node_uptime_cdf.txt', 'w+')
+    total_uptime_nodes = sum(node_uptime_histogram.values())
+    s = 0
+    for k, v in sorted(node_uptime_histogram.items()):
+        s += v
+        print('%f %f' % (k / float(60), s / float(total_uptime_nodes)), file=out)
     out.close()
 
-out = open('dht_lookups.txt', 'w+')
-for s in searches:
-    for i in s:
-        if i['e'] == 'INVOKE':
-            print(' ->', i['t'], 160 - i['d'], i['i'], i['a'], file=out)
-        elif i['e'] == '1ST_TIMEOUT':
-            print(' x ', i['t'], 160 - i['d'], i['i'], i['a'], file=out)
-        elif i['e'] == 'TIMEOUT':
-            print(' X ', i['t'], 160 - i['d'], i['i'], i['a'], file=out)
-        elif i['e'] == 'ADD':
-            print(' + ', i['t'], 160 - i['d'], i['i'], i['a'], i['s'], file=out)
-        elif i['e'] == 'RESPONSE':
-            print(' <-', i['t'], 160 - i['d'], i['i'], i['a'], file=out)
-        elif i['e'] == 'PEERS':
-            print(' <-', i['t'], 160 - i['d'], i['i'], i['a'], file=out)
-        elif i['e'] == 'ABORTED':
-            print('abort', file=out)
-        elif i['e'] == 'COMPLETED':
-            print('***', i['t'], 160 - i['d'], '\n', file=out)
-        elif i['e'] == 'NEW':
-            print('===', i['abstime'], i['type'], '===', file=out)
-            print('<> ', 0, our_node_id, i['i'], file=out)
-out.close()
-
-out = open('dht_announce_distribution.dat', 'w+')
-print('announce distribution items: %d' % len(announce_histogram))
-for k, v in list(announce_histogram.items()):
-    print('%d %d' % (k, v), file=out)
-    print('%d %d' % (k, v))
-out.close()
-
-out = open('dht_node_uptime_cdf.txt', 'w+')
-s = 0
-
-total_uptime_nodes = 0
-for k, v in list(node_uptime_histogram.items()):
-    total_uptime_nodes += v
-
-for k, v in sorted(node_uptime_histogram.items()):
-    s += v
-    print('%f %f' % (k / float(60), s / float(total_uptime_nodes)), file=out)
-    print('%f %f' % (k / float(60), s / float(total_uptime_nodes)))
-out.close()
-
-
-print('clients by version')
-client_version_histogram = sorted(list(client_version_histogram.items()), key=lambda x: x[1], reverse=True)
-pp.pprint(client_version_histogram)
-
-print('clients')
-client_histogram = sorted(list(client_histogram.items()), key=lambda x: x[1], reverse=True)
-pp.pprint(client_histogram)
-
-out = open('dht.gnuplot', 'w+')
-out.write('''
+    client_histogram = {}
+    for v, count in client_version_histogram.items():
+        client_histogram[v[0:2]] = client_histogram.get(v[0:2], 0) + count
+
+    print('clients by version')
+    for v, count in sorted(client_version_histogram.items(), key=lambda x: x[1], reverse=True):
+        print('  %-12s %d' % (v, count))
+
+    print('clients')
+    for v, count in sorted(client_histogram.items(), key=lambda x: x[1], reverse=True):
+        print('  %-12s %d' % (v, count))
+
+
+def write_gnuplot():
+    out = open('dht.gnuplot', 'w+')
+    out.write('''
 set term png size 1200,700 small
 set output "dht_lookup_times_cdf.png"
 set title "portion of lookups that have received at least one data response"
@@ -329,13 +462,61 @@ set xtics 100
 set grid
 plot ''')
 
-dist = 0
-for i in lookup_distance:
-    if dist > 0:
-        out.write(', ')
-    out.write('"dht_lookup_distance_%d.txt" using 1:2 title "%d" with lines' % (dist, dist))
-    dist += 1
+    for dist in range(num_distances):
+        if dist > 0:
+            out.write(', ')
+        out.write('"dht_lookup_distance_%d.txt" using 1:2 title "%d" with lines' % (dist, dist))
+    out.write('\n')
+    out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate DHT graphs from libtorrent DHT logs')
+    parser.add_argument('logs', nargs='*', help='the log file(s) (shards) to parse')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='the number of log shards to parse in parallel (default: %(default)s)')
+    parser.add_argument('--columns-dir', default='dht_columns',
+                        help='where to store the columnar files (default: %(default)s)')
+    parser.add_argument('--reuse', action='store_true',
+                        help='do not parse any logs, generate graphs from the existing columns')
+    parser.add_argument('--no-lookups', action='store_true',
+                        help='do not write dht_lookups.txt (the input to parse_lookup_log.py)')
+    parser.add_argument('--no-plot', action='store_true', help='do not run gnuplot')
+    args = parser.parse_args()
+
+    lookups = not args.no_lookups
+
+    if args.reuse:
+        shards = sorted(os.path.basename(p)[:-5] for p in glob.glob(os.path.join(args.columns_dir, '*.json')))
+    else:
+        if not args.logs:
+            parser.error('no log files specified')
+        try:
+            os.mkdir(args.columns_dir)
+        except OSError:
+            pass
+
+        jobs = [(i, p, args.columns_dir, lookups) for i, p in enumerate(args.logs)]
+        shards = []
+        pool = multiprocessing.Pool(max(1, min(args.jobs, len(jobs))))
+        for shard in pool.imap_unordered(parse_shard, jobs):
+            print('parsed %s' % shard)
+            sys.stdout.flush()
+            shards.append(shard)
+        pool.close()
+        pool.join()
+        shards.sort()
+
+    if not shards:
+        print('no shards found in %s' % args.columns_dir)
+        sys.exit(1)
+
+    generate_report(args.columns_dir, shards, lookups)
+    write_gnuplot()
+
+    if not args.no_plot:
+        os.system('gnuplot dht.gnuplot')
 
-out.close()
 
-os.system('gnuplot dht.gnuplot')
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
 
-# this is meant to parse the dht_lookups.log generated by parse_dht_log.py
-from __future__ import print_function
+# this is meant to parse the dht_lookups.txt generated by parse_dht_log.py
+#
+# by default, the first lookup in dht_lookups.txt is rendered as a sequence of
+# graphviz frames in dht_frames/.
+#
+# with --batch, every lookup in every lookups file found in the given
+# directories (or files) is analyzed instead, in parallel. The distributions of
+# time-to-first-response, time-to-k-closest, timeouts per lookup and the
+# distance to the target per round are printed as percentile tables, written
+# to lookup_stats.json and plotted as CDFs. This is meant for comparing DHT
+# settings such as dht_search_branching and dht_max_fail_count.
+#
+# usage: parse_lookup_log.py
+#        parse_lookup_log.py --batch [options] directory-or-file [...]
 
+import argparse
+import glob
+import json
+import multiprocessing
 import os
+import sys
 
 nodes = {}
 
@@ -22,12 +39,12 @@ def calculate_pos(nid, dist):
     x = 0
     y = 0
     for i in range(0, 28, 2):
-        x |= (nid & (1 << i)) >> (i / 2)
-        y |= (nid & (2 << i)) >> (i / 2 + 1)
+        x |= (nid & (1 << i)) >> (i // 2)
+        y |= (nid & (2 << i)) >> (i // 2 + 1)
 
 # print '%d -> %d %d' % (dist, x, y)
 
-    return (x / 3, y / 3)
+    return (x // 3, y // 3)
 
 
 def plot_nodes(nodes, frame):
@@ -71,61 +88,299 @@ def plot_nodes(nodes, frame):
     os.system('neato -n dht_frames/plot-%02d.dot -Tpng -o dht_frames/frame-%02d.png' % (frame, frame))
 
 
-frame = 0
-next_render_time = 100
-f = open('dht_lookups.txt')
-for line in f:
-    if line.startswith('***'):
-        break
-
-    kind = line[0:3].strip()
-    line = line[3:].strip().split(' ')
-
-    if kind == '===':
-        continue
-
-    t = int(line[0])
-    if t > next_render_time:
-        plot_nodes(nodes, frame)
-        frame += 1
-        next_render_time += 100
-        # sys.exit(0)
-
-    if kind == '<>':
-        p = calculate_pos(line[1], 0)
-        dst = '0.0.0.0'
-        if dst not in nodes:
-            nodes[dst] = {'conns': set(), 'p': p, 'c': 'blue', 's': 'circle'}
-
-        p = calculate_pos(line[2], 25)
-        dst = '255.255.255.255'
-        if dst not in nodes:
-            nodes[dst] = {'conns': set(), 'p': p, 'c': 'yellow', 's': 'circle'}
-    elif kind == '->':
-        dst = line[3]
-
-        if dst not in nodes:
-            src = get_origin(dst)
+def render_lookup(filename):
+    frame = 0
+    next_render_time = 100
+    f = open(filename)
+    for line in f:
+        if line.startswith('***'):
+            break
+
+        kind = line[0:3].strip()
+        line = line[3:].strip().split(' ')
+
+        if kind == '===':
+            continue
+
+        t = int(line[0])
+        if t > next_render_time:
+            plot_nodes(nodes, frame)
+            frame += 1
+            next_render_time += 100
+            # sys.exit(0)
+
+        if kind == '<>':
+            p = calculate_pos(line[1], 0)
+            dst = '0.0.0.0'
+            if dst not in nodes:
+                nodes[dst] = {'conns': set(), 'p': p, 'c': 'blue', 's': 'circle'}
+
+            p = calculate_pos(line[2], 25)
+            dst = '255.255.255.255'
+            if dst not in nodes:
+                nodes[dst] = {'conns': set(), 'p': p, 'c': 'yellow', 's': 'circle'}
+        elif kind == '->':
+            dst = line[3]
+
+            if dst not in nodes:
+                src = get_origin(dst)
+                p = calculate_pos(line[2], int(line[1]))
+                nodes[dst] = {'conns': set(src), 'p': p, 'c': 'grey'}
+            nodes[dst]['c'] = 'grey'
+
+        elif kind == '+':
+            dst = line[3]
+            src = line[4]
             p = calculate_pos(line[2], int(line[1]))
-            nodes[dst] = {'conns': set(src), 'p': p, 'c': 'grey'}
-        nodes[dst]['c'] = 'grey'
-
-    elif kind == '+':
-        dst = line[3]
-        src = line[4]
-        p = calculate_pos(line[2], int(line[1]))
-        if dst not in nodes:
-            nodes[dst] = {'conns': set(), 'p': p, 'c': 'white'}
-        nodes[dst]['conns'].add(src)
-
-    elif kind == '<-':
-        dst = line[3]
-        nodes[dst]['c'] = 'green'
-    elif kind == 'x':
-        dst = line[3]
-        nodes[dst]['c'] = 'orange'
-    elif kind == 'X':
-        dst = line[3]
-        nodes[dst]['c'] = 'red'
-
-f.close()
+            if dst not in nodes:
+                nodes[dst] = {'conns': set(), 'p': p, 'c': 'white'}
+            nodes[dst]['conns'].add(src)
+
+        elif kind == '<-':
+            dst = line[3]
+            nodes[dst]['c'] = 'green'
+        elif kind == 'x':
+            dst = line[3]
+            nodes[dst]['c'] = 'orange'
+        elif kind == 'X':
+            dst = line[3]
+            nodes[dst]['c'] = 'red'
+
+    f.close()
+
+
+# the metrics recorded for every lookup in batch mode
+lookup_metrics = ['time_to_first_response', 'time_to_k_closest', 'duration',
+                  'timeouts', 'short_timeouts', 'invokes', 'responses']
+
+
+def analyze_lookup(events, k):
+    # events is the list of (kind, fields) of one lookup, in order. Returns a
+    # dict of metrics and the best distance (in shared prefix bits with the
+    # target) reached in every round. A node is in round 0 if we knew about
+    # it before the lookup started, and in round n + 1 if it was returned by
+    # a node in round n. Nodes are keyed by node id, since INVOKE lines log
+    # the address without the port, whereas RESPONSE and ADD lines include it.
+    # A get_peers reply is logged twice, as PEERS and RESPONSE, so only the
+    # first response of every node counts
+    ret = {'timeouts': 0, 'short_timeouts': 0, 'invokes': 0, 'responses': 0,
+           'time_to_first_response': None, 'time_to_k_closest': None, 'duration': None}
+    node_round = {}
+    # the node id of every node that responded, by ip:port. ADD lines refer
+    # to the node that returned them by its address
+    responder_id = {}
+    responded = set()
+    rounds = []
+    responders = []
+    for kind, line in events:
+        if kind == '***':
+            ret['duration'] = int(line[0])
+            continue
+        if kind not in ('->', '+', '<-', 'x', 'X') or len(line) < 4:
+            continue
+        t = int(line[0])
+        distance = int(line[1])
+        nid = line[2]
+        if kind == '+':
+            if len(line) > 4 and nid not in node_round:
+                node_round[nid] = node_round.get(responder_id.get(line[4]), 0) + 1
+        elif kind == '->':
+            ret['invokes'] += 1
+            node_round.setdefault(nid, 0)
+        elif kind == 'x':
+            ret['short_timeouts'] += 1
+        elif kind == 'X':
+            ret['timeouts'] += 1
+        else:
+            responder_id[line[3]] = nid
+            if nid in responded:
+                continue
+            responded.add(nid)
+            ret['responses'] += 1
+            if ret['time_to_first_response'] is None:
+                ret['time_to_first_response'] = t
+            responders.append((distance, t))
+            r = node_round.get(nid, 0)
+            while len(rounds) <= r:
+                rounds.append(-1)
+            rounds[r] = max(rounds[r], distance)
+
+    # the time when the k closest nodes that responded had all responded
+    if len(responders) >= k:
+        responders.sort(key=lambda x: x[0], reverse=True)
+        ret['time_to_k_closest'] = max(t for d, t in responders[:k])
+    return ret, rounds
+
+
+def analyze_file(job):
+    # analyzes every lookup in one lookups file. This runs in a worker process
+    filename, k = job
+    metrics = dict((m, []) for m in lookup_metrics)
+    rounds = []
+    types = {}
+    events = None
+    lookup_type = None
+    for line in open(filename, errors='replace'):
+        if line.startswith('==='):
+            events = []
+            parts = line.strip('= \n').split(' ')
+            lookup_type = parts[-1] if parts else 'unknown'
+            continue
+        if events is None:
+            continue
+        if line.startswith('abort'):
+            continue
+        kind = line[0:3].strip()
+        events.append((kind, line[3:].strip().split(' ')))
+        if kind != '***':
+            continue
+
+        ret, best = analyze_lookup(events, k)
+        events = None
+        types[lookup_type] = types.get(lookup_type, 0) + 1
+        for m in lookup_metrics:
+            if ret[m] is not None:
+                metrics[m].append(ret[m])
+        for r, d in enumerate(best):
+            while len(rounds) <= r:
+                rounds.append([])
+            if d >= 0:
+                rounds[r].append(d)
+    return metrics, rounds, types
+
+
+def percentile(values, p):
+    # values must be sorted
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+def write_cdf(filename, values):
+    out = open(filename, 'w+')
+    n = float(len(values))
+    for i, v in enumerate(values):
+        print('%d\t%f' % (v, (i + 1) / n), file=out)
+    out.close()
+
+
+def batch(args):
+    files = []
+    for p in args.paths:
+        if os.path.isdir(p):
+            files.extend(sorted(glob.glob(os.path.join(p, args.pattern))))
+        else:
+            files.append(p)
+    if not files:
+        print('no lookup files found')
+        sys.exit(1)
+
+    metrics = dict((m, []) for m in lookup_metrics)
+    rounds = []
+    types = {}
+    pool = multiprocessing.Pool(max(1, min(args.jobs, len(files))))
+    for m, r, t in pool.imap_unordered(analyze_file, [(f, args.k) for f in files]):
+        for name in lookup_metrics:
+            metrics[name].extend(m[name])
+        for i, d in enumerate(r):
+            while len(rounds) <= i:
+                rounds.append([])
+            rounds[i].extend(d)
+        for name, count in t.items():
+            types[name] = types.get(name, 0) + count
+    pool.close()
+    pool.join()
+
+    for values in metrics.values():
+        values.sort()
+    for values in rounds:
+        values.sort()
+
+    percentiles = [10, 50, 90, 99]
+    num_lookups = sum(types.values())
+    print('%d lookups in %d files (%s)' % (num_lookups, len(files), ', '.join(
+        '%s: %d' % t for t in sorted(types.items()))))
+    print('\n%-24s %8s %8s %8s %8s %8s' % (('metric', 'count') + tuple('p%d' % p for p in percentiles)))
+    for m in lookup_metrics:
+        values = metrics[m]
+        print('%-24s %8d %8d %8d %8d %8d' % ((m, len(values)) + tuple(percentile(values, p) for p in percentiles)))
+
+    print('\nshared prefix bits with target of the closest response, per round')
+    print('%-8s %8s %8s %8s %8s' % ('round', 'lookups', 'p10', 'p50', 'p90'))
+    for i, values in enumerate(rounds):
+        if not values:
+            continue
+        print('%-8d %8d %8d %8d %8d' % (i, len(values), percentile(values, 10),
+                                        percentile(values, 50), percentile(values, 90)))
+
+    stats = {
+        'label': args.label,
+        'k': args.k,
+        'lookups': num_lookups,
+        'types': types,
+        'metrics': dict((m, dict([('count', len(metrics[m]))]
+                                 + [('p%d' % p, percentile(metrics[m], p)) for p in percentiles]))
+                        for m in lookup_metrics),
+        'rounds': [dict([('lookups', len(v))] + [('p%d' % p, percentile(v, p)) for p in [10, 50, 90]])
+                   for v in rounds],
+    }
+    with open(os.path.join(args.output_dir, 'lookup_stats.json'), 'w+') as f:
+        json.dump(stats, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+    cdfs = ['time_to_first_response', 'time_to_k_closest', 'duration', 'timeouts']
+    for m in cdfs:
+        write_cdf(os.path.join(args.output_dir, 'lookup_%s.cdf' % m), metrics[m])
+
+    out = open(os.path.join(args.output_dir, 'lookup_stats.gnuplot'), 'w+')
+    print('set term png size 1200,700 small', file=out)
+    print('set grid', file=out)
+    print('set key box', file=out)
+    print('set ylabel "portion of lookups"', file=out)
+    print('set yrange [0:1]', file=out)
+    print('set output "%s"' % os.path.join(args.output_dir, 'lookup_times_cdf.png'), file=out)
+    print('set title "DHT lookup times %s"' % args.label, file=out)
+    print('set xlabel "time from start of lookup (ms)"', file=out)
+    print('plot %s' % ', '.join('"%s" using 1:2 title "%s" with steps' % (
+        os.path.join(args.output_dir, 'lookup_%s.cdf' % m), m.replace('_', ' ')) for m in cdfs[0:3]), file=out)
+    print('set output "%s"' % os.path.join(args.output_dir, 'lookup_timeouts_cdf.png'), file=out)
+    print('set title "DHT lookup timeouts %s"' % args.label, file=out)
+    print('set xlabel "timeouts per lookup"', file=out)
+    print('plot "%s" using 1:2 title "timeouts" with steps' % os.path.join(
+        args.output_dir, 'lookup_timeouts.cdf'), file=out)
+    out.close()
+
+    if not args.no_plot:
+        os.system('gnuplot "%s"' % os.path.join(args.output_dir, 'lookup_stats.gnuplot'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='render or analyze DHT lookups from parse_dht_log.py')
+    parser.add_argument('paths', nargs='*', help='(batch mode) directories or lookup files to analyze')
+    parser.add_argument('--batch', action='store_true', help='analyze all lookups instead of rendering one')
+    parser.add_argument('--pattern', default='*lookups*.txt',
+                        help='the files to analyze in the given directories (default: %(default)s)')
+    parser.add_argument('-k', type=int, default=8,
+                        help='the number of closest nodes a lookup is looking for (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='the number of files to analyze in parallel (default: %(default)s)')
+    parser.add_argument('--label', default='', help='a label identifying this run, e.g. the settings used')
+    parser.add_argument('--output-dir', default='.', help='where to write the results (default: %(default)s)')
+    parser.add_argument('--no-plot', action='store_true', help='do not run gnuplot')
+    args = parser.parse_args()
+
+    if not args.batch:
+        render_lookup(args.paths[0] if args.paths else 'dht_lookups.txt')
+        return
+
+    if not args.paths:
+        parser.error('batch mode requires at least one directory or file')
+    try:
+        os.mkdir(args.output_dir)
+    except OSError:
+        pass
+    batch(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,75 +1,264 @@
 #!/usr/bin/env python3
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
 
-from __future__ import print_function
+# this script parses the per-peer logs (*.log) in a libtorrent peer log
+# directory and analyzes the throughput of the swarm.
+#
+# the logs are parsed in parallel by a process pool. The sent (==> PIECE) and
+# received (<== PIECE) blocks of every peer are bucketed per time interval
+# into a matrix of peers x time. From that, the aggregate swarm throughput,
+# per-peer rate percentiles and the fastest and slowest peers are reported
+# and plotted.
+#
+# with --per-peer, a .dat file is also written for every peer and all peers
+# are plotted in the same graph, which is only useful with a handful of peers.
+#
+# usage: parse_peer_log.py [options] <path-to-libtorrent-peer-logs>
 
+import argparse
+import array
 import glob
+import multiprocessing
 import os
+import re
 import sys
 
-# usage: parse_peer_log <path-to-libtorrent-peer-logs>
+# matches the timestamp and direction of every block sent or received. The
+# timestamp is either a wall-clock time "12:34:56.789" or the number of
+# milliseconds since the session started "[1234]"
+piece_re = re.compile(rb'^\[?(\d+)(?::(\d+):(\d+))?(?:\.\d+)?\]?[^\n]*? (==>|<==) PIECE', re.M)
 
-log_files = []
+read_size = 4 * 1024 * 1024
 
-for p in glob.iglob(os.path.join(sys.argv[1], '*.log')):
-    name = os.path.split(p)[1]
-    if name == 'main_session.log':
-        continue
-    print(name)
-    f = open(p, 'r')
-    out_file = p + '.dat'
-    log_files.append(out_file)
-    out = open(out_file, 'w+')
 
+def timestamp(m):
+    # returns the timestamp of the match in seconds
+    if m.group(2) is None:
+        return int(m.group(1)) / 1000.
+    return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3))
+
+
+def parse_log(job):
+    # counts the blocks sent and received by one peer, per time interval.
+    # Returns the peer name and a dict of interval -> [uploaded, downloaded].
+    # This runs in a worker process
+    path, interval, per_peer = job
+    name = os.path.split(path)[1].split('.log')[0]
+    buckets = {}
+
+    out = None
     uploaded_blocks = 0
     downloaded_blocks = 0
+    if per_peer:
+        out = open(path + '.dat', 'w+')
 
-    for line in f:
-        t = line.split(': ')[0].split('.')[0]
-        log_line = False
-        if ' ==> PIECE' in line:
-            uploaded_blocks += 1
-            log_line = True
+    f = open(path, 'rb')
+    tail = b''
+    while tail is not None:
+        # only match complete lines, the remainder is carried over to the
+        # next read
+        buf = f.read(read_size)
+        if buf:
+            buf = tail + buf
+            end = buf.rfind(b'\n') + 1
+            tail = buf[end:]
+            buf = buf[:end]
+        else:
+            buf = tail
+            tail = None
 
-        if ' <== PIECE' in line:
-            downloaded_blocks += 1
-            log_line = True
+        for m in piece_re.finditer(buf):
+            t = timestamp(m)
+            b = buckets.get(int(t // interval))
+            if b is None:
+                b = buckets[int(t // interval)] = [0, 0]
+            if m.group(4) == b'==>':
+                b[0] += 1
+                uploaded_blocks += 1
+            else:
+                b[1] += 1
+                downloaded_blocks += 1
+            if out is not None:
+                print('%d\t%d\t%d' % (t, uploaded_blocks, downloaded_blocks), file=out)
+    f.close()
+    if out is not None:
+        out.close()
+    return name, buckets
 
-        if log_line:
-            print('%s\t%d\t%d' % (t, uploaded_blocks, downloaded_blocks), file=out)
 
+def percentile(values, p):
+    # values must be sorted
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(len(values) * p / 100.))]
+
+
+def write_per_peer_plot(log_files, plot):
+    out = open('peers.gnuplot', 'w+')
+    print("set term png size 1200,700", file=out)
+    print('set xrange [0:*]', file=out)
+    print('set xlabel "time (s)"', file=out)
+    print('set ylabel "blocks"', file=out)
+    print('set key box', file=out)
+    for column, title, output in [(2, 'uploaded blocks', 'peers_upload.png'),
+                                  (3, 'downloaded blocks', 'peers_download.png')]:
+        print('set title "%s"' % title, file=out)
+        print('set output "%s"' % output, file=out)
+        print('plot %s' % ', '.join(' "%s" using 1:%d title "%s" with steps' % (
+            n, column, os.path.split(n)[1].split('.log')[0]) for n in log_files), file=out)
     out.close()
-    f.close()
+    if plot:
+        os.system('gnuplot peers.gnuplot')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='analyze the throughput of libtorrent peer logs')
+    parser.add_argument('log_dir', help='the directory with the peer logs')
+    parser.add_argument('-i', '--interval', type=float, default=1.,
+                        help='the bucket size, in seconds (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='the number of logs to parse in parallel (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='the number of fastest and slowest peers to report (default: %(default)s)')
+    parser.add_argument('--block-size', type=int, default=16 * 1024,
+                        help='the size of a block, in bytes (default: %(default)s)')
+    parser.add_argument('--output-dir', default='peer_report',
+                        help='where to write the results (default: %(default)s)')
+    parser.add_argument('--per-peer', action='store_true',
+                        help='also write one .dat file per peer and plot them all in one graph')
+    parser.add_argument('--no-plot', action='store_true', help='do not run gnuplot')
+    args = parser.parse_args()
+
+    logs = [p for p in glob.iglob(os.path.join(args.log_dir, '*.log'))
+            if os.path.split(p)[1] != 'main_session.log']
+    if not logs:
+        print('no peer logs found in %s' % args.log_dir)
+        sys.exit(1)
+
+    try:
+        os.mkdir(args.output_dir)
+    except OSError:
+        pass
+
+    print('parsing %d peer logs' % len(logs))
+    peers = []
+    pool = multiprocessing.Pool(max(1, min(args.jobs, len(logs))))
+    for peer in pool.imap_unordered(parse_log, [(p, args.interval, args.per_peer) for p in logs],
+                                    chunksize=16):
+        if peer[1]:
+            peers.append(peer)
+        if len(peers) % 100 == 0:
+            print('\r%d' % len(peers), end='')
+            sys.stdout.flush()
+    pool.close()
+    pool.join()
+    print('\r%d peers transferred data' % len(peers))
+
+    if args.per_peer:
+        write_per_peer_plot([p + '.dat' for p in logs], not args.no_plot)
+
+    if not peers:
+        return
+
+    peers.sort()
+    first = min(min(b) for name, b in peers)
+    last = max(max(b) for name, b in peers)
+    num_buckets = last - first + 1
+    rate = args.block_size / args.interval
+
+    # the peers x time matrix, one row of int32 per peer
+    upload = open(os.path.join(args.output_dir, 'upload.matrix'), 'wb')
+    download = open(os.path.join(args.output_dir, 'download.matrix'), 'wb')
+    swarm_up = array.array('q', [0] * num_buckets)
+    swarm_down = array.array('q', [0] * num_buckets)
+    peer_stats = []
+    with open(os.path.join(args.output_dir, 'peers.index'), 'w+') as index:
+        for name, buckets in peers:
+            up = array.array('i', [0] * num_buckets)
+            down = array.array('i', [0] * num_buckets)
+            for t, (u, d) in buckets.items():
+                up[t - first] = u
+                down[t - first] = d
+                swarm_up[t - first] += u
+                swarm_down[t - first] += d
+            up.tofile(upload)
+            down.tofile(download)
+            print(name, file=index)
+
+            # average rates over the time the peer was active
+            active = (max(buckets) - min(buckets) + 1)
+            peer_stats.append((name, sum(up) * rate / active, sum(down) * rate / active))
+    upload.close()
+    download.close()
+
+    with open(os.path.join(args.output_dir, 'swarm.dat'), 'w+') as out:
+        for i in range(num_buckets):
+            print('%f\t%f\t%f' % (i * args.interval, swarm_up[i] * rate, swarm_down[i] * rate), file=out)
+
+    summary = open(os.path.join(args.output_dir, 'summary.txt'), 'w+')
+
+    def report(line=''):
+        print(line)
+        print(line, file=summary)
+
+    report('%d peers over %.0f seconds' % (len(peers), num_buckets * args.interval))
+    report('swarm upload: %.1f kB/s average, %.1f kB/s peak' % (
+        sum(swarm_up) * rate / num_buckets / 1000., max(swarm_up) * rate / 1000.))
+    report('swarm download: %.1f kB/s average, %.1f kB/s peak' % (
+        sum(swarm_down) * rate / num_buckets / 1000., max(swarm_down) * rate / 1000.))
+
+    report('\nper-peer average rate (kB/s)')
+    report('%-10s %10s %10s %10s %10s' % ('', 'p10', 'p50', 'p90', 'p99'))
+    for column, label in [(1, 'upload'), (2, 'download')]:
+        rates = sorted(s[column] for s in peer_stats if s[column] > 0)
+        report('%-10s %10.1f %10.1f %10.1f %10.1f' % ((label,) + tuple(
+            percentile(rates, p) / 1000. for p in [10, 50, 90, 99])))
+
+    top = {}
+    for column, label in [(1, 'upload'), (2, 'download')]:
+        ranked = sorted((s for s in peer_stats if s[column] > 0), key=lambda s: s[column], reverse=True)
+        top[label] = ranked[:args.top]
+        report('\nfastest peers (%s)' % label)
+        for s in ranked[:args.top]:
+            report('  %-40s %10.1f kB/s' % (s[0], s[column] / 1000.))
+        report('slowest peers (%s)' % label)
+        for s in ranked[-args.top:][::-1]:
+            report('  %-40s %10.1f kB/s' % (s[0], s[column] / 1000.))
+    summary.close()
+
+    # write the rows of the fastest peers, to plot them
+    rows = dict(peers)
+    for label, ranked in top.items():
+        with open(os.path.join(args.output_dir, 'top_%s.dat' % label), 'w+') as out:
+            for i in range(num_buckets):
+                values = [rows[s[0]].get(first + i, [0, 0])[0 if label == 'upload' else 1] * rate
+                          for s in ranked]
+                print('%f\t%s' % (i * args.interval, '\t'.join('%f' % v for v in values)), file=out)
+
+    out = open(os.path.join(args.output_dir, 'peers.gnuplot'), 'w+')
+    print('set term png size 1200,700', file=out)
+    print('set xlabel "time (s)"', file=out)
+    print('set ylabel "rate (B/s)"', file=out)
+    print('set format y "%.1s%cB/s"', file=out)
+    print('set key box', file=out)
+    print('set style data steps', file=out)
+    print('set output "%s"' % os.path.join(args.output_dir, 'swarm.png'), file=out)
+    print('set title "swarm throughput"', file=out)
+    print('plot "%s" using 1:2 title "upload", "%s" using 1:3 title "download"' % (
+        os.path.join(args.output_dir, 'swarm.dat'), os.path.join(args.output_dir, 'swarm.dat')), file=out)
+    for label, ranked in top.items():
+        if not ranked:
+            continue
+        name = os.path.join(args.output_dir, 'top_%s' % label)
+        print('set output "%s.png"' % name, file=out)
+        print('set title "fastest peers (%s)"' % label, file=out)
+        print('plot %s' % ', '.join('"%s.dat" using 1:%d title "%s"' % (name, i + 2, s[0])
+                                    for i, s in enumerate(ranked)), file=out)
+    out.close()
+
+    if not args.no_plot:
+        os.system('gnuplot "%s"' % os.path.join(args.output_dir, 'peers.gnuplot'))
+
 
-out = open('peers.gnuplot', 'wb')
-print("set term png size 1200,700", file=out)
-print('set xrange [0:*]', file=out)
-print('set xlabel "time"', file=out)
-print('set ylabel "blocks"', file=out)
-print('set key box', file=out)
-print('set xdata time', file=out)
-print('set timefmt "%H:%M:%S"', file=out)
-print('set title "uploaded blocks"', file=out)
-print('set output "peers_upload.png"', file=out)
-print('plot', end=' ', file=out)
-first = True
-for n in log_files:
-    if not first:
-        print(',', end=' ', file=out)
-    first = False
-    print(' "%s" using 1:2 title "%s" with steps' % (n, os.path.split(n)[1].split('.log')[0]), end=' ', file=out)
-print('', file=out)
-
-print('set title "downloaded blocks"', file=out)
-print('set output "peers_download.png"', file=out)
-print('plot', end=' ', file=out)
-first = True
-for n in log_files:
-    if not first:
-        print(',', end=' ', file=out)
-    first = False
-    print(' "%s" using 1:3 title "%s" with steps' % (n, os.path.split(n)[1].split('.log')[0]), end=' ', file=out)
-print('', file=out)
-out.close()
-
-os.system('gnuplot peers.gnuplot')
+if __name__ == '__main__':
+    main()
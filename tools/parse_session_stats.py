@@ -35,6 +35,7 @@ from __future__ import print_function
 # libtorrent session
 
 import os
+import re
 import sys
 import math
 from multiprocessing.pool import ThreadPool
@@ -71,6 +72,7 @@ line_graph = 0
 histogram = 1
 stacked = 2
 diff = 3
+heatmap = 4
 
 graph_colors = []
 
@@ -146,6 +148,57 @@ def to_title(key):
     return key.replace('_', ' ').replace('.', ' - ')
 
 
+def latency_label(n):
+    # the lower bound of latency histogram bucket n (1 << n microseconds)
+    us = 1 << n
+    if us < 1000:
+        return '%dus' % us
+    if us < 1000000:
+        return '%dms' % (us // 1000)
+    return '%ds' % (us // 1000000)
+
+
+def gen_heatmap_data(name, lines, log_file):
+    # histogram counters are cumulative. This writes the number of samples
+    # per bucket and interval (for the heatmap) and the bucket of the 50th,
+    # 90th and 99th percentile of every interval
+    columns = []
+    for k in lines:
+        try:
+            columns.append(keys.index(k) + 1)
+        except Exception:
+            print('"%s" not found' % k)
+            return None
+    data_file = os.path.join(output_dir, '%s.dat' % name)
+    pct_file = os.path.join(output_dir, '%s_percentiles.dat' % name)
+    out = open(data_file, 'w+')
+    pct = open(pct_file, 'w+')
+    last = None
+    for line in open(log_file):
+        fields = line.strip().split('\t')
+        values = [int(fields[c]) for c in columns]
+        if last is not None:
+            delta = [v - lv for v, lv in zip(values, last)]
+            for b, d in enumerate(delta):
+                print('%s\t%d\t%d' % (fields[0], b, d), file=out)
+            print('', file=out)
+            total = sum(delta)
+            if total > 0:
+                ret = []
+                for p in [0.5, 0.9, 0.99]:
+                    acc = 0
+                    for b, d in enumerate(delta):
+                        acc += d
+                        if acc >= total * p:
+                            ret.append(b)
+                            break
+                print('%s\t%s' % (fields[0], '\t'.join('%d' % b for b in ret)), file=pct)
+        last = values
+    out.close()
+    pct.close()
+    return data_file, pct_file
+
+
 def gen_report(name, unit, lines, short_unit, generation, log_file, options):
     filename = os.path.join(output_dir, '%s_%04d.png' % (name, generation))
     thumb = os.path.join(output_dir, '%s_%04d_thumb.png' % (name, generation))
@@ -236,6 +289,24 @@ def gen_report(name, unit, lines, short_unit, generation, log_file, options):
             first = False
             color += 1
         print(plot_expression, file=out)
+    elif options['type'] == heatmap:
+        files = gen_heatmap_data(name, lines, log_file)
+        if files is None:
+            return None
+        # the counter names end with the bucket number of their lower bound
+        first_bucket = int(re.search(r'(\d+)$', lines[0]).group(1))
+        print('set xrange [0:*]', file=out)
+        print('set yrange [-0.5:%f]' % (len(lines) - 0.5), file=out)
+        print('set xlabel "time (s)"', file=out)
+        print('set ylabel "%s"' % unit, file=out)
+        print('set ytics (%s)' % ', '.join('"%s" %d' % (latency_label(first_bucket + i), i)
+                                           for i in range(0, len(lines), 2)), file=out)
+        print('set cblabel "log10(1 + jobs)"', file=out)
+        print('set palette defined (0 "white", 1 "#ffff80", 2 "#ff8000", 3 "#c00000", 4 "black")', file=out)
+        print('plot "%s" using 1:2:(log10(1+$3)) notitle with image, '
+              '"%s" using 1:2 title "p50" with steps lw 2 lc rgb "#0000ff", '
+              '"" using 1:3 title "p90" with steps lw 2 lc rgb "#00a000", '
+              '"" using 1:4 title "p99" with steps lw 2 lc rgb "#ff00ff"' % files, file=out)
     elif options['type'] == diff:
         print('set xrange [0:*]', file=out)
         print('set ylabel "%s"' % unit, file=out)
@@ -418,6 +489,17 @@ reports = [
 
     ('disk_time', '% of total disk job time', '%%', 'proportion of time spent by the disk thread',
      ['disk.disk_read_time', 'disk.disk_write_time', 'disk.disk_hash_time'], {'type': stacked}),
+
+    # the number of disk jobs per latency bucket and second, with the 50th,
+    # 90th and 99th percentile
+    ('disk_read_latency', 'latency', '', 'latency of disk read jobs',
+     ['disk.disk_read_latency%d' % i for i in range(4, 25)], {'type': heatmap}),
+    ('disk_write_latency', 'latency', '', 'latency of disk write jobs',
+     ['disk.disk_write_latency%d' % i for i in range(4, 25)], {'type': heatmap}),
+    ('disk_hash_latency', 'latency', '', 'latency of disk hash jobs',
+     ['disk.disk_hash_latency%d' % i for i in range(4, 25)], {'type': heatmap}),
+    ('disk_queue_latency', 'latency', '', 'time disk jobs spend queued, waiting for a disk thread',
+     ['disk.disk_queue_latency%d' % i for i in range(4, 25)], {'type': heatmap}),
     ('disk_queue', 'blocks (16kiB)', '', 'disk store-buffer size',
      ['disk.num_write_jobs',
       'disk.num_read_jobs',
@@ -1,67 +1,51 @@
 #!/usr/bin/env python3
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
 
-from __future__ import print_function
-
+# this script parses the utp.log written by libtorrent when built with
+# TORRENT_UTP_LOG enabled. The log is read in a single pass, every socket
+# is demultiplexed into its own binary time series (one row of float64
+# columns per congestion-control sample) and a summary table is printed
+# for all sockets. The sockets with the most samples are plotted with gnuplot.
+#
+# memory use is bounded by the number of sockets, not the size of the log.
+# Samples are buffered per socket and appended to the series files in the
+# output directory.
+#
+# with --aggregate, the LEDBAT behaviour of all sockets is also combined into
+# fleet-wide histograms and CDFs, and a compact summary.json is written that
+# can be diffed between releases.
+#
+# usage: parse_utp_log.py [options] utp.log [socket ...]
+
+import argparse
+import array
+import json
 import os
+import re
 import sys
-from functools import reduce
-
-# usage: parse_log.py log-file [socket-index to focus on]
 
+# every line is prefixed by the timestamp (in microseconds) and the address
+# of the socket it refers to, e.g.:
+# [000035301484] 0x00ec1190: actual_delay:1021583 our_delay:102.000000 ...
+line_re = re.compile(rb'^\[(\d+)\] +(\S+): (.*)$')
 
-socket_filter = None
-if len(sys.argv) >= 3:
-    socket_filter = sys.argv[2].strip()
+# "name:value" pairs of the congestion-control sample lines. Non-numeric
+# values (such as "delay_base:-") are ignored
+field_re = re.compile(rb'(\w+):(-?\d+(?:\.\d+)?)')
 
-if socket_filter is None:
-    print("scanning for socket with the most packets")
-    file = open(sys.argv[1], 'rb')
+# the columns of the per-socket series files, in order. The first column is
+# the time (in seconds) from the start of the log. packet_loss and
+# packet_timeout are the number of such events since the previous sample
+columns = ['time', 'our_delay', 'target_delay', 'max_window', 'cur_window',
+           'rtt', 'send_buffer', 'packet_loss', 'packet_timeout']
 
-    sockets = {}
+column_index = dict((c, i) for i, c in enumerate(columns))
 
-    for line in file:
-        if 'our_delay' not in line:
-            continue
-
-        try:
-            a = line.strip().split(" ")
-            socket_index = a[1][:-1]
-        except Exception:
-            continue
-
-        # msvc's runtime library doesn't prefix pointers
-        # with '0x'
-        # if socket_index[:2] != '0x':
-        #     continue
-
-        if socket_index in sockets:
-            sockets[socket_index] += 1
-        else:
-            sockets[socket_index] = 1
-
-    items = list(sockets.items())
-    items.sort(lambda x, y: y[1] - x[1])
-
-    count = 0
-    for i in items:
-        print('%s: %d' % (i[0], i[1]))
-        count += 1
-        if count > 5:
-            break
-
-    file.close()
-    socket_filter = items[0][0]
-    print('\nfocusing on socket %s' % socket_filter)
-
-file = open(sys.argv[1], 'rb')
-out_file = 'utp.out%s' % socket_filter
-out = open(out_file, 'wb')
+# the log fields copied verbatim into the series, in column order
+sample_fields = [f.encode() for f in columns[1:7]]
 
 delay_samples = 'points lc rgb "blue"'
-delay_base = 'steps lw 2 lc rgb "purple"'
 target_delay = 'steps lw 2 lc rgb "red"'
-off_target = 'dots lc rgb "blue"'
 cwnd = 'steps lc rgb "green" lw 2'
 window_size = 'steps lc rgb "sea-green"'
 rtt = 'lines lc rgb "light-blue"'
@@ -69,349 +53,535 @@ send_buffer = 'lines lc rgb "light-red"'
 
 metrics = {
     'our_delay': ['our delay (ms)', 'x1y2', delay_samples],
-    'upload_rate': ['send rate (B/s)', 'x1y1', 'lines'],
-    'max_window': ['cwnd (B)', 'x1y1', cwnd],
     'target_delay': ['target delay (ms)', 'x1y2', target_delay],
+    'max_window': ['cwnd (B)', 'x1y1', cwnd],
     'cur_window': ['bytes in-flight (B)', 'x1y1', window_size],
-    'cur_window_packets': ['number of packets in-flight', 'x1y2', 'steps'],
-    'packet_size': ['current packet size (B)', 'x1y2', 'steps'],
     'rtt': ['rtt (ms)', 'x1y2', rtt],
-    'off_target': ['off-target (ms)', 'x1y2', off_target],
-    'delay_sum': ['delay sum (ms)', 'x1y2', 'steps'],
-    'their_delay': ['their delay (ms)', 'x1y2', delay_samples],
-    'get_microseconds': ['clock (us)', 'x1y1', 'steps'],
-    'wnduser': ['advertised window size (B)', 'x1y1', 'steps'],
-    'ssthres': ['slow-start threshold (B)', 'x1y1', 'steps'],
-    'timeout': ['until next timeout (ms)', 'x1y2', 'steps'],
-    'rto': ['current timeout (ms)', 'x1y2', 'steps'],
-
-    'delay_base': ['delay base (us)', 'x1y1', delay_base],
-    'their_delay_base': ['their delay base (us)', 'x1y1', delay_base],
-    'their_actual_delay': ['their actual delay (us)', 'x1y1', delay_samples],
-    'actual_delay': ['actual_delay (us)', 'x1y1', delay_samples],
     'send_buffer': ['send buffer size (B)', 'x1y1', send_buffer],
-    'recv_buffer': ['receive buffer size (B)', 'x1y1', 'lines'],
-    'packet_loss': ['packet lost', 'x1y2', 'steps'],
-    'packet_timeout': ['packet timed out', 'x1y2', 'steps'],
-    'acked_bytes': ['Bytes ACKed by packet', 'x1y2', 'steps'],
-    'bytes_sent': ['cumulative bytes sent', 'x1y2', 'steps'],
-    'bytes_resent': ['cumulative bytes resent', 'x1y2', 'steps'],
-    'written': ['reported written bytes', 'x1y2', 'steps'],
-    'ack_nr': ['acked sequence number', 'x1y2', 'steps'],
-    'seq_nr': ['sent sequence number', 'x1y2', 'steps'],
+    'packet_loss': ['packets lost', 'x1y2', 'impulses'],
+    'packet_timeout': ['packets timed out', 'x1y2', 'impulses'],
 }
 
-histogram_quantization = 1.0
-socket_index = None
-
-columns = []
-
-begin = None
-
-title = "-"
-packet_loss = 0
-packet_timeout = 0
-num_acked = 0
-
-delay_histogram = {}
-packet_size_histogram = {}
-window_size = {'0': 0, '1': 0}
-bytes_sent = 0
-bytes_resent = 0
-written = 0
-ack_nr = 0
-seq_nr = 0
-
-# [35301484] 0x00ec1190: actual_delay:1021583 our_delay:102 their_delay:-1021345 off_target:297 max_window:2687
-# upload_rate:18942 delay_base:1021481154 delay_sum:-1021242 target_delay:400 acked_bytes:1441 cur_window:2882
-# scaled_gain:2.432
-
-counter = 0
-
-print("reading log file")
-
-for line in file:
-    if "UTP_Connect" in line:
-        title = line[:-2]
-        if socket_filter is not None:
-            title += ' socket: %s' % socket_filter
-        else:
-            title += ' sum of all sockets'
-        continue
-
-    try:
-        a = line.strip().split(" ")
-        t = a[0][1:-1]
-        socket_index = a[1][:-1]
-    except Exception:
-        continue
-#    if socket_index[:2] != '0x':
-#        continue
-
-    if socket_filter is not None and socket_index != socket_filter:
-        continue
-
-    counter += 1
-    if (counter % 300 == 0):
-        print("\r%d  " % counter, end=' ')
-
-    if "lost." in line:
-        packet_loss += 1
-        continue
-
-    if "lost (timeout)" in line:
-        packet_timeout += 1
-        continue
-
-    if "acked packet " in line:
-        num_acked += 1
-
-    if "sending packet" in line:
-        v = line.split('size:')[1].split(' ')[0]
-        packet_size_histogram[v] = 1 + packet_size_histogram.get(v, 0)
-        bytes_sent += int(v)
-
-    if "re-sending packet" in line:
-        v = line.split('size:')[1].split(' ')[0]
-        bytes_resent += int(v)
-
-    if 'calling write handler' in line:
-        v = line.split('written:')[1].split(' ')[0]
-        written += int(v)
-
-    if "incoming packet" in line \
-            and "ERROR" not in line \
-            and "seq_nr:" in line \
-            and "type:ST_SYN" not in line:
-        if "ack_nr:" not in line:
-            print(line)
-        ack_nr = int(line.split('ack_nr:')[1].split(' ')[0])
-        seq_nr = int(line.split('seq_nr:')[1].split(' ')[0])
-
-    if "our_delay:" not in line:
-        continue
-
-# used for Logf timestamps
-#    t, m = t.split(".")
-#    t = time.strptime(t, "%H:%M:%S")
-#    t = list(t)
-#    t[0] += 107
-#    t = tuple(t)
-#    m = float(m)
-#    m /= 1000.0
-#    t = time.mktime(t) + m
-
-# used for tick count timestamps
-    t = int(t)
-
-    if begin is None:
-        begin = t
-    t = t - begin
-    # print time. Convert from milliseconds to seconds
-    print('%f\t' % (float(t) / 1000.), end=' ', file=out)
-
-    # if t > 200000:
-    #    break
-
-    fill_columns = not columns
-    for i in a[2:]:
-        try:
-            n, v = i.split(':')
-        except Exception:
-            continue
-        v = float(v)
-        if n == "our_delay":
-            bucket = int(v / histogram_quantization)
-            delay_histogram[bucket] = 1 + delay_histogram.get(bucket, 0)
-        if n not in metrics:
-            continue
-        if fill_columns:
-            columns.append(n)
-        if n == "max_window":
-            window_size[socket_index] = v
-            print('%f\t' % int(reduce(lambda a, b: a + b, list(window_size.values()))), end=' ', file=out)
-        else:
-            print('%f\t' % v, end=' ', file=out)
-
-    if fill_columns:
-        columns += ['packet_loss', 'packet_timeout', 'bytes_sent', 'ack_nr',
-                    'seq_nr', 'bytes_resent', 'written']
-    print(float(packet_loss), float(packet_timeout), float(bytes_sent),
-          ack_nr, seq_nr, float(bytes_resent), written, file=out)
-    packet_loss = 0
-    packet_timeout = 0
-    num_acked = 0
-    written = 0
-
-out.close()
-
-out = open('%s.histogram' % out_file, 'wb')
-for d, f in delay_histogram.items():
-    print(float(d * histogram_quantization) + histogram_quantization / 2.0, f, file=out)
-out.close()
-
-out = open('%s_packet_size.histogram' % out_file, 'wb')
-for d, f in packet_size_histogram.items():
-    print(d, f, file=out)
-out.close()
-
 plot = [
     {
-        'data': ['max_window', 'send_buffer', 'cur_window', 'rtt'],
-        'title': 'send-packet-size',
-        'y1': 'Bytes',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['max_window', 'send_buffer', 'cur_window', 'written'],
-        'title': 'bytes-written',
-        'y1': 'Bytes',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['upload_rate', 'max_window', 'cur_window', 'wnduser', 'cur_window_packets', 'packet_size', 'rtt'],
-        'title': 'slow-start',
+        'data': ['max_window', 'cur_window', 'our_delay', 'target_delay'],
+        'title': 'cwnd',
         'y1': 'Bytes',
         'y2': 'Time (ms)'
     },
     {
-        'data': ['max_window', 'cur_window', 'our_delay', 'target_delay', 'ssthres'],
-        'title': 'cwnd',
+        'data': ['max_window', 'cur_window', 'send_buffer', 'rtt'],
+        'title': 'send-buffer',
         'y1': 'Bytes',
         'y2': 'Time (ms)'
     },
     {
-        'data': ['max_window', 'cur_window', 'packet_loss'],
+        'data': ['max_window', 'cur_window', 'packet_loss', 'packet_timeout'],
         'title': 'packet-loss',
         'y1': 'Bytes',
         'y2': 'count'
     },
-    {
-        'data': ['max_window', 'cur_window', 'packet_timeout'],
-        'title': 'packet-timeout',
-        'y1': 'Bytes',
-        'y2': 'count'
-    },
-    {
-        'data': ['max_window', 'cur_window', 'bytes_sent', 'bytes_resent'],
-        'title': 'cumulative-bytes-sent',
-        'y1': 'Bytes',
-        'y2': 'Cumulative Bytes'
-    },
-    {
-        'data': ['max_window', 'cur_window', 'rto', 'timeout'],
-        'title': 'connection-timeout',
-        'y1': 'Bytes',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['our_delay', 'max_window', 'target_delay', 'cur_window', 'wnduser', 'cur_window_packets'],
-        'title': 'uploading',
-        'y1': 'Bytes',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['our_delay', 'max_window', 'target_delay', 'cur_window', 'send_buffer'],
-        'title': 'uploading-packets',
-        'y1': 'Bytes',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['their_delay', 'target_delay', 'rtt'],
-        'title': 'their-delay',
-        'y1': '',
-        'y2': 'Time (ms)'
-    },
-    {
-        'data': ['their_actual_delay', 'their_delay_base'],
-        'title': 'their-delay-base',
-        'y1': 'Time (us)',
-        'y2': ''
-    },
     {
         'data': ['our_delay', 'target_delay', 'rtt'],
         'title': 'our-delay',
         'y1': '',
         'y2': 'Time (ms)'
     },
-    {
-        'data': ['actual_delay', 'delay_base'],
-        'title': 'our-delay-base',
-        'y1': 'Time (us)',
-        'y2': ''
-    },
-    {
-        'data': ['ack_nr', 'seq_nr'],
-        'title': 'sequence-numbers',
-        'y1': 'Bytes',
-        'y2': 'seqnr'
-    },
-    {
-        'data': ['max_window', 'cur_window', 'acked_bytes'],
-        'title': 'ack-rate',
-        'y1': 'Bytes',
-        'y2': 'Bytes'
-    }
 ]
 
-out = open('utp.gnuplot', 'w+')
-
-files = ''
-
-# print('set xtics 0, 20', file=out)
-print("set term png size 1280,800", file=out)
-print('set output "%s.delays.png"' % out_file, file=out)
-print('set xrange [0:200]', file=out)
-print('set xlabel "delay (ms)"', file=out)
-print('set boxwidth 1', file=out)
-print('set ylabel "number of packets"', file=out)
-print('plot "%s.histogram" using 1:2 with boxes fs solid 0.3' % out_file, file=out)
-files += out_file + '.delays.png '
-
-print('set output "%s.packet_sizes.png"' % out_file, file=out)
-print('set xrange [0:*]', file=out)
-print('set xlabel "packet size (B)"', file=out)
-print('set boxwidth 1', file=out)
-print('set ylabel "number of packets sent"', file=out)
-print('set logscale y', file=out)
-print('plot "%s_packet_size.histogram" using 1:2 with boxes fs solid 0.3' % out_file, file=out)
-print('set nologscale y', file=out)
-files += out_file + '.packet_sizes.png '
-
-print("set style data steps", file=out)
-# print("set yrange [0:*]", file=out)
-print("set y2range [*:*]", file=out)
-# set hidden3d
-# set title "Peer bandwidth distribution"
-# set xlabel "Ratio"
-
-for p in plot:
-    print('set title "%s %s"' % (p['title'], title), file=out)
-    print('set xlabel "time (s)"', file=out)
-    print('set ylabel "%s"' % p['y1'], file=out)
-    print("set tics nomirror", file=out)
-    print('set y2tics', file=out)
-    print('set y2label "%s"' % p['y2'], file=out)
-    print('set xrange [0:*]', file=out)
-    print("set key box", file=out)
-    print("set term png size 1280,800", file=out)
-    print('set output "%s-%s.png"' % (out_file, p['title']), file=out)
-    files += '%s-%s.png ' % (out_file, p['title'])
-
-    comma = ''
-    print("plot", end=' ', file=out)
-
-    for c in p['data']:
-        if c not in metrics:
-            continue
-        i = columns.index(c)
-        print('%s"%s" using ($1/1000):%d title "%s-%s" axes %s with %s' %
-              (comma, out_file, i + 2, metrics[c][0], metrics[c][1], metrics[c][1], metrics[c][2]), end=' ', file=out)
-        comma = ', '
-    print('', file=out)
+# delay histograms are quantized to this many milliseconds per bucket
+histogram_quantization = 1.0
 
-out.close()
+# our_delay / target_delay histograms are quantized to this ratio per bucket
+ratio_quantization = 0.05
+
+# a sample whose cwnd is at most this fraction of the previous sample's is
+# counted as a cwnd cut (as opposed to the gradual LEDBAT decrease)
+cwnd_cut_ratio = 0.8
+
+
+def percentile(histogram, total, p, quantization=histogram_quantization):
+    # returns the value below which p percent of the samples in the
+    # (bucket -> count) histogram fall
+    if total == 0:
+        return 0.0
+    threshold = total * p / 100.
+    acc = 0
+    for bucket in sorted(histogram):
+        acc += histogram[bucket]
+        if acc >= threshold:
+            return (bucket + 0.5) * quantization
+    return 0.0
+
+
+def cdf(values):
+    # returns a list of (value, fraction of values <= value)
+    values = sorted(values)
+    n = float(len(values))
+    return [(v, (i + 1) / n) for i, v in enumerate(values)]
+
+
+def histogram_cdf(histogram, quantization):
+    total = float(sum(histogram.values()))
+    acc = 0
+    ret = []
+    for bucket in sorted(histogram):
+        acc += histogram[bucket]
+        ret.append(((bucket + 1) * quantization, acc / total))
+    return ret
+
+
+class utp_socket(object):
+    __slots__ = ['name', 'path', 'buffer', 'samples', 'first', 'last',
+                 'sent', 'resent', 'lost', 'timeouts', 'loss_since', 'timeout_since',
+                 'delay_histogram', 'utilisation', 'utilisation_samples',
+                 'prev_max_window', 'prev_off_target', 'off_target_time',
+                 'intervals', 'cwnd_cuts', 'loss_intervals', 'cuts_with_loss']
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.buffer = array.array('d')
+        self.samples = 0
+        self.first = None
+        self.last = None
+        self.sent = 0
+        self.resent = 0
+        self.lost = 0
+        self.timeouts = 0
+        self.loss_since = 0
+        self.timeout_since = 0
+        self.delay_histogram = {}
+        self.utilisation = 0.0
+        self.utilisation_samples = 0
+        self.prev_max_window = None
+        self.prev_off_target = False
+        self.off_target_time = 0.0
+        # the number of intervals between two consecutive samples, and how
+        # many of them saw a cwnd cut, a packet loss, or both
+        self.intervals = 0
+        self.cwnd_cuts = 0
+        self.loss_intervals = 0
+        self.cuts_with_loss = 0
+
+    def add_sample(self, t, values):
+        if self.first is None:
+            self.first = t
+        elif self.prev_off_target:
+            self.off_target_time += t - self.last
+        self.last = t
+        self.samples += 1
+
+        our_delay = values[0]
+        bucket = int(our_delay / histogram_quantization)
+        self.delay_histogram[bucket] = self.delay_histogram.get(bucket, 0) + 1
+        self.prev_off_target = our_delay > values[1]
+
+        max_window = values[2]
+        if max_window > 0:
+            self.utilisation += values[3] / max_window
+            self.utilisation_samples += 1
+
+        if self.prev_max_window is not None:
+            self.intervals += 1
+            loss = self.loss_since > 0 or self.timeout_since > 0
+            cut = max_window <= self.prev_max_window * cwnd_cut_ratio
+            if loss:
+                self.loss_intervals += 1
+            if cut:
+                self.cwnd_cuts += 1
+                if loss:
+                    self.cuts_with_loss += 1
+        self.prev_max_window = max_window
+
+        self.buffer.append(t)
+        self.buffer.extend(values)
+        self.buffer.append(self.loss_since)
+        self.buffer.append(self.timeout_since)
+        self.loss_since = 0
+        self.timeout_since = 0
+
+    def flush(self):
+        if not self.buffer:
+            return 0
+        n = len(self.buffer)
+        with open(self.path, 'ab') as f:
+            self.buffer.tofile(f)
+        self.buffer = array.array('d')
+        return n
+
+    def delay_percentile(self, p):
+        return percentile(self.delay_histogram, self.samples, p)
+
+    def cwnd_utilisation(self):
+        if self.utilisation_samples == 0:
+            return 0.0
+        return self.utilisation / self.utilisation_samples
+
+    def loss_rate(self):
+        if self.sent == 0:
+            return 0.0
+        return (self.lost + self.timeouts) / float(self.sent)
+
+    def off_target_fraction(self):
+        if self.first is None or self.last == self.first:
+            return 0.0
+        return self.off_target_time / (self.last - self.first)
+
+
+class utp_fleet(object):
+    # fleet-wide congestion-control statistics. Everything that can be
+    # derived from the per-socket state is summed up at the end, only the
+    # distribution of our_delay relative to target_delay needs to see every
+    # sample
+
+    def __init__(self):
+        self.ratio_histogram = {}
+        self.target_histogram = {}
+
+    def add_sample(self, values):
+        our_delay, target = values[0], values[1]
+        bucket = int(target / histogram_quantization)
+        self.target_histogram[bucket] = self.target_histogram.get(bucket, 0) + 1
+        if target <= 0:
+            return
+        bucket = int(our_delay / target / ratio_quantization)
+        self.ratio_histogram[bucket] = self.ratio_histogram.get(bucket, 0) + 1
+
+    def summarize(self, sockets):
+        delay_histogram = {}
+        samples = 0
+        sent = 0
+        lost = 0
+        duration = 0.0
+        off_target_time = 0.0
+        n = [0, 0, 0, 0]
+        for s in sockets:
+            for bucket, count in s.delay_histogram.items():
+                delay_histogram[bucket] = delay_histogram.get(bucket, 0) + count
+            samples += s.samples
+            sent += s.sent
+            lost += s.lost + s.timeouts
+            if s.first is not None:
+                duration += s.last - s.first
+            off_target_time += s.off_target_time
+            n[0] += s.intervals
+            n[1] += s.loss_intervals
+            n[2] += s.cwnd_cuts
+            n[3] += s.cuts_with_loss
+        self.delay_histogram = delay_histogram
+
+        intervals, loss_intervals, cuts, cuts_with_loss = n
+
+        def ratio(a, b):
+            return a / float(b) if b > 0 else 0.0
+
+        # phi coefficient of the 2x2 contingency table of (loss, cwnd cut)
+        # over all sample intervals
+        n11 = cuts_with_loss
+        n10 = loss_intervals - cuts_with_loss
+        n01 = cuts - cuts_with_loss
+        n00 = intervals - loss_intervals - n01
+        denominator = float(loss_intervals * (intervals - loss_intervals)
+                            * cuts * (intervals - cuts)) ** 0.5
+        phi = (n11 * n00 - n10 * n01) / denominator if denominator > 0 else 0.0
+
+        ratio_total = sum(self.ratio_histogram.values())
+        ratio_on_target = sum(c for b, c in self.ratio_histogram.items()
+                              if (b + 1) * ratio_quantization <= 1.0)
+
+        return {
+            'sockets': len(sockets),
+            'samples': samples,
+            'packets_sent': sent,
+            'packets_lost': lost,
+            'loss_rate': ratio(lost, sent),
+            'our_delay_p50': percentile(delay_histogram, samples, 50),
+            'our_delay_p90': percentile(delay_histogram, samples, 90),
+            'our_delay_p99': percentile(delay_histogram, samples, 99),
+            'target_delay_p50': percentile(self.target_histogram, samples, 50),
+            'delay_ratio_p50': percentile(self.ratio_histogram, ratio_total, 50, ratio_quantization),
+            'samples_on_target': ratio(ratio_on_target, ratio_total),
+            'off_target_time': ratio(off_target_time, duration),
+            'cwnd_cuts': cuts,
+            'cwnd_cuts_with_loss': ratio(cuts_with_loss, cuts),
+            'losses_causing_cut': ratio(cuts_with_loss, loss_intervals),
+            'loss_cut_correlation': phi,
+        }
+
+
+def write_aggregate(fleet, sockets, output_dir):
+    summary = fleet.summarize(sockets)
+
+    # round to 4 significant digits, to keep the summary diffable
+    for k, v in summary.items():
+        if isinstance(v, float):
+            summary[k] = float('%.4g' % v)
+    with open(os.path.join(output_dir, 'summary.json'), 'w+') as f:
+        json.dump(summary, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+    def write_table(name, rows):
+        with open(os.path.join(output_dir, name), 'w+') as f:
+            for r in rows:
+                print('%f\t%f' % r, file=f)
+
+    write_table('aggregate_delay.cdf', histogram_cdf(fleet.delay_histogram, histogram_quantization))
+    write_table('aggregate_delay_ratio.cdf', histogram_cdf(fleet.ratio_histogram, ratio_quantization))
+    write_table('aggregate_delay_ratio.histogram', [
+        ((b + 0.5) * ratio_quantization, float(c)) for b, c in sorted(fleet.ratio_histogram.items())])
+    write_table('aggregate_off_target.cdf', cdf(s.off_target_fraction() for s in sockets))
+    write_table('aggregate_loss_rate.cdf', cdf(s.loss_rate() for s in sockets if s.sent > 0))
+    write_table('aggregate_p50_delay.cdf', cdf(s.delay_percentile(50) for s in sockets))
+
+    out = open(os.path.join(output_dir, 'aggregate.gnuplot'), 'w+')
+    print('set term png size 1280,800', file=out)
+    print('set key box', file=out)
+    print('set grid', file=out)
+    print('set yrange [0:1]', file=out)
+    print('set ylabel "portion"', file=out)
+
+    graphs = [
+        ('aggregate_delay.cdf', 'our delay (ms)', 'our delay of all samples'),
+        ('aggregate_delay_ratio.cdf', 'our delay / target delay', 'our delay relative to target delay'),
+        ('aggregate_off_target.cdf', 'portion of time above target delay', 'time off-target per socket'),
+        ('aggregate_loss_rate.cdf', 'lost packets / sent packets', 'loss rate per socket'),
+        ('aggregate_p50_delay.cdf', 'median our delay (ms)', 'median delay per socket'),
+    ]
+    for name, xlabel, title in graphs:
+        print('set output "%s.png"' % os.path.join(output_dir, name), file=out)
+        print('set title "%s (CDF)"' % title, file=out)
+        print('set xlabel "%s"' % xlabel, file=out)
+        print('plot "%s" using 1:2 title "%s" with steps' % (os.path.join(output_dir, name), title), file=out)
+
+    print('set yrange [0:*]', file=out)
+    print('set output "%s"' % os.path.join(output_dir, 'aggregate_delay_ratio.png'), file=out)
+    print('set title "our delay relative to target delay, all samples"', file=out)
+    print('set xlabel "our delay / target delay"', file=out)
+    print('set ylabel "number of samples"', file=out)
+    print('set boxwidth %f' % ratio_quantization, file=out)
+    print('plot "%s" using 1:2 title "samples" with boxes fs solid 0.3' % os.path.join(
+        output_dir, 'aggregate_delay_ratio.histogram'), file=out)
+    out.close()
+
+    return summary
+
+
+class utp_log_parser(object):
+
+    def __init__(self, output_dir, max_buffered, fleet=None):
+        self.output_dir = output_dir
+        self.max_buffered = max_buffered
+        self.fleet = fleet
+        self.buffered = 0
+        # maps the socket address to the currently live socket using it
+        self.live = {}
+        # all sockets seen, in order of first appearance. Socket addresses
+        # are re-used once a socket is destroyed, so the same address may
+        # appear more than once, with a generation suffix
+        self.sockets = []
+        self.generation = {}
+        self.begin = None
+        self.lines = 0
+
+    def get_socket(self, address):
+        s = self.live.get(address)
+        if s is not None:
+            return s
+        name = address.decode('ascii', 'replace')
+        gen = self.generation.get(address, 0)
+        self.generation[address] = gen + 1
+        if gen > 0:
+            name = '%s-%d' % (name, gen)
+        s = utp_socket(name, os.path.join(self.output_dir, '%s.dat' % name))
+        # we append to the series file, make sure we don't pick up a
+        # previous run's data
+        try:
+            os.remove(s.path)
+        except OSError:
+            pass
+        self.live[address] = s
+        self.sockets.append(s)
+        return s
+
+    def flush_all(self):
+        for s in self.live.values():
+            s.flush()
+        self.buffered = 0
+
+    def parse_line(self, line):
+        m = line_re.match(line)
+        if m is None:
+            return None
+        t, address, msg = m.groups()
+
+        t = int(t)
+        if self.begin is None:
+            self.begin = t
+
+        if msg.startswith(b'actual_delay:'):
+            s = self.get_socket(address)
+            fields = dict(field_re.findall(msg))
+            try:
+                values = [float(fields[f]) for f in sample_fields]
+            except KeyError:
+                return s
+            if self.fleet is not None:
+                self.fleet.add_sample(values)
+            s.add_sample((t - self.begin) / 1000000., values)
+            self.buffered += len(columns)
+            if self.buffered > self.max_buffered:
+                self.flush_all()
+            return s
+
+        if msg.startswith(b'sending packet'):
+            self.get_socket(address).sent += 1
+        elif msg.startswith(b're-sending packet'):
+            self.get_socket(address).resent += 1
+        elif msg.startswith(b'Packet ') and b' lost' in msg:
+            s = self.get_socket(address)
+            if b'lost (timeout)' in msg:
+                s.timeouts += 1
+                s.timeout_since += 1
+            else:
+                s.lost += 1
+                s.loss_since += 1
+        elif msg.startswith(b'destroying utp socket state'):
+            s = self.live.pop(address, None)
+            if s is not None:
+                self.buffered -= s.flush()
+        return None
+
+    def parse(self, f):
+        for line in f:
+            self.lines += 1
+            if (self.lines % 100000) == 0:
+                print('\r%d lines, %d sockets  ' % (self.lines, len(self.sockets)), end='')
+                sys.stdout.flush()
+            self.parse_line(line.rstrip())
+        self.flush_all()
+        print('\r%d lines, %d sockets  ' % (self.lines, len(self.sockets)))
+
+
+def print_summary(sockets, out):
+    print('%-20s %8s %9s %9s %9s %7s %8s %7s %7s' % (
+        'socket', 'samples', 'duration', 'p50-delay', 'p99-delay', 'cwnd-%',
+        'sent', 'lost', 'loss-%'), file=out)
+    for s in sockets:
+        duration = 0.0
+        if s.first is not None:
+            duration = s.last - s.first
+        print('%-20s %8d %8.1fs %7.1fms %7.1fms %6.1f%% %8d %7d %6.2f%%' % (
+            s.name, s.samples, duration, s.delay_percentile(50), s.delay_percentile(99),
+            s.cwnd_utilisation() * 100., s.sent, s.lost + s.timeouts, s.loss_rate() * 100.),
+            file=out)
+
+
+def write_plots(sockets, output_dir):
+    out = open(os.path.join(output_dir, 'utp.gnuplot'), 'w+')
+    binary = 'binary format="%s"' % ('%float64' * len(columns))
+    files = []
 
-os.system("gnuplot utp.gnuplot")
+    print("set term png size 1280,800", file=out)
+    print("set style data steps", file=out)
+    print("set y2range [*:*]", file=out)
+
+    for s in sockets:
+        histogram_file = os.path.join(output_dir, '%s.histogram' % s.name)
+        with open(histogram_file, 'w+') as f:
+            for bucket, count in sorted(s.delay_histogram.items()):
+                print(float(bucket * histogram_quantization) + histogram_quantization / 2.0, count, file=f)
+
+        name = os.path.join(output_dir, s.name)
+        print('set output "%s.delays.png"' % name, file=out)
+        print('set title "delay distribution socket: %s"' % s.name, file=out)
+        print('set xrange [0:*]', file=out)
+        print('set xlabel "delay (ms)"', file=out)
+        print('set ylabel "number of samples"', file=out)
+        print('unset y2tics', file=out)
+        print('set y2label ""', file=out)
+        print('set boxwidth %f' % histogram_quantization, file=out)
+        print('plot "%s" using 1:2 title "our delay" with boxes fs solid 0.3' % histogram_file, file=out)
+        files.append('%s.delays.png' % name)
+
+        for p in plot:
+            print('set title "%s socket: %s"' % (p['title'], s.name), file=out)
+            print('set xlabel "time (s)"', file=out)
+            print('set ylabel "%s"' % p['y1'], file=out)
+            print("set tics nomirror", file=out)
+            print('set y2tics', file=out)
+            print('set y2label "%s"' % p['y2'], file=out)
+            print('set xrange [*:*]', file=out)
+            print("set key box", file=out)
+            print('set output "%s-%s.png"' % (name, p['title']), file=out)
+            files.append('%s-%s.png' % (name, p['title']))
+
+            graphs = []
+            for c in p['data']:
+                graphs.append('"%s" %s using 1:%d title "%s" axes %s with %s' % (
+                    s.path, binary, column_index[c] + 1, metrics[c][0], metrics[c][1], metrics[c][2]))
+            print('plot %s' % ', '.join(graphs), file=out)
+
+    out.close()
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='parse and plot a libtorrent utp.log')
+    parser.add_argument('log', help='the utp.log file to parse')
+    parser.add_argument('sockets', nargs='*',
+                        help='the socket(s) to plot. Defaults to the ones with the most samples')
+    parser.add_argument('--top', type=int, default=5,
+                        help='the number of sockets to plot, when none are specified (default: %(default)s)')
+    parser.add_argument('--output-dir', default='utp_report',
+                        help='where to write the series, summary and graphs (default: %(default)s)')
+    parser.add_argument('--max-buffered', type=int, default=4 * 1024 * 1024,
+                        help='the max number of values to buffer before flushing the series to disk')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='also compute fleet-wide statistics over all sockets and write summary.json')
+    parser.add_argument('--no-plot', action='store_true', help='do not run gnuplot')
+    args = parser.parse_args()
 
-os.system("open %s" % files)
+    try:
+        os.mkdir(args.output_dir)
+    except OSError:
+        pass
+
+    fleet = utp_fleet() if args.aggregate else None
+    p = utp_log_parser(args.output_dir, args.max_buffered, fleet)
+    print('reading log file')
+    with open(args.log, 'rb') as f:
+        p.parse(f)
+
+    sockets = [s for s in p.sockets if s.samples > 0]
+    sockets.sort(key=lambda s: s.samples, reverse=True)
+
+    with open(os.path.join(args.output_dir, 'summary.txt'), 'w+') as out:
+        print_summary(sockets, out)
+    print_summary(sockets[:args.top], sys.stdout)
+
+    if fleet is not None:
+        summary = write_aggregate(fleet, sockets, args.output_dir)
+        print('\nfleet summary (%s)' % os.path.join(args.output_dir, 'summary.json'))
+        for k in sorted(summary):
+            print('  %-22s %s' % (k, summary[k]))
+        if not args.no_plot:
+            os.system('gnuplot "%s"' % os.path.join(args.output_dir, 'aggregate.gnuplot'))
+
+    if args.sockets:
+        focus = [s for s in sockets if s.name in args.sockets]
+    else:
+        focus = sockets[:args.top]
+
+    if not focus:
+        print('no sockets to plot')
+        return
+
+    print('\nplotting: %s' % ' '.join(s.name for s in focus))
+    write_plots(focus, args.output_dir)
+    if not args.no_plot:
+        os.system('gnuplot "%s"' % os.path.join(args.output_dir, 'utp.gnuplot'))
+
+
+if __name__ == '__main__':
+    main()
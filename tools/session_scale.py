@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# this script measures how a session scales with the number of torrents. It
+# adds --torrents small synthetic torrents to a session (using the python
+# binding and the "disabled" disk I/O back-end), all seeding and announcing
+# to a local HTTP tracker (and optionally the DHT, through a local DHT node),
+# and measures:
+#
+#   add_time              seconds to add all torrents (add_torrent_alerts)
+#   ready_time            seconds until all torrents are seeding
+#   rss_per_torrent       kB of RSS per torrent
+#   idle_cpu              CPU (in cores) while idling for --idle seconds
+#   updates_first_latency seconds for post_torrent_updates() of all torrents
+#   updates_latency       median seconds for post_torrent_updates() after that
+#   tracker_announces     tracker announces per second while idling
+#   dht_messages_out      DHT messages sent per second while idling
+#
+# the tracker and DHT node run in a separate process, so they don't count
+# towards the session's CPU time. The results are printed (or written to
+# --output) as JSON. This is what the "scale" driver of benchmark.py runs, see
+# tools/benchmarks/scale.json
+#
+# usage: session_scale.py [options] --torrents 10000
+
+import argparse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import multiprocessing
+import multiprocessing.synchronize
+import resource
+import socket
+import sys
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Type
+
+import libtorrent as lt
+
+
+def make_torrent(
+    i: int, tracker: str, piece_length: int = 16 * 1024, file_size: int = 64 * 1024
+) -> Any:
+    # a single file v1 torrent with (fake) zero piece hashes, unique per i
+    info: Dict[str, Any] = {
+        "name": "scale-%d" % i,
+        "piece length": piece_length,
+        "length": file_size,
+        "pieces": b"\0" * 20 * ((file_size + piece_length - 1) // piece_length),
+    }
+    return lt.torrent_info({"announce": tracker, "info": info})
+
+
+def rss() -> int:
+    # in kiB
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_time() -> float:
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+
+def run_peers(
+    tracker_port: int,
+    dht_port: int,
+    interval: int,
+    announces: Any,
+    ready: multiprocessing.synchronize.Event,
+) -> None:
+    # the local tracker (counting announces) and DHT node
+    class handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            with announces.get_lock():
+                announces.value += 1
+            body = lt.bencode({"interval": interval, "peers": b""})
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt: str, *args: Any) -> None:
+            pass
+
+    ses = None
+    if dht_port:
+        ses = lt.session(
+            {
+                "enable_dht": True,
+                "enable_lsd": False,
+                "enable_upnp": False,
+                "enable_natpmp": False,
+                "listen_interfaces": "127.0.0.1:%d" % dht_port,
+                "dht_restrict_routing_ips": False,
+                "dht_restrict_search_ips": False,
+                "dht_bootstrap_nodes": "",
+                "alert_mask": 0,
+            },
+            disk_io="disabled",
+        )
+    server = ThreadingHTTPServer(("127.0.0.1", tracker_port), handler)
+    server.daemon_threads = True
+    ready.set()
+    server.serve_forever()
+    del ses
+
+
+def free_port() -> int:
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port: int = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_for_alerts(
+    ses: Any, alert_type: Type[Any], count: int, timeout: float
+) -> List[Any]:
+    # pops alerts until count alerts of alert_type have been posted. Returns
+    # them
+    ret: List[Any] = []
+    deadline = time.monotonic() + timeout
+    while len(ret) < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError(
+                "timed out waiting for %s (got %d of %d)"
+                % (alert_type.__name__, len(ret), count)
+            )
+        ses.wait_for_alert(500)
+        ret += [a for a in ses.pop_alerts() if isinstance(a, alert_type)]
+    return ret
+
+
+def session_stats(ses: Any, timeout: float) -> Dict[str, int]:
+    ses.post_session_stats()
+    values: Dict[str, int] = wait_for_alerts(ses, lt.session_stats_alert, 1, timeout)[
+        0
+    ].values
+    return values
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="measure how a session scales with the number of torrents"
+    )
+    parser.add_argument(
+        "--torrents",
+        type=int,
+        default=1000,
+        help="the number of torrents (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--idle",
+        type=float,
+        default=30.0,
+        help="the number of seconds to measure idle CPU and announces "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=5.0,
+        help="seconds to wait after adding the torrents, before idling "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--updates",
+        type=int,
+        default=10,
+        help="the number of post_torrent_updates() calls to time "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--announce-interval",
+        type=int,
+        default=1800,
+        help="the announce interval the tracker replies with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dht",
+        action="store_true",
+        help="enable the DHT, bootstrapping off a local node",
+    )
+    parser.add_argument(
+        "--paused", action="store_true", help="add the torrents paused (not announcing)"
+    )
+    parser.add_argument(
+        "--disk-io",
+        default="disabled",
+        help="the disk I/O back-end (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--settings", default="{}", help="additional settings, as a JSON object"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600.0,
+        help="fail after this many seconds per step",
+    )
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    tracker_port = free_port()
+    dht_port = free_port() if args.dht else 0
+    announces = multiprocessing.Value("l", 0)
+    ready = multiprocessing.Event()
+    peers = multiprocessing.Process(
+        target=run_peers,
+        daemon=True,
+        args=(tracker_port, dht_port, args.announce_interval, announces, ready),
+    )
+    peers.start()
+    ready.wait(30)
+
+    settings: Dict[str, Any] = {
+        "alert_mask": lt.alert.category_t.status_notification
+        | lt.alert.category_t.error_notification,
+        "enable_dht": args.dht,
+        "enable_lsd": False,
+        "enable_natpmp": False,
+        "enable_upnp": False,
+        "listen_interfaces": "127.0.0.1:%d" % free_port(),
+        "alert_queue_size": args.torrents * 2 + 1000,
+        "active_limit": -1,
+        "active_downloads": -1,
+        "active_seeds": -1,
+        "active_checking": -1,
+        "active_tracker_limit": -1,
+        "active_dht_limit": -1,
+    }
+    if args.dht:
+        settings.update(
+            {
+                "dht_bootstrap_nodes": "127.0.0.1:%d" % dht_port,
+                "dht_restrict_routing_ips": False,
+                "dht_restrict_search_ips": False,
+            }
+        )
+    settings.update(json.loads(args.settings))
+
+    start = time.monotonic()
+    ses = lt.session(settings, disk_io=args.disk_io)
+    ses.pop_alerts()
+    results: Dict[str, float] = {
+        "torrents": args.torrents,
+        "session_time": time.monotonic() - start,
+    }
+
+    start = time.monotonic()
+    tracker = "http://127.0.0.1:%d/announce" % tracker_port
+    torrents = [make_torrent(i, tracker) for i in range(args.torrents)]
+    results["generate_time"] = time.monotonic() - start
+
+    flags = lt.torrent_flags.seed_mode
+    if args.paused:
+        flags |= lt.torrent_flags.paused
+    rss_before = rss()
+    start = time.monotonic()
+    for ti in torrents:
+        ses.async_add_torrent({"ti": ti, "save_path": ".", "flags": flags})
+    added = wait_for_alerts(ses, lt.add_torrent_alert, args.torrents, args.timeout)
+    results["add_time"] = time.monotonic() - start
+    del torrents
+    errors = [a for a in added if a.error.value() != 0]
+    if errors:
+        raise RuntimeError("failed to add torrent: %s" % errors[0].message())
+
+    if not args.paused:
+        deadline = time.monotonic() + args.timeout
+        while (
+            session_stats(ses, args.timeout).get("ses.num_seeding_torrents", 0)
+            < args.torrents
+        ):
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    "timed out waiting for the torrents to start seeding"
+                )
+            time.sleep(0.1)
+        results["ready_time"] = time.monotonic() - start
+    results["rss"] = rss()
+    results["rss_per_torrent"] = (results["rss"] - rss_before) / float(args.torrents)
+
+    time.sleep(args.settle)
+    ses.pop_alerts()
+
+    # idle. The session is only asked for its counters at the start and
+    # the end
+    before = session_stats(ses, args.timeout)
+    announces_before = announces.value
+    cpu_before = cpu_time()
+    start = time.monotonic()
+    while time.monotonic() - start < args.idle:
+        time.sleep(min(1.0, args.idle))
+        ses.pop_alerts()
+    idle = time.monotonic() - start
+    cpu = cpu_time() - cpu_before
+    after = session_stats(ses, args.timeout)
+    results["idle_cpu"] = cpu / idle
+    results["tracker_announces"] = (announces.value - announces_before) / idle
+    results["tracker_bytes_out"] = (
+        after.get("net.sent_tracker_bytes", 0) - before.get("net.sent_tracker_bytes", 0)
+    ) / idle
+    for counter in [
+        "dht.dht_messages_out",
+        "dht.dht_get_peers_out",
+        "dht.dht_announce_peer_out",
+    ]:
+        results[counter.split(".")[1]] = (
+            after.get(counter, 0) - before.get(counter, 0)
+        ) / idle
+
+    # the first post_torrent_updates() returns the status of every torrent,
+    # later ones only of the ones that changed
+    latencies: List[float] = []
+    for i in range(args.updates + 1):
+        start = time.monotonic()
+        ses.post_torrent_updates()
+        wait_for_alerts(ses, lt.state_update_alert, 1, args.timeout)
+        latencies.append(time.monotonic() - start)
+    results["updates_first_latency"] = latencies[0]
+    if len(latencies) > 1:
+        results["updates_latency"] = sorted(latencies[1:])[len(latencies[1:]) // 2]
+
+    start = time.monotonic()
+    del ses
+    results["shutdown_time"] = time.monotonic() - start
+    peers.terminate()
+
+    out = json.dumps(results, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w+") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# tests of loading and comparing the results stored by benchmark.py
+#
+# usage: python3 -m unittest test_benchmark (in the tools directory)
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from typing import Any
+from typing import Dict
+import unittest
+
+import benchmark
+
+
+def result(scenario: str, rate: float) -> Dict[str, Any]:
+    params = {"peers": 10}
+    return {
+        "scenario": scenario,
+        "key": benchmark.config_key(params),
+        "params": params,
+        "revision": "test",
+        "better": {"download_rate": "higher"},
+        "summary": {"download_rate": benchmark.summarize([rate, rate])},
+    }
+
+
+class test_compare(unittest.TestCase):
+    def setUp(self) -> None:
+        self.results_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.results_dir)
+
+    def store(self, revision: str, name: str, r: Any) -> None:
+        out_dir = os.path.join(self.results_dir, revision, "transfer")
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, name), "w+") as f:
+            json.dump(r, f)
+
+    def compare(self, *args: str) -> int:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return benchmark.main(
+                ["compare", "--results-dir", self.results_dir, "base", "new"]
+                + list(args)
+            )
+
+    def test_regression(self) -> None:
+        self.store("base", "a.json", result("transfer", 100.0))
+        self.store("new", "a.json", result("transfer", 50.0))
+        self.assertEqual(self.compare(), 1)
+        self.assertEqual(self.compare("--threshold", "60"), 0)
+
+    def test_other_json(self) -> None:
+        # JSON files that aren't results of a configuration are ignored
+        for revision in ("base", "new"):
+            self.store(revision, "a.json", result("transfer", 100.0))
+            self.store(revision, "curves.json", {"scenario": "transfer"})
+            self.store(revision, "list.json", [])
+        r = benchmark.load_results(self.results_dir, "new")
+        self.assertEqual(list(r), [("transfer", result("transfer", 0)["key"])])
+        self.assertEqual(self.compare(), 0)
+
+    def test_curves(self) -> None:
+        # the curves of a scenario with a "plot" section are stored next to
+        # the results
+        scenario = {
+            "name": "scale",
+            "sweep": {"torrents": [1000, 10000]},
+            "plot": {"x": "torrents", "metrics": ["add_time"]},
+        }
+        ctx = benchmark.context(
+            argparse.Namespace(
+                bin_dir=".",
+                work_dir=self.results_dir,
+                verbose=False,
+                profile=None,
+                call_graph=None,
+                sample_rate=None,
+                session_stats=False,
+                memory=False,
+                memory_interval=None,
+            )
+        )
+        for revision in ("base", "new"):
+            out_dir = os.path.join(self.results_dir, revision, "scale")
+            os.makedirs(out_dir)
+            points = []
+            for torrents in (1000, 10000):
+                params = {"torrents": torrents}
+                summary = {"add_time": benchmark.summarize([torrents / 1000.0])}
+                with open(
+                    os.path.join(out_dir, benchmark.config_key(params) + ".json"), "w+"
+                ) as f:
+                    json.dump(
+                        {
+                            "scenario": "scale",
+                            "key": benchmark.config_key(params),
+                            "params": params,
+                            "summary": summary,
+                            "better": {"add_time": "lower"},
+                        },
+                        f,
+                    )
+                points.append((params, summary))
+            with contextlib.redirect_stdout(io.StringIO()):
+                benchmark.write_curves(ctx, scenario, points, out_dir, revision)
+            self.assertTrue(
+                os.path.exists(os.path.join(out_dir, "curves", "curves.json"))
+            )
+        self.assertEqual(len(benchmark.load_results(self.results_dir, "new")), 2)
+        self.assertEqual(self.compare(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# tests of the C++ name simplification and component accounting of
+# flamegraph.py, with frames as demangled by perf
+#
+# usage: python3 -m unittest test_flamegraph (in the tools directory)
+
+import unittest
+
+import flamegraph
+
+pick_pieces = (
+    "libtorrent::aux::piece_picker::pick_pieces("
+    "libtorrent::typed_bitfield<libtorrent::aux::strong_typedef<int, "
+    "libtorrent::aux::piece_index_tag, void> > const&, "
+    "std::vector<libtorrent::piece_block, std::allocator<libtorrent::piece_block> >&, "
+    "int, int, libtorrent::aux::torrent_peer*, "
+    "libtorrent::flags::bitfield_flag<unsigned int, "
+    "libtorrent::picker_options_tag, void>, "
+    "std::vector<libtorrent::aux::strong_typedef<int, "
+    "libtorrent::aux::piece_index_tag, void>, "
+    "std::allocator<libtorrent::aux::strong_typedef<int, "
+    "libtorrent::aux::piece_index_tag, void> > > const&, int, "
+    "libtorrent::counters&) const"
+)
+
+on_receive = (
+    "libtorrent::aux::bt_peer_connection::on_receive("
+    "boost::system::error_code const&, unsigned long)"
+)
+
+incoming_piece = (
+    "libtorrent::aux::peer_connection::incoming_piece("
+    "libtorrent::peer_request const&, char const*)"
+)
+
+
+class test_strip_arguments(unittest.TestCase):
+    def test_plain(self) -> None:
+        self.assertEqual(
+            flamegraph.strip_arguments(on_receive),
+            "libtorrent::aux::bt_peer_connection::on_receive",
+        )
+
+    def test_const(self) -> None:
+        self.assertEqual(
+            flamegraph.strip_arguments(pick_pieces),
+            "libtorrent::aux::piece_picker::pick_pieces",
+        )
+
+    def test_ref_qualifiers(self) -> None:
+        self.assertEqual(flamegraph.strip_arguments("foo::get() const &"), "foo::get")
+        self.assertEqual(flamegraph.strip_arguments("foo::get() &&"), "foo::get")
+
+    def test_clone(self) -> None:
+        self.assertEqual(
+            flamegraph.strip_arguments(incoming_piece + " [clone .isra.0]"),
+            "libtorrent::aux::peer_connection::incoming_piece",
+        )
+        self.assertEqual(
+            flamegraph.strip_arguments(
+                pick_pieces + " [clone .constprop.0] [clone .cold]"
+            ),
+            "libtorrent::aux::piece_picker::pick_pieces",
+        )
+
+    def test_call_operator(self) -> None:
+        self.assertEqual(
+            flamegraph.strip_arguments("foo::{lambda(int)#1}::operator()(int) const"),
+            "foo::{lambda(int)#1}::operator()",
+        )
+
+    def test_unknown(self) -> None:
+        self.assertEqual(flamegraph.strip_arguments("[libc.so.6]"), "[libc.so.6]")
+
+    def test_one_frame(self) -> None:
+        # all variants of a function end up as the same frame
+        f = flamegraph.folder()
+        f.add(["t", pick_pieces])
+        f.add(["t", pick_pieces + " [clone .isra.0]"])
+        self.assertEqual(f.stacks, {"t;libtorrent::aux::piece_picker::pick_pieces": 2})
+
+
+class test_components(unittest.TestCase):
+    def test_aux(self) -> None:
+        f = flamegraph.folder()
+        f.add(["t", pick_pieces], 3)
+        f.add(["t", on_receive], 2)
+        f.add(["t", incoming_piece], 1)
+        f.add(["t", "main"], 4)
+        total, functions, components = flamegraph.top_functions(f.stacks)
+        self.assertEqual(total, 10)
+        self.assertEqual(components["piece_picker"], 3)
+        self.assertEqual(components["bt_peer_connection"], 2)
+        self.assertEqual(components["peer_connection"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
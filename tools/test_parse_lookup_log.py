@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# tests of the batch mode of parse_lookup_log.py, fed with the lookups file
+# parse_dht_log.py produces from a DHT log
+#
+# usage: python3 -m unittest test_parse_lookup_log (in the tools directory)
+
+import os
+import tempfile
+import unittest
+
+import parse_dht_log
+import parse_lookup_log
+
+target = "0123456789abcdef0123456789abcdef01234567"
+node_a = "a" * 40
+node_b = "b" * 40
+
+# a get_peers lookup, as logged by traversal_algorithm. INVOKE lines log the
+# address without the port, RESPONSE and ADD lines log ip:port. Node a is
+# known when the lookup starts (round 0) and returns node b (round 1)
+dht_log = """\
+[100] [7] NEW target: {target} type: get_peers
+[110] [7] INVOKE nodes-left: 1 top-invoke-count: 0 invoke-count: 1 \
+branch-factor: 3 distance: 150 id: {a} addr: 10.0.0.1 type: get_peers
+[140] [7] RESPONSE id: {a} invoke-count: 1 addr: 10.0.0.1:6881 type: get_peers
+[141] [7] ADD id: {b} addr: 10.0.0.2:6881 distance: 140 invoke-count: 0 \
+type: get_peers
+[150] [7] INVOKE nodes-left: 1 top-invoke-count: 0 invoke-count: 1 \
+branch-factor: 3 distance: 140 id: {b} addr: 10.0.0.2 type: get_peers
+[190] [7] RESPONSE id: {b} invoke-count: 1 addr: 10.0.0.2:6881 type: get_peers
+[200] [7] COMPLETED distance: 140 type: get_peers
+""".format(
+    target=target, a=node_a, b=node_b
+)
+
+# the same lookup, where the replies carry peers. Those are logged twice,
+# as PEERS and as RESPONSE
+peers_log = """\
+[100] [7] NEW target: {target} type: get_peers
+[110] [7] INVOKE nodes-left: 1 top-invoke-count: 0 invoke-count: 1 \
+branch-factor: 3 distance: 150 id: {a} addr: 10.0.0.1 type: get_peers
+[140] [7] PEERS invoke-count: 1 branch-factor: 3 addr: 10.0.0.1:6881 id: {a} \
+distance: 150 p: 5
+[140] [7] RESPONSE id: {a} invoke-count: 1 addr: 10.0.0.1:6881 type: get_peers
+[141] [7] ADD id: {b} addr: 10.0.0.2:6881 distance: 140 invoke-count: 0 \
+type: get_peers
+[150] [7] INVOKE nodes-left: 1 top-invoke-count: 0 invoke-count: 1 \
+branch-factor: 3 distance: 140 id: {b} addr: 10.0.0.2 type: get_peers
+[190] [7] PEERS invoke-count: 1 branch-factor: 3 addr: 10.0.0.2:6881 id: {b} \
+distance: 140 p: 5
+[191] [7] RESPONSE id: {b} invoke-count: 1 addr: 10.0.0.2:6881 type: get_peers
+[200] [7] COMPLETED distance: 140 type: get_peers
+""".format(
+    target=target, a=node_a, b=node_b
+)
+
+
+class test_batch(unittest.TestCase):
+    log = dht_log
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        log = os.path.join(self.dir.name, "dht.log")
+        with open(log, "w") as f:
+            f.write(self.log)
+        shard = parse_dht_log.parse_shard((0, log, self.dir.name, True))
+        self.lookups = os.path.join(self.dir.name, "%s.lookups.txt" % shard)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_rounds(self) -> None:
+        metrics, rounds, types = parse_lookup_log.analyze_file((self.lookups, 2))
+        self.assertEqual(types, {"get_peers": 1})
+        # the closest response of every round, in shared prefix bits
+        self.assertEqual(rounds, [[10], [20]])
+
+    def test_metrics(self) -> None:
+        metrics, rounds, types = parse_lookup_log.analyze_file((self.lookups, 2))
+        self.assertEqual(metrics["invokes"], [2])
+        self.assertEqual(metrics["responses"], [2])
+        self.assertEqual(metrics["time_to_first_response"], [40])
+        self.assertEqual(metrics["time_to_k_closest"], [90])
+        self.assertEqual(metrics["duration"], [100])
+
+
+class test_peers(test_batch):
+    log = peers_log
+
+    def test_metrics(self) -> None:
+        # one response per node, the first one
+        metrics, rounds, types = parse_lookup_log.analyze_file((self.lookups, 2))
+        self.assertEqual(metrics["invokes"], [2])
+        self.assertEqual(metrics["responses"], [2])
+        self.assertEqual(metrics["time_to_first_response"], [40])
+        self.assertEqual(metrics["time_to_k_closest"], [90])
+
+
+if __name__ == "__main__":
+    unittest.main()